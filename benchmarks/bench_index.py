@@ -0,0 +1,170 @@
+# Xandikos
+# Copyright (C) 2026 Jelmer Vernooĳ <jelmer@jelmer.uk>, et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Indexing benchmarks for Xandikos.
+
+These measure how quickly index values can be extracted from calendar
+items, which bounds the throughput of eager indexing on large stores.
+
+Scenarios:
+  - Extracting the default index keys from already parsed items, either
+    one key at a time or with a single pass over each calendar
+  - Populating the index for a complete 10k-event store (eager indexing),
+    including parsing of each item
+  - Memory used by the values for 10k items in the dict based and the
+    columnar memory index layouts (reported in extra_info)
+
+Run:
+    pytest benchmarks/bench_index.py --benchmark-enable
+"""
+
+import hashlib
+import tracemalloc
+
+import pytest
+
+from xandikos.icalendar import ICalendarFile
+from xandikos.store import File
+
+from .conftest import HUGE_COLLECTION
+
+try:
+    from xandikos.store import _populate_indexes
+except ImportError:  # Older versions without eager indexing
+    _populate_indexes = None  # type: ignore
+
+try:
+    from xandikos.store.index import CompactMemoryIndex, MemoryIndex
+except ImportError:  # Older versions without the columnar layout
+    CompactMemoryIndex = None  # type: ignore
+
+
+def _has_default_index_keys():
+    return hasattr(ICalendarFile, "default_index_keys")
+
+
+@pytest.fixture(scope="module")
+def parsed_files_huge(memory_store_huge):
+    store, _ = memory_store_huge
+    files = []
+    for name, content_type, etag in store.iter_with_etag():
+        fi = store.get_file(name, content_type, etag)
+        # Parse up front, so only index extraction is measured.
+        fi.calendar
+        files.append(fi)
+    return files
+
+
+@pytest.mark.skipif(
+    not _has_default_index_keys(),
+    reason="default_index_keys() not available in this version",
+)
+class TestIndexExtraction:
+    """Extract the default index keys from 10k parsed events."""
+
+    def test_per_key(self, benchmark, parsed_files_huge):
+        keys = ICalendarFile.default_index_keys()
+        result = benchmark(
+            lambda: [File.get_indexes(fi, keys) for fi in parsed_files_huge]
+        )
+        assert len(result) == HUGE_COLLECTION
+
+    def test_single_pass(self, benchmark, parsed_files_huge):
+        keys = ICalendarFile.default_index_keys()
+        result = benchmark(lambda: [fi.get_indexes(keys) for fi in parsed_files_huge])
+        assert len(result) == HUGE_COLLECTION
+        assert result[0] == File.get_indexes(parsed_files_huge[0], keys)
+
+
+@pytest.mark.skipif(
+    _populate_indexes is None, reason="eager indexing not available in this version"
+)
+class TestEagerIndexing:
+    """Populate the default indexes for a 10k-event store from scratch."""
+
+    def test_memory_huge(self, benchmark, memory_store_huge):
+        store, _ = memory_store_huge
+        keys = ICalendarFile.default_index_keys()
+
+        def reset():
+            store.index.reset(keys)
+
+        benchmark.pedantic(_populate_indexes, args=(store,), setup=reset, rounds=3)
+        assert len(list(store.index.iter_etags())) == HUGE_COLLECTION
+
+    @pytest.mark.parametrize("workers", [2, 4])
+    def test_memory_huge_workers(self, benchmark, memory_store_huge, workers):
+        store, _ = memory_store_huge
+        keys = ICalendarFile.default_index_keys()
+
+        def reset():
+            store.index.reset(keys)
+
+        benchmark.pedantic(
+            _populate_indexes, args=(store, workers), setup=reset, rounds=3
+        )
+        assert len(list(store.index.iter_etags())) == HUGE_COLLECTION
+
+
+@pytest.fixture(scope="module")
+def index_values_huge(parsed_files_huge):
+    keys = ICalendarFile.default_index_keys()
+    return [
+        (
+            f"{i}.ics",
+            hashlib.sha1(str(i).encode()).hexdigest(),
+            fi.get_indexes(keys),
+        )
+        for i, fi in enumerate(parsed_files_huge)
+    ]
+
+
+@pytest.mark.skipif(
+    CompactMemoryIndex is None or not _has_default_index_keys(),
+    reason="CompactMemoryIndex not available in this version",
+)
+class TestIndexMemory:
+    """Fill a memory index with the default index values for 10k items."""
+
+    @pytest.mark.parametrize("index_cls", ["MemoryIndex", "CompactMemoryIndex"])
+    def test_fill(self, benchmark, index_values_huge, index_cls):
+        cls = {"MemoryIndex": MemoryIndex, "CompactMemoryIndex": CompactMemoryIndex}[
+            index_cls
+        ]
+        keys = ICalendarFile.default_index_keys()
+
+        def fill():
+            index = cls()
+            index.reset(keys)
+            for name, etag, values in index_values_huge:
+                index.add_values(name, etag, values)
+            return index
+
+        tracemalloc.start()
+        try:
+            index = fill()
+            size, unused_peak = tracemalloc.get_traced_memory()
+        finally:
+            tracemalloc.stop()
+        benchmark.extra_info["bytes"] = size
+        benchmark.extra_info["bytes_per_item"] = size // HUGE_COLLECTION
+        del index
+
+        index = benchmark.pedantic(fill, rounds=3)
+        assert len(list(index.iter_etags())) == HUGE_COLLECTION
@@ -27,6 +27,8 @@ Scenarios exercised:
   - Looking up a single item by name     (get_etag / get_file_meta)
   - Looking up every item one-by-one     (simulates calendar-multiget)
   - Getting file contents by name        (get_file)
+  - Writing items to a new collection     (import_one)
+  - Writing an item to a large collection (import_one, flat vs sharded)
 
 Each scenario is tested against BareGitStore, TreeGitStore and MemoryStore,
 with both small (50) and large (500) collections.
@@ -37,11 +39,23 @@ Run:
     pytest-benchmark compare <label1> <label2> --sort=fullname
 """
 
+from datetime import datetime, timezone
+
 import pytest
+from dulwich.repo import Repo
+
+from xandikos.icalendar import ICalendarFile
+from xandikos.store.git import BareGitStore, TreeGitStore
 
 from .conftest import (
+    HUGE_COLLECTION,
     LARGE_COLLECTION,
     SMALL_COLLECTION,
+    _make_recurring_vcalendar,
+    _make_vcalendar,
+    has_commit_message_policy,
+    has_fsync_policy,
+    has_layouts,
     has_get_etag,
     has_get_file_meta,
 )
@@ -278,3 +292,107 @@ class TestMultigetWithFileRetrieval:
     def test_memory_large(self, benchmark, memory_store_large):
         store, etags = memory_store_large
         benchmark(self._fetch_all, store, etags)
+
+
+class TestWriteThroughput:
+    """Write items to a new TreeGitStore on disk, one commit per item.
+
+    This is the hot path for PUT requests. Each round writes
+    SMALL_COLLECTION items to a fresh collection.
+    """
+
+    def _run(self, benchmark, tmp_path_factory, **kwargs):
+        base_date = datetime(2025, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
+        items = [
+            (f"event-{i}.ics", _make_vcalendar(i, base_date))
+            for i in range(SMALL_COLLECTION)
+        ]
+
+        def setup():
+            path = tmp_path_factory.mktemp("write")
+            store = TreeGitStore(Repo.init(str(path)), **kwargs)
+            store.load_extra_file_handler(ICalendarFile)
+            return (store,), {}
+
+        def write(store):
+            for name, data in items:
+                store.import_one(name, "text/calendar", [data])
+            store.repo.close()
+
+        benchmark.pedantic(write, setup=setup, rounds=5)
+
+    def test_tree_default(self, benchmark, tmp_path_factory):
+        self._run(benchmark, tmp_path_factory)
+
+    @pytest.mark.skipif(
+        not has_fsync_policy(), reason="fsync policies not available in this version"
+    )
+    @pytest.mark.parametrize("fsync_policy", ["none", "batch", "always"])
+    def test_tree_fsync(self, benchmark, tmp_path_factory, fsync_policy):
+        self._run(benchmark, tmp_path_factory, fsync_policy=fsync_policy)
+
+
+@pytest.mark.skipif(not has_layouts(), reason="layouts not available in this version")
+class TestBareWriteLatency:
+    """Write a single item to a BareGitStore, by collection size and layout.
+
+    With the flat layout, every write rewrites a tree with all items in
+    the collection; with the sharded layout only a small subtree.
+    """
+
+    @pytest.mark.parametrize("layout", ["flat", "sharded"])
+    @pytest.mark.parametrize("size", [LARGE_COLLECTION, HUGE_COLLECTION])
+    def test_write(self, benchmark, layout, size):
+        base_date = datetime(2025, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
+        store = BareGitStore.create_memory()
+        store.load_extra_file_handler(ICalendarFile)
+        store.set_layout(layout)
+        store.import_many(
+            [
+                (f"event-{i}.ics", "text/calendar", [_make_vcalendar(i, base_date)])
+                for i in range(size)
+            ]
+        )
+        counter = iter(range(size, size * 2))
+
+        def write():
+            i = next(counter)
+            store.import_one(
+                f"event-{i}.ics", "text/calendar", [_make_vcalendar(i, base_date)]
+            )
+
+        benchmark.pedantic(write, rounds=20)
+
+
+@pytest.mark.skipif(
+    not has_commit_message_policy(),
+    reason="commit message policies not available in this version",
+)
+class TestPutLatency:
+    """Replace a large recurring event, by commit message policy.
+
+    With the full policy, the previous version of the event is parsed too,
+    to describe what changed.
+    """
+
+    @pytest.mark.parametrize("policy", ["full", "summary", "minimal"])
+    def test_replace_recurring(self, benchmark, policy):
+        base_date = datetime(2025, 1, 1, 10, 0, 0, tzinfo=timezone.utc)
+        store = BareGitStore.create_memory()
+        store.load_extra_file_handler(ICalendarFile)
+        store.commit_message_policy = policy
+        (name, etag) = store.import_one(
+            "recurring.ics",
+            "text/calendar",
+            [_make_recurring_vcalendar(200, base_date)],
+        )
+        revisions = iter(range(1, 1000))
+        state = {"etag": etag}
+
+        def put():
+            data = _make_recurring_vcalendar(200, base_date, next(revisions))
+            (_, state["etag"]) = store.import_one(
+                name, "text/calendar", [data], replace_etag=state["etag"]
+            )
+
+        benchmark.pedantic(put, rounds=20)
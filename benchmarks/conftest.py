@@ -42,13 +42,14 @@ from datetime import datetime, timedelta, timezone
 import pytest
 
 from xandikos.icalendar import ICalendarFile
-from xandikos.store.git import BareGitStore, TreeGitStore
+from xandikos.store.git import BareGitStore, GitStore, TreeGitStore
 from xandikos.store.memory import MemoryStore
 
 
 # Number of items in collections used for benchmarks.
 SMALL_COLLECTION = 50
 LARGE_COLLECTION = 500
+HUGE_COLLECTION = 10000
 
 
 def _make_vcalendar(i: int, base_date: datetime) -> bytes:
@@ -69,6 +70,43 @@ def _make_vcalendar(i: int, base_date: datetime) -> bytes:
     )
 
 
+def _make_recurring_vcalendar(
+    overrides: int, base_date: datetime, revision: int = 0
+) -> bytes:
+    """Generate a VCALENDAR with a weekly recurring VEVENT.
+
+    The event has the specified number of overridden instances; the
+    revision ends up in the description of the master event.
+    """
+    lines = [
+        "BEGIN:VCALENDAR",
+        "VERSION:2.0",
+        "PRODID:-//Xandikos Bench//EN",
+        "BEGIN:VEVENT",
+        "UID:bench-recurring@example.com",
+        f"DTSTART:{base_date.strftime('%Y%m%dT%H%M%SZ')}",
+        "DURATION:PT1H",
+        "RRULE:FREQ=WEEKLY",
+        "SUMMARY:Weekly meeting",
+        f"DESCRIPTION:Revision {revision}",
+        "END:VEVENT",
+    ]
+    for i in range(1, overrides + 1):
+        recurrence_id = (base_date + timedelta(weeks=i)).strftime("%Y%m%dT%H%M%SZ")
+        start = (base_date + timedelta(weeks=i, hours=1)).strftime("%Y%m%dT%H%M%SZ")
+        lines += [
+            "BEGIN:VEVENT",
+            "UID:bench-recurring@example.com",
+            f"RECURRENCE-ID:{recurrence_id}",
+            f"DTSTART:{start}",
+            "DURATION:PT1H",
+            f"SUMMARY:Weekly meeting (moved {i})",
+            "END:VEVENT",
+        ]
+    lines.append("END:VCALENDAR")
+    return "".join(line + "\r\n" for line in lines).encode()
+
+
 def _import_one(store, name, content_type, data):
     """Call import_one with the right kwargs for the current xandikos version.
 
@@ -153,6 +191,13 @@ def memory_store_large():
     return store, etags
 
 
+@pytest.fixture(scope="session")
+def memory_store_huge():
+    store = MemoryStore()
+    etags = _populate_store(store, HUGE_COLLECTION)
+    return store, etags
+
+
 # -- helpers available to test modules ----------------------------------------
 
 
@@ -163,6 +208,21 @@ def has_get_etag():
     )
 
 
+def has_fsync_policy():
+    """True if the installed xandikos supports fsync policies."""
+    return "fsync_policy" in inspect.signature(GitStore.__init__).parameters
+
+
+def has_commit_message_policy():
+    """True if the installed xandikos supports commit message policies."""
+    return "commit_message_policy" in inspect.signature(GitStore.__init__).parameters
+
+
+def has_layouts():
+    """True if the installed xandikos supports sharded bare stores."""
+    return hasattr(BareGitStore, "set_layout")
+
+
 def has_get_file_meta():
     """True if the installed xandikos has get_file_meta()."""
     from xandikos.store import Store
@@ -86,6 +86,50 @@ if [ "$EAGER" = "true" ] || [ "$EAGER" = "1" ]; then
     ARGS+=("--eager")
 fi
 
+if [ -n "$EAGER_WORKERS" ]; then
+    ARGS+=("--eager-workers=$EAGER_WORKERS")
+fi
+
+if [ -n "$INDEX_BACKEND" ]; then
+    ARGS+=("--index-backend=$INDEX_BACKEND")
+fi
+
+if [ -n "$INDEX_MEMORY_BUDGET" ]; then
+    ARGS+=("--index-memory-budget=$INDEX_MEMORY_BUDGET")
+fi
+
+if [ -n "$MAX_INDEX_SIZE" ]; then
+    ARGS+=("--max-index-size=$MAX_INDEX_SIZE")
+fi
+
+if [ -n "$TEXT_INDEX" ]; then
+    ARGS+=("--text-index=$TEXT_INDEX")
+fi
+
+if [ -n "$COMMIT_DELAY" ]; then
+    ARGS+=("--commit-delay=$COMMIT_DELAY")
+fi
+
+if [ -n "$FSYNC" ]; then
+    ARGS+=("--fsync=$FSYNC")
+fi
+
+if [ -n "$COMMIT_MESSAGES" ]; then
+    ARGS+=("--commit-messages=$COMMIT_MESSAGES")
+fi
+
+if [ -n "$STORE_THREADS" ]; then
+    ARGS+=("--store-threads=$STORE_THREADS")
+fi
+
+if [ -n "$MAINTENANCE_INTERVAL" ]; then
+    ARGS+=("--maintenance-interval=$MAINTENANCE_INTERVAL")
+fi
+
+if [ "$OBJECT_POOL" = "true" ] || [ "$OBJECT_POOL" = "1" ]; then
+    ARGS+=("--object-pool")
+fi
+
 if [ "$NO_DETECT_SYSTEMD" = "true" ] || [ "$NO_DETECT_SYSTEMD" = "1" ]; then
     ARGS+=("--no-detect-systemd")
 fi
@@ -40,6 +40,7 @@ def test_suite():
         "davcommon",
         "expand_property",
         "icalendar",
+        "index",
         "insufficient_index_handling",
         "main",
         "multi_user",
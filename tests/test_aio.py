@@ -0,0 +1,133 @@
+# Xandikos
+# Copyright (C) 2026 Jelmer Vernooĳ <jelmer@jelmer.uk>, et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for xandikos.store.aio."""
+
+import asyncio
+import threading
+import unittest
+
+from xandikos.store import NoSuchItem
+from xandikos.store.aio import AsyncStore, create_store_executor
+from xandikos.store.memory import MemoryStore
+
+EXAMPLE_VCALENDAR1 = b"""\
+BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//bitfire web engineering//DAVdroid 0.8.0 (ical4j 1.0.x)//EN
+BEGIN:VTODO
+CREATED:20150314T223512Z
+DTSTAMP:20150527T221952Z
+LAST-MODIFIED:20150314T223512Z
+STATUS:NEEDS-ACTION
+SUMMARY:do something
+UID:bdc22720-b9e1-42c9-89c2-a85405d8fbff
+END:VTODO
+END:VCALENDAR
+"""
+
+
+class AsyncStoreTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.executor = create_store_executor(2)
+        self.addCleanup(self.executor.shutdown)
+        self.store = MemoryStore()
+        self.async_store = AsyncStore(self.store, self.executor)
+
+    def test_repr(self):
+        self.assertEqual(f"AsyncStore({self.store!r})", repr(self.async_store))
+
+    def test_import_and_delete(self):
+        async def run():
+            (name, etag) = await self.async_store.import_one(
+                "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+            )
+            self.assertEqual(etag, await self.async_store.get_etag(name))
+            self.assertEqual(
+                ("text/calendar", etag), await self.async_store.get_file_meta(name)
+            )
+            self.assertEqual(self.store.get_ctag(), await self.async_store.get_ctag())
+            fi = await self.async_store.get_file(name, "text/calendar", etag)
+            self.assertEqual([EXAMPLE_VCALENDAR1], list(fi.content))
+            await self.async_store.delete_one(name, etag=etag)
+            with self.assertRaises(NoSuchItem):
+                await self.async_store.delete_one(name)
+
+        asyncio.run(run())
+
+    def test_iter_with_etag(self):
+        (name, etag) = self.store.import_one(
+            "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+
+        async def run():
+            return [item async for item in self.async_store.iter_with_etag()]
+
+        self.assertEqual([(name, "text/calendar", etag)], asyncio.run(run()))
+
+    def test_iter_changes_unsupported(self):
+        async def run():
+            return [change async for change in self.async_store.iter_changes("", "")]
+
+        self.assertRaises(NotImplementedError, asyncio.run, run())
+
+    def test_runs_on_executor(self):
+        async def run():
+            return await self.async_store.run(lambda: threading.current_thread().name)
+
+        self.assertTrue(asyncio.run(run()).startswith("xandikos-store"))
+
+    def test_does_not_block_event_loop(self):
+        started = threading.Event()
+        release = threading.Event()
+
+        def slow_ctag():
+            started.set()
+            release.wait(10)
+            return "ctag"
+
+        self.store.get_ctag = slow_ctag
+
+        async def run():
+            task = asyncio.ensure_future(self.async_store.get_ctag())
+            # The event loop keeps running while the store is busy.
+            while not started.is_set():
+                await asyncio.sleep(0.001)
+            self.assertFalse(task.done())
+            release.set()
+            return await task
+
+        self.assertEqual("ctag", asyncio.run(run()))
+
+    def test_errors(self):
+        async def run():
+            await self.async_store.get_etag("nonexistent.ics")
+
+        self.assertRaises(KeyError, asyncio.run, run())
+
+
+class CreateStoreExecutorTests(unittest.TestCase):
+    def test_max_workers(self):
+        executor = create_store_executor(3)
+        self.addCleanup(executor.shutdown)
+        self.assertEqual(3, executor._max_workers)
+
+    def test_invalid(self):
+        self.assertRaises(ValueError, create_store_executor, 0)
@@ -19,6 +19,7 @@
 
 """Tests for xandikos.icalendar."""
 
+import math
 import unittest
 from datetime import date, datetime, timedelta, timezone
 from zoneinfo import ZoneInfo
@@ -34,7 +35,9 @@ from xandikos.icalendar import (
     ICalendarFile,
     MIN_EXPANSION_TIME,
     MissingProperty,
+    TIME_RANGE_INDEX_PROPERTIES,
     TextMatcher,
+    _compile_index_rrule,
     _create_enriched_valarm,
     _event_overlaps_range,
     _normalize_rrule_until,
@@ -46,6 +49,7 @@ from xandikos.icalendar import (
     as_tz_aware_ts,
     expand_calendar_rrule,
     limit_calendar_recurrence_set,
+    split_calendar,
     validate_calendar,
 )
 
@@ -667,6 +671,47 @@ class CalendarFilterTests(unittest.TestCase):
         # Also test with the actual calendar
         self.assertTrue(filter.check("file", self.cal))
 
+    def test_rrule_index_based_filtering_cached(self):
+        """Compiled recurrence rules are reused across queries."""
+        indexes = {
+            "C=VCALENDAR/C=VEVENT/P=DTSTART": [b"20150527T221952Z"],
+            "C=VCALENDAR/C=VEVENT/P=DTEND": [],
+            "C=VCALENDAR/C=VEVENT/P=DURATION": [b"PT1H"],
+            "C=VCALENDAR/C=VEVENT/P=RRULE": [b"FREQ=YEARLY;COUNT=3"],
+            "C=VCALENDAR/C=VEVENT": [True],
+        }
+        _compile_index_rrule.cache_clear()
+        for year, expected in [(2016, True), (2018, False), (2017, True)]:
+            filter = CalendarFilter(ZoneInfo("UTC"))
+            filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+                "VEVENT"
+            ).filter_time_range(
+                start=self._tzify(datetime(year, 5, 27, 0, 0, 0)),
+                end=self._tzify(datetime(year, 5, 28, 0, 0, 0)),
+            )
+            self.assertEqual(expected, filter.check_from_indexes("file", indexes))
+        cache_info = _compile_index_rrule.cache_info()
+        self.assertEqual(1, cache_info.misses)
+        self.assertEqual(2, cache_info.hits)
+
+    def test_rrule_index_based_filtering_invalid_duration(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT"
+        ).filter_time_range(
+            start=self._tzify(datetime(2016, 5, 27, 0, 0, 0)),
+            end=self._tzify(datetime(2016, 5, 28, 0, 0, 0)),
+        )
+        indexes = {
+            "C=VCALENDAR/C=VEVENT/P=DTSTART": [b"20150527T221952Z"],
+            "C=VCALENDAR/C=VEVENT/P=DTEND": [],
+            "C=VCALENDAR/C=VEVENT/P=DURATION": [b"invalid"],
+            "C=VCALENDAR/C=VEVENT/P=RRULE": [b"FREQ=YEARLY"],
+            "C=VCALENDAR/C=VEVENT": [True],
+        }
+        with self.assertLogs("xandikos", level="WARNING"):
+            self.assertFalse(filter.check_from_indexes("file", indexes))
+
     def test_rrule_index_based_filtering_no_match(self):
         """Test that rrule filtering correctly returns False when no recurrences match."""
         self.cal = ICalendarFile([EXAMPLE_VCALENDAR_RRULE], "text/calendar")
@@ -1265,6 +1310,267 @@ END:VCALENDAR
         )
 
 
+class GetIndexesTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cal = ICalendarFile(
+            [
+                b"""\
+BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Xandikos//Tests//EN
+BEGIN:VEVENT
+UID:first
+DTSTAMP:20200101T000000Z
+DTSTART:20200610T100000Z
+DURATION:PT1H
+SUMMARY:First
+BEGIN:VALARM
+ACTION:DISPLAY
+TRIGGER:-PT15M
+END:VALARM
+END:VEVENT
+BEGIN:VEVENT
+UID:second
+DTSTAMP:20200101T000000Z
+DTSTART:20200611T100000Z
+DTEND:20200611T110000Z
+SUMMARY:Second
+BEGIN:VALARM
+ACTION:DISPLAY
+TRIGGER:-PT30M
+END:VALARM
+END:VEVENT
+BEGIN:VTODO
+UID:third
+DTSTAMP:20200101T000000Z
+SUMMARY:Third
+END:VTODO
+END:VCALENDAR
+"""
+            ],
+            "text/calendar",
+        )
+
+    def test_matches_per_key(self):
+        keys = ICalendarFile.default_index_keys() + [
+            "C=VCALENDAR/P=PRODID",
+            "C=VCALENDAR/C=VEVENT/P=SUMMARY",
+            "C=VCALENDAR/C=VEVENT/C=VALARM",
+            "C=VCALENDAR/C=VEVENT/C=VALARM/P=TRIGGER",
+            "C=VCALENDAR/C=VFREEBUSY/P=DTSTART",
+            "C=VTODO",
+            "P=UID",
+        ]
+        self.assertEqual(
+            {key: list(self.cal._get_index(key)) for key in keys},
+            self.cal.get_indexes(keys),
+        )
+
+    def test_values(self):
+        self.assertEqual(
+            {
+                "C=VCALENDAR/C=VEVENT/P=SUMMARY": [b"First", b"Second"],
+                "C=VCALENDAR/C=VEVENT/C=VALARM/P=TRIGGER": [
+                    b"20200610T094500Z",
+                    b"20200611T093000Z",
+                ],
+                "C=VCALENDAR/C=VTODO": [True],
+            },
+            self.cal.get_indexes(
+                [
+                    "C=VCALENDAR/C=VEVENT/P=SUMMARY",
+                    "C=VCALENDAR/C=VEVENT/C=VALARM/P=TRIGGER",
+                    "C=VCALENDAR/C=VTODO",
+                ]
+            ),
+        )
+
+    def test_unsupported_key(self):
+        self.assertRaises(
+            AssertionError, self.cal.get_indexes, ["C=VCALENDAR/P=PRODID/P=X"]
+        )
+
+
+class TimeRangesFromIndexesTests(unittest.TestCase):
+    def _indexes(self, component, count, **props):
+        ret = {}
+        for name in ("VEVENT", "VTODO", "VJOURNAL"):
+            prefix = "C=VCALENDAR/C=" + name
+            ret[prefix] = [True] * (count if name == component else 0)
+            for prop in TIME_RANGE_INDEX_PROPERTIES[name]:
+                ret[prefix + "/P=" + prop] = (
+                    props.get(prop, []) if name == component else []
+                )
+        return ret
+
+    def _ts(self, *args):
+        return datetime(*args, tzinfo=timezone.utc).timestamp()
+
+    def test_event(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes(
+                "VEVENT",
+                1,
+                DTSTART=[b"20200610T100000Z"],
+                DTEND=[b"20200610T110000Z"],
+            )
+        )
+        self.assertEqual(
+            {
+                "VEVENT": [(self._ts(2020, 6, 10, 10), self._ts(2020, 6, 10, 11))],
+                "VTODO": [],
+                "VJOURNAL": [],
+            },
+            ranges,
+        )
+
+    def test_event_duration(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes(
+                "VEVENT", 1, DTSTART=[b"20200610T100000Z"], DURATION=[b"PT2H"]
+            )
+        )
+        self.assertEqual(
+            [(self._ts(2020, 6, 10, 10), self._ts(2020, 6, 10, 12))], ranges["VEVENT"]
+        )
+
+    def test_floating_date(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes("VEVENT", 1, DTSTART=[b"20200610"])
+        )
+        self.assertEqual(
+            [(self._ts(2020, 6, 9), self._ts(2020, 6, 12))], ranges["VEVENT"]
+        )
+
+    def test_recurring(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes(
+                "VEVENT",
+                1,
+                DTSTART=[b"20200610T100000Z"],
+                DTEND=[b"20200610T110000Z"],
+                RRULE=[b"FREQ=DAILY"],
+            )
+        )
+        self.assertEqual([(self._ts(2020, 6, 10, 10), math.inf)], ranges["VEVENT"])
+
+    def test_event_without_dtstart(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(self._indexes("VEVENT", 1))
+        self.assertEqual([(-math.inf, math.inf)], ranges["VEVENT"])
+
+    def test_todo_created(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes("VTODO", 1, CREATED=[b"20150314T223512Z"])
+        )
+        self.assertEqual(
+            [(self._ts(2015, 3, 14, 22, 35, 12), math.inf)], ranges["VTODO"]
+        )
+
+    def test_todo_without_dates(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes("VTODO", 2, DUE=[b"20150314T223512Z"])
+        )
+        self.assertEqual([(-math.inf, math.inf)], ranges["VTODO"])
+
+    def test_invalid_value(self):
+        ranges = ICalendarFile.time_ranges_from_indexes(
+            self._indexes("VEVENT", 1, DTSTART=[b"invalid"])
+        )
+        self.assertEqual([(-math.inf, math.inf)], ranges["VEVENT"])
+
+    def test_missing_keys(self):
+        self.assertEqual(
+            {},
+            ICalendarFile.time_ranges_from_indexes({"C=VCALENDAR/C=VEVENT": [True]}),
+        )
+
+    def test_filter_index_time_range(self):
+        start = datetime(2020, 6, 8, tzinfo=timezone.utc)
+        end = datetime(2020, 6, 15, tzinfo=timezone.utc)
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        self.assertIsNone(filter.index_time_range())
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT"
+        ).filter_time_range(start, end)
+        self.assertEqual(("VEVENT", start, end), filter.index_time_range())
+
+    def test_filter_index_time_range_not_defined(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT", is_not_defined=True
+        )
+        self.assertIsNone(filter.index_time_range())
+
+
+class TextIndexTests(unittest.TestCase):
+    def test_text_index_keys(self):
+        self.assertEqual(
+            [
+                "C=VCALENDAR/C=VEVENT/P=SUMMARY",
+                "C=VCALENDAR/C=VTODO/P=SUMMARY",
+                "C=VCALENDAR/C=VJOURNAL/P=SUMMARY",
+            ],
+            ICalendarFile.text_index_keys(["summary"]),
+        )
+
+    def test_index_value_texts(self):
+        key = "C=VCALENDAR/C=VEVENT/P=SUMMARY"
+        self.assertEqual(["Lunch"], ICalendarFile.index_value_texts(key, b"Lunch"))
+        self.assertEqual(
+            ["Lunch\\, dinner\\nparty", "Lunch, dinner\nparty"],
+            ICalendarFile.index_value_texts(key, b"Lunch\\, dinner\\nparty"),
+        )
+
+    def test_filter_index_text_matches(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        self.assertEqual([], filter.index_text_matches())
+        comp = filter.filter_subcomponent("VCALENDAR").filter_subcomponent("VEVENT")
+        comp.filter_property("SUMMARY").filter_text_match("meeting")
+        comp.filter_property("LOCATION").filter_text_match(
+            "room", negate_condition=True
+        )
+        comp.filter_property("DESCRIPTION", is_not_defined=True)
+        self.assertEqual(
+            [("C=VCALENDAR/C=VEVENT/P=SUMMARY", "meeting")],
+            filter.index_text_matches(),
+        )
+
+
+class ComponentIndexTests(unittest.TestCase):
+    def test_components_from_indexes(self):
+        self.assertEqual(
+            {"C=VCALENDAR": True, "C=VCALENDAR/C=VTODO": False},
+            ICalendarFile.components_from_indexes(
+                {
+                    "C=VCALENDAR": [True],
+                    "C=VCALENDAR/C=VTODO": [],
+                    "C=VCALENDAR/C=VEVENT/P=DTSTART": [b"20200101T100000Z"],
+                }
+            ),
+        )
+
+    def test_filter_index_components(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        self.assertIsNone(filter.index_components())
+        comp = filter.filter_subcomponent("VCALENDAR")
+        self.assertEqual([("C=VCALENDAR", True)], filter.index_components())
+        comp.filter_subcomponent("VTODO")
+        self.assertEqual([("C=VCALENDAR/C=VTODO", True)], filter.index_components())
+
+    def test_filter_index_components_other_conditions(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VTODO"
+        ).filter_property("SUMMARY")
+        self.assertIsNone(filter.index_components())
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VTODO", is_not_defined=True
+        )
+        self.assertIsNone(filter.index_components())
+
+
 class TextMatchTest(unittest.TestCase):
     def test_default_collation(self):
         tm = TextMatcher("summary", "foobar")
@@ -2923,3 +3229,73 @@ END:VCALENDAR"""
         # Verify we got the expected number of events
         events = [comp for comp in expanded.walk() if comp.name == "VEVENT"]
         self.assertEqual(len(events), 10)  # Jan 22-31 = 10 days
+
+
+class SplitCalendarTests(unittest.TestCase):
+    def test_split(self):
+        cal = Calendar.from_ical(
+            b"""\
+BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Example//Test//EN
+METHOD:PUBLISH
+BEGIN:VTIMEZONE
+TZID:Europe/London
+BEGIN:STANDARD
+DTSTART:19701025T020000
+TZOFFSETFROM:+0100
+TZOFFSETTO:+0000
+END:STANDARD
+END:VTIMEZONE
+BEGIN:VTIMEZONE
+TZID:Europe/Paris
+BEGIN:STANDARD
+DTSTART:19701025T030000
+TZOFFSETFROM:+0200
+TZOFFSETTO:+0100
+END:STANDARD
+END:VTIMEZONE
+BEGIN:VEVENT
+UID:event1
+DTSTAMP:20240101T000000Z
+DTSTART;TZID=Europe/London:20240101T100000
+RRULE:FREQ=DAILY;COUNT=3
+SUMMARY:Recurring
+END:VEVENT
+BEGIN:VEVENT
+UID:event2
+DTSTAMP:20240101T000000Z
+DTSTART:20240105T100000Z
+SUMMARY:Single
+END:VEVENT
+BEGIN:VEVENT
+UID:event1
+RECURRENCE-ID;TZID=Europe/London:20240102T100000
+DTSTAMP:20240101T000000Z
+DTSTART;TZID=Europe/London:20240102T110000
+SUMMARY:Moved
+END:VEVENT
+END:VCALENDAR
+"""
+        )
+        [cal1, cal2] = split_calendar(cal)
+        self.assertEqual(
+            ["VTIMEZONE", "VEVENT", "VEVENT"],
+            [comp.name for comp in cal1.subcomponents],
+        )
+        self.assertEqual("Europe/London", cal1.subcomponents[0]["TZID"])
+        self.assertEqual(
+            {"event1"}, {str(comp["UID"]) for comp in cal1.subcomponents[1:]}
+        )
+        self.assertEqual(["VEVENT"], [comp.name for comp in cal2.subcomponents])
+        self.assertEqual("event2", cal2.subcomponents[0]["UID"])
+        for c in (cal1, cal2):
+            self.assertEqual("2.0", c["VERSION"])
+            self.assertNotIn("METHOD", c)
+
+    def test_no_uid(self):
+        cal = Calendar()
+        cal.add("VERSION", "2.0")
+        cal.add_component(Todo(summary="one"))
+        cal.add_component(Todo(summary="two"))
+        self.assertEqual(2, len(split_calendar(cal)))
@@ -0,0 +1,749 @@
+# Xandikos
+# Copyright (C) 2026 Jelmer Vernooĳ <jelmer@jelmer.uk>, et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Tests for xandikos.store.index."""
+
+import hashlib
+import math
+import os
+import shutil
+import sqlite3
+import tempfile
+import unittest
+
+from xandikos.store.index import (
+    SHARED_INDEX_CACHE,
+    AutoIndexManager,
+    CompactMemoryIndex,
+    ComponentIndex,
+    IndexKeyStats,
+    MemoryIndex,
+    SharedIndex,
+    SharedIndexCache,
+    SqliteIndex,
+    TimeRangeIndex,
+    TrigramIndex,
+    open_index,
+    trigrams,
+)
+
+
+class BaseIndexTest:
+    def test_empty(self):
+        index = self.create_index()
+        self.assertEqual(set(), set(index.available_keys()))
+        self.assertEqual([], list(index.iter_etags()))
+
+    def test_add_and_get(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR", "C=VCALENDAR/C=VEVENT/P=DTSTART"])
+        index.add_values(
+            "foo.ics",
+            "etag1",
+            {
+                "C=VCALENDAR": [True],
+                "C=VCALENDAR/C=VEVENT/P=DTSTART": [b"20260101T100000Z", False],
+            },
+        )
+        self.assertEqual(
+            {
+                "C=VCALENDAR": [True],
+                "C=VCALENDAR/C=VEVENT/P=DTSTART": [b"20260101T100000Z", False],
+            },
+            index.get_values(
+                "foo.ics", "etag1", ["C=VCALENDAR", "C=VCALENDAR/C=VEVENT/P=DTSTART"]
+            ),
+        )
+        self.assertEqual(["etag1"], list(index.iter_etags()))
+
+    def test_get_missing_etag(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        self.assertRaises(
+            KeyError, index.get_values, "foo.ics", "etag1", ["C=VCALENDAR"]
+        )
+
+    def test_indexed_without_values(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {})
+        self.assertEqual(
+            {"C=VCALENDAR": []},
+            index.get_values("foo.ics", "etag1", ["C=VCALENDAR"]),
+        )
+
+    def test_reset(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        self.assertEqual(
+            {"C=VCALENDAR", "C=VCALENDAR/C=VTODO"}, set(index.available_keys())
+        )
+        self.assertEqual([], list(index.iter_etags()))
+
+    def test_remove_values(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index.add_values("bar.ics", "etag2", {"C=VCALENDAR": [True]})
+        index.remove_values(["etag1", "etag3"])
+        self.assertEqual(["etag2"], list(index.iter_etags()))
+        self.assertRaises(
+            KeyError, index.get_values, "foo.ics", "etag1", ["C=VCALENDAR"]
+        )
+
+    def test_indexed_ctag(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        self.assertIsNone(index.get_indexed_ctag())
+        index.set_indexed_ctag("ctag1")
+        self.assertEqual("ctag1", index.get_indexed_ctag())
+        index.set_indexed_ctag("ctag2")
+        self.assertEqual("ctag2", index.get_indexed_ctag())
+        index.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        self.assertIsNone(index.get_indexed_ctag())
+
+    def test_add_keys(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index.set_indexed_ctag("ctag1")
+        index.add_keys(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        self.assertEqual(
+            {"C=VCALENDAR", "C=VCALENDAR/C=VTODO"}, set(index.available_keys())
+        )
+        self.assertIsNone(index.get_indexed_ctag())
+        # Values for existing keys are kept
+        self.assertEqual(
+            {"C=VCALENDAR": [True]},
+            index.get_values("foo.ics", "etag1", ["C=VCALENDAR"]),
+        )
+        # .. but the item has not been indexed for the new key yet
+        self.assertRaises(
+            KeyError,
+            index.get_values,
+            "foo.ics",
+            "etag1",
+            ["C=VCALENDAR", "C=VCALENDAR/C=VTODO"],
+        )
+        self.assertEqual([], list(index.iter_etags()))
+        index.add_values(
+            "foo.ics",
+            "etag1",
+            {"C=VCALENDAR": [True], "C=VCALENDAR/C=VTODO": [True]},
+        )
+        self.assertEqual(
+            {"C=VCALENDAR": [True], "C=VCALENDAR/C=VTODO": [True]},
+            index.get_values(
+                "foo.ics", "etag1", ["C=VCALENDAR", "C=VCALENDAR/C=VTODO"]
+            ),
+        )
+        self.assertEqual(["etag1"], list(index.iter_etags()))
+
+    def test_remove_keys(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        index.add_values(
+            "foo.ics",
+            "etag1",
+            {"C=VCALENDAR": [True], "C=VCALENDAR/C=VTODO": [True]},
+        )
+        index.remove_keys(["C=VCALENDAR/C=VTODO"])
+        self.assertEqual({"C=VCALENDAR"}, set(index.available_keys()))
+        self.assertEqual(
+            {"C=VCALENDAR": [True]},
+            index.get_values("foo.ics", "etag1", ["C=VCALENDAR"]),
+        )
+        self.assertRaises(
+            KeyError,
+            index.get_values,
+            "foo.ics",
+            "etag1",
+            ["C=VCALENDAR/C=VTODO"],
+        )
+        self.assertEqual(["etag1"], list(index.iter_etags()))
+
+
+class MemoryIndexTest(BaseIndexTest, unittest.TestCase):
+    def create_index(self):
+        return MemoryIndex()
+
+
+class CompactMemoryIndexTest(BaseIndexTest, unittest.TestCase):
+    def create_index(self):
+        return CompactMemoryIndex()
+
+    def test_value_shapes(self):
+        index = self.create_index()
+        values = {
+            "a": [True],
+            "b": [False],
+            "c": [],
+            "d": [b"20260101T100000Z"],
+            "e": [b"x", b"y"],
+            "f": [False, b"x"],
+        }
+        index.reset(values)
+        index.add_values("foo.ics", "etag1", values)
+        self.assertEqual(values, index.get_values("foo.ics", "etag1", list(values)))
+
+    def test_hex_etags(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        etags = ["%040x" % i for i in range(3)] + ["etag-1", "%040X" % 3]
+        for i, etag in enumerate(etags):
+            index.add_values("%d.ics" % i, etag, {"C=VCALENDAR": [i % 2 == 0]})
+        self.assertEqual(set(etags), set(index.iter_etags()))
+        for i, etag in enumerate(etags):
+            self.assertEqual(
+                {"C=VCALENDAR": [i % 2 == 0]},
+                index.get_values("%d.ics" % i, etag, ["C=VCALENDAR"]),
+            )
+
+    def test_reuses_rows(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "%040x" % 1, {"C=VCALENDAR": [True]})
+        index.remove_values(["%040x" % 1])
+        index.add_values("bar.ics", "%040x" % 2, {"C=VCALENDAR": []})
+        self.assertEqual(1, len(index._row_generations))
+        self.assertEqual(
+            {"C=VCALENDAR": []},
+            index.get_values("bar.ics", "%040x" % 2, ["C=VCALENDAR"]),
+        )
+        self.assertEqual(["%040x" % 2], list(index.iter_etags()))
+
+    def test_many_etags(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        # The first of these all hash to the same slot.
+        etags = ["%040x" % i for i in range(50)] + [
+            hashlib.sha1(b"%d" % i).hexdigest() for i in range(50)
+        ]
+        for etag in etags:
+            index.add_values("foo.ics", etag, {"C=VCALENDAR": [True]})
+        index.remove_values(etags[::2])
+        for etag in etags[::4]:
+            index.add_values("foo.ics", etag, {"C=VCALENDAR": [False]})
+        expected = set(etags[1::2]) | set(etags[::4])
+        self.assertEqual(expected, set(index.iter_etags()))
+        self.assertEqual(len(etags), len(index._row_generations))
+        for i, etag in enumerate(etags):
+            if etag not in expected:
+                self.assertRaises(
+                    KeyError, index.get_values, "foo.ics", etag, ["C=VCALENDAR"]
+                )
+            else:
+                self.assertEqual(
+                    {"C=VCALENDAR": [i % 2 == 1]},
+                    index.get_values("foo.ics", etag, ["C=VCALENDAR"]),
+                )
+
+
+class SqliteIndexTest(BaseIndexTest, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.tempdir)
+
+    def create_index(self):
+        index = SqliteIndex(os.path.join(self.tempdir, "index.sqlite"))
+        self.addCleanup(index.close)
+        return index
+
+    def test_persistent(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True, False]})
+        index.close()
+        index = self.create_index()
+        self.assertEqual({"C=VCALENDAR"}, set(index.available_keys()))
+        self.assertEqual(["etag1"], list(index.iter_etags()))
+        self.assertEqual(
+            {"C=VCALENDAR": [True, False]},
+            index.get_values("foo.ics", "etag1", ["C=VCALENDAR"]),
+        )
+
+    def test_persistent_indexed_ctag(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.set_indexed_ctag("ctag1")
+        index.close()
+        self.assertEqual("ctag1", self.create_index().get_indexed_ctag())
+
+    def test_persistent_add_keys(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index.remove_keys(["C=VCALENDAR/C=VTODO"])
+        index.add_keys(["C=VCALENDAR/C=VEVENT"])
+        index.close()
+        index = self.create_index()
+        index.add_keys(["C=VCALENDAR/C=VTODO"])
+        self.assertRaises(
+            KeyError,
+            index.get_values,
+            "foo.ics",
+            "etag1",
+            ["C=VCALENDAR/C=VTODO"],
+        )
+
+    def test_old_schema(self):
+        path = os.path.join(self.tempdir, "index.sqlite")
+        conn = sqlite3.connect(path)
+        conn.execute("CREATE TABLE index_keys (key TEXT PRIMARY KEY)")
+        conn.execute("INSERT INTO index_keys (key) VALUES ('C=VCALENDAR')")
+        conn.commit()
+        conn.close()
+        index = self.create_index()
+        self.assertEqual(set(), set(index.available_keys()))
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        self.assertEqual(["etag1"], list(index.iter_etags()))
+
+    def test_concurrent_values(self):
+        index1 = self.create_index()
+        index1.reset(["C=VCALENDAR"])
+        index2 = self.create_index()
+        index1.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        self.assertEqual(
+            {"C=VCALENDAR": [True]},
+            index2.get_values("foo.ics", "etag1", ["C=VCALENDAR"]),
+        )
+
+    def test_concurrent_add_keys(self):
+        index1 = self.create_index()
+        index1.reset(["C=VCALENDAR"])
+        index2 = self.create_index()
+        index1.add_keys(["C=VCALENDAR/C=VTODO"])
+        self.assertEqual(
+            {"C=VCALENDAR", "C=VCALENDAR/C=VTODO"}, set(index2.available_keys())
+        )
+        # Both processes picking the same key doesn't clash.
+        index2.add_keys(["C=VCALENDAR/C=VTODO", "C=VCALENDAR/C=VEVENT"])
+        index1.add_values(
+            "foo.ics",
+            "etag1",
+            {
+                "C=VCALENDAR": [True],
+                "C=VCALENDAR/C=VTODO": [False],
+                "C=VCALENDAR/C=VEVENT": [True],
+            },
+        )
+        self.assertEqual(
+            {"C=VCALENDAR/C=VEVENT": [True]},
+            index2.get_values("foo.ics", "etag1", ["C=VCALENDAR/C=VEVENT"]),
+        )
+
+    def test_concurrent_remove_keys(self):
+        index1 = self.create_index()
+        index1.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        index1.add_values(
+            "foo.ics", "etag1", {"C=VCALENDAR": [True], "C=VCALENDAR/C=VTODO": [True]}
+        )
+        index2 = self.create_index()
+        index1.remove_keys(["C=VCALENDAR/C=VTODO"])
+        # The values for the removed key are gone, so they must not be
+        # reported as empty.
+        self.assertRaises(
+            KeyError,
+            index2.get_values,
+            "foo.ics",
+            "etag1",
+            ["C=VCALENDAR/C=VTODO"],
+        )
+        self.assertEqual({"C=VCALENDAR"}, set(index2.available_keys()))
+
+
+class SharedIndexTest(BaseIndexTest, unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.cache = SharedIndexCache()
+
+    def create_index(self):
+        return SharedIndex(self.cache)
+
+    def test_default_cache(self):
+        self.assertIs(SHARED_INDEX_CACHE, SharedIndex()._cache)
+
+    def test_indexed_without_values(self):
+        # Values that weren't computed are not reported as absent, since
+        # other stores may rely on them.
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {})
+        self.assertRaises(
+            KeyError, index.get_values, "foo.ics", "etag1", ["C=VCALENDAR"]
+        )
+        self.assertEqual([], list(index.iter_etags()))
+
+    def test_remove_values(self):
+        # Values may be in use by other stores, so they are left for the
+        # cache to evict.
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index.remove_values(["etag1"])
+        self.assertEqual([], list(index.iter_etags()))
+        self.assertEqual({"C=VCALENDAR": [True]}, self.cache.get("etag1"))
+
+    def test_shared_between_indexes(self):
+        index1 = self.create_index()
+        index1.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        index1.add_values(
+            "foo.ics", "etag1", {"C=VCALENDAR": [True], "C=VCALENDAR/C=VTODO": []}
+        )
+        index2 = self.create_index()
+        index2.reset(["C=VCALENDAR"])
+        # Only the etags of a store's own items are listed.
+        self.assertEqual([], list(index2.iter_etags()))
+        self.assertEqual(
+            {"C=VCALENDAR": [True]},
+            index2.get_values("bar.ics", "etag1", ["C=VCALENDAR"]),
+        )
+        self.assertEqual(["etag1"], list(index2.iter_etags()))
+
+    def test_added_key_not_stored(self):
+        # Values computed before a key was added don't cover that key.
+        index1 = self.create_index()
+        index1.reset(["C=VCALENDAR"])
+        index1.add_keys(["C=VCALENDAR/C=VTODO"])
+        index1.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        self.assertEqual({"C=VCALENDAR": [True]}, self.cache.get("etag1"))
+        self.assertEqual([], list(index1.iter_etags()))
+        index2 = self.create_index()
+        index2.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        self.assertRaises(
+            KeyError,
+            index2.get_values,
+            "foo.ics",
+            "etag1",
+            ["C=VCALENDAR/C=VTODO"],
+        )
+
+    def test_available_keys_copy(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        keys = index.available_keys()
+        index.add_keys(["C=VCALENDAR/C=VTODO"])
+        index.remove_keys(["C=VCALENDAR"])
+        self.assertEqual({"C=VCALENDAR"}, set(keys))
+
+    def test_missing_key_values(self):
+        index1 = self.create_index()
+        index1.reset(["C=VCALENDAR"])
+        index1.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index2 = self.create_index()
+        index2.reset(["C=VCALENDAR", "C=VCALENDAR/C=VTODO"])
+        self.assertEqual([], list(index2.iter_etags()))
+        self.assertRaises(
+            KeyError,
+            index2.get_values,
+            "foo.ics",
+            "etag1",
+            ["C=VCALENDAR", "C=VCALENDAR/C=VTODO"],
+        )
+        index2.add_values(
+            "foo.ics", "etag1", {"C=VCALENDAR": [True], "C=VCALENDAR/C=VTODO": [True]}
+        )
+        self.assertEqual(
+            {"C=VCALENDAR": [True]},
+            index1.get_values("foo.ics", "etag1", ["C=VCALENDAR"]),
+        )
+        self.assertEqual(["etag1"], list(index2.iter_etags()))
+
+    def test_eviction(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        entry_size = self.cache.size
+        self.cache.set_budget(entry_size * 2)
+        index.add_values("bar.ics", "etag2", {"C=VCALENDAR": [True]})
+        # Using etag1 makes etag2 the least recently used entry
+        index.get_values("foo.ics", "etag1", ["C=VCALENDAR"])
+        index.add_values("baz.ics", "etag3", {"C=VCALENDAR": [True]})
+        self.assertEqual(["etag1", "etag3"], list(index.iter_etags()))
+        self.assertEqual(entry_size * 2, self.cache.size)
+        self.cache.set_budget(0)
+        self.assertEqual(0, len(self.cache))
+        self.assertEqual(0, self.cache.size)
+
+    def test_eviction_indexed_ctag(self):
+        index = self.create_index()
+        index.reset(["C=VCALENDAR"])
+        index.add_values("foo.ics", "etag1", {"C=VCALENDAR": [True]})
+        index.set_indexed_ctag("ctag1")
+        entry_size = self.cache.size
+        self.cache.set_budget(entry_size * 2)
+        other = self.create_index()
+        other.reset(["C=VCALENDAR"])
+        other.add_values("bar.ics", "etag2", {"C=VCALENDAR": [True]})
+        index.get_values("foo.ics", "etag1", ["C=VCALENDAR"])
+        other.add_values("baz.ics", "etag3", {"C=VCALENDAR": [True]})
+        # Evicting values of other stores doesn't matter.
+        self.assertNotIn("etag2", self.cache)
+        self.assertEqual("ctag1", index.get_indexed_ctag())
+        other.add_values("qux.ics", "etag4", {"C=VCALENDAR": [True]})
+        self.assertNotIn("etag1", self.cache)
+        self.assertIsNone(index.get_indexed_ctag())
+
+
+class AutoIndexManagerTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.index = MemoryIndex()
+        self.index.reset(["C=VCALENDAR/C=VEVENT"])
+        self.manager = AutoIndexManager(self.index, threshold=1)
+
+    def test_add_keeps_values(self):
+        self.index.add_values("foo.ics", "etag1", {"C=VCALENDAR/C=VEVENT": [True]})
+        key = "C=VCALENDAR/C=VTODO"
+        self.assertIsNone(self.manager.find_present_keys([[key]]))
+        self.assertNotIn(key, self.index.available_keys())
+        self.assertIsNone(self.manager.find_present_keys([[key]]))
+        self.assertIn(key, self.index.available_keys())
+        self.assertEqual(
+            {"C=VCALENDAR/C=VEVENT": [True]},
+            self.index.get_values("foo.ics", "etag1", ["C=VCALENDAR/C=VEVENT"]),
+        )
+        self.assertEqual([key], self.manager.find_present_keys([[key]]))
+        self.assertEqual(
+            [("add", key, "needed 2 times while missing")],
+            list(self.manager.decisions),
+        )
+        self.assertEqual(1, self.manager.stats[key].hits)
+        self.assertEqual(2, self.manager.stats[key].misses)
+        self.assertAlmostEqual(1 / 3, self.manager.stats[key].hit_rate)
+
+    def test_evict(self):
+        self.manager.pinned.add("C=VCALENDAR/C=VEVENT")
+        self.index.add_keys(["C=VCALENDAR/C=VTODO", "C=VCALENDAR/C=VJOURNAL"])
+        self.manager.memory_budget = 100000
+        self.manager.record_values(
+            "foo.ics",
+            "etag1",
+            {
+                "C=VCALENDAR/C=VEVENT": [b"x" * 2000],
+                "C=VCALENDAR/C=VTODO": [b"x" * 100],
+                "C=VCALENDAR/C=VJOURNAL": [b"x" * 100],
+            },
+        )
+        self.manager.find_present_keys([["C=VCALENDAR/C=VTODO"]])
+        self.manager.record_pass(["C=VCALENDAR/C=VTODO"], 10, 1)
+        self.manager.memory_budget = self.manager.stats["C=VCALENDAR/C=VTODO"].size
+        self.manager.find_present_keys([["C=VCALENDAR/C=VEVENT"]])
+        self.assertEqual(
+            {"C=VCALENDAR/C=VEVENT", "C=VCALENDAR/C=VTODO"},
+            set(self.index.available_keys()),
+        )
+        self.assertEqual(
+            ["C=VCALENDAR/C=VJOURNAL"],
+            [key for (action, key, reason) in self.manager.decisions],
+        )
+        self.manager.memory_budget = 0
+        self.manager.find_present_keys([["C=VCALENDAR/C=VEVENT"]])
+        self.assertEqual({"C=VCALENDAR/C=VEVENT"}, set(self.index.available_keys()))
+        self.assertEqual(0, self.manager.desired["C=VCALENDAR/C=VTODO"])
+
+    def test_record_values(self):
+        key = "C=VCALENDAR/C=VEVENT"
+        self.manager.memory_budget = 100000
+        values = {key: [b"x" * 100]}
+        self.manager.record_values("foo.ics", "etag1", values)
+        self.index.add_values("foo.ics", "etag1", values)
+        size = self.manager.stats[key].size
+        self.assertGreater(size, 0)
+        # Indexing the same item again doesn't count its values twice.
+        self.manager.record_values("foo.ics", "etag1", values)
+        self.index.add_values("foo.ics", "etag1", values)
+        self.assertEqual(size, self.manager.stats[key].size)
+        self.manager.record_values("bar.ics", "etag2", values)
+        self.index.add_values("bar.ics", "etag2", values)
+        self.assertEqual(2 * size, self.manager.stats[key].size)
+        self.assertEqual(2 * size, self.manager.estimated_size())
+        self.index.remove_values(["etag1"])
+        self.manager.forget_values(["etag1"])
+        self.assertEqual(size, self.manager.stats[key].size)
+        self.index.remove_values(["etag2", "etag3"])
+        self.manager.forget_values(["etag2", "etag3"])
+        self.assertEqual(0, self.manager.estimated_size())
+
+    def test_record_values_added_key(self):
+        key1 = "C=VCALENDAR/C=VEVENT"
+        key2 = "C=VCALENDAR/C=VTODO"
+        self.manager.memory_budget = 100000
+        self.manager.record_values("foo.ics", "etag1", {key1: [b"x" * 100]})
+        self.index.add_values("foo.ics", "etag1", {key1: [b"x" * 100]})
+        size = self.manager.stats[key1].size
+        self.index.add_keys([key2])
+        # The item is indexed again for the new key.
+        values = {key1: [b"x" * 100], key2: [b"y" * 100]}
+        self.manager.record_values("foo.ics", "etag1", values)
+        self.index.add_values("foo.ics", "etag1", values)
+        self.assertEqual(size, self.manager.stats[key1].size)
+        self.assertEqual(1, self.manager.stats[key1].count)
+        self.assertEqual(size, self.manager.stats[key2].size)
+
+    def test_no_budget(self):
+        key = "C=VCALENDAR/C=VEVENT"
+        self.manager.record_values("foo.ics", "etag1", {key: [b"x" * 100]})
+        self.assertEqual(0, self.manager.estimated_size())
+
+    def test_stats(self):
+        stats = IndexKeyStats()
+        self.assertIsNone(stats.hit_rate)
+        self.assertIsNone(stats.selectivity)
+        stats.hits = 4
+        stats.checked = 10
+        stats.matched = 1
+        stats.size = 100
+        self.assertEqual(0.1, stats.selectivity)
+        self.assertAlmostEqual(4 * 1.9 / 100, stats.score())
+
+
+class OpenIndexTest(unittest.TestCase):
+    def test_memory(self):
+        self.assertIsInstance(open_index("memory"), MemoryIndex)
+
+    def test_compact(self):
+        self.assertIsInstance(open_index("compact"), CompactMemoryIndex)
+
+    def test_sqlite(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        index = open_index("sqlite", d)
+        self.addCleanup(index.close)
+        self.assertIsInstance(index, SqliteIndex)
+
+    def test_shared(self):
+        index = open_index("shared")
+        self.assertIsInstance(index, SharedIndex)
+        self.assertIs(SHARED_INDEX_CACHE, index._cache)
+
+    def test_sqlite_without_directory(self):
+        self.assertIsInstance(open_index("sqlite"), MemoryIndex)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, open_index, "unknown")
+
+
+class TrigramIndexTest(unittest.TestCase):
+    def test_trigrams(self):
+        self.assertEqual({"abc", "bcd"}, trigrams("abcd"))
+        self.assertEqual(set(), trigrams("ab"))
+
+    def test_query(self):
+        index = TrigramIndex()
+        index.add("e1", "P=SUMMARY", ["team meeting"])
+        index.add("e2", "P=SUMMARY", ["dentist", "meet up"])
+        index.add("e3", "P=LOCATION", ["meeting room"])
+        self.assertTrue(index.covers("e1", "P=SUMMARY"))
+        self.assertFalse(index.covers("e1", "P=LOCATION"))
+        self.assertEqual({"e1", "e2"}, index.query("P=SUMMARY", "meet"))
+        self.assertEqual({"e1"}, index.query("P=SUMMARY", "meeting"))
+        self.assertEqual({"e2"}, index.query("P=SUMMARY", "dentist"))
+        self.assertEqual(set(), index.query("P=SUMMARY", "lunch"))
+        self.assertEqual({"e3"}, index.query("P=LOCATION", "room"))
+        self.assertIsNone(index.query("P=SUMMARY", "me"))
+
+    def test_remove(self):
+        index = TrigramIndex()
+        index.add("e1", "P=SUMMARY", ["meeting"])
+        index.add("e2", "P=SUMMARY", ["meeting"])
+        self.assertEqual(2, len(index))
+        index.remove(["e1"])
+        self.assertFalse(index.covers("e1", "P=SUMMARY"))
+        self.assertEqual({"e2"}, index.query("P=SUMMARY", "meeting"))
+        index.retain(set())
+        self.assertEqual(0, len(index))
+        self.assertEqual(set(), index.query("P=SUMMARY", "meeting"))
+
+
+class ComponentIndexTest(unittest.TestCase):
+    def test_query(self):
+        index = ComponentIndex()
+        index.add("e1", {"C=VCALENDAR": True, "C=VCALENDAR/C=VTODO": True})
+        index.add("e2", {"C=VCALENDAR": True, "C=VCALENDAR/C=VTODO": False})
+        self.assertTrue(index.covers("e1", ["C=VCALENDAR/C=VTODO"]))
+        self.assertFalse(index.covers("e1", ["C=VCALENDAR/C=VEVENT"]))
+        self.assertFalse(index.covers("e3", []))
+        self.assertEqual({"e1"}, index.query([("C=VCALENDAR/C=VTODO", True)]))
+        self.assertEqual({"e2"}, index.query([("C=VCALENDAR/C=VTODO", False)]))
+        self.assertEqual(
+            {"e1"},
+            index.query([("C=VCALENDAR", True), ("C=VCALENDAR/C=VTODO", True)]),
+        )
+        self.assertEqual(set(), index.query([("C=VCALENDAR/C=VEVENT", True)]))
+
+    def test_remove(self):
+        index = ComponentIndex()
+        index.add("e1", {"C=VCALENDAR/C=VTODO": True})
+        index.add("e2", {"C=VCALENDAR/C=VTODO": True})
+        self.assertEqual(2, len(index))
+        index.remove(["e1"])
+        self.assertFalse(index.covers("e1", ["C=VCALENDAR/C=VTODO"]))
+        self.assertEqual({"e2"}, index.query([("C=VCALENDAR/C=VTODO", True)]))
+        index.retain(set())
+        self.assertEqual(0, len(index))
+        self.assertEqual(set(), index.query([("C=VCALENDAR/C=VTODO", True)]))
+
+
+class TimeRangeIndexTest(unittest.TestCase):
+    def test_empty(self):
+        index = TimeRangeIndex()
+        self.assertEqual(0, len(index))
+        self.assertFalse(index.covers("e1", "VEVENT"))
+        self.assertEqual(set(), index.query("VEVENT", 0, 100))
+
+    def test_query(self):
+        index = TimeRangeIndex()
+        index.add("e1", {"VEVENT": [(10, 20)], "VTODO": []})
+        index.add("e2", {"VEVENT": [(30, math.inf)]})
+        index.add("e3", {"VEVENT": [(-math.inf, math.inf)]})
+        self.assertTrue(index.covers("e1", "VTODO"))
+        self.assertFalse(index.covers("e2", "VTODO"))
+        self.assertEqual({"e1", "e3"}, index.query("VEVENT", 0, 15))
+        self.assertEqual({"e1", "e3"}, index.query("VEVENT", 20, 25))
+        self.assertEqual({"e2", "e3"}, index.query("VEVENT", 40, 50))
+        self.assertEqual(set(), index.query("VTODO", 0, 100))
+
+    def test_remove(self):
+        index = TimeRangeIndex()
+        index.add("e1", {"VEVENT": [(10, 20)]})
+        index.add("e2", {"VEVENT": [(15, 25)]})
+        index.remove(["e1"])
+        self.assertFalse(index.covers("e1", "VEVENT"))
+        self.assertEqual({"e2"}, index.query("VEVENT", 0, 100))
+        index.retain(set())
+        self.assertEqual(set(), index.query("VEVENT", 0, 100))
+
+    def test_query_tree(self):
+        index = TimeRangeIndex()
+        for i in range(1000):
+            index.add(f"e{i}", {"VEVENT": [(i * 10, i * 10 + 15)]})
+        index.add("long", {"VEVENT": [(0, 10000)]})
+        self.assertEqual({"e49", "e50", "long"}, index.query("VEVENT", 500, 500))
+        index.remove(["e50"])
+        index.add("new", {"VEVENT": [(490, 510)]})
+        self.assertEqual({"e49", "long", "new"}, index.query("VEVENT", 500, 500))
+        self.assertEqual(
+            {f"e{i}" for i in range(1000)} - {"e50"} | {"long", "new"},
+            index.query("VEVENT", -math.inf, math.inf),
+        )
@@ -27,8 +27,19 @@ import tempfile
 import unittest
 from unittest.mock import patch
 
-from xandikos.__main__ import add_create_collection_parser, create_collection_main, main
+from xandikos.__main__ import (
+    add_create_collection_parser,
+    create_collection_main,
+    import_main,
+    layout_main,
+    main,
+    maintenance_main,
+)
+from dulwich.objects import Blob
+
+from xandikos.fs import OBJECT_POOL_DIRNAME
 from xandikos.store import STORE_TYPE_ADDRESSBOOK, STORE_TYPE_CALENDAR
+from xandikos.store.git import BareGitStore, TreeGitStore, open_object_pool
 from xandikos.web import SingleUserFilesystemBackend
 
 
@@ -186,6 +197,227 @@ class CreateCollectionTests(unittest.TestCase):
         self.assertEqual(resource.store.get_type(), STORE_TYPE_CALENDAR)
 
 
+EXAMPLE_CALENDAR = b"""\
+BEGIN:VCALENDAR
+VERSION:2.0
+PRODID:-//Example//Test//EN
+BEGIN:VEVENT
+UID:event1
+DTSTAMP:20240101T000000Z
+DTSTART:20240101T100000Z
+SUMMARY:First
+END:VEVENT
+BEGIN:VEVENT
+UID:event2
+DTSTAMP:20240101T000000Z
+DTSTART:20240102T100000Z
+SUMMARY:Second
+END:VEVENT
+END:VCALENDAR
+"""
+
+EXAMPLE_VCARDS = b"""\
+BEGIN:VCARD
+VERSION:3.0
+UID:card1
+FN:Jeffrey Harris
+N:Harris;Jeffrey;;;
+END:VCARD
+BEGIN:VCARD
+VERSION:3.0
+UID:card2
+FN:Somebody Else
+N:Else;Somebody;;;
+END:VCARD
+"""
+
+
+class ImportTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def _write(self, name, contents):
+        path = os.path.join(self.test_dir, name)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, "wb") as f:
+            f.write(contents)
+        return path
+
+    def _import(self, name, paths, type=None):
+        import argparse
+
+        args = argparse.Namespace(
+            directory=self.test_dir, name=name, type=type, workers=0, paths=paths
+        )
+        return asyncio.run(import_main(args, None))
+
+    def _get_store(self, name):
+        backend = SingleUserFilesystemBackend(self.test_dir)
+        store = backend.get_resource("/" + name).store
+        self.addCleanup(store.repo.close)
+        return store
+
+    def _get_contents(self, name):
+        store = self._get_store(name)
+        return sorted(
+            b"".join(store.get_file(name, content_type, etag).content)
+            for (name, content_type, etag) in store.iter_with_etag()
+        )
+
+    def test_import_calendar(self):
+        path = self._write("in/calendar.ics", EXAMPLE_CALENDAR)
+        self.assertEqual(0, self._import("cal", [path], type="calendar"))
+        [event1, event2] = self._get_contents("cal")
+        self.assertIn(b"UID:event1", event1)
+        self.assertNotIn(b"UID:event2", event1)
+        self.assertIn(b"UID:event2", event2)
+        store = self._get_store("cal")
+        self.assertEqual(STORE_TYPE_CALENDAR, store.get_type())
+        [entry] = list(store.repo.get_walker(max_entries=1))
+        self.assertTrue(entry.commit.message.startswith(b"Import 2 items"))
+
+    def test_import_directory(self):
+        self._write("in/a.vcf", EXAMPLE_VCARDS)
+        self._write("in/README", b"not a vcard")
+        self.assertEqual(
+            0,
+            self._import(
+                "contacts", [os.path.join(self.test_dir, "in")], type="addressbook"
+            ),
+        )
+        [card1, card2] = self._get_contents("contacts")
+        self.assertIn(b"FN:Jeffrey Harris", card1)
+        self.assertIn(b"FN:Somebody Else", card2)
+
+    def test_import_existing_collection(self):
+        SingleUserFilesystemBackend(self.test_dir).create_collection("cal")
+        path = self._write("in/calendar.ics", EXAMPLE_CALENDAR)
+        self.assertEqual(0, self._import("cal", [path]))
+        self.assertEqual(2, len(self._get_contents("cal")))
+
+    def test_import_missing_collection(self):
+        path = self._write("in/calendar.ics", EXAMPLE_CALENDAR)
+        with self.assertLogs("xandikos.__main__", level=logging.ERROR) as cm:
+            self.assertEqual(1, self._import("cal", [path]))
+        self.assertIn("does not exist", cm.output[0])
+
+    def test_import_duplicate_uid(self):
+        path = self._write("in/calendar.ics", EXAMPLE_CALENDAR)
+        self.assertEqual(0, self._import("cal", [path], type="calendar"))
+        with self.assertLogs("xandikos.__main__", level=logging.ERROR) as cm:
+            self.assertEqual(1, self._import("cal", [path]))
+        self.assertIn("UID event", cm.output[0])
+
+
+class MaintenanceTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def _maintenance(self, min_loose_objects=0, object_pool=False):
+        import argparse
+
+        args = argparse.Namespace(
+            directory=self.test_dir,
+            min_loose_objects=min_loose_objects,
+            object_pool=object_pool,
+        )
+        with self.assertLogs("xandikos.__main__", level=logging.INFO) as cm:
+            self.assertEqual(0, asyncio.run(maintenance_main(args, None)))
+        return cm.output
+
+    def test_maintenance(self):
+        for name in ["user/calendars/cal", "user/contacts/addressbook"]:
+            path = os.path.join(self.test_dir, name)
+            os.makedirs(os.path.dirname(path))
+            store = TreeGitStore.create(path)
+            self.addCleanup(store.repo.close)
+            store.import_one("foo.vcf", "text/vcard", [b"BEGIN:VCARD\r\nEND:VCARD\r\n"])
+        self.assertEqual(
+            ["INFO:xandikos.__main__:Packed 0 objects, reclaimed 0 bytes"],
+            self._maintenance(min_loose_objects=100),
+        )
+        output = self._maintenance()
+        self.assertEqual(3, len(output))
+        self.assertIn("user/calendars/cal: packed 3 objects", output[0])
+        self.assertIn("user/contacts/addressbook: packed 3 objects", output[1])
+        self.assertIn("Packed 6 objects", output[2])
+        self.assertEqual(
+            ["INFO:xandikos.__main__:Packed 0 objects, reclaimed 0 bytes"],
+            self._maintenance(),
+        )
+
+    def test_object_pool(self):
+        vcard = b"BEGIN:VCARD\r\nEND:VCARD\r\n"
+        blob = Blob.from_string(vcard).id
+        stores = {}
+        for name in ["alice/contacts", "bob/contacts", "carol/contacts"]:
+            path = os.path.join(self.test_dir, name)
+            os.makedirs(os.path.dirname(path))
+            store = TreeGitStore.create(path)
+            self.addCleanup(store.repo.close)
+            if name != "carol/contacts":
+                store.import_one("foo.vcf", "text/vcard", [vcard])
+            else:
+                store.import_one("bar.vcf", "text/vcard", [vcard + b"\r\n"])
+            stores[name] = store
+        output = self._maintenance(object_pool=True)
+        self.assertIn("alice/contacts: moved", output[-3])
+        self.assertIn("bob/contacts: moved", output[-2])
+        self.assertIn("Moved", output[-1])
+        pool_path = os.path.join(self.test_dir, OBJECT_POOL_DIRNAME)
+        for name, store in stores.items():
+            store = TreeGitStore.open_from_path(store.repo.path)
+            self.addCleanup(store.repo.close)
+            own = set(store.iter_own_objects())
+            if name != "carol/contacts":
+                self.assertNotIn(blob, own)
+                self.assertEqual(vcard, store.repo.object_store[blob].data)
+            else:
+                self.assertEqual([], store.repo.object_store.alternates)
+        self.assertIn(blob, open_object_pool(pool_path))
+
+
+class LayoutTests(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.test_dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.test_dir)
+
+    def _layout(self, layout):
+        import argparse
+
+        args = argparse.Namespace(directory=self.test_dir, layout=layout)
+        with self.assertLogs("xandikos.__main__", level=logging.INFO) as cm:
+            self.assertEqual(0, asyncio.run(layout_main(args, None)))
+        return cm.output
+
+    def test_layout(self):
+        os.makedirs(os.path.join(self.test_dir, "user"))
+        bare = BareGitStore.create(os.path.join(self.test_dir, "user", "bare"))
+        self.addCleanup(bare.repo.close)
+        (name, etag) = bare.import_one(
+            "foo.vcf", "text/vcard", [b"BEGIN:VCARD\r\nEND:VCARD\r\n"]
+        )
+        tree = TreeGitStore.create(os.path.join(self.test_dir, "user", "tree"))
+        self.addCleanup(tree.repo.close)
+        output = self._layout("sharded")
+        self.assertEqual(2, len(output))
+        self.assertIn("user/bare: changed layout to sharded", output[0])
+        self.assertIn("Changed layout of 1 collections", output[1])
+        store = BareGitStore.open_from_path(bare.path)
+        self.addCleanup(store.repo.close)
+        self.assertEqual("sharded", store.layout)
+        self.assertEqual(etag, store.get_etag("foo.vcf"))
+        self.assertEqual(
+            ["INFO:xandikos.__main__:Changed layout of 0 collections"],
+            self._layout("sharded"),
+        )
+
+
 class MainCommandTests(unittest.TestCase):
     def test_main_create_collection_subcommand(self):
         """Test that the main function recognizes create-collection subcommand."""
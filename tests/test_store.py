@@ -17,30 +17,45 @@
 # Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
 # MA  02110-1301, USA.
 
+import json
 import logging
 import os
 import shutil
 import stat
 import tempfile
 import unittest
+from datetime import datetime, timezone
+from unittest import mock
 from zoneinfo import ZoneInfo
 
 
 from dulwich.objects import Blob, Commit, Tree
-from dulwich.repo import Repo
+from dulwich.repo import MemoryRepo, Repo
 
 from xandikos.store import (
     DuplicateUidError,
     File,
     Filter,
+    InvalidCTag,
     InvalidETag,
+    InvalidFileContents,
+    LockedError,
     NoSuchItem,
     Store,
+    _index_batch,
     start_eager_indexing,
 )
 
 from xandikos.icalendar import ICalendarFile, CalendarFilter
-from xandikos.store.git import BareGitStore, GitStore, TreeGitStore
+from xandikos.store.git import (
+    BareGitStore,
+    Changelog,
+    GitStore,
+    ItemTimes,
+    TreeGitStore,
+    open_object_pool,
+)
+from xandikos.store.index import MemoryIndex
 from xandikos.store.memory import MemoryStore
 from xandikos.store.vdir import VdirStore
 
@@ -128,6 +143,21 @@ class BaseStoreTest:
             [("foo.ics", "text/calendar", etag)], list(gc.iter_with_etag())
         )
 
+    def test_import_many(self):
+        gc = self.create_store()
+        [(name1, etag1), (name2, etag2)] = gc.import_many(
+            [
+                ("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]),
+                (None, "text/calendar", [EXAMPLE_VCALENDAR2]),
+            ]
+        )
+        self.assertEqual("foo.ics", name1)
+        self.assertTrue(name2.endswith(".ics"))
+        self.assertEqual(
+            sorted([(name1, "text/calendar", etag1), (name2, "text/calendar", etag2)]),
+            sorted(gc.iter_with_etag()),
+        )
+
     def test_with_filter(self):
         gc = self.create_store()
         (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
@@ -157,6 +187,37 @@ class BaseStoreTest:
             EXAMPLE_VCALENDAR2.replace(b"\n", b"\r\n"),
         )
 
+    def test_with_filter_cached(self):
+        gc = self.create_store()
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+
+        class DummyFilter(Filter):
+            content_type = "text/calendar"
+
+            def __init__(self, text) -> None:
+                self.text = text
+
+            def check(self, name, resource):
+                return self.text in b"".join(resource.content)
+
+            def cache_key(self):
+                return self.text
+
+        filter = DummyFilter(b"do something")
+        self.assertEqual(
+            [name1], [name for (name, file, etag) in gc.iter_with_filter(filter)]
+        )
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        self.assertEqual(
+            {name1, name2},
+            {name for (name, file, etag) in gc.iter_with_filter(filter)},
+        )
+        gc.delete_one(name1)
+        self.assertEqual(
+            [(name2, etag2)],
+            [(name, etag) for (name, file, etag) in gc.iter_with_filter(filter)],
+        )
+
     def test_get_by_index(self):
         gc = self.create_store()
         (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
@@ -219,6 +280,22 @@ class BaseStoreTest:
             [EXAMPLE_VCALENDAR1],
         )
 
+    def test_lookup_uid(self):
+        gc = self.create_store()
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        self.assertEqual(
+            ("foo.ics", etag1), gc.lookup_uid("bdc22720-b9e1-42c9-89c2-a85405d8fbff")
+        )
+        self.assertEqual(
+            ("bar.ics", etag2), gc.lookup_uid("bdc22764-b9e1-42c9-89c2-a85405d8fbff")
+        )
+        gc.delete_one("foo.ics")
+        self.assertRaises(
+            KeyError, gc.lookup_uid, "bdc22720-b9e1-42c9-89c2-a85405d8fbff"
+        )
+        self.assertRaises(KeyError, gc.lookup_uid, "nonexistent")
+
     def test_import_one_duplicate_name(self):
         gc = self.create_store()
         (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
@@ -317,6 +394,31 @@ class VdirStoreTest(BaseStoreTest, unittest.TestCase):
         store.load_extra_file_handler(ICalendarFile)
         return store
 
+    def test_persistent_index(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, "store")
+        gc = self.kls.create(path)
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        gc = self.kls.open_from_path(path, index_backend="sqlite")
+        self.assertIsInstance(gc.index, MemoryIndex)
+        self.assertEqual(["foo.ics"], os.listdir(path))
+
+    def test_get_file_changed(self):
+        gc = self.create_store()
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        with open(os.path.join(gc.path, name), "wb") as f:
+            f.write(EXAMPLE_VCALENDAR2)
+        self.assertRaises(KeyError, gc.get_file, name, "text/calendar", etag)
+        fi = gc.get_file(name, "text/calendar")
+        self.assertEqual(EXAMPLE_VCALENDAR2, b"".join(fi.content))
+
+    def test_get_file_removed(self):
+        gc = self.create_store()
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        os.unlink(os.path.join(gc.path, name))
+        self.assertRaises(KeyError, gc.get_file, name, "text/calendar", etag)
+
 
 class MemoryStoreTest(BaseStoreTest, unittest.TestCase):
     kls = MemoryStore
@@ -343,6 +445,60 @@ class BaseGitStoreTest(BaseStoreTest):
         self.assertIsInstance(gc, GitStore)
         self.assertEqual(gc.repo.path, os.path.join(d, "store"))
 
+    def test_iter_changes_changelog(self):
+        gc = self.create_store()
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        ctag1 = gc.get_ctag()
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        gc.delete_one("foo.ics")
+        ctag2 = gc.get_ctag()
+        with mock.patch.object(gc, "iter_with_etag") as iter_with_etag:
+            self.assertEqual(
+                [
+                    ("bar.ics", "text/calendar", None, etag2),
+                    ("foo.ics", "text/calendar", etag1, None),
+                ],
+                sorted(gc.iter_changes(ctag1, ctag2)),
+            )
+        iter_with_etag.assert_not_called()
+        self.assertEqual(
+            [("foo.ics", "text/calendar", etag1, None)],
+            list(gc.iter_changes(ctag1, ctag2, after="bar.ics")),
+        )
+
+    def test_iter_changes_other_store(self):
+        gc = self.create_store()
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        ctag1 = gc.get_ctag()
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        gc.delete_one("foo.ics")
+        ctag2 = gc.get_ctag()
+        # Another store on the same repository did not make these commits,
+        # so it compares the trees.
+        other = type(gc)(gc.repo)
+        with mock.patch.object(other.repo, "get_walker") as get_walker:
+            self.assertEqual(
+                [
+                    ("bar.ics", "text/calendar", None, etag2),
+                    ("foo.ics", "text/calendar", etag1, None),
+                ],
+                sorted(other.iter_changes(ctag1, ctag2)),
+            )
+        get_walker.assert_not_called()
+        self.assertEqual(
+            [("bar.ics", "text/calendar", None, etag2)],
+            list(other.iter_changes(None, ctag2)),
+        )
+        self.assertRaises(InvalidCTag, list, other.iter_changes("0" * 40, ctag2))
+
+    def test_iter_changes_writes_nothing(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        ctag = gc.get_ctag()
+        before = set(gc.repo.object_store)
+        list(gc.iter_changes(None, ctag))
+        self.assertEqual(before, set(gc.repo.object_store))
+
     def test_iter_with_etag_missing_uid(self):
         logging.getLogger("").setLevel(logging.ERROR)
         gc = self.create_store()
@@ -351,6 +507,35 @@ class BaseGitStoreTest(BaseStoreTest):
         gc._scan_uids()
         logging.getLogger("").setLevel(logging.NOTSET)
 
+    def test_lookup_uid_incremental(self):
+        gc = self.create_store()
+        bid = self.add_blob(gc, "foo.ics", EXAMPLE_VCALENDAR1)
+        self.assertEqual(
+            ("foo.ics", bid), gc.lookup_uid("bdc22720-b9e1-42c9-89c2-a85405d8fbff")
+        )
+        with mock.patch.object(gc, "_read_uid", wraps=gc._read_uid) as read_uid:
+            (name, etag) = gc.import_one(
+                "bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2]
+            )
+            self.assertEqual(
+                ("bar.ics", etag),
+                gc.lookup_uid("bdc22764-b9e1-42c9-89c2-a85405d8fbff"),
+            )
+            self.assertEqual(
+                ("foo.ics", bid),
+                gc.lookup_uid("bdc22720-b9e1-42c9-89c2-a85405d8fbff"),
+            )
+        read_uid.assert_not_called()
+
+    def test_get_file_lazy(self):
+        gc = self.create_store()
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        fi = gc.get_file(name, "text/calendar", etag)
+        self.assertFalse(fi.content.loaded)
+        self.assertEqual("bdc22720-b9e1-42c9-89c2-a85405d8fbff", fi.get_uid())
+        self.assertTrue(fi.content.loaded)
+        self.assertRaises(KeyError, gc.get_file, name, "text/calendar", "0" * 40)
+
     def test_iter_with_etag(self):
         gc = self.create_store()
         bid = self.add_blob(gc, "foo.ics", EXAMPLE_VCALENDAR1)
@@ -463,6 +648,51 @@ class BaseGitStoreTest(BaseStoreTest):
         message = self._get_last_commit_message(gc)
         self.assertNotIn("Requester:", message)
 
+    def test_commit_messages_full(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        with mock.patch.object(gc, "get_file", wraps=gc.get_file) as get_file:
+            gc.import_one(
+                "foo.ics",
+                "text/calendar",
+                [EXAMPLE_VCALENDAR1.replace(b"NEEDS-ACTION", b"COMPLETED")],
+            )
+        get_file.assert_called_once()
+        message = self._get_last_commit_message(gc)
+        self.assertEqual("task 'do something' marked as complete", message)
+
+    def test_commit_messages_summary(self):
+        gc = self.create_store()
+        gc.commit_message_policy = "summary"
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertEqual("Added do something", self._get_last_commit_message(gc))
+        with mock.patch.object(gc, "get_file") as get_file:
+            gc.import_one(
+                "foo.ics",
+                "text/calendar",
+                [EXAMPLE_VCALENDAR1.replace(b"NEEDS-ACTION", b"COMPLETED")],
+            )
+        get_file.assert_not_called()
+        self.assertEqual("Modified do something", self._get_last_commit_message(gc))
+        gc.delete_one("foo.ics")
+        self.assertEqual("Delete do something", self._get_last_commit_message(gc))
+
+    def test_commit_messages_minimal(self):
+        gc = self.create_store()
+        gc.commit_message_policy = "minimal"
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertEqual("Added foo.ics", self._get_last_commit_message(gc))
+        gc.import_one(
+            "foo.ics",
+            "text/calendar",
+            [EXAMPLE_VCALENDAR1.replace(b"NEEDS-ACTION", b"COMPLETED")],
+        )
+        self.assertEqual("Modified foo.ics", self._get_last_commit_message(gc))
+        with mock.patch("xandikos.store.git.open_by_extension") as open_by_extension:
+            gc.delete_one("foo.ics")
+        open_by_extension.assert_not_called()
+        self.assertEqual("Delete foo.ics", self._get_last_commit_message(gc))
+
     def test_import_only_once(self):
         gc = self.create_store()
         (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
@@ -472,6 +702,72 @@ class BaseGitStoreTest(BaseStoreTest):
         walker = gc.repo.get_walker(include=[gc.repo.refs[gc.ref]])
         self.assertEqual(1, len([w.commit for w in walker]))
 
+    def test_import_many_single_commit(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        with mock.patch.object(gc, "_scan_uids", wraps=gc._scan_uids) as scan_uids:
+            [(name, etag)] = gc.import_many(
+                [("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])],
+                remote_user="alice",
+            )
+        scan_uids.assert_called_once_with()
+        walker = gc.repo.get_walker(include=[gc.repo.refs[gc.ref]])
+        self.assertEqual(2, len([w.commit for w in walker]))
+        message = self._get_last_commit_message(gc)
+        self.assertTrue(message.startswith("Import 1 items\n"))
+        self.assertIn("Remote-User: alice", message)
+        self.assertEqual(
+            ("bar.ics", etag), gc.lookup_uid("bdc22764-b9e1-42c9-89c2-a85405d8fbff")
+        )
+        self.assertEqual(
+            EXAMPLE_VCALENDAR2_NORMALIZED, b"".join(gc._get_raw("bar.ics", etag))
+        )
+
+    def test_import_many_duplicate_uid(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        ctag = gc.get_ctag()
+        self.assertRaises(
+            DuplicateUidError,
+            gc.import_many,
+            [
+                ("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2]),
+                ("baz.ics", "text/calendar", [EXAMPLE_VCALENDAR1]),
+            ],
+        )
+        self.assertRaises(
+            DuplicateUidError,
+            gc.import_many,
+            [
+                ("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2]),
+                ("baz.ics", "text/calendar", [EXAMPLE_VCALENDAR2]),
+            ],
+        )
+        self.assertEqual(ctag, gc.get_ctag())
+
+    def test_import_many_invalid(self):
+        gc = self.create_store()
+        self.assertRaises(
+            InvalidFileContents,
+            gc.import_many,
+            [
+                ("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]),
+                ("bar.ics", "text/calendar", [b"BEGIN:VCALENDAR\r\n"]),
+            ],
+        )
+        self.assertEqual([], list(gc.iter_with_etag()))
+
+    def test_import_many_indexes(self):
+        gc = self.create_store()
+        gc.index.add_keys(["C=VCALENDAR/C=VTODO"])
+        [(name, etag)] = gc.import_many(
+            [("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])]
+        )
+        self.assertEqual(
+            {"C=VCALENDAR/C=VTODO": [True]},
+            gc.index.get_values(name, etag, ["C=VCALENDAR/C=VTODO"]),
+        )
+
 
 class GitStoreTest(unittest.TestCase):
     def test_open_from_path_bare(self):
@@ -490,6 +786,27 @@ class GitStoreTest(unittest.TestCase):
         self.assertIsInstance(gc, TreeGitStore)
         self.assertEqual(gc.repo.path, d)
 
+    def test_persistent_index(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        Repo.init_bare(d)
+        gc = GitStore.open_from_path(d, index_backend="sqlite")
+        self.addCleanup(gc.index.close)
+        gc.load_extra_file_handler(ICalendarFile)
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertEqual([etag], list(gc.index.iter_etags()))
+        gc.repo.close()
+
+        gc = GitStore.open_from_path(d, index_backend="sqlite")
+        self.addCleanup(gc.index.close)
+        self.addCleanup(gc.repo.close)
+        gc.load_extra_file_handler(ICalendarFile)
+        self.assertEqual([etag], list(gc.index.iter_etags()))
+        self.assertEqual(
+            {"C=VCALENDAR/C=VTODO": [True]},
+            gc.index.get_values(name, etag, ["C=VCALENDAR/C=VTODO"]),
+        )
+
 
 class BareGitStoreTest(BaseGitStoreTest, unittest.TestCase):
     kls = BareGitStore
@@ -523,6 +840,63 @@ class BareGitStoreTest(BaseGitStoreTest, unittest.TestCase):
         self.add_blob(gc, "foo.ics", EXAMPLE_VCALENDAR1)
         self.assertEqual(gc._get_current_tree().id.decode("ascii"), gc.get_ctag())
 
+    def test_import_many_workers(self):
+        gc = self.create_store()
+        [(name1, etag1), (name2, etag2)] = gc.import_many(
+            [
+                ("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]),
+                ("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2]),
+            ],
+            workers=2,
+        )
+        self.assertEqual(
+            EXAMPLE_VCALENDAR1_NORMALIZED, b"".join(gc._get_raw(name1, etag1))
+        )
+        self.assertEqual(
+            ("bar.ics", etag2), gc.lookup_uid("bdc22764-b9e1-42c9-89c2-a85405d8fbff")
+        )
+
+    def test_item_times(self):
+        gc = self.create_store()
+        self.assertRaises(KeyError, gc.get_last_modified, "foo.ics")
+        self.add_blob(gc, "foo.ics", EXAMPLE_VCALENDAR1)
+        self.assertEqual(
+            datetime(1970, 1, 10, 6, 13, 20, tzinfo=timezone.utc),
+            gc.get_creation_date("foo.ics"),
+        )
+        self.assertEqual(
+            datetime(1970, 1, 10, 6, 13, 20, tzinfo=timezone.utc),
+            gc.get_last_modified("foo.ics"),
+        )
+        self.assertRaises(KeyError, gc.get_last_modified, "bar.ics")
+        gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        self.assertGreater(gc.get_creation_date("bar.ics").year, 2000)
+
+    def test_maintain_memory(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertEqual((0, 0), gc.maintain())
+
+    def test_share_objects_locked(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        pool_path = os.path.join(d, "pool")
+        gc = self.kls.create(os.path.join(d, "store"))
+        self.addCleanup(gc.repo.close)
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        lock_path = os.fsdecode(gc.repo.refs.refpath(gc.ref)) + ".lock"
+        with open(lock_path, "wb"):
+            pass
+        self.assertRaises(
+            LockedError, gc.share_objects, pool_path, [etag.encode("ascii")]
+        )
+        self.assertRaises(
+            LockedError, gc.import_one, "bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2]
+        )
+        os.unlink(lock_path)
+        self.assertIn(etag.encode("ascii"), set(gc.iter_own_objects()))
+        self.assertEqual(1, gc.share_objects(pool_path, [etag.encode("ascii")])[0])
+
     def test_tree_caching(self):
         """Test that the current tree is cached and not re-read on every call."""
         gc = self.create_store()
@@ -546,6 +920,92 @@ class BareGitStoreTest(BaseGitStoreTest, unittest.TestCase):
         self.assertEqual(etag1, gc.get_etag("foo.ics"))
         self.assertRaises(KeyError, gc.get_etag, "bar.ics")
 
+    def test_set_layout(self):
+        gc = BareGitStore.create_memory()
+        gc.load_extra_file_handler(ICalendarFile)
+        self.assertEqual("flat", gc.layout)
+        self.add_blob(gc, "foo.ics", EXAMPLE_VCALENDAR1)
+        (name, etag) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        gc.config.set_displayname("Calendar")
+        etags = dict((name, etag) for (name, _, etag) in gc.iter_with_etag())
+        ctag = gc.get_ctag()
+        created = gc.get_creation_date("foo.ics")
+        gc.set_layout("sharded")
+        self.assertEqual("sharded", gc.layout)
+        tree = gc.repo[gc.repo[gc.repo.head()].tree]
+        self.assertEqual(
+            {b".xandikos"},
+            {name for (name, mode, sha) in tree.iteritems() if not stat.S_ISDIR(mode)},
+        )
+        self.assertEqual(
+            etags, dict((name, etag) for (name, _, etag) in gc.iter_with_etag())
+        )
+        self.assertEqual(etag, gc.get_etag("bar.ics"))
+        self.assertEqual("Calendar", gc.config.get_displayname())
+        self.assertEqual([], list(gc.iter_changes(ctag, gc.get_ctag())))
+        self.assertEqual(created, gc.get_creation_date("foo.ics"))
+        self.assertEqual(
+            "sharded", BareGitStore(gc.repo).layout, "layout not persisted"
+        )
+        gc.set_layout("flat")
+        tree = gc.repo[gc.repo[gc.repo.head()].tree]
+        self.assertEqual(
+            [b".xandikos", b"bar.ics", b"foo.ics"],
+            [name for (name, mode, sha) in tree.iteritems()],
+        )
+        self.assertRaises(ValueError, gc.set_layout, "nested")
+
+    def test_set_layout_on_disk(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        gc = BareGitStore.create(os.path.join(d, "store"))
+        self.addCleanup(gc.repo.close)
+        gc.config.set_color("#ff0000")
+        gc.set_layout("sharded")
+        gc = BareGitStore.open_from_path(gc.repo.path)
+        self.addCleanup(gc.repo.close)
+        self.assertEqual("sharded", gc.layout)
+        self.assertEqual("#ff0000", gc.config.get_color())
+
+
+class ShardedBareGitStoreTest(BareGitStoreTest):
+    def create_store(self):
+        store = super().create_store()
+        store.set_layout("sharded")
+        return store
+
+    def test_sharded(self):
+        gc = self.create_store()
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        tree = gc.repo[gc.repo[gc.repo.head()].tree]
+        [(shard, mode, subtree_id)] = list(tree.iteritems())
+        self.assertTrue(stat.S_ISDIR(mode))
+        self.assertEqual(2, len(shard))
+        self.assertEqual(etag.encode("ascii"), gc.repo[subtree_id][b"foo.ics"][1])
+        gc.delete_one("foo.ics")
+        self.assertEqual(0, len(gc.repo[gc.repo[gc.repo.head()].tree]))
+
+    def test_write_size(self):
+        gc = self.create_store()
+        for i in range(50):
+            gc.import_one(
+                f"{i}.ics",
+                "text/calendar",
+                [EXAMPLE_VCALENDAR1.replace(b"bdc22720", f"{i:08d}".encode("ascii"))],
+            )
+        with mock.patch.object(
+            gc.repo.object_store, "add_object", wraps=gc.repo.object_store.add_object
+        ) as add_object:
+            gc.import_one("new.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        trees = [
+            call.args[0]
+            for call in add_object.call_args_list
+            if isinstance(call.args[0], Tree)
+        ]
+        # Root tree and one shard
+        self.assertEqual(2, len(trees))
+        self.assertLess(len(trees[0]), 50)
+
 
 class TreeGitStoreTest(BaseGitStoreTest, unittest.TestCase):
     kls = TreeGitStore
@@ -586,6 +1046,205 @@ class TreeGitStoreTest(BaseGitStoreTest, unittest.TestCase):
         self.assertEqual(etag1, gc.get_etag("foo.ics"))
         self.assertRaises(KeyError, gc.get_etag, "bar.ics")
 
+    def test_maintain(self):
+        gc = self.create_store()
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        loose = gc.repo.object_store.count_loose_objects()
+        self.assertEqual((0, 0), gc.maintain(min_loose_objects=loose + 1))
+        stats = gc.maintain()
+        self.addCleanup(gc.repo.close)
+        self.assertEqual(loose, stats.objects_packed)
+        self.assertGreater(stats.bytes_reclaimed, 0)
+        self.assertEqual(0, gc.repo.object_store.count_loose_objects())
+        self.assertEqual((0, 0), gc.maintain())
+        self.assertEqual(
+            EXAMPLE_VCALENDAR1_NORMALIZED, b"".join(gc._get_raw(name1, etag1))
+        )
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1 + b"\n"])
+        self.assertGreater(gc.repo.object_store.count_loose_objects(), 0)
+
+    def test_maintain_locked(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        with open(gc.repo.index_path() + ".lock", "wb"):
+            pass
+        self.assertRaises(LockedError, gc.maintain)
+        os.unlink(gc.repo.index_path() + ".lock")
+        self.assertGreater(gc.repo.object_store.count_loose_objects(), 0)
+
+    def test_object_pool(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        pool_path = os.path.join(d, "pool")
+        gc = self.kls.create(os.path.join(d, "store"), object_pool=pool_path)
+        self.addCleanup(gc.repo.close)
+        self.assertEqual(
+            [pool_path],
+            [alternate.path for alternate in gc.repo.object_store.alternates],
+        )
+        # Using the same pool again is a no-op.
+        gc.use_object_pool(pool_path)
+        self.assertEqual(1, len(gc.repo.object_store.alternates))
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        blob = etag.encode("ascii")
+        raw = b"".join(gc._get_raw(name, etag))
+        self.assertIn(blob, set(gc.iter_own_objects()))
+        stats = gc.share_objects(pool_path, [blob])
+        self.assertEqual(1, stats.objects_packed)
+        self.assertNotIn(blob, set(gc.iter_own_objects()))
+        self.assertIn(blob, open_object_pool(pool_path))
+        self.assertEqual(raw, b"".join(gc._get_raw(name, etag)))
+        gc = self.kls.open_from_path(gc.repo.path)
+        self.addCleanup(gc.repo.close)
+        self.assertEqual(etag, gc.get_etag("foo.ics"))
+        self.assertEqual(raw, b"".join(gc._get_raw(name, etag)))
+
+    def test_share_objects_existing_store(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        pool_path = os.path.join(d, "pool")
+        gc = self.kls.create(os.path.join(d, "store"))
+        self.addCleanup(gc.repo.close)
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        raw = b"".join(gc._get_raw(name, etag))
+        gc.share_objects(pool_path, [etag.encode("ascii")])
+        gc = self.kls.open_from_path(gc.repo.path)
+        self.addCleanup(gc.repo.close)
+        self.assertNotIn(etag.encode("ascii"), set(gc.iter_own_objects()))
+        self.assertEqual(raw, b"".join(gc._get_raw(name, etag)))
+
+    def test_share_objects_open_store(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        pool_path = os.path.join(d, "pool")
+        gc = self.kls.create(os.path.join(d, "store"))
+        self.addCleanup(gc.repo.close)
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        raw = b"".join(gc._get_raw(name, etag))
+        # A lookup of a missing object makes dulwich read the alternates.
+        self.assertRaises(KeyError, gc._get_raw, name, "0" * 40)
+        # Maintenance opens stores of its own.
+        other = self.kls.open_from_path(gc.repo.path)
+        self.addCleanup(other.repo.close)
+        other.share_objects(pool_path, [etag.encode("ascii")])
+        self.assertNotIn(etag.encode("ascii"), set(gc.iter_own_objects()))
+        self.assertEqual(raw, b"".join(gc._get_raw(name, etag)))
+        fi = gc.get_file(name, "text/calendar", etag)
+        self.assertEqual(raw, b"".join(fi.content))
+
+    def test_share_objects_packed(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        pool_path = os.path.join(d, "pool")
+        gc = self.kls.create(os.path.join(d, "store"))
+        self.addCleanup(gc.repo.close)
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        raw1 = b"".join(gc._get_raw(name1, etag1))
+        raw2 = b"".join(gc._get_raw(name2, etag2))
+        gc.maintain()
+        self.assertEqual(1, len(gc.repo.object_store.packs))
+        own = set(gc.iter_own_objects())
+        gc.share_objects(pool_path, [etag1.encode("ascii")])
+        self.assertEqual(own - {etag1.encode("ascii")}, set(gc.iter_own_objects()))
+        self.assertEqual(1, len(gc.repo.object_store.packs))
+        self.assertEqual(raw1, b"".join(gc._get_raw(name1, etag1)))
+        self.assertEqual(raw2, b"".join(gc._get_raw(name2, etag2)))
+
+    def test_share_objects_locked(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        pool_path = os.path.join(d, "pool")
+        gc = self.kls.create(os.path.join(d, "store"), object_pool=pool_path)
+        self.addCleanup(gc.repo.close)
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        with open(gc.repo.index_path() + ".lock", "wb"):
+            pass
+        self.assertRaises(
+            LockedError, gc.share_objects, pool_path, [etag.encode("ascii")]
+        )
+        os.unlink(gc.repo.index_path() + ".lock")
+        self.assertIn(etag.encode("ascii"), set(gc.iter_own_objects()))
+
+    def test_import_blob(self):
+        gc = self.create_store()
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        with open(os.path.join(gc.path, "foo.ics"), "rb") as f:
+            contents = f.read()
+        self.assertEqual(Blob.from_string(contents).id.decode("ascii"), etag)
+        self.assertEqual(contents, gc.repo.object_store[etag.encode("ascii")].data)
+
+    def test_import_streamed(self):
+        gc = self.create_store()
+        chunks = iter([EXAMPLE_VCALENDAR1[:10], EXAMPLE_VCALENDAR1[10:]])
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", chunks)
+        with open(os.path.join(gc.path, "foo.ics"), "rb") as f:
+            contents = f.read()
+        self.assertEqual(Blob.from_string(contents).id.decode("ascii"), etag)
+        self.assertNotIn("foo.ics.tmp", os.listdir(gc.path))
+
+    def create_fsync_store(self, fsync_policy, **kwargs):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        store = TreeGitStore(Repo.init(d), fsync_policy=fsync_policy, **kwargs)
+        store.load_extra_file_handler(ICalendarFile)
+        return store
+
+    def test_fsync_none(self):
+        gc = self.create_fsync_store("none")
+        with mock.patch("xandikos.store.git._fsync_path") as fsync_path:
+            gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        fsync_path.assert_not_called()
+        self.assertFalse(gc.repo.object_store.fsync_object_files)
+
+    def test_fsync_always(self):
+        gc = self.create_fsync_store("always")
+        self.assertTrue(gc.repo.object_store.fsync_object_files)
+        with mock.patch("xandikos.store.git._fsync_path") as fsync_path:
+            gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertEqual(
+            [mock.call(os.path.join(gc.path, "foo.ics")), mock.call(gc.path)],
+            fsync_path.call_args_list,
+        )
+
+    def test_fsync_batch(self):
+        gc = self.create_fsync_store("batch", commit_delay=60)
+        self.addCleanup(gc.flush)
+        with mock.patch("xandikos.store.git._fsync_path") as fsync_path:
+            (name, etag) = gc.import_one(
+                "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+            )
+            gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+            fsync_path.assert_not_called()
+            gc.flush()
+        synced = {call.args[0] for call in fsync_path.call_args_list}
+        self.assertIn(os.path.join(gc.path, "foo.ics"), synced)
+        self.assertIn(os.path.join(gc.path, "bar.ics"), synced)
+        self.assertIn(gc.path, synced)
+        self.assertIn(
+            gc.repo.object_store._get_shafile_path(etag.encode("ascii")), synced
+        )
+        self.assertEqual([], gc._unsynced)
+        self.assertFalse(gc.repo.object_store.fsync_object_files)
+
+    def test_fsync_batch_keeps_repository_setting(self):
+        gc = self.create_fsync_store("batch")
+        # As set by core.fsyncObjectFiles
+        gc.repo.object_store.fsync_object_files = True
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertTrue(gc.repo.object_store.fsync_object_files)
+
+    def test_fsync_invalid(self):
+        self.assertRaises(ValueError, self.create_fsync_store, "sometimes")
+
+    def test_commit_message_policy_invalid(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        self.assertRaises(
+            ValueError, TreeGitStore, Repo.init(d), commit_message_policy="verbose"
+        )
+
     def test_index_cache_invalidated_on_delete(self):
         gc = self.create_store()
         (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
@@ -597,6 +1256,334 @@ class TreeGitStoreTest(BaseGitStoreTest, unittest.TestCase):
         self.assertRaises(KeyError, gc.get_etag, "foo.ics")
 
 
+class HistoryTestCase(unittest.TestCase):
+    """Base class for tests that build a commit history by hand."""
+
+    def setUp(self):
+        super().setUp()
+        self.repo = MemoryRepo()
+        self.head = None
+
+    def commit(self, commit_time, changes):
+        tree = Tree()
+        if self.head is not None:
+            for entry in self.repo[self.repo[self.head].tree].items():
+                tree.add(entry.path, entry.mode, entry.sha)
+        objects = []
+        for name, contents in changes.items():
+            if contents is None:
+                del tree[name.encode("utf-8")]
+            else:
+                blob = Blob.from_string(contents)
+                objects.append(blob)
+                tree.add(name.encode("utf-8"), 0o644 | stat.S_IFREG, blob.id)
+        c = Commit()
+        c.tree = tree.id
+        c.parents = [self.head] if self.head is not None else []
+        c.committer = c.author = b"Somebody <foo@example.com>"
+        c.commit_time = c.author_time = commit_time
+        c.commit_timezone = c.author_timezone = 0
+        c.message = b"do something"
+        self.repo.object_store.add_objects([(obj, None) for obj in objects + [tree, c]])
+        self.head = c.id
+        return c.id
+
+    def tree(self):
+        return self.repo[self.head].tree.decode("ascii")
+
+
+class ItemTimesTest(HistoryTestCase):
+    def test_incremental(self):
+        times = ItemTimes()
+        self.commit(1000, {"a.ics": b"a", "b.ics": b"b"})
+        self.assertEqual((1000, 1000), times.get(self.repo, self.head, "a.ics"))
+        self.commit(2000, {"a.ics": b"a2", "b.ics": None})
+        self.commit(3000, {"c.ics": b"c"})
+        with mock.patch.object(
+            self.repo, "get_walker", wraps=self.repo.get_walker
+        ) as get_walker:
+            self.assertEqual((1000, 2000), times.get(self.repo, self.head, "a.ics"))
+            self.assertEqual((3000, 3000), times.get(self.repo, self.head, "c.ics"))
+            self.assertRaises(KeyError, times.get, self.repo, self.head, "b.ics")
+        self.assertEqual(1, get_walker.call_count)
+        self.assertIsNotNone(get_walker.call_args.kwargs["exclude"])
+
+    def test_rewritten_history(self):
+        times = ItemTimes()
+        self.commit(1000, {"a.ics": b"a"})
+        times.get(self.repo, self.head, "a.ics")
+        self.head = None
+        self.commit(2000, {"b.ics": b"b"})
+        self.assertEqual((2000, 2000), times.get(self.repo, self.head, "b.ics"))
+        self.assertRaises(KeyError, times.get, self.repo, self.head, "a.ics")
+
+    def test_persistent(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, "times.json")
+        self.commit(1000, {"a.ics": b"a"})
+        self.assertEqual(
+            (1000, 1000), ItemTimes(path).get(self.repo, self.head, "a.ics")
+        )
+        times = ItemTimes(path)
+        with mock.patch.object(self.repo, "get_walker") as get_walker:
+            self.assertEqual((1000, 1000), times.get(self.repo, self.head, "a.ics"))
+        get_walker.assert_not_called()
+        with open(path, "w") as f:
+            f.write("garbage")
+        with self.assertLogs("xandikos", level=logging.WARNING):
+            self.assertEqual(
+                (1000, 1000), ItemTimes(path).get(self.repo, self.head, "a.ics")
+            )
+
+    def test_shared(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, "times.json")
+        self.commit(1000, {"a.ics": b"a"})
+        times1 = ItemTimes(path)
+        times2 = ItemTimes(path)
+        times1.get(self.repo, self.head, "a.ics")
+        times2.get(self.repo, self.head, "a.ics")
+        self.commit(2000, {"b.ics": b"b"})
+        self.assertEqual((2000, 2000), times1.get(self.repo, self.head, "b.ics"))
+        # The times saved by the other instance are used, rather than
+        # walking the history again.
+        with mock.patch.object(self.repo, "get_walker") as get_walker:
+            self.assertEqual((2000, 2000), times2.get(self.repo, self.head, "b.ics"))
+        get_walker.assert_not_called()
+
+    def test_appends_changes(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, "times.json")
+        self.commit(1000, {"a.ics": b"a", "b.ics": b"b"})
+        times = ItemTimes(path)
+        times.get(self.repo, self.head, "a.ics")
+        inode = os.stat(path).st_ino
+        self.commit(2000, {"a.ics": b"a2", "b.ics": None})
+        self.commit(3000, {"c.ics": b"c"})
+        self.assertEqual((1000, 2000), times.get(self.repo, self.head, "a.ics"))
+        self.assertEqual((3000, 3000), times.get(self.repo, self.head, "c.ics"))
+        # Only the changes were appended to the file.
+        self.assertEqual(inode, os.stat(path).st_ino)
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        self.assertEqual(2, len(lines))
+        self.assertEqual(
+            {"a.ics": [1000, 2000], "b.ics": None, "c.ics": [3000, 3000]},
+            json.loads(lines[1])["items"],
+        )
+        times = ItemTimes(path)
+        with mock.patch.object(self.repo, "get_walker") as get_walker:
+            self.assertEqual((1000, 2000), times.get(self.repo, self.head, "a.ics"))
+            self.assertRaises(KeyError, times.get, self.repo, self.head, "b.ics")
+        get_walker.assert_not_called()
+
+    def test_rewrites_snapshot(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, "times.json")
+        self.commit(1000, {"a.ics": b"a"})
+        times = ItemTimes(path)
+        times.get(self.repo, self.head, "a.ics")
+        self.commit(2000, {"b.ics": b"b"})
+        with mock.patch("xandikos.store.git.ITEM_TIMES_MIN_LOG_SIZE", 0):
+            times.get(self.repo, self.head, "b.ics")
+            self.commit(3000, {"c.ics": b"c"})
+            times.get(self.repo, self.head, "c.ics")
+        with open(path, "rb") as f:
+            lines = f.readlines()
+        self.assertEqual(1, len(lines))
+        self.assertEqual(3, len(json.loads(lines[0])["items"]))
+
+    def test_ignores_stale_changes(self):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        path = os.path.join(d, "times.json")
+        self.commit(1000, {"a.ics": b"a"})
+        ItemTimes(path).get(self.repo, self.head, "a.ics")
+        with open(path, "ab") as f:
+            f.write(b"garbage\n")
+            f.write(
+                json.dumps(
+                    {"parent": "0" * 40, "commit": "1" * 40, "items": {"a.ics": None}}
+                ).encode("utf-8")
+                + b"\n"
+            )
+            # Not yet completely written
+            f.write(b'{"parent"')
+        times = ItemTimes(path)
+        with self.assertLogs("xandikos", level=logging.WARNING):
+            self.assertEqual((1000, 1000), times.get(self.repo, self.head, "a.ics"))
+
+
+class ChangelogTest(unittest.TestCase):
+    def changes(self, changelog, old_ctag, new_ctag):
+        changes = changelog.changes(old_ctag, new_ctag)
+        if changes is None:
+            return None
+        return sorted(
+            (name, old is not None, new is not None) for (name, old, new) in changes
+        )
+
+    def test_changes(self):
+        changelog = Changelog()
+        changelog.record("t1", "t2", [("a.ics", b"a", b"a2"), ("b.ics", b"b", None)])
+        changelog.record("t2", "t3", [("c.ics", None, b"c")])
+        changelog.record("t3", "t4", [("c.ics", b"c", None), ("d.ics", None, b"d")])
+        self.assertEqual(
+            [("a.ics", True, True), ("b.ics", True, False), ("d.ics", False, True)],
+            self.changes(changelog, "t1", "t4"),
+        )
+        self.assertEqual([], self.changes(changelog, "t4", "t4"))
+        # Going backwards is not supported
+        self.assertIsNone(self.changes(changelog, "t4", "t1"))
+        self.assertIsNone(self.changes(changelog, "t0", "t4"))
+
+    def test_max_size(self):
+        changelog = Changelog(max_size=2)
+        changelog.record("t1", "t2", [("b.ics", None, b"b")])
+        changelog.record("t2", "t3", [("c.ics", None, b"c")])
+        changelog.record("t3", "t4", [("d.ics", None, b"d")])
+        self.assertIsNone(self.changes(changelog, "t1", "t4"))
+        self.assertEqual(
+            [("c.ics", False, True), ("d.ics", False, True)],
+            self.changes(changelog, "t2", "t4"),
+        )
+
+    def test_other_commits(self):
+        changelog = Changelog()
+        changelog.record("t1", "t2", [("b.ics", None, b"b")])
+        # Somebody else went from t2 to t3
+        changelog.record("t3", "t4", [("c.ics", None, b"c")])
+        self.assertIsNone(self.changes(changelog, "t1", "t4"))
+        self.assertIsNone(self.changes(changelog, "t2", "t4"))
+        self.assertEqual([("c.ics", False, True)], self.changes(changelog, "t3", "t4"))
+
+
+class GroupCommitTests:
+    """Tests for staging writes and committing them together."""
+
+    def create_group_store(self, **kwargs):
+        raise NotImplementedError(self.create_group_store)
+
+    def create_store(self):
+        store = self.create_group_store(commit_delay=60)
+        self.addCleanup(store.flush)
+        return store
+
+    def _commits(self, gc):
+        try:
+            return list(gc.repo.get_walker())
+        except KeyError:
+            # No commits yet
+            return []
+
+    def test_writes_combined(self):
+        gc = self.create_store()
+        before = len(self._commits(gc))
+        (name1, etag1) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        (name2, etag2) = gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        gc.delete_one("foo.ics")
+        self.assertEqual(before, len(self._commits(gc)))
+        self.assertEqual(etag2, gc.get_etag("bar.ics"))
+        self.assertRaises(KeyError, gc.get_etag, "foo.ics")
+        self.assertEqual(
+            ("bar.ics", etag2),
+            gc.lookup_uid("bdc22764-b9e1-42c9-89c2-a85405d8fbff"),
+        )
+        gc.flush()
+        commits = self._commits(gc)
+        self.assertEqual(before + 1, len(commits))
+        self.assertTrue(commits[0].commit.message.startswith(b"Update 3 items\n"))
+        self.assertEqual(
+            [("bar.ics", "text/calendar", etag2)], list(gc.iter_with_etag())
+        )
+
+    def test_get_ctag_commits(self):
+        gc = self.create_store()
+        ctag = gc.get_ctag()
+        (name, etag) = gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        new_ctag = gc.get_ctag()
+        self.assertNotEqual(ctag, new_ctag)
+        self.assertEqual(
+            [("foo.ics", "text/calendar", None, etag)],
+            list(gc.iter_changes(ctag, new_ctag)),
+        )
+
+    def test_batch_size(self):
+        gc = self.create_group_store(commit_delay=60, commit_batch_size=2)
+        self.addCleanup(gc.flush)
+        before = len(self._commits(gc))
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertEqual(before, len(self._commits(gc)))
+        gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        self.assertEqual(before + 1, len(self._commits(gc)))
+
+    def test_delay(self):
+        gc = self.create_group_store(commit_delay=0.01)
+        self.addCleanup(gc.flush)
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        timer = gc._commit_timer
+        self.assertIsNotNone(timer)
+        timer.join()
+        self.assertIsNone(gc._commit_timer)
+        self.assertEqual({}, gc._staged)
+
+    def test_item_times_staged(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        gc.flush()
+        before = len(self._commits(gc))
+        modified = gc.get_last_modified("foo.ics")
+        # Looking up an item that isn't staged doesn't commit anything.
+        gc.delete_one("bar.ics")
+        self.assertEqual(modified, gc.get_last_modified("foo.ics"))
+        self.assertEqual(before, len(self._commits(gc)))
+        self.assertRaises(KeyError, gc.get_creation_date, "bar.ics")
+        gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        self.assertGreater(gc.get_creation_date("bar.ics").year, 2000)
+        self.assertGreater(gc.get_last_modified("bar.ics").year, 2000)
+        self.assertEqual(before + 2, len(self._commits(gc)))
+
+    def test_duplicate_uid(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self.assertRaises(
+            DuplicateUidError,
+            gc.import_one,
+            "bar.ics",
+            "text/calendar",
+            [EXAMPLE_VCALENDAR1],
+        )
+
+
+class GroupCommitBareGitStoreTest(GroupCommitTests, unittest.TestCase):
+    def create_group_store(self, **kwargs):
+        store = BareGitStore.create_memory(**kwargs)
+        store.load_extra_file_handler(ICalendarFile)
+        return store
+
+
+class GroupCommitTreeGitStoreTest(GroupCommitTests, unittest.TestCase):
+    def create_group_store(self, **kwargs):
+        d = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, d)
+        store = TreeGitStore(Repo.init(d), **kwargs)
+        store.load_extra_file_handler(ICalendarFile)
+        return store
+
+    def test_working_tree_updated(self):
+        gc = self.create_store()
+        gc.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        gc.import_one("bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2])
+        gc.delete_one("foo.ics")
+        gc.flush()
+        self.assertEqual([".git", "bar.ics"], sorted(os.listdir(gc.path)))
+
+
 class ExtractRegularUIDTests(unittest.TestCase):
     def test_extract_no_uid(self):
         fi = File([EXAMPLE_VCALENDAR_NO_UID], "text/bla")
@@ -746,6 +1733,35 @@ class EagerIndexingTest(unittest.TestCase):
         self.assertEqual(results[0][0], name)
         self.assertEqual(results[0][2], etag)
 
+    def test_eager_indexing_filter_lazy_files(self):
+        store = self._create_bare_store()
+        (name, etag) = store.import_one(
+            "test.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        thread = start_eager_indexing(store)
+        thread.join(timeout=10)
+        store._parsed_file_cache.cache_clear()
+
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent("VTODO")
+        [(result_name, result_file, result_etag)] = store.iter_with_filter(filter)
+        # Matches served from the index don't need the blob to be read.
+        self.assertFalse(result_file.content.loaded)
+        self.assertEqual(
+            b"".join(store._get_raw(name, etag)), b"".join(result_file.content)
+        )
+
+    def test_start_eager_indexing_keeps_existing_values(self):
+        store = self._create_bare_store()
+        (name, etag) = store.import_one(
+            "test.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        with mock.patch.object(store.index, "reset") as reset:
+            thread = start_eager_indexing(store)
+            thread.join(timeout=10)
+        reset.assert_not_called()
+        self.assertEqual([etag], list(store.index.iter_etags()))
+
     def test_start_eager_indexing_no_handlers(self):
         store = self._create_bare_store()
         # Remove all file handlers so there are no default keys
@@ -773,3 +1789,488 @@ class EagerIndexingTest(unittest.TestCase):
         # The valid file should be indexed
         indexed_etags = list(store.index.iter_etags())
         self.assertEqual(len(indexed_etags), 1)
+
+    def _populate(self, store):
+        thread = start_eager_indexing(store)
+        thread.join(timeout=10)
+        self.assertFalse(thread.is_alive())
+
+    def test_eager_indexing_records_ctag(self):
+        store = self._create_bare_store()
+        store.import_one("test.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        self._populate(store)
+        self.assertEqual(store.get_ctag(), store.index.get_indexed_ctag())
+        with mock.patch.object(store, "iter_with_etag") as iter_with_etag:
+            self._populate(store)
+        iter_with_etag.assert_not_called()
+
+    def test_eager_indexing_incremental(self):
+        store = self._create_bare_store()
+        (name1, etag1) = store.import_one(
+            "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        self._populate(store)
+        (name2, etag2) = store.import_one(
+            "bar.ics", "text/calendar", [EXAMPLE_VCALENDAR2]
+        )
+        store.delete_one(name1)
+        (name3, etag3) = store.import_one(
+            "baz.ics",
+            "text/calendar",
+            [_example_event(b"baz", b"20200110T100000Z", b"20200110T110000Z")],
+        )
+        # Simulate an item that was added without being indexed.
+        store.index.remove_values([etag3])
+        with mock.patch.object(store, "get_file", wraps=store.get_file) as get_file:
+            self._populate(store)
+        self.assertEqual([name3], [call.args[0] for call in get_file.call_args_list])
+        self.assertEqual({etag2, etag3}, set(store.index.iter_etags()))
+        self.assertEqual(store.get_ctag(), store.index.get_indexed_ctag())
+
+    def test_eager_indexing_incremental_identical(self):
+        store = self._create_bare_store()
+        store._check_for_duplicate_uids = False
+        (name1, etag1) = store.import_one(
+            "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        (name2, etag2) = store.import_one(
+            "bar.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        self._populate(store)
+        store.delete_one(name1)
+        self._populate(store)
+        # The other item with the same contents keeps its index values.
+        self.assertEqual([etag2], list(store.index.iter_etags()))
+
+    def test_eager_indexing_workers(self):
+        store = self._create_bare_store()
+        etags = set()
+        for month in range(1, 4):
+            (name, etag) = store.import_one(
+                f"{month}.ics",
+                "text/calendar",
+                [
+                    _example_event(
+                        str(month).encode("ascii"),
+                        b"2020%02d10T100000Z" % month,
+                        b"2020%02d10T110000Z" % month,
+                    )
+                ],
+            )
+            etags.add(etag)
+        store.index.reset([])
+        thread = start_eager_indexing(store, workers=2, batch_size=2)
+        thread.join(timeout=60)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(etags, set(store.index.iter_etags()))
+        self.assertEqual(
+            {"C=VCALENDAR/C=VEVENT/P=DTSTART": [b"20200110T100000Z"]},
+            store.index.get_values(
+                "1.ics",
+                store.get_file_meta("1.ics")[1],
+                ["C=VCALENDAR/C=VEVENT/P=DTSTART"],
+            ),
+        )
+
+    def test_index_batch(self):
+        self.assertEqual(
+            [{"C=VCALENDAR/C=VTODO": [True]}, None],
+            _index_batch(
+                [
+                    (ICalendarFile, [EXAMPLE_VCALENDAR1], "text/calendar"),
+                    (ICalendarFile, [b"invalid"], "text/calendar"),
+                ],
+                ["C=VCALENDAR/C=VTODO"],
+            ),
+        )
+
+    def test_eager_indexing_invalid_ctag(self):
+        store = self._create_bare_store()
+        (name, etag) = store.import_one(
+            "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        store.index.set_indexed_ctag("0" * 40)
+        store.index.add_values("gone.ics", "gone", {})
+        self._populate(store)
+        self.assertEqual([etag], list(store.index.iter_etags()))
+
+
+def _example_event(uid, dtstart, dtend, rrule=None):
+    lines = [
+        b"BEGIN:VCALENDAR",
+        b"VERSION:2.0",
+        b"PRODID:-//Xandikos//Tests//EN",
+        b"BEGIN:VEVENT",
+        b"UID:" + uid,
+        b"DTSTAMP:20200101T000000Z",
+        b"DTSTART:" + dtstart,
+        b"DTEND:" + dtend,
+    ]
+    if rrule is not None:
+        lines.append(b"RRULE:" + rrule)
+    lines.extend([b"SUMMARY:" + uid, b"END:VEVENT", b"END:VCALENDAR", b""])
+    return b"\n".join(lines)
+
+
+class TimeRangeIndexStoreTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = BareGitStore.create_memory(
+            double_check_indexes=True, index_threshold=0
+        )
+        self.store.load_extra_file_handler(ICalendarFile)
+        self.january = self.store.import_one(
+            "january.ics",
+            "text/calendar",
+            [_example_event(b"january", b"20200110T100000Z", b"20200110T110000Z")],
+        )
+        self.june = self.store.import_one(
+            "june.ics",
+            "text/calendar",
+            [_example_event(b"june", b"20200610T100000Z", b"20200610T110000Z")],
+        )
+        self.weekly = self.store.import_one(
+            "weekly.ics",
+            "text/calendar",
+            [
+                _example_event(
+                    b"weekly", b"20190101T100000", b"20190101T110000", b"FREQ=WEEKLY"
+                )
+            ],
+        )
+
+    def _week_filter(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT"
+        ).filter_time_range(
+            datetime(2020, 6, 8, tzinfo=timezone.utc),
+            datetime(2020, 6, 15, tzinfo=timezone.utc),
+        )
+        return filter
+
+    def test_time_ranges_indexed_on_import(self):
+        for name, etag in [self.january, self.june, self.weekly]:
+            self.assertTrue(self.store.time_range_index.covers(etag, "VEVENT"))
+        self.assertEqual(
+            {self.june[1], self.weekly[1]},
+            self.store.time_range_index.query(
+                "VEVENT",
+                datetime(2020, 6, 8, tzinfo=timezone.utc).timestamp(),
+                datetime(2020, 6, 15, tzinfo=timezone.utc).timestamp(),
+            ),
+        )
+
+    def test_iter_with_filter(self):
+        filter = self._week_filter()
+        with mock.patch.object(
+            self.store.index, "get_values", wraps=self.store.index.get_values
+        ) as get_values:
+            results = list(self.store.iter_with_filter(filter))
+        self.assertEqual(
+            {"june.ics", "weekly.ics"}, {name for (name, file, etag) in results}
+        )
+        self.assertNotIn(
+            "january.ics", [call.args[0] for call in get_values.call_args_list]
+        )
+
+    def test_iter_with_filter_candidates_only(self):
+        self.store.double_check_indexes = False
+        list(self.store.iter_with_filter(self._week_filter()))
+        self.store.import_one(
+            "july.ics",
+            "text/calendar",
+            [_example_event(b"july", b"20200710T100000Z", b"20200710T110000Z")],
+        )
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT"
+        ).filter_time_range(
+            datetime(2020, 7, 1, tzinfo=timezone.utc),
+            datetime(2020, 7, 15, tzinfo=timezone.utc),
+        )
+        # Only the items that changed since the last pass are listed, and
+        # only the candidates from the time range index are examined.
+        with (
+            mock.patch.object(self.store, "iter_with_etag") as iter_with_etag,
+            mock.patch.object(
+                self.store.index, "get_values", wraps=self.store.index.get_values
+            ) as get_values,
+        ):
+            results = list(self.store.iter_with_filter(filter))
+        self.assertEqual(
+            {"july.ics", "weekly.ics"}, {name for (name, file, etag) in results}
+        )
+        iter_with_etag.assert_not_called()
+        self.assertEqual(
+            {"july.ics", "weekly.ics"},
+            {call.args[0] for call in get_values.call_args_list},
+        )
+
+    def test_iter_with_filter_repopulates(self):
+        self.store.time_range_index.reset()
+        filter = self._week_filter()
+        self.assertEqual(
+            {"june.ics", "weekly.ics"},
+            {name for (name, file, etag) in self.store.iter_with_filter(filter)},
+        )
+        self.assertTrue(self.store.time_range_index.covers(self.january[1], "VEVENT"))
+        self.assertEqual(
+            {"june.ics", "weekly.ics"},
+            {name for (name, file, etag) in self.store.iter_with_filter(filter)},
+        )
+
+
+class TextIndexStoreTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = BareGitStore.create_memory(
+            double_check_indexes=True, index_threshold=0
+        )
+        self.store.load_extra_file_handler(ICalendarFile)
+        self.store.enable_text_index(["SUMMARY"])
+        self.meeting = self.store.import_one(
+            "meeting.ics",
+            "text/calendar",
+            [_example_event(b"Team Meeting", b"20200110T100000Z", b"20200110T110000Z")],
+        )
+        self.dentist = self.store.import_one(
+            "dentist.ics",
+            "text/calendar",
+            [_example_event(b"Dentist", b"20200610T100000Z", b"20200610T110000Z")],
+        )
+
+    def _summary_filter(self, text):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT"
+        ).filter_property("SUMMARY").filter_text_match(text)
+        return filter
+
+    def test_text_indexed_on_import(self):
+        key = "C=VCALENDAR/C=VEVENT/P=SUMMARY"
+        self.assertIn(key, self.store.text_index_keys)
+        self.assertEqual({self.meeting[1]}, self.store.text_index.query(key, "meet"))
+
+    def test_iter_with_filter(self):
+        filter = self._summary_filter("MEETING")
+        with mock.patch.object(
+            self.store.index, "get_values", wraps=self.store.index.get_values
+        ) as get_values:
+            results = list(self.store.iter_with_filter(filter))
+        self.assertEqual(["meeting.ics"], [name for (name, file, etag) in results])
+        self.assertNotIn(
+            "dentist.ics", [call.args[0] for call in get_values.call_args_list]
+        )
+
+    def test_iter_with_filter_short_text(self):
+        self.assertEqual(
+            ["dentist.ics"],
+            [
+                name
+                for (name, file, etag) in self.store.iter_with_filter(
+                    self._summary_filter("de")
+                )
+            ],
+        )
+
+    def test_iter_with_filter_repopulates(self):
+        self.store.text_index.reset()
+        filter = self._summary_filter("dentist")
+        for i in range(2):
+            self.assertEqual(
+                ["dentist.ics"],
+                [name for (name, file, etag) in self.store.iter_with_filter(filter)],
+            )
+        self.assertTrue(
+            self.store.text_index.covers(
+                self.meeting[1], "C=VCALENDAR/C=VEVENT/P=SUMMARY"
+            )
+        )
+
+
+class ComponentIndexStoreTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = BareGitStore.create_memory(
+            double_check_indexes=True, index_threshold=0
+        )
+        self.store.load_extra_file_handler(ICalendarFile)
+        self.event = self.store.import_one(
+            "event.ics",
+            "text/calendar",
+            [_example_event(b"event", b"20200110T100000Z", b"20200110T110000Z")],
+        )
+        self.todo = self.store.import_one(
+            "todo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+
+    def _todo_filter(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent("VTODO")
+        return filter
+
+    def test_components_indexed_on_import(self):
+        key = "C=VCALENDAR/C=VTODO"
+        self.assertTrue(self.store.component_index.covers(self.event[1], [key]))
+        self.assertEqual(
+            {self.todo[1]}, self.store.component_index.query([(key, True)])
+        )
+
+    def test_iter_with_filter(self):
+        with mock.patch.object(self.store.index, "get_values") as get_values:
+            results = list(self.store.iter_with_filter(self._todo_filter()))
+        self.assertEqual(["todo.ics"], [name for (name, file, etag) in results])
+        get_values.assert_not_called()
+
+    def test_iter_with_filter_candidates_only(self):
+        self.store.double_check_indexes = False
+        list(self.store.iter_with_filter(self._todo_filter()))
+        self.store.delete_one("todo.ics")
+        journal = self.store.import_one(
+            "journal.ics",
+            "text/calendar",
+            [
+                b"BEGIN:VCALENDAR\nVERSION:2.0\nPRODID:-//Test//EN\n"
+                b"BEGIN:VJOURNAL\nUID:journal\nDTSTAMP:20200101T000000Z\n"
+                b"END:VJOURNAL\nEND:VCALENDAR\n"
+            ],
+        )
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent("VJOURNAL")
+        with (
+            mock.patch.object(self.store, "iter_with_etag") as iter_with_etag,
+            mock.patch.object(self.store.index, "get_values") as get_values,
+        ):
+            results = list(self.store.iter_with_filter(filter))
+        self.assertEqual(
+            [("journal.ics", journal[1])],
+            [(name, etag) for (name, file, etag) in results],
+        )
+        iter_with_etag.assert_not_called()
+        get_values.assert_not_called()
+        self.assertEqual(
+            [],
+            [
+                name
+                for (name, file, etag) in self.store.iter_with_filter(
+                    self._todo_filter()
+                )
+            ],
+        )
+
+    def test_iter_with_filter_repopulates(self):
+        self.store.component_index.reset()
+        for i in range(2):
+            self.assertEqual(
+                ["todo.ics"],
+                [
+                    name
+                    for (name, file, etag) in self.store.iter_with_filter(
+                        self._todo_filter()
+                    )
+                ],
+            )
+        self.assertTrue(
+            self.store.component_index.covers(self.event[1], ["C=VCALENDAR/C=VTODO"])
+        )
+
+    def test_delete_identical(self):
+        store = BareGitStore.create_memory(
+            index_threshold=0, check_for_duplicate_uids=False
+        )
+        store.load_extra_file_handler(ICalendarFile)
+        (name1, etag1) = store.import_one(
+            "todo1.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        (name2, etag2) = store.import_one(
+            "todo2.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        self.assertEqual(etag1, etag2)
+        self.assertEqual(
+            ["todo1.ics", "todo2.ics"],
+            sorted(
+                name
+                for (name, file, etag) in store.iter_with_filter(self._todo_filter())
+            ),
+        )
+        store.delete_one("todo1.ics")
+        # The remaining item with the same etag is still found.
+        self.assertEqual(
+            ["todo2.ics"],
+            [
+                name
+                for (name, file, etag) in store.iter_with_filter(self._todo_filter())
+            ],
+        )
+        self.assertTrue(store.component_index.covers(etag2, ["C=VCALENDAR/C=VTODO"]))
+
+    def test_delete(self):
+        self.store.delete_one("todo.ics")
+        self.assertEqual([], list(self.store.iter_with_filter(self._todo_filter())))
+
+
+class FilterCacheTest(unittest.TestCase):
+    def setUp(self):
+        super().setUp()
+        self.store = BareGitStore.create_memory()
+        self.store.load_extra_file_handler(ICalendarFile)
+        for month in range(1, 7):
+            self.store.import_one(
+                f"{month}.ics",
+                "text/calendar",
+                [
+                    _example_event(
+                        str(month).encode("ascii"),
+                        b"2020%02d10T100000Z" % month,
+                        b"2020%02d10T110000Z" % month,
+                    )
+                ],
+            )
+
+    def _filter(self):
+        filter = CalendarFilter(ZoneInfo("UTC"))
+        filter.filter_subcomponent("VCALENDAR").filter_subcomponent(
+            "VEVENT"
+        ).filter_time_range(
+            datetime(2020, 3, 1, tzinfo=timezone.utc),
+            datetime(2020, 5, 1, tzinfo=timezone.utc),
+        )
+        return filter
+
+    def _names(self, filter):
+        return {name for (name, file, etag) in self.store.iter_with_filter(filter)}
+
+    def test_cache_key(self):
+        self.assertEqual(self._filter().cache_key(), self._filter().cache_key())
+        other = CalendarFilter(ZoneInfo("Europe/London"))
+        other.children = self._filter().children
+        self.assertNotEqual(self._filter().cache_key(), other.cache_key())
+
+    def test_cached(self):
+        self.assertEqual({"3.ics", "4.ics"}, self._names(self._filter()))
+        filter = self._filter()
+        with mock.patch.object(filter, "check") as check:
+            self.assertEqual({"3.ics", "4.ics"}, self._names(filter))
+        check.assert_not_called()
+
+    def test_incremental_update(self):
+        self.assertEqual({"3.ics", "4.ics"}, self._names(self._filter()))
+        self.store.import_one(
+            "extra.ics",
+            "text/calendar",
+            [_example_event(b"extra", b"20200320T100000Z", b"20200320T110000Z")],
+        )
+        self.store.delete_one("4.ics")
+        filter = self._filter()
+        with mock.patch.object(filter, "check", wraps=filter.check) as check:
+            self.assertEqual({"3.ics", "extra.ics"}, self._names(filter))
+        self.assertEqual(["extra.ics"], [call.args[0] for call in check.call_args_list])
+
+    def test_cache_size(self):
+        with mock.patch("xandikos.store.FILTER_CACHE_SIZE", 1):
+            self._names(self._filter())
+            other = CalendarFilter(ZoneInfo("UTC"))
+            other.filter_subcomponent("VCALENDAR")
+            self._names(other)
+        self.assertEqual(1, len(self.store._filter_cache))
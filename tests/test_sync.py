@@ -20,13 +20,24 @@
 """Tests for xandikos.sync."""
 
 import unittest
-from unittest.mock import Mock, patch
+from unittest.mock import AsyncMock, Mock, patch
 from xml.etree import ElementTree as ET
 import asyncio
 
 from xandikos import sync, webdav
 
 
+def _changes(changes):
+    """Create a side effect for iter_differences_since."""
+
+    async def iter_differences_since(old_token, new_token, after=None):
+        for change in changes:
+            if after is None or change[0] > after:
+                yield change
+
+    return iter_differences_since
+
+
 class SyncTokenTests(unittest.TestCase):
     """Tests for SyncToken."""
 
@@ -53,6 +64,24 @@ class InvalidTokenTests(unittest.TestCase):
         self.assertEqual(exc.token, "bad-token")
 
 
+class PartialTokenTests(unittest.TestCase):
+    """Tests for format_partial_token and parse_sync_token."""
+
+    def test_plain(self):
+        self.assertEqual(("abc", None, None), sync.parse_sync_token("abc"))
+
+    def test_roundtrip(self):
+        token = sync.format_partial_token("new", "old", "a b&c.ics")
+        self.assertEqual(("new", "old", "a b&c.ics"), sync.parse_sync_token(token))
+
+    def test_initial(self):
+        token = sync.format_partial_token("new", None, "a.ics")
+        self.assertEqual(("new", None, "a.ics"), sync.parse_sync_token(token))
+
+    def test_invalid(self):
+        self.assertRaises(sync.InvalidToken, sync.parse_sync_token, "new?base=x")
+
+
 class SyncCollectionReporterTests(unittest.TestCase):
     """Tests for SyncCollectionReporter."""
 
@@ -74,14 +103,16 @@ class SyncCollectionReporterTests(unittest.TestCase):
 
             # Mock resource
             resource = Mock()
-            resource.get_sync_token.return_value = "new-token"
+            resource.get_sync_token = AsyncMock(return_value="new-token")
 
             # Mock differences
             new_resource = Mock()
-            resource.iter_differences_since.return_value = [
-                ("file1.txt", None, new_resource),  # New file
-                ("file2.txt", Mock(), None),  # Deleted file
-            ]
+            resource.iter_differences_since.side_effect = _changes(
+                [
+                    ("file1.txt", None, new_resource),  # New file
+                    ("file2.txt", Mock(), None),  # Deleted file
+                ]
+            )
 
             # Mock property handling
             async def mock_get_property_from_element(href, res, props, env, el):
@@ -157,7 +188,7 @@ class SyncCollectionReporterTests(unittest.TestCase):
             sync_level_el.text = "1"
 
             resource = Mock()
-            resource.get_sync_token.return_value = "new-token"
+            resource.get_sync_token = AsyncMock(return_value="new-token")
             resource.iter_differences_since.side_effect = NotImplementedError()
 
             response = await self.reporter.report(
@@ -205,7 +236,7 @@ class SyncCollectionReporterTests(unittest.TestCase):
             sync_level_el.text = "1"
 
             resource = Mock()
-            resource.get_sync_token.return_value = "new-token"
+            resource.get_sync_token = AsyncMock(return_value="new-token")
             resource.iter_differences_since.side_effect = sync.InvalidToken(
                 "invalid-token"
             )
@@ -246,14 +277,16 @@ class SyncCollectionReporterTests(unittest.TestCase):
             ET.SubElement(prop_el, "{DAV:}getetag")
 
             resource = Mock()
-            resource.get_sync_token.return_value = "new-token"
+            resource.get_sync_token = AsyncMock(return_value="new-token")
 
             # Return more changes than the limit
-            resource.iter_differences_since.return_value = [
-                ("file1.txt", None, Mock()),
-                ("file2.txt", None, Mock()),
-                ("file3.txt", None, Mock()),
-            ]
+            resource.iter_differences_since.side_effect = _changes(
+                [
+                    ("file1.txt", None, Mock()),
+                    ("file2.txt", None, Mock()),
+                    ("file3.txt", None, Mock()),
+                ]
+            )
 
             # Mock property handling
             async def mock_get_property_from_element(href, res, props, env, el):
@@ -278,14 +311,25 @@ class SyncCollectionReporterTests(unittest.TestCase):
             xml_content = b"".join(response.body)
             root = ET.fromstring(xml_content)
 
-            # Limit is now working - only 1 response should be returned
+            # One member, and a 507 for the truncated result
             responses = root.findall("{DAV:}response")
-            self.assertEqual(len(responses), 1)
+            self.assertEqual(2, len(responses))
+            self.assertEqual(
+                "/collection/file1.txt", responses[0].find("{DAV:}href").text
+            )
+            self.assertEqual("/collection/", responses[1].find("{DAV:}href").text)
+            self.assertIn("507", responses[1].find("{DAV:}status").text)
+            self.assertIsNotNone(
+                responses[1].find("{DAV:}error/{DAV:}number-of-matches-within-limits")
+            )
 
-            # Verify sync token is still present
+            # The sync token reflects the partial result
             sync_tokens = root.findall("{DAV:}sync-token")
             self.assertEqual(len(sync_tokens), 1)
-            self.assertEqual(sync_tokens[0].text, "new-token")
+            self.assertEqual(
+                sync.format_partial_token("new-token", "old-token", "file1.txt"),
+                sync_tokens[0].text,
+            )
 
         asyncio.run(run_test())
 
@@ -299,8 +343,8 @@ class SyncCollectionReporterTests(unittest.TestCase):
             ET.SubElement(body, "{TEST:}unknown")
 
             resource = Mock()
-            resource.get_sync_token.return_value = "new-token"
-            resource.iter_differences_since.return_value = []
+            resource.get_sync_token = AsyncMock(return_value="new-token")
+            resource.iter_differences_since.side_effect = _changes([])
 
             with patch("xandikos.webdav.nonfatal_bad_request") as mock_bad_request:
                 await self.reporter.report(
@@ -339,15 +383,17 @@ class SyncCollectionReporterTests(unittest.TestCase):
             ET.SubElement(prop_el, "{DAV:}getetag")
 
             resource = Mock()
-            resource.get_sync_token.return_value = "token-1"
+            resource.get_sync_token = AsyncMock(return_value="token-1")
 
             # All current resources returned for initial sync
             new_resource1 = Mock()
             new_resource2 = Mock()
-            resource.iter_differences_since.return_value = [
-                ("file1.txt", None, new_resource1),  # None = not in old state
-                ("file2.txt", None, new_resource2),
-            ]
+            resource.iter_differences_since.side_effect = _changes(
+                [
+                    ("file1.txt", None, new_resource1),  # None = not in old state
+                    ("file2.txt", None, new_resource2),
+                ]
+            )
 
             # Mock property handling
             async def mock_get_property_from_element(href, res, props, env, el):
@@ -382,7 +428,7 @@ class SyncCollectionReporterTests(unittest.TestCase):
             self.assertEqual(sync_tokens[0].text, "token-1")
 
             # Verify called with empty token
-            resource.iter_differences_since.assert_called_once_with("", "token-1")
+            resource.iter_differences_since.assert_called_once_with("", "token-1", None)
 
         asyncio.run(run_test())
 
@@ -403,16 +449,18 @@ class SyncCollectionReporterTests(unittest.TestCase):
             ET.SubElement(prop_el, "{DAV:}resourcetype")
 
             resource = Mock()
-            resource.get_sync_token.return_value = "new-token"
+            resource.get_sync_token = AsyncMock(return_value="new-token")
 
             # Mix of file and collection changes
             new_file = Mock()
             new_collection = Mock()
-            resource.iter_differences_since.return_value = [
-                ("newfile.txt", None, new_file),  # New file
-                ("subcollection/", None, new_collection),  # New collection
-                ("oldcollection/", Mock(), None),  # Deleted collection
-            ]
+            resource.iter_differences_since.side_effect = _changes(
+                [
+                    ("newfile.txt", None, new_file),  # New file
+                    ("subcollection/", None, new_collection),  # New collection
+                    ("oldcollection/", Mock(), None),  # Deleted collection
+                ]
+            )
 
             # Mock property handling
             async def mock_get_property_from_element(href, res, props, env, el):
@@ -459,6 +507,133 @@ class SyncCollectionReporterTests(unittest.TestCase):
         asyncio.run(run_test())
 
 
+class PagedSyncTests(unittest.TestCase):
+    """Tests for paging through changes with a limit."""
+
+    def setUp(self):
+        self.reporter = sync.SyncCollectionReporter()
+        # Collection state for each token
+        self.states = {
+            "": {},
+            "1": {"a": "1", "b": "1", "c": "1", "d": "1", "e": "1"},
+            "2": {"a": "1", "b": "2", "c": "1", "e": "2", "f": "1"},
+        }
+        self.resource = Mock()
+        self.resource.get_sync_token = AsyncMock(return_value="1")
+        self.resource.iter_differences_since.side_effect = self._differences
+
+    async def _differences(self, old_token, new_token, after=None):
+        try:
+            old = self.states[old_token or ""]
+        except KeyError as exc:
+            raise sync.InvalidToken(old_token) from exc
+        new = self.states[new_token]
+        for name in set(old) | set(new):
+            if after is not None and name <= after:
+                continue
+            if old.get(name) != new.get(name):
+                yield (name, old.get(name), new.get(name))
+
+    def _sync(self, token, limit):
+        body = ET.Element("body")
+        ET.SubElement(body, "{DAV:}sync-token").text = token
+        ET.SubElement(body, "{DAV:}sync-level").text = "1"
+        if limit is not None:
+            limit_el = ET.SubElement(body, "{DAV:}limit")
+            ET.SubElement(limit_el, "{DAV:}nresults").text = str(limit)
+        ET.SubElement(body, "{DAV:}prop")
+        response = asyncio.run(
+            self.reporter.report(
+                environ={},
+                request_body=body,
+                resources_by_hrefs=lambda hrefs: [],
+                properties={},
+                href="/c/",
+                resource=self.resource,
+                depth="1",
+                strict=True,
+            )
+        )
+        root = ET.fromstring(b"".join(response.body))
+        changes = []
+        truncated = False
+        for r in root.findall("{DAV:}response"):
+            href = r.find("{DAV:}href").text
+            status = r.find("{DAV:}status")
+            if href == "/c/":
+                self.assertIn("507", status.text)
+                truncated = True
+            else:
+                changes.append(
+                    (href[len("/c/") :], status is None or "404" not in status.text)
+                )
+        return changes, truncated, root.find("{DAV:}sync-token").text
+
+    def test_initial_paged(self):
+        changes, truncated, token = self._sync("", 2)
+        self.assertEqual([("a", True), ("b", True)], changes)
+        self.assertTrue(truncated)
+        changes, truncated, token = self._sync(token, 2)
+        self.assertEqual([("c", True), ("d", True)], changes)
+        self.assertTrue(truncated)
+        # Resumed pages only ask for the members after the last one
+        self.resource.iter_differences_since.assert_called_with(None, "1", "b")
+        changes, truncated, token = self._sync(token, 2)
+        self.assertEqual([("e", True)], changes)
+        self.assertFalse(truncated)
+        self.assertEqual("1", token)
+
+    def test_exact_limit(self):
+        changes, truncated, token = self._sync("", 5)
+        self.assertEqual(5, len(changes))
+        self.assertFalse(truncated)
+        self.assertEqual("1", token)
+
+    def test_changed_while_paging(self):
+        changes, truncated, token = self._sync("", 3)
+        self.assertEqual([("a", True), ("b", True), ("c", True)], changes)
+        self.resource.get_sync_token.return_value = "2"
+        # The rest of the initial sync, combined with the changes since:
+        # d was added and removed again, and e is only reported once.
+        changes, truncated, token = self._sync(token, 3)
+        self.assertEqual([("b", True), ("e", True)], changes)
+        self.assertTrue(truncated)
+        self.assertEqual(sync.format_partial_token("2", "1", "e"), token)
+        changes, truncated, token = self._sync(token, 3)
+        self.assertEqual([("f", True)], changes)
+        self.assertFalse(truncated)
+        self.assertEqual("2", token)
+
+    def test_changed_while_paging_unlimited(self):
+        changes, truncated, token = self._sync("", 3)
+        self.resource.get_sync_token.return_value = "2"
+        changes, truncated, token = self._sync(token, None)
+        self.assertEqual([("b", True), ("e", True), ("f", True)], sorted(changes))
+        self.assertFalse(truncated)
+        self.assertEqual("2", token)
+
+    def test_changed_while_paging_truncated(self):
+        changes, truncated, token = self._sync("", 2)
+        self.resource.get_sync_token.return_value = "2"
+        # The rest of the initial sync doesn't fit
+        changes, truncated, token = self._sync(token, 2)
+        self.assertEqual([("c", True), ("d", True)], changes)
+        self.assertTrue(truncated)
+        self.assertEqual(sync.format_partial_token("1", "", "d"), token)
+        changes, truncated, token = self._sync(token, 1)
+        self.assertEqual([("e", True)], changes)
+        self.assertTrue(truncated)
+        self.assertEqual("1", token)
+        changes, truncated, token = self._sync(token, 5)
+        self.assertEqual([("b", True), ("d", False), ("e", True), ("f", True)], changes)
+        self.assertFalse(truncated)
+        self.assertEqual("2", token)
+
+    def test_invalid_partial_token(self):
+        token = sync.format_partial_token("1", "unknown", "b")
+        self.assertRaises(webdav.PreconditionFailure, self._sync, token, 2)
+
+
 class SyncTokenPropertyTests(unittest.TestCase):
     """Tests for SyncTokenProperty."""
 
@@ -476,7 +651,7 @@ class SyncTokenPropertyTests(unittest.TestCase):
         async def run_test():
             prop = sync.SyncTokenProperty()
             resource = Mock()
-            resource.get_sync_token.return_value = "test-sync-token"
+            resource.get_sync_token = AsyncMock(return_value="test-sync-token")
 
             el = ET.Element("test")
             await prop.get_value("/collection/", resource, el, {})
@@ -21,7 +21,8 @@
 
 import unittest
 
-from xandikos.vcard import VCardFile, CardDAVFilter
+from xandikos.store import InvalidFileContents
+from xandikos.vcard import VCardFile, CardDAVFilter, split_vcards
 
 EXAMPLE_VCARD1 = b"""\
 BEGIN:VCARD
@@ -206,3 +207,58 @@ class CardDAVFilterTests(unittest.TestCase):
         param_filter4 = prop_filter4.add_param_filter("TYPE")
         param_filter4.add_text_match("INTERNET", match_type="equals")
         self.assertTrue(filter4.check("test.vcf", fi))
+
+
+class TextIndexTests(unittest.TestCase):
+    def test_text_index_keys(self):
+        self.assertEqual(
+            ["P=FN", "P=EMAIL"], VCardFile.text_index_keys(["fn", "EMAIL"])
+        )
+
+    def test_normalize_text(self):
+        self.assertEqual("JOHN DOE", VCardFile.normalize_text("John Doe"))
+
+    def test_filter_index_text_matches(self):
+        filter = CardDAVFilter()
+        filter.add_property_filter("FN").add_text_match("john")
+        filter.add_property_filter("EMAIL").add_text_match(
+            "example", negate_condition=True
+        )
+        filter.test = all
+        self.assertEqual([("P=FN", "john")], filter.index_text_matches())
+
+    def test_filter_index_text_matches_anyof(self):
+        filter = CardDAVFilter()
+        filter.add_property_filter("FN").add_text_match("john")
+        self.assertEqual([("P=FN", "john")], filter.index_text_matches())
+        filter.add_property_filter("NICKNAME").add_text_match("jd")
+        self.assertEqual([], filter.index_text_matches())
+
+    def test_cache_key(self):
+        def make_filter(text):
+            filter = CardDAVFilter()
+            filter.add_property_filter("FN").add_text_match(text)
+            return filter
+
+        self.assertEqual(
+            make_filter("john").cache_key(), make_filter("john").cache_key()
+        )
+        self.assertNotEqual(
+            make_filter("john").cache_key(), make_filter("jane").cache_key()
+        )
+
+
+class SplitVcardsTests(unittest.TestCase):
+    def test_split(self):
+        other = EXAMPLE_VCARD1.replace(b"Jeffrey Harris", b"Somebody Else")
+        self.assertEqual(
+            [EXAMPLE_VCARD1, other], split_vcards(EXAMPLE_VCARD1 + b"\n" + other)
+        )
+
+    def test_single(self):
+        self.assertEqual([EXAMPLE_VCARD1], split_vcards(EXAMPLE_VCARD1))
+
+    def test_unterminated(self):
+        self.assertRaises(
+            InvalidFileContents, split_vcards, b"BEGIN:VCARD\nVERSION:3.0\n"
+        )
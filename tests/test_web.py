@@ -23,11 +23,16 @@ import asyncio
 import os
 import shutil
 import tempfile
+import threading
 import unittest
+from unittest import mock
+from datetime import datetime, timezone
 
 from xandikos import caldav
 from xandikos.icalendar import ICalendarFile
+from xandikos.store.aio import AsyncStore, create_store_executor
 from xandikos.store.git import TreeGitStore
+from xandikos.store.memory import MemoryStore
 from xandikos.web import (
     CalendarCollection,
     ObjectResource,
@@ -84,21 +89,45 @@ class CalendarCollectionTests(unittest.TestCase):
             self.cal.get_supported_calendar_components(),
         )
 
+    def _calendar_query(self, create_fn):
+        async def collect():
+            return [member async for member in self.cal.calendar_query(create_fn)]
+
+        return asyncio.run(collect())
+
     def test_calendar_query_vtodos(self):
         def create_fn(cls):
             f = cls(None)
             f.filter_subcomponent("VCALENDAR").filter_subcomponent("VTODO")
             return f
 
-        self.assertEqual([], list(self.cal.calendar_query(create_fn)))
+        self.assertEqual([], self._calendar_query(create_fn))
         self.store.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
-        result = list(self.cal.calendar_query(create_fn))
+        result = self._calendar_query(create_fn)
         self.assertEqual(1, len(result))
         self.assertEqual("foo.ics", result[0][0])
         self.assertIs(self.store, result[0][1].store)
         self.assertEqual("foo.ics", result[0][1].name)
         self.assertEqual("text/calendar", result[0][1].content_type)
 
+    def test_calendar_query_etag_only(self):
+        from xandikos.store import start_eager_indexing
+
+        def create_fn(cls):
+            f = cls(None)
+            f.filter_subcomponent("VCALENDAR").filter_subcomponent("VTODO")
+            return f
+
+        (name, etag) = self.store.import_one(
+            "foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1]
+        )
+        start_eager_indexing(self.store).join(timeout=10)
+        self.store._parsed_file_cache.cache_clear()
+        [(result_name, resource)] = self._calendar_query(create_fn)
+        self.assertEqual(f'"{etag}"', asyncio.run(resource.get_etag()))
+        # Reporting just the etag doesn't require reading the item.
+        self.assertFalse(resource._file.content.loaded)
+
     def test_calendar_query_vtodo_by_uid(self):
         def create_fn(cls):
             f = cls(None)
@@ -109,9 +138,9 @@ class CalendarCollectionTests(unittest.TestCase):
             )
             return f
 
-        self.assertEqual([], list(self.cal.calendar_query(create_fn)))
+        self.assertEqual([], self._calendar_query(create_fn))
         self.store.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
-        result = list(self.cal.calendar_query(create_fn))
+        result = self._calendar_query(create_fn)
         self.assertEqual(1, len(result))
         self.assertEqual("foo.ics", result[0][0])
         self.assertIs(self.store, result[0][1].store)
@@ -140,6 +169,32 @@ class CalendarCollectionTests(unittest.TestCase):
         self.assertEqual("foo.ics", result[0][1].name)
         self.assertEqual("text/calendar", result[0][1].content_type)
 
+    def test_iter_members(self):
+        async def collect():
+            return [member async for member in self.cal.iter_members()]
+
+        self.assertEqual([], asyncio.run(collect()))
+        self.store.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        result = asyncio.run(collect())
+        self.assertEqual(["foo.ics"], [name for (name, resource) in result])
+        self.assertIs(self.cal.async_store, result[0][1].async_store)
+        self.assertEqual("text/calendar", result[0][1].content_type)
+
+    def test_get_ctag(self):
+        self.store.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
+        ctag = self.store.get_ctag()
+        self.assertEqual(ctag, asyncio.run(self.cal.get_ctag()))
+        self.assertEqual(ctag, asyncio.run(self.cal.get_sync_token()))
+        self.assertEqual(f'"{ctag}"', asyncio.run(self.cal.get_etag()))
+
+    def test_store_executor(self):
+        self.assertIs(self.backend.store_executor, self.cal.async_store.executor)
+        backend = SingleUserFilesystemBackend(self.tempdir, store_threads=2)
+        self.assertEqual(2, backend.store_executor._max_workers)
+        self.assertRaises(
+            ValueError, SingleUserFilesystemBackend, self.tempdir, store_threads=0
+        )
+
     def test_get_member(self):
         self.assertRaises(KeyError, self.cal.get_member, "foo.ics")
         self.store.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
@@ -152,7 +207,7 @@ class CalendarCollectionTests(unittest.TestCase):
         self.assertRaises(KeyError, self.cal.get_member, "foo.ics")
         self.store.import_one("foo.ics", "text/calendar", [EXAMPLE_VCALENDAR1])
         self.cal.get_member("foo.ics")
-        self.cal.delete_member("foo.ics")
+        asyncio.run(self.cal.delete_member("foo.ics"))
         self.assertRaises(KeyError, self.cal.get_member, "foo.ics")
 
     def test_get_schedule_calendar_transparency(self):
@@ -732,6 +787,96 @@ class ObjectResourceScheduleTagTests(unittest.TestCase):
         asyncio.run(run())
 
 
+class ObjectResourceTimesTests(unittest.TestCase):
+    def test_git_store(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        store = TreeGitStore.create(os.path.join(tempdir, "c"))
+        store.load_extra_file_handler(ICalendarFile)
+        _, etag = store.import_one("event.ics", "text/calendar", [SCHEDULING_BASE])
+        resource = ObjectResource(store, "event.ics", "text/calendar", etag)
+        self.assertEqual(
+            store.get_last_modified("event.ics"),
+            asyncio.run(resource.get_last_modified()),
+        )
+        self.assertEqual(
+            store.get_creation_date("event.ics"),
+            asyncio.run(resource.get_creationdate()),
+        )
+
+    def test_unsupported(self):
+        store = MemoryStore()
+        store.load_extra_file_handler(ICalendarFile)
+        _, etag = store.import_one("event.ics", "text/calendar", [SCHEDULING_BASE])
+        resource = ObjectResource(store, "event.ics", "text/calendar", etag)
+        self.assertRaises(KeyError, asyncio.run, resource.get_last_modified())
+        self.assertRaises(KeyError, asyncio.run, resource.get_creationdate())
+
+    def test_looked_up_on_executor(self):
+        store = MemoryStore()
+        store.load_extra_file_handler(ICalendarFile)
+        _, etag = store.import_one("event.ics", "text/calendar", [SCHEDULING_BASE])
+        executor = create_store_executor(1)
+        self.addCleanup(executor.shutdown)
+        resource = ObjectResource(
+            store,
+            "event.ics",
+            "text/calendar",
+            etag,
+            async_store=AsyncStore(store, executor),
+        )
+        threads = []
+
+        def get_last_modified(name):
+            threads.append(threading.current_thread().name)
+            return datetime(2026, 1, 1, tzinfo=timezone.utc)
+
+        store.get_last_modified = get_last_modified
+        self.assertEqual(
+            datetime(2026, 1, 1, tzinfo=timezone.utc),
+            asyncio.run(resource.get_last_modified()),
+        )
+        self.assertEqual(1, len(threads))
+        self.assertTrue(threads[0].startswith("xandikos-store"))
+
+
+class ObjectResourceBodyTests(unittest.TestCase):
+    def test_loaded_on_executor(self):
+        tempdir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, tempdir)
+        store = TreeGitStore.create(os.path.join(tempdir, "c"))
+        store.load_extra_file_handler(ICalendarFile)
+        _, etag = store.import_one("event.ics", "text/calendar", [SCHEDULING_BASE])
+        executor = create_store_executor(1)
+        self.addCleanup(executor.shutdown)
+        resource = ObjectResource(
+            store,
+            "event.ics",
+            "text/calendar",
+            etag,
+            async_store=AsyncStore(store, executor),
+        )
+        raw = b"".join(store._get_raw("event.ics", etag))
+        store._parsed_file_cache.cache_clear()
+        loaded_in = []
+        orig_get_raw = store._get_raw
+
+        def get_raw(name, etag=None):
+            loaded_in.append(threading.current_thread().name)
+            return orig_get_raw(name, etag)
+
+        store._get_raw = get_raw
+
+        async def run():
+            body = await resource.get_body()
+            # Iterating over the body doesn't do any I/O on the event loop.
+            return b"".join(body)
+
+        self.assertEqual(raw, asyncio.run(run()))
+        self.assertEqual(1, len(loaded_in))
+        self.assertTrue(loaded_in[0].startswith("xandikos-store"))
+
+
 class ScheduleOutboxLookupTests(unittest.TestCase):
     """Integration tests for ScheduleOutbox.get_attendee_busy_periods."""
 
@@ -1472,6 +1617,25 @@ class InboxAutoProcessingTests(unittest.TestCase):
             self._calendar_events("/bob"),
         )
 
+    def test_request_resend_looks_up_uid(self):
+        self._bob_calendar().store.import_one(
+            "event.ics", "text/calendar", [self.INVITATION]
+        )
+        edited = self.INVITATION.replace(b"SUMMARY:Sync", b"SUMMARY:Sync (rev)")
+        # The existing copy is found through the store's UID map rather
+        # than by parsing every member of the calendar.
+        with mock.patch.object(
+            CalendarCollection, "members", side_effect=AssertionError
+        ):
+            asyncio.run(
+                self._alice_calendar().pre_put_hook(
+                    "event.ics", [edited], "text/calendar"
+                )
+            )
+        self.assertEqual(
+            ["Sync (rev)"], [e["summary"] for e in self._calendar_events("/bob")]
+        )
+
     def test_request_resend_preserves_attendee_partstat(self):
         # Bob has accepted alice's invitation in his calendar.
         accepted = self.INVITATION.replace(
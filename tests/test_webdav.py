@@ -20,6 +20,7 @@
 import asyncio
 import logging
 import unittest
+from datetime import datetime, timezone
 from io import BytesIO
 from wsgiref.util import setup_testing_defaults
 
@@ -117,10 +118,12 @@ class WebTests(WebTestCase):
         contents = b"".join(app(environ, start_response))
         return _code[0], _headers, contents
 
-    def get(self, app, path, if_none_match=None):
+    def get(self, app, path, if_none_match=None, if_modified_since=None):
         environ = {"PATH_INFO": path, "REQUEST_METHOD": "GET"}
         if if_none_match is not None:
             environ["HTTP_IF_NONE_MATCH"] = if_none_match
+        if if_modified_since is not None:
+            environ["HTTP_IF_MODIFIED_SINCE"] = if_modified_since
         setup_testing_defaults(environ)
         _code = []
         _headers = []
@@ -259,7 +262,7 @@ class WebTests(WebTestCase):
             async def get_body(self):
                 return [b"this is content"]
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 raise KeyError
 
             def get_content_language(self):
@@ -276,6 +279,61 @@ class WebTests(WebTestCase):
         self.assertEqual("200 OK", code)
         self.assertEqual(b"this is content", contents)
 
+    def _make_dated_resource(self):
+        class TestResource(Resource):
+            async def render(
+                self, self_url, accepted_content_types, accepted_languages
+            ):
+                return ([b"this is content"], 15, '"myetag"', "text/plain", None)
+
+            async def get_last_modified(self):
+                return datetime(2024, 3, 1, 12, 30, 15, tzinfo=timezone.utc)
+
+            async def get_etag(self):
+                return '"myetag"'
+
+        return self.makeApp({"/resource": TestResource()}, [])
+
+    def test_get_last_modified(self):
+        app = self._make_dated_resource()
+        code, headers, contents = self.get(app, "/resource")
+        self.assertEqual("200 OK", code)
+        self.assertIn(("Last-Modified", "Fri, 01 Mar 2024 12:30:15 GMT"), headers)
+
+    def test_get_if_modified_since(self):
+        app = self._make_dated_resource()
+        code, headers, contents = self.get(
+            app, "/resource", if_modified_since="Fri, 01 Mar 2024 12:30:15 GMT"
+        )
+        self.assertEqual("304 Not Modified", code)
+        self.assertEqual(b"", contents)
+        self.assertIn(("ETag", '"myetag"'), headers)
+        code, headers, contents = self.get(
+            app, "/resource", if_modified_since="Fri, 01 Mar 2024 12:30:14 GMT"
+        )
+        self.assertEqual("200 OK", code)
+        self.assertEqual(b"this is content", contents)
+        code, headers, contents = self.get(
+            app, "/resource", if_modified_since="not a date"
+        )
+        self.assertEqual("200 OK", code)
+
+    def test_get_if_none_match(self):
+        app = self._make_dated_resource()
+        code, headers, contents = self.get(app, "/resource", if_none_match='"myetag"')
+        self.assertEqual("304 Not Modified", code)
+        self.assertIn(("ETag", '"myetag"'), headers)
+
+    def test_get_if_modified_since_ignored_with_if_none_match(self):
+        app = self._make_dated_resource()
+        code, headers, contents = self.get(
+            app,
+            "/resource",
+            if_none_match='"otheretag"',
+            if_modified_since="Fri, 01 Mar 2024 12:30:15 GMT",
+        )
+        self.assertEqual("200 OK", code)
+
     def test_set_body(self):
         new_body = []
 
@@ -321,7 +379,9 @@ class WebTests(WebTestCase):
             def get_member(self, name):
                 raise KeyError(name)
 
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 raise KeyError(name)
 
             async def create_member(
@@ -329,7 +389,7 @@ class WebTests(WebTestCase):
             ):
                 return ("new_item", '"new_etag"')
 
-            def get_ctag(self):
+            async def get_ctag(self):
                 return "test-ctag"
 
             def destroy(self):
@@ -786,7 +846,9 @@ class WebTests(WebTestCase):
             async def get_etag(self):
                 return '"parent-etag"'
 
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 deleted_items.append((name, etag))
 
             def get_member(self, name):
@@ -930,7 +992,9 @@ class WebTests(WebTestCase):
                 return '"sched-1"'
 
         class TestCollection(Collection):
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 deleted_items.append((name, etag))
 
             def get_member(self, name):
@@ -962,7 +1026,9 @@ class WebTests(WebTestCase):
                 return '"sched-1"'
 
         class TestCollection(Collection):
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 self.fail("delete_member should not be called")  # pragma: no cover
 
             def get_member(self, name):
@@ -995,7 +1061,7 @@ class WebTests(WebTestCase):
             ):
                 return ([b"x"], 1, '"etag-1"', "text/calendar", None)
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 raise KeyError
 
         app = self.makeApp({"/event.ics": TestResource()}, [])
@@ -1015,7 +1081,7 @@ class WebTests(WebTestCase):
             ):
                 return ([b"x"], 1, '"etag-1"', "text/plain", None)
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 raise KeyError
 
         app = self.makeApp({"/note.txt": TestResource()}, [])
@@ -1247,7 +1313,9 @@ class WebTests(WebTestCase):
             def get_member(self, name):
                 raise KeyError(name)
 
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 deleted_items.append((name, etag))
 
         app = self.makeApp({"/": TestCollection(), "/emptycol": TestCollection()}, [])
@@ -1287,7 +1355,9 @@ class WebTests(WebTestCase):
                     return TestCollection(has_members=True)
                 raise KeyError(name)
 
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 deleted_items.append((name, etag))
 
         app = self.makeApp(
@@ -1334,7 +1404,9 @@ class WebTests(WebTestCase):
                     return self._children[name]
                 raise KeyError(name)
 
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 deleted_items.append((name, etag))
 
         subcol = TestCollection()
@@ -1354,7 +1426,7 @@ class WebTests(WebTestCase):
             async def get_etag(self):
                 return '"foo"'
 
-            def delete_member(
+            async def delete_member(
                 unused_self, name, etag=None, remote_user=None, requester=None
             ):
                 self.assertEqual(name, "resource")
@@ -1381,7 +1453,7 @@ class WebTests(WebTestCase):
             async def get_etag(self):
                 return '"foo"'
 
-            def delete_member(
+            async def delete_member(
                 unused_self, name, etag=None, remote_user=None, requester=None
             ):
                 deleted_items.append(name)
@@ -3085,7 +3157,9 @@ class CollectionMoveMemberTests(unittest.TestCase):
                     return self.members[name]
                 raise KeyError(name)
 
-            def delete_member(self, name, etag=None, remote_user=None, requester=None):
+            async def delete_member(
+                self, name, etag=None, remote_user=None, requester=None
+            ):
                 if name not in self.members:
                     raise KeyError(name)
                 del self.members[name]
@@ -3344,7 +3418,7 @@ class ChunkedTransferEncodingTests(WebTestCase):
             ):
                 self.contents = b"".join(data)
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 return None
 
             async def get_etag(self):
@@ -3385,7 +3459,7 @@ class ChunkedTransferEncodingTests(WebTestCase):
             ):
                 self.contents = b"".join(data)
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 return None
 
             async def get_etag(self):
@@ -3425,7 +3499,7 @@ class ChunkedTransferEncodingTests(WebTestCase):
             ):
                 self.contents = b"".join(data)
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 return None
 
             async def get_etag(self):
@@ -3468,7 +3542,7 @@ class ChunkedTransferEncodingTests(WebTestCase):
             ):
                 self.contents = b"".join(data)
 
-            def get_last_modified(self):
+            async def get_last_modified(self):
                 return None
 
             async def get_etag(self):
@@ -3485,3 +3559,26 @@ class ChunkedTransferEncodingTests(WebTestCase):
         self.assertIn(code.split()[0], ["200", "201", "204"])
         # Verify binary data integrity
         self.assertEqual(resources["/binary.dat"].contents, test_data)
+
+
+class FormatDateTests(unittest.TestCase):
+    def test_format_http_date(self):
+        self.assertEqual(
+            "Fri, 01 Mar 2024 12:30:15 GMT",
+            webdav.format_http_date(datetime(2024, 3, 1, 12, 30, 15)),
+        )
+
+    def test_parse_http_date(self):
+        self.assertEqual(
+            datetime(2024, 3, 1, 12, 30, 15, tzinfo=timezone.utc),
+            webdav.parse_http_date("Fri, 01 Mar 2024 12:30:15 GMT"),
+        )
+        self.assertIsNone(webdav.parse_http_date("yesterday"))
+
+    def test_format_datetime(self):
+        self.assertEqual(
+            "2024-03-01T12:30:15Z",
+            webdav.format_datetime(
+                datetime(2024, 3, 1, 12, 30, 15, tzinfo=timezone.utc)
+            ),
+        )
@@ -22,6 +22,7 @@
 import argparse
 import asyncio
 import logging
+import os
 import sys
 from . import __version__
 from .store import STORE_TYPE_CALENDAR, STORE_TYPE_ADDRESSBOOK
@@ -110,6 +111,219 @@ async def create_collection_main(args, parser):
     return 0
 
 
+def add_import_parser(parser):
+    """Add arguments for the import subcommand."""
+    parser.add_argument(
+        "-d",
+        "--directory",
+        type=str,
+        required=True,
+        help="Root directory containing collections",
+    )
+    parser.add_argument(
+        "--name",
+        type=str,
+        required=True,
+        help="Name of the collection to import into (used as path component)",
+    )
+    parser.add_argument(
+        "--type",
+        choices=["calendar", "addressbook"],
+        help="Type of collection to create, if it does not exist yet",
+    )
+    parser.add_argument(
+        "--workers",
+        type=int,
+        default=0,
+        help="Number of worker processes to validate items in. "
+        "[%(default)s, validate in the main process]",
+    )
+    parser.add_argument(
+        "paths",
+        nargs="+",
+        help="iCalendar or vCard files, or directories (e.g. vdirs) containing them",
+    )
+
+
+def _iter_import_files(paths):
+    """Iterate over the .ics and .vcf files in a set of paths."""
+    for path in paths:
+        if os.path.isdir(path):
+            for entry in sorted(os.listdir(path)):
+                if entry.lower().endswith((".ics", ".vcf")):
+                    yield os.path.join(path, entry)
+        else:
+            yield path
+
+
+def _split_import_file(path):
+    """Split a file into items to import, one per UID.
+
+    Returns: list of (content type, data) tuples
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if path.lower().endswith(".vcf"):
+        from .vcard import split_vcards
+
+        return [("text/vcard", [card]) for card in split_vcards(data)]
+    else:
+        from icalendar.cal import Calendar
+
+        from .icalendar import split_calendar
+
+        return [
+            ("text/calendar", [cal.to_ical()])
+            for calendar in Calendar.from_ical(data, multiple=True)
+            for cal in split_calendar(calendar)
+        ]
+
+
+async def import_main(args, parser):
+    """Main function for the import subcommand."""
+    from .store import DuplicateUidError, InvalidFileContents
+    from .web import SingleUserFilesystemBackend
+
+    logger = logging.getLogger(__name__)
+
+    backend = SingleUserFilesystemBackend(args.directory)
+    collection_path = args.name
+    resource = backend.get_resource("/" + collection_path)
+    if resource is None:
+        if args.type is None:
+            logger.error(
+                f"Collection '{collection_path}' does not exist; "
+                "specify --type to create it"
+            )
+            return 1
+        resource = backend.create_collection(collection_path)
+        resource.store.set_type(
+            STORE_TYPE_CALENDAR if args.type == "calendar" else STORE_TYPE_ADDRESSBOOK
+        )
+    elif not hasattr(resource, "store"):
+        logger.error(f"'{collection_path}' is not a collection")
+        return 1
+
+    items = []
+    for path in _iter_import_files(args.paths):
+        try:
+            items.extend(
+                (None, content_type, data)
+                for (content_type, data) in _split_import_file(path)
+            )
+        except (ValueError, InvalidFileContents) as exc:
+            logger.error(f"Unable to parse {path}: {exc}")
+            return 1
+
+    try:
+        imported = resource.store.import_many(items, workers=args.workers)
+    except InvalidFileContents as exc:
+        logger.error(f"Unable to import: {exc}")
+        return 1
+    except DuplicateUidError as exc:
+        logger.error(
+            f"Unable to import: UID {exc.uid} is used by both "
+            f"{exc.existing_name} and {exc.new_name}"
+        )
+        return 1
+    finally:
+        resource.store.repo.close()
+
+    logger.info(f"Imported {len(imported)} items into {collection_path}")
+    return 0
+
+
+def add_maintenance_parser(parser):
+    """Add arguments for the maintenance subcommand."""
+    parser.add_argument(
+        "-d",
+        "--directory",
+        type=str,
+        required=True,
+        help="Root directory containing collections",
+    )
+    parser.add_argument(
+        "--min-loose-objects",
+        type=int,
+        default=0,
+        help="Only pack collections with at least this many loose objects. "
+        "[%(default)s]",
+    )
+    parser.add_argument(
+        "--object-pool",
+        action="store_true",
+        help="Also move objects that are kept in several collections into "
+        "a pool shared by all collections.",
+    )
+
+
+async def maintenance_main(args, parser):
+    """Main function for the maintenance subcommand."""
+    from .fs import maintain_stores, share_store_objects
+
+    logger = logging.getLogger(__name__)
+
+    total_objects = 0
+    total_bytes = 0
+    for path, stats in maintain_stores(args.directory, args.min_loose_objects):
+        if stats.objects_packed:
+            logger.info(
+                f"{path}: packed {stats.objects_packed} objects, "
+                f"reclaimed {stats.bytes_reclaimed} bytes"
+            )
+        total_objects += stats.objects_packed
+        total_bytes += stats.bytes_reclaimed
+    logger.info(f"Packed {total_objects} objects, reclaimed {total_bytes} bytes")
+    if args.object_pool:
+        total_objects = 0
+        total_bytes = 0
+        for path, stats in share_store_objects(args.directory):
+            logger.info(
+                f"{path}: moved {stats.objects_packed} objects into the pool, "
+                f"reclaimed {stats.bytes_reclaimed} bytes"
+            )
+            total_objects += stats.objects_packed
+            total_bytes += stats.bytes_reclaimed
+        logger.info(
+            f"Moved {total_objects} objects into the pool, "
+            f"reclaimed {total_bytes} bytes"
+        )
+    return 0
+
+
+def add_layout_parser(parser):
+    """Add arguments for the layout subcommand."""
+    from .store.git import LAYOUTS
+
+    parser.add_argument(
+        "-d",
+        "--directory",
+        type=str,
+        required=True,
+        help="Root directory containing collections",
+    )
+    parser.add_argument(
+        "layout",
+        choices=LAYOUTS,
+        help="Tree layout to use: flat, or sharded into subtrees so that "
+        "writes to large collections are cheaper",
+    )
+
+
+async def layout_main(args, parser):
+    """Main function for the layout subcommand."""
+    from .fs import set_store_layouts
+
+    logger = logging.getLogger(__name__)
+
+    count = 0
+    for path in set_store_layouts(args.directory, args.layout):
+        logger.info(f"{path}: changed layout to {args.layout}")
+        count += 1
+    logger.info(f"Changed layout of {count} collections")
+    return 0
+
+
 async def main(argv):
     # For now, just invoke xandikos.web
     from . import web
@@ -134,6 +348,21 @@ async def main(argv):
     )
     add_create_collection_parser(create_parser)
 
+    import_parser = subparsers.add_parser(
+        "import", help="Import iCalendar or vCard files into a collection"
+    )
+    add_import_parser(import_parser)
+
+    maintenance_parser = subparsers.add_parser(
+        "maintenance", help="Pack loose git objects in all collections"
+    )
+    add_maintenance_parser(maintenance_parser)
+
+    layout_parser = subparsers.add_parser(
+        "layout", help="Change the tree layout of bare git collections"
+    )
+    add_layout_parser(layout_parser)
+
     multi_user_parser = subparsers.add_parser(
         "multi-user",
         usage="%(prog)s -d ROOT-DIR [OPTIONS]",
@@ -151,6 +380,15 @@ async def main(argv):
         # Configure logging for create-collection subcommand
         logging.basicConfig(level=logging.INFO, format="%(message)s")
         return await create_collection_main(args, parser)
+    elif args.subcommand == "import":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        return await import_main(args, parser)
+    elif args.subcommand == "maintenance":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        return await maintenance_main(args, parser)
+    elif args.subcommand == "layout":
+        logging.basicConfig(level=logging.INFO, format="%(message)s")
+        return await layout_main(args, parser)
     elif args.subcommand == "help":
         parser.print_help()
         return 0
@@ -23,7 +23,6 @@ https://tools.ietf.org/html/rfc4791
 """
 
 import datetime
-import itertools
 import logging
 from collections.abc import Collection
 from zoneinfo import ZoneInfo
@@ -198,7 +197,7 @@ class Calendar(webdav.Collection):
         Args:
           create_filter_fn: Callback that constructs a
             filter; takes a filter building class.
-        Returns: Iterator over name, resource objects
+        Returns: AsyncIterator over name, resource objects
         """
         raise NotImplementedError(self.calendar_query)
 
@@ -621,11 +620,11 @@ class CalendarQueryReporter(webdav.Reporter):
         def filter_fn(cls):
             return parse_filter(filter_el, cls(tz))
 
-        def members(collection):
-            return itertools.chain(
-                collection.calendar_query(filter_fn),
-                collection.subcollections(),
-            )
+        async def members(collection):
+            async for member in collection.calendar_query(filter_fn):
+                yield member
+            for member in collection.subcollections():
+                yield member
 
         async for href, resource in webdav.traverse_resource(
             base_resource, base_href, depth, members=members
@@ -22,8 +22,6 @@
 https://tools.ietf.org/html/rfc6352
 """
 
-import itertools
-
 from . import collation as _mod_collation
 from . import davcommon, webdav
 
@@ -438,11 +436,11 @@ class AddressbookQueryReporter(webdav.Reporter):
         def filter_fn(cls):
             return parse_filter(filter_el, cls())
 
-        def members(collection):
-            return itertools.chain(
-                collection.addressbook_query(filter_fn),
-                collection.subcollections(),
-            )
+        async def members(collection):
+            async for member in collection.addressbook_query(filter_fn):
+                yield member
+            for member in collection.subcollections():
+                yield member
 
         i = 0
         async for href, resource in webdav.traverse_resource(
@@ -19,29 +19,220 @@
 
 """Filesystem-based backend base class."""
 
+import collections
 import functools
 import os
 import shutil
+import threading
+import time
+from collections.abc import Iterator
+from logging import getLogger
+
+import dulwich.repo
 
 from xandikos import webdav
 from xandikos.icalendar import ICalendarFile
-from xandikos.store import start_eager_indexing
-from xandikos.store.git import GitStore
+from xandikos.store import (
+    DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+    LockedError,
+    NotStoreError,
+    start_eager_indexing,
+)
+from xandikos.store.git import (
+    DEFAULT_MAINTENANCE_LOOSE_OBJECTS,
+    BareGitStore,
+    GitStore,
+    MaintenanceStats,
+    open_object_pool,
+)
+from xandikos.store.index import DEFAULT_INDEX_BACKEND
 from xandikos.vcard import VCardFile
 
 STORE_CACHE_SIZE = 128
 
+# Name of the directory in the root directory that keeps the pool of git
+# objects shared between collections.
+OBJECT_POOL_DIRNAME = ".xandikos-objects"
+
+# Number of collections an object needs to be kept in before maintenance
+# moves it into the shared object pool.
+DEFAULT_OBJECT_POOL_MIN_STORES = 2
+
+logger = getLogger("xandikos")
+
 
 @functools.lru_cache(maxsize=STORE_CACHE_SIZE)
-def open_store_from_path(path: str, *, eager_indexing: bool = False, **kwargs):
-    store = GitStore.open_from_path(path, **kwargs)
+def open_store_from_path(
+    path: str,
+    *,
+    eager_indexing: bool = False,
+    eager_workers: int = 0,
+    eager_batch_size: int = DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+    index_backend: str = DEFAULT_INDEX_BACKEND,
+    text_index_properties: tuple[str, ...] = (),
+    **kwargs,
+):
+    store = GitStore.open_from_path(path, index_backend=index_backend, **kwargs)
     store.load_extra_file_handler(ICalendarFile)
     store.load_extra_file_handler(VCardFile)
+    if text_index_properties:
+        store.enable_text_index(text_index_properties)
     if eager_indexing:
-        start_eager_indexing(store)
+        start_eager_indexing(store, eager_workers, eager_batch_size)
     return store
 
 
+def _iter_stores(path: str) -> Iterator[tuple[str, GitStore]]:
+    """Iterate over the git stores under a directory.
+
+    Each store is closed once the caller moves on to the next one.
+
+    Args:
+      path: Directory to look for stores in
+    Returns: iterator over (store path, store) tuples
+    """
+    for dirpath, dirnames, filenames in os.walk(path):
+        dirnames.sort()
+        try:
+            store = GitStore.open_from_path(dirpath)
+        except NotStoreError:
+            continue
+        try:
+            if store.repo.bare:
+                # Bare repositories don't contain other stores.
+                dirnames[:] = []
+            elif dulwich.repo.CONTROLDIR in dirnames:
+                dirnames.remove(dulwich.repo.CONTROLDIR)
+            yield (dirpath, store)
+        finally:
+            store.repo.close()
+
+
+def maintain_stores(
+    path: str, min_loose_objects: int = 0
+) -> Iterator[tuple[str, MaintenanceStats]]:
+    """Pack loose objects in all git stores under a directory.
+
+    Stores that are being written to are skipped.
+
+    Args:
+      path: Directory to look for stores in
+      min_loose_objects: Only pack objects in stores with at least this
+        many loose objects
+    Returns: iterator over (store path, MaintenanceStats) tuples
+    """
+    for dirpath, store in _iter_stores(path):
+        try:
+            stats = store.maintain(min_loose_objects)
+        except LockedError:
+            logger.info("Skipping maintenance of locked store %s.", dirpath)
+            continue
+        yield (dirpath, stats)
+
+
+def share_store_objects(
+    path: str, min_stores: int = DEFAULT_OBJECT_POOL_MIN_STORES
+) -> Iterator[tuple[str, MaintenanceStats]]:
+    """Move objects kept in several git stores into a shared object pool.
+
+    The pool lives in OBJECT_POOL_DIRNAME under the directory. Stores that
+    don't use the pool yet are set up to use it, if they have any objects
+    to move into it. Stores that are being written to are skipped.
+
+    Args:
+      path: Directory to look for stores in
+      min_stores: Number of stores an object needs to be kept in before
+        it is moved into the pool
+    Returns: iterator over (store path, MaintenanceStats) tuples
+    """
+    pool_path = os.path.join(path, OBJECT_POOL_DIRNAME)
+    counts: collections.Counter[bytes] = collections.Counter()
+    for dirpath, store in _iter_stores(path):
+        counts.update(set(store.iter_own_objects()))
+    common = {sha for (sha, count) in counts.items() if count >= min_stores}
+    del counts
+    pool = open_object_pool(pool_path)
+    for dirpath, store in _iter_stores(path):
+        shas = {sha for sha in store.iter_own_objects() if sha in common or sha in pool}
+        if not shas:
+            continue
+        try:
+            stats = store.share_objects(pool_path, shas)
+        except LockedError:
+            logger.info("Skipping sharing objects of locked store %s.", dirpath)
+            continue
+        yield (dirpath, stats)
+
+
+def set_store_layouts(path: str, layout: str) -> Iterator[str]:
+    """Change the tree layout of all bare git stores under a directory.
+
+    Args:
+      path: Directory to look for stores in
+      layout: New layout (one of LAYOUTS)
+    Returns: iterator over paths of the stores that were changed
+    """
+    for dirpath, store in _iter_stores(path):
+        if not isinstance(store, BareGitStore) or store.layout == layout:
+            continue
+        store.set_layout(layout)
+        yield dirpath
+
+
+def _run_maintenance(
+    path: str, interval: float, min_loose_objects: int, share_objects: bool
+) -> None:
+    while True:
+        time.sleep(interval)
+        try:
+            for store_path, stats in maintain_stores(path, min_loose_objects):
+                if stats.objects_packed:
+                    logger.info(
+                        "Packed %d loose objects in %s, reclaiming %d bytes.",
+                        stats.objects_packed,
+                        store_path,
+                        stats.bytes_reclaimed,
+                    )
+            if share_objects:
+                for store_path, stats in share_store_objects(path):
+                    logger.info(
+                        "Moved %d objects from %s into the shared pool, "
+                        "reclaiming %d bytes.",
+                        stats.objects_packed,
+                        store_path,
+                        stats.bytes_reclaimed,
+                    )
+        except Exception:
+            logger.exception("Maintenance of stores in %s failed", path)
+
+
+def start_maintenance(
+    path: str,
+    interval: float,
+    min_loose_objects: int = DEFAULT_MAINTENANCE_LOOSE_OBJECTS,
+    share_objects: bool = False,
+) -> threading.Thread:
+    """Start a background thread that periodically packs loose objects.
+
+    Args:
+      path: Directory to look for stores in
+      interval: Number of seconds between maintenance runs
+      min_loose_objects: Only pack objects in stores with at least this
+        many loose objects
+      share_objects: Whether to also move objects that are kept in
+        several stores into the shared object pool
+    Returns: The background thread performing the maintenance
+    """
+    thread = threading.Thread(
+        target=_run_maintenance,
+        args=(path, interval, min_loose_objects, share_objects),
+        name="git-maintenance",
+        daemon=True,
+    )
+    thread.start()
+    return thread
+
+
 class FilesystemBackend(webdav.Backend):
     """A backend that stores data on the local filesystem.
 
@@ -19,6 +19,9 @@
 
 """ICalendar file handling."""
 
+import functools
+import math
+import re
 from logging import getLogger
 from collections.abc import Iterable
 from datetime import date, datetime, time, timedelta, timezone
@@ -72,6 +75,33 @@ MAX_EXPANSION_TIME = datetime(
 # Following sabre/dav and Stalwart's approach of limiting to ~3000 instances
 MAX_RECURRENCE_INSTANCES = 3000
 
+# Maximum number of compiled sets of index keys to keep.
+INDEX_TRIE_CACHE_SIZE = 16
+
+# Maximum number of compiled recurrence rules to keep for index-based
+# time-range matching.
+RRULE_CACHE_SIZE = 1024
+
+
+# Properties that determine the time range covered by a component, for
+# the components that time ranges are derived for from index values. These
+# match the keys used by ComponentTimeRangeMatcher.index_keys.
+TIME_RANGE_INDEX_PROPERTIES = {
+    "VEVENT": ["DTSTART", "DTEND", "DURATION", "RRULE"],
+    "VTODO": ["DTSTART", "DUE", "DURATION", "CREATED", "COMPLETED", "RRULE"],
+    "VJOURNAL": ["DTSTART"],
+}
+
+# Components whose properties can be covered by a text index.
+TEXT_INDEX_COMPONENTS = ("VEVENT", "VTODO", "VJOURNAL")
+
+# Escape sequences in TEXT values, see RFC5545 section 3.3.11.
+_TEXT_ESCAPE_RE = re.compile(r"\\([\\;,nN])")
+
+# Floating times and dates can be interpreted in any timezone, so their
+# time ranges are widened by a day (more than any UTC offset) on each side.
+_FLOATING_TIME_SLACK = 86400.0
+
 
 # Based on RFC5545 section 3.3.11, CONTROL = %x00-08 / %x0A-1F / %x7F
 # Control characters are forbidden in TEXT values, EXCEPT:
@@ -625,6 +655,9 @@ class PropertyTimeRangeMatcher:
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self.start!r}, {self.end!r})"
 
+    def cache_key(self) -> tuple:
+        return ("time-range", self.start, self.end)
+
     def match(self, prop, tzify):
         dt = tzify(prop.dt)
         return dt >= self.start and dt <= self.end
@@ -683,6 +716,9 @@ class ComponentTimeRangeMatcher:
         else:
             return f"{self.__class__.__name__}({self.start!r}, {self.end!r})"
 
+    def cache_key(self) -> tuple:
+        return ("time-range", self.start, self.end, self.comp)
+
     def match(self, comp: Component, tzify: TzifyFunction):
         if comp.name is None:
             raise ValueError("Component has no name in time-range filter")
@@ -819,15 +855,21 @@ class ComponentTimeRangeMatcher:
         assert isinstance(rrule_value, bytes)
         assert isinstance(dtstart_value, bytes)
 
+        duration_values = indexes.get("P=DURATION", [])
+        dtend_values = indexes.get("P=DTEND", [])
+        due_values = indexes.get("P=DUE", [])
+        duration_value = duration_values[0] if duration_values else None
+        # Check DTEND (for VEVENT) or DUE (for VTODO)
+        end_values = dtend_values if (dtend_values and dtend_values[0]) else due_values
+        end_value = end_values[0] if end_values else None
+
         try:
-            rrule_str = decode_bytes(rrule_value, "RRULE")
-            dtstart_str = decode_bytes(dtstart_value, "DTSTART")
-
-            # Parse DTSTART and create rrule
-            dtstart_parsed = vDDDTypes.from_ical(dtstart_str)
-            # Normalize UNTIL to be UTC if dtstart is timezone-aware
-            rrule_str = _normalize_rrule_until(rrule_str, dtstart_parsed)
-            rrule = dateutil.rrule.rrulestr(rrule_str, dtstart=dtstart_parsed)
+            (rrule, dtstart_parsed, event_duration) = _compile_index_rrule(
+                rrule_value,
+                dtstart_value,
+                duration_value if isinstance(duration_value, bytes) else None,
+                end_value if isinstance(end_value, bytes) else None,
+            )
         except (TypeError, ValueError) as e:
             # If RRULE parsing fails, log with context and return False
             uid_values = indexes.get("P=UID", [])
@@ -857,11 +899,6 @@ class ComponentTimeRangeMatcher:
             logger.warning("unknown component %r in time-range filter", self.comp)
             return False
 
-        # Calculate event duration for boundary adjustment
-        event_duration = self._calculate_event_duration(
-            indexes, dtstart_parsed, decode_bytes
-        )
-
         # Generate occurrences within the time range. Clamp to MIN_EXPANSION_TIME
         # so an open-start query (start at year 1) plus any positive duration
         # does not overflow datetime.
@@ -880,39 +917,9 @@ class ComponentTimeRangeMatcher:
             event_duration,
             component_handler,
             tzify,
-            decode_bytes,
             dtstart_parsed=dtstart_parsed,
         )
 
-    def _calculate_event_duration(
-        self, indexes: SubIndexDict, dtstart_parsed, decode_bytes
-    ):
-        """Calculate event duration from DURATION, DTEND, or DUE properties."""
-        duration_values = indexes.get("P=DURATION", [])
-        dtend_values = indexes.get("P=DTEND", [])
-        due_values = indexes.get("P=DUE", [])
-
-        if duration_values and duration_values[0]:
-            duration_value = duration_values[0]
-            if isinstance(duration_value, bytes):
-                duration_str = decode_bytes(duration_value, "DURATION")
-                return vDuration.from_ical(duration_str)
-
-        # Check DTEND (for VEVENT) or DUE (for VTODO)
-        end_values = dtend_values if (dtend_values and dtend_values[0]) else due_values
-        if end_values and end_values[0]:
-            end_value = end_values[0]
-            if isinstance(end_value, bytes):
-                end_str = decode_bytes(
-                    end_value, "DTEND" if end_values is dtend_values else "DUE"
-                )
-                end_parsed_val = vDDDTypes.from_ical(end_str)
-                if isinstance(dtstart_parsed, datetime) and isinstance(
-                    end_parsed_val, datetime
-                ):
-                    return end_parsed_val - dtstart_parsed
-        return None
-
     def _get_occurrences_in_range(self, rrule, dtstart_parsed, query_start, query_end):
         """Generate RRULE occurrences within the specified time range."""
         # Normalize query bounds to match the original DTSTART type/timezone
@@ -953,7 +960,6 @@ class ComponentTimeRangeMatcher:
         event_duration,
         component_handler,
         tzify,
-        decode_bytes,
         dtstart_parsed: date | datetime | None = None,
     ):
         """Test each occurrence against the time range filter."""
@@ -978,11 +984,8 @@ class ComponentTimeRangeMatcher:
 
             # Add DTEND/DUE or DURATION to the occurrence
             if duration_values and duration_values[0]:
-                duration_value = duration_values[0]
-                if isinstance(duration_value, bytes):
-                    duration_str = decode_bytes(duration_value, "DURATION")
-                    duration_obj = vDuration.from_ical(duration_str)
-                    occurrence_dict["DURATION"] = MockProperty(duration_obj)
+                # The event duration was parsed from DURATION
+                occurrence_dict["DURATION"] = MockProperty(event_duration)
             elif event_duration:
                 # Use DUE for VTODO, DTEND for other components
                 end_prop = "DUE" if self.comp == "VTODO" else "DTEND"
@@ -1034,6 +1037,7 @@ class TextMatcher:
         self.text = text
         if collation is None:
             collation = "i;ascii-casemap"
+        self.collation_name = collation
         self.collation = _mod_collation.get_collation(collation)
         self.negate_condition = negate_condition
         self.match_type = match_type
@@ -1044,6 +1048,16 @@ class TextMatcher:
             f"collation={self.collation!r}, negate_condition={self.negate_condition!r})"
         )
 
+    def cache_key(self) -> tuple:
+        return (
+            "text-match",
+            self.name,
+            self.text,
+            self.collation_name,
+            self.negate_condition,
+            self.match_type,
+        )
+
     def match_indexes(self, indexes: SubIndexDict):
         return any(
             self.match(self.type_fn(self.type_fn.from_ical(k))) for k in indexes[None]
@@ -1085,6 +1099,15 @@ class ComponentFilter:
             f"is_not_defined={self.is_not_defined!r}, time_range={self.time_range!r})"
         )
 
+    def cache_key(self) -> tuple:
+        return (
+            self.__class__.__name__,
+            self.name,
+            self.is_not_defined,
+            self.time_range.cache_key() if self.time_range is not None else None,
+            tuple(child.cache_key() for child in self.children),
+        )
+
     def filter_subcomponent(
         self,
         name: str,
@@ -1219,6 +1242,28 @@ class ComponentFilter:
 
         return True
 
+    def index_text_matches(self, prefix: str) -> list[tuple[IndexKey, str]]:
+        """Return strings that matching components contain.
+
+        Args:
+          prefix: Index key prefix for this component
+        Returns: list of (index key, text) tuples
+        """
+        ret = []
+        for child in self.children:
+            if child.is_not_defined:
+                continue
+            if isinstance(child, ComponentFilter):
+                ret.extend(child.index_text_matches(prefix + "/C=" + child.name))
+            elif isinstance(child, PropertyFilter):
+                for matcher in child.children:
+                    if (
+                        isinstance(matcher, TextMatcher)
+                        and not matcher.negate_condition
+                    ):
+                        ret.append((prefix + "/P=" + child.name, matcher.text))
+        return ret
+
     def index_keys(self):
         mine = "C=" + self.name
         for child in self.children + ([self.time_range] if self.time_range else []):
@@ -1247,6 +1292,15 @@ class PropertyFilter:
             f"is_not_defined={self.is_not_defined!r}, time_range={self.time_range!r})"
         )
 
+    def cache_key(self) -> tuple:
+        return (
+            self.__class__.__name__,
+            self.name,
+            self.is_not_defined,
+            self.time_range.cache_key() if self.time_range is not None else None,
+            tuple(child.cache_key() for child in self.children),
+        )
+
     def filter_parameter(
         self, name: str, is_not_defined: bool = False
     ) -> "ParameterFilter":
@@ -1353,6 +1407,14 @@ class ParameterFilter:
         self.is_not_defined = is_not_defined
         self.children = children or []
 
+    def cache_key(self) -> tuple:
+        return (
+            self.__class__.__name__,
+            self.name,
+            self.is_not_defined,
+            tuple(child.cache_key() for child in self.children),
+        )
+
     def filter_text_match(
         self,
         text: str,
@@ -1403,12 +1465,73 @@ class ParameterFilter:
         return True
 
 
+def _index_value_time_range(value: bytes) -> tuple[float, float]:
+    """Return the range of UTC timestamps a DATE or DATE-TIME may refer to."""
+    dt = vDDDTypes.from_ical(value.decode("utf-8"))
+    if isinstance(dt, datetime):
+        if dt.tzinfo is not None:
+            ts = dt.timestamp()
+            return (ts, ts)
+        ts = dt.replace(tzinfo=timezone.utc).timestamp()
+        return (ts - _FLOATING_TIME_SLACK, ts + _FLOATING_TIME_SLACK)
+    elif isinstance(dt, date):
+        ts = datetime.combine(dt, time(), timezone.utc).timestamp()
+        return (
+            ts - _FLOATING_TIME_SLACK,
+            ts + timedelta(1).total_seconds() + _FLOATING_TIME_SLACK,
+        )
+    raise ValueError(f"not a date or date-time: {value!r}")
+
+
+def _component_time_range(
+    count: int, values: dict[str, list[bytes]], component: str
+) -> tuple[float, float]:
+    """Compute a range covering all time ranges of a set of components.
+
+    Args:
+      count: Number of components
+      values: Dictionary mapping property names to index values
+      component: Component name
+    Returns: tuple with start and end UTC timestamp
+    """
+    start_ranges = [_index_value_time_range(v) for v in values.get("DTSTART", [])]
+    ranges = list(start_ranges)
+    for prop in ("DTEND", "DUE", "CREATED", "COMPLETED"):
+        ranges.extend(_index_value_time_range(v) for v in values.get(prop, []))
+    if not ranges:
+        return (-math.inf, math.inf)
+    start = min(r[0] for r in ranges)
+    end = max(r[1] for r in ranges)
+    durations = [
+        vDuration.from_ical(v.decode("utf-8")).total_seconds()
+        for v in values.get("DURATION", [])
+    ]
+    if start_ranges and durations:
+        end = max(end, max(r[1] for r in start_ranges) + max(durations))
+    if any(values.get("RRULE", [])):
+        end = math.inf
+    # Index values are not grouped by component, so allow for components
+    # that lack the properties which bound them (see RFC4791, section 9.9).
+    counts = {prop: len(values.get(prop, [])) for prop in values}
+    if component == "VTODO":
+        if count > max(counts["DTSTART"], counts["DUE"], counts["COMPLETED"]):
+            end = math.inf
+        if count > max(
+            counts["DTSTART"], counts["DUE"], counts["COMPLETED"], counts["CREATED"]
+        ):
+            start = -math.inf
+    elif count > counts["DTSTART"]:
+        return (-math.inf, math.inf)
+    return (start, end)
+
+
 class CalendarFilter(Filter):
     """A filter that works on ICalendar files."""
 
     content_type = "text/calendar"
 
     def __init__(self, default_timezone: str | timezone) -> None:
+        self.default_timezone = default_timezone
         self.tzify = lambda dt: as_tz_aware_ts(dt, default_timezone)
         self.children: list[ComponentFilter] = []
 
@@ -1484,6 +1607,62 @@ class CalendarFilter(Filter):
             result.extend(child.index_keys())
         return result
 
+    def index_components(self) -> list[tuple[IndexKey, bool]] | None:
+        if not self.children:
+            return None
+        ret = []
+        for child in self.children:
+            if (
+                child.name != "VCALENDAR"
+                or child.is_not_defined
+                or child.time_range is not None
+            ):
+                return None
+            if not child.children:
+                ret.append(("C=VCALENDAR", True))
+            for sub in child.children:
+                if (
+                    not isinstance(sub, ComponentFilter)
+                    or sub.is_not_defined
+                    or sub.time_range is not None
+                    or sub.children
+                ):
+                    return None
+                ret.append(("C=VCALENDAR/C=" + sub.name, True))
+        return ret
+
+    def index_text_matches(self) -> list[tuple[IndexKey, str]]:
+        ret = []
+        for child in self.children:
+            if not child.is_not_defined:
+                ret.extend(child.index_text_matches("C=" + child.name))
+        return ret
+
+    def index_time_range(self) -> tuple[str, datetime, datetime] | None:
+        for child in self.children:
+            if child.name != "VCALENDAR" or child.is_not_defined:
+                continue
+            for sub in child.children:
+                if (
+                    isinstance(sub, ComponentFilter)
+                    and not sub.is_not_defined
+                    and sub.time_range is not None
+                    and sub.name in TIME_RANGE_INDEX_PROPERTIES
+                ):
+                    return (
+                        sub.name,
+                        self.tzify(sub.time_range.start),
+                        self.tzify(sub.time_range.end),
+                    )
+        return None
+
+    def cache_key(self) -> tuple:
+        # Floating times are interpreted in the default timezone.
+        return (
+            self.default_timezone,
+            tuple(child.cache_key() for child in self.children),
+        )
+
     def __repr__(self) -> str:
         return f"{self.__class__.__name__}({self.children!r})"
 
@@ -1513,6 +1692,64 @@ class ICalendarFile(File):
             "C=VCALENDAR/C=VJOURNAL/P=DTSTART",
         ]
 
+    @classmethod
+    def text_index_keys(cls, properties: Iterable[str]) -> list[IndexKey]:
+        return [
+            f"C=VCALENDAR/C={component}/P={prop.upper()}"
+            for component in TEXT_INDEX_COMPONENTS
+            for prop in properties
+        ]
+
+    @classmethod
+    def index_value_texts(cls, key: IndexKey, value: bytes) -> list[str]:
+        # Index values hold the escaped form of the property value; the
+        # index-based and parsed text matching see the escaped and
+        # unescaped text respectively, so return both.
+        text = value.decode("utf-8")
+        unescaped = _TEXT_ESCAPE_RE.sub(
+            lambda m: "\n" if m.group(1) in "nN" else m.group(1), text
+        )
+        if unescaped == text:
+            return [text]
+        return [text, unescaped]
+
+    @classmethod
+    def time_ranges_from_indexes(
+        cls, indexes: IndexDict
+    ) -> dict[str, list[tuple[float, float]]]:
+        ret: dict[str, list[tuple[float, float]]] = {}
+        for component, props in TIME_RANGE_INDEX_PROPERTIES.items():
+            prefix = "C=VCALENDAR/C=" + component
+            try:
+                count = len(indexes[prefix])
+                values = {
+                    prop: [
+                        v
+                        for v in indexes[prefix + "/P=" + prop]
+                        if isinstance(v, bytes)
+                    ]
+                    for prop in props
+                }
+            except KeyError:
+                continue
+            if not count:
+                ret[component] = []
+                continue
+            try:
+                ret[component] = [_component_time_range(count, values, component)]
+            except ValueError as e:
+                logger.debug("Unable to derive time range from %r: %s", values, e)
+                ret[component] = [(-math.inf, math.inf)]
+        return ret
+
+    @classmethod
+    def components_from_indexes(cls, indexes: IndexDict) -> dict[IndexKey, bool]:
+        return {
+            key: bool(value)
+            for (key, value) in indexes.items()
+            if all(segment.startswith("C=") for segment in key.split("/"))
+        }
+
     def __init__(self, content, content_type) -> None:
         super().__init__(content, content_type)
         self._calendar = None
@@ -1639,31 +1876,133 @@ class ICalendarFile(File):
                 yield True
             elif segments[0].startswith("P="):
                 assert len(segments) == 1
-                prop_name = segments[0][2:]
-                try:
-                    p = c[prop_name]
-                except KeyError:
-                    pass
-                else:
-                    if p is not None:
-                        ical = p.to_ical()
-                        # Special handling for VALARM TRIGGER property
-                        if (
-                            c.name == "VALARM"
-                            and prop_name == "TRIGGER"
-                            and parent is not None
-                            and isinstance(p.dt, timedelta)
-                        ):
-                            # Create enriched VALARM to get absolute trigger time.
-                            # This ensures index values match what the filter will see,
-                            # preventing "index based filter not matching real file filter" errors.
-                            enriched = _create_enriched_valarm(c, parent)
-                            if "TRIGGER" in enriched:
-                                ical = enriched["TRIGGER"].to_ical()
-                        yield ical
+                ical = _get_property_index_value(c, segments[0][2:], parent)
+                if ical is not None:
+                    yield ical
             else:
                 raise AssertionError(f"segments: {segments!r}")
 
+    def get_indexes(self, keys: Iterable[IndexKey]) -> IndexDict:
+        """Obtain indexes for this file.
+
+        All keys that consist of component segments optionally followed by
+        a single property segment are combined into a trie, so that the
+        calendar only has to be walked once. Any other keys are handled
+        one at a time by _get_index.
+
+        Args:
+          keys: Iterable of index keys
+        Returns: Dictionary mapping key names to values
+        """
+        keys = tuple(keys)
+        (root, other_keys) = _compile_index_trie(keys)
+        ret: IndexDict = {key: [] for key in keys}
+        if root.components:
+            _walk_index_trie(self.calendar, root, None, ret)
+        for key in other_keys:
+            ret[key] = list(self._get_index(key))
+        return ret
+
+
+def _get_property_index_value(
+    comp: Component, prop_name: str, parent: Component | None
+) -> bytes | None:
+    """Return the index value for a property of a component, if set."""
+    try:
+        p = comp[prop_name]
+    except KeyError:
+        return None
+    if p is None:
+        return None
+    ical = p.to_ical()
+    # Special handling for VALARM TRIGGER property
+    if (
+        comp.name == "VALARM"
+        and prop_name == "TRIGGER"
+        and parent is not None
+        and isinstance(p.dt, timedelta)
+    ):
+        # Create enriched VALARM to get absolute trigger time.
+        # This ensures index values match what the filter will see,
+        # preventing "index based filter not matching real file filter" errors.
+        enriched = _create_enriched_valarm(comp, parent)
+        if "TRIGGER" in enriched:
+            ical = enriched["TRIGGER"].to_ical()
+    return ical
+
+
+class _IndexTrieNode:
+    """Node in a trie of index keys, for a component segment."""
+
+    def __init__(self) -> None:
+        # Child nodes, by component name
+        self.components: dict[str, _IndexTrieNode] = {}
+        # (property name, key) tuples for keys ending in a property
+        self.properties: list[tuple[str, IndexKey]] = []
+        # Keys ending in this component
+        self.keys: list[IndexKey] = []
+
+
+@functools.lru_cache(maxsize=INDEX_TRIE_CACHE_SIZE)
+def _compile_index_trie(
+    keys: tuple[IndexKey, ...],
+) -> tuple[_IndexTrieNode, list[IndexKey]]:
+    """Compile a set of index keys into a trie.
+
+    Args:
+      keys: Index keys
+    Returns: tuple with root node of the trie and list of keys that
+      could not be added to it
+    """
+    root = _IndexTrieNode()
+    other_keys = []
+    for key in dict.fromkeys(keys):
+        segments = key.split("/")
+        if not all(s.startswith("C=") for s in segments[:-1]) or not (
+            segments[-1].startswith("C=") or segments[-1].startswith("P=")
+        ):
+            other_keys.append(key)
+            continue
+        node = root
+        for segment in segments[:-1]:
+            node = node.components.setdefault(segment[2:], _IndexTrieNode())
+        if segments[-1].startswith("C="):
+            node.components.setdefault(segments[-1][2:], _IndexTrieNode()).keys.append(
+                key
+            )
+        else:
+            node.properties.append((segments[-1][2:], key))
+    return (root, other_keys)
+
+
+def _walk_index_trie(
+    comp: Component,
+    node: _IndexTrieNode,
+    parent: Component | None,
+    ret: IndexDict,
+) -> None:
+    """Collect the index values for all keys in a trie, depth-first.
+
+    Values for each key end up in the same order as the breadth-first
+    search in ICalendarFile._get_index, since all matches for a key are
+    at the same depth.
+    """
+    if comp.name is None:
+        return
+    try:
+        child = node.components[comp.name]
+    except KeyError:
+        return
+    for key in child.keys:
+        ret[key].append(True)
+    for prop_name, key in child.properties:
+        ical = _get_property_index_value(comp, prop_name, parent)
+        if ical is not None:
+            ret[key].append(ical)
+    if child.components:
+        for sub in comp.subcomponents:
+            _walk_index_trie(sub, child, comp, ret)
+
 
 def as_tz_aware_ts(dt: datetime | date, default_timezone: str | timezone) -> datetime:
     if not getattr(dt, "time", None):
@@ -1795,6 +2134,42 @@ def _normalize_rrule_until(rrule_str: str, dtstart: date | datetime) -> str:
     return rrule_str
 
 
+@functools.lru_cache(maxsize=RRULE_CACHE_SIZE)
+def _compile_index_rrule(
+    rrule_value: bytes,
+    dtstart_value: bytes,
+    duration_value: bytes | None,
+    end_value: bytes | None,
+) -> tuple[dateutil.rrule.rrulebase, date | datetime, timedelta | None]:
+    """Compile the recurrence rule for a component from its index values.
+
+    Results are cached, since the same recurring components are matched
+    by every time-range query; cache_info() reports hits and misses.
+
+    Args:
+      rrule_value: RRULE index value
+      dtstart_value: DTSTART index value
+      duration_value: DURATION index value, if any
+      end_value: DTEND or DUE index value, if any
+    Returns: tuple with rrule, parsed DTSTART and event duration (or None)
+    :raise ValueError: If any of the values can not be parsed
+    """
+    dtstart_parsed = vDDDTypes.from_ical(dtstart_value.decode("utf-8"))
+    # Normalize UNTIL to be UTC if dtstart is timezone-aware
+    rrule_str = _normalize_rrule_until(rrule_value.decode("utf-8"), dtstart_parsed)
+    rrule = dateutil.rrule.rrulestr(rrule_str, dtstart=dtstart_parsed)
+
+    # Calculate event duration for boundary adjustment
+    event_duration = None
+    if duration_value:
+        event_duration = vDuration.from_ical(duration_value.decode("utf-8"))
+    elif end_value:
+        end_parsed = vDDDTypes.from_ical(end_value.decode("utf-8"))
+        if isinstance(dtstart_parsed, datetime) and isinstance(end_parsed, datetime):
+            event_duration = end_parsed - dtstart_parsed
+    return (rrule, dtstart_parsed, event_duration)
+
+
 def rruleset_from_comp(comp: Component) -> dateutil.rrule.rruleset:
     dtstart = comp["DTSTART"].dt
     rrulestr = comp["RRULE"].to_ical().decode("utf-8")
@@ -2329,6 +2704,57 @@ def limit_calendar_freebusy_set(
     return outcal
 
 
+def _referenced_tzids(comp: Component) -> set[str]:
+    """Return the TZIDs referenced by the properties of a component."""
+    tzids = set()
+    for subcomp in comp.walk():
+        for value in subcomp.values():
+            for v in value if isinstance(value, list) else [value]:
+                params = getattr(v, "params", None)
+                if params is not None and "TZID" in params:
+                    tzids.add(str(params["TZID"]))
+    return tzids
+
+
+def split_calendar(calendar: Calendar) -> list[Calendar]:
+    """Split a calendar into one calendar per UID.
+
+    Components that share a UID (e.g. a recurring event and its
+    overridden instances) end up in the same calendar, together with the
+    VTIMEZONE components they reference. Components without a UID each
+    end up in a calendar of their own. The METHOD property is dropped,
+    since it is not allowed in calendar object resources.
+
+    Args:
+      calendar: Calendar to split
+    Returns: list of calendars
+    """
+    timezones = {}
+    groups: dict[object, list[Component]] = {}
+    for comp in calendar.subcomponents:
+        if comp.name == "VTIMEZONE":
+            timezones[str(comp["TZID"])] = comp
+            continue
+        uid = comp.get("UID")
+        groups.setdefault(str(uid) if uid is not None else object(), []).append(comp)
+    ret = []
+    for comps in groups.values():
+        cal = Calendar()
+        for name, value in calendar.items():
+            if name != "METHOD":
+                cal[name] = value
+        tzids: set[str] = set()
+        for comp in comps:
+            tzids.update(_referenced_tzids(comp))
+        for tzid in sorted(tzids):
+            if tzid in timezones:
+                cal.add_component(timezones[tzid])
+        for comp in comps:
+            cal.add_component(comp)
+        ret.append(cal)
+    return ret
+
+
 def asutc(dt):
     if isinstance(dt, date) and not isinstance(dt, datetime):
         # Return date as-is - dates are timezone-agnostic
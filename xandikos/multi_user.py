@@ -29,12 +29,30 @@ import logging
 import os
 import signal
 
+from .fs import start_maintenance
+from .store.aio import DEFAULT_STORE_THREADS
+from .store.git import (
+    COMMIT_MESSAGE_POLICIES,
+    DEFAULT_COMMIT_BATCH_SIZE,
+    DEFAULT_COMMIT_MESSAGE_POLICY,
+    DEFAULT_FSYNC_POLICY,
+    DEFAULT_MAINTENANCE_LOOSE_OBJECTS,
+    FSYNC_POLICIES,
+)
+from .store.index import (
+    DEFAULT_INDEX_BACKEND,
+    DEFAULT_SHARED_INDEX_BUDGET,
+    INDEX_BACKENDS,
+    SHARED_INDEX_CACHE,
+)
 from .web import (
     SingleUserFilesystemBackend,
     XandikosApp,
     WELLKNOWN_DAV_PATHS,
     RedirectDavHandler,
     get_systemd_listen_sockets,
+    parse_mib,
+    parse_property_list,
     systemd_imported,
 )
 from .webdav import ForbiddenError
@@ -354,6 +372,126 @@ def add_parser(parser):
     # and are generally just meant for developers.
     parser.add_argument("--paranoid", action="store_true", help=argparse.SUPPRESS)
     parser.add_argument("--index-threshold", type=int, help=argparse.SUPPRESS)
+    parser.add_argument(
+        "--index-backend",
+        choices=INDEX_BACKENDS,
+        default=DEFAULT_INDEX_BACKEND,
+        help=(
+            "Where to keep index values. 'memory' keeps them in memory per "
+            "collection; 'shared' keeps them in memory, shared between "
+            "collections with identical items; 'compact' "
+            "keeps them in a compact layout per collection; 'sqlite' "
+            "persists them in each collection so they survive restarts. "
+            "[%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--index-memory-budget",
+        type=int,
+        default=DEFAULT_SHARED_INDEX_BUDGET // (1024 * 1024),
+        metavar="MIB",
+        help="Memory budget for the shared index, in MiB. [%(default)s]",
+    )
+    parser.add_argument(
+        "--max-index-size",
+        type=int,
+        metavar="MIB",
+        help=(
+            "Estimated size of the values for automatically added index keys "
+            "per collection, in MiB, above which the least useful ones are "
+            "dropped."
+        ),
+    )
+    parser.add_argument(
+        "--text-index",
+        type=parse_property_list,
+        default=[],
+        metavar="PROPERTIES",
+        help=(
+            "Comma-separated list of properties (e.g. SUMMARY,FN) to keep "
+            "a trigram index on, to speed up text searches."
+        ),
+    )
+    parser.add_argument(
+        "--commit-delay",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Combine writes to a collection that arrive within this many "
+            "seconds into a single git commit."
+        ),
+    )
+    parser.add_argument(
+        "--commit-batch-size",
+        type=int,
+        default=DEFAULT_COMMIT_BATCH_SIZE,
+        metavar="N",
+        help=(
+            "Maximum number of writes to combine into a single git commit "
+            "with --commit-delay. [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default=DEFAULT_FSYNC_POLICY,
+        dest="fsync_policy",
+        help=(
+            "When to sync written items to disk: as they are written "
+            "(always), once per commit (batch) or leave it to the operating "
+            "system (none). [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--commit-messages",
+        choices=COMMIT_MESSAGE_POLICIES,
+        default=DEFAULT_COMMIT_MESSAGE_POLICY,
+        dest="commit_message_policy",
+        help=(
+            "How to describe writes in git commit messages: what changed "
+            "compared to the previous version (full), the new version only "
+            "(summary) or just the name of the item (minimal). [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--store-threads",
+        type=int,
+        default=DEFAULT_STORE_THREADS,
+        metavar="N",
+        help=(
+            "Number of threads to run collection reads and writes in, so "
+            "that slow git operations do not hold up other requests. "
+            "[%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--maintenance-interval",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Pack loose git objects in the background, checking every this "
+            "many seconds."
+        ),
+    )
+    parser.add_argument(
+        "--maintenance-loose-objects",
+        type=int,
+        default=DEFAULT_MAINTENANCE_LOOSE_OBJECTS,
+        metavar="N",
+        help=(
+            "Number of loose objects a collection must have before "
+            "background maintenance packs them. [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--object-pool",
+        action="store_true",
+        help=(
+            "Keep git objects that are stored in several collections in a "
+            "single pool in the root directory. Background maintenance "
+            "moves them there."
+        ),
+    )
 
 
 async def main(options, parser):
@@ -371,12 +509,23 @@ async def main(options, parser):
 
     logging.basicConfig(level=loglevel, format="%(message)s")
 
+    SHARED_INDEX_CACHE.set_budget(options.index_memory_budget * 1024 * 1024)
+
     backend = MultiUserFilesystemBackend(
         os.path.abspath(options.directory),
         principal_path_prefix=options.principal_path_prefix,
         principal_path_suffix=options.principal_path_suffix,
         paranoid=options.paranoid,
         index_threshold=options.index_threshold,
+        max_index_size=parse_mib(options.max_index_size),
+        index_backend=options.index_backend,
+        text_index_properties=options.text_index,
+        commit_delay=options.commit_delay,
+        commit_batch_size=options.commit_batch_size,
+        fsync_policy=options.fsync_policy,
+        commit_message_policy=options.commit_message_policy,
+        object_pool=options.object_pool,
+        store_threads=options.store_threads,
         show_principals_on_root=not options.hide_principals,
     )
 
@@ -384,6 +533,14 @@ async def main(options, parser):
         os.makedirs(options.directory)
         logging.info("Created data directory: %s", options.directory)
 
+    if options.maintenance_interval:
+        start_maintenance(
+            backend.path,
+            options.maintenance_interval,
+            options.maintenance_loose_objects,
+            share_objects=options.object_pool,
+        )
+
     from .__main__ import _get_package_versions
 
     version_str = ", ".join(f"{pkg} {ver}" for pkg, ver in _get_package_versions())
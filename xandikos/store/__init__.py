@@ -23,13 +23,26 @@ ETags (https://en.wikipedia.org/wiki/HTTP_ETag) used in this file
 are always strong, and should be returned without wrapping quotes.
 """
 
+import collections
+import functools
 from logging import getLogger
 import mimetypes
+import multiprocessing
 import threading
-from collections.abc import Iterable, Iterator
+from concurrent.futures import Future, ProcessPoolExecutor
+from collections.abc import Callable, Hashable, Iterable, Iterator, Set
+from datetime import datetime
 from typing import Optional
 
-from .index import AutoIndexManager, IndexDict, IndexKey, IndexValueIterator
+from .index import (
+    AutoIndexManager,
+    ComponentIndex,
+    IndexDict,
+    IndexKey,
+    IndexValueIterator,
+    TimeRangeIndex,
+    TrigramIndex,
+)
 
 logger = getLogger("xandikos")
 
@@ -56,6 +69,15 @@ MIMETYPES.add_type("text/vcard", ".vcf")  # type: ignore
 
 DEFAULT_MIME_TYPE = "application/octet-stream"
 
+# Number of filters per store to cache the matching items for.
+FILTER_CACHE_SIZE = 32
+
+# Number of items that eager indexing sends to a worker process at once.
+DEFAULT_EAGER_INDEXING_BATCH_SIZE = 64
+
+# Number of items after which eager indexing reports its progress.
+EAGER_INDEXING_PROGRESS_INTERVAL = 1000
+
 
 class InvalidCTag(Exception):
     """The request CTag can not be retrieved."""
@@ -64,6 +86,33 @@ class InvalidCTag(Exception):
         self.ctag = ctag
 
 
+class LazyContent:
+    """Chunks of an item, loaded when they are first iterated over.
+
+    This allows creating File objects for items whose contents may never
+    be needed, e.g. when only their etag is requested.
+    """
+
+    def __init__(self, load: Callable[[], Iterable[bytes]]) -> None:
+        self._load = load
+        self._chunks: list[bytes] | None = None
+
+    def __repr__(self) -> str:
+        if self._chunks is None:
+            return f"{type(self).__name__}({self._load!r})"
+        return repr(self._chunks)
+
+    def __iter__(self) -> Iterator[bytes]:
+        if self._chunks is None:
+            self._chunks = list(self._load())
+        return iter(self._chunks)
+
+    @property
+    def loaded(self) -> bool:
+        """Whether the chunks have been loaded."""
+        return self._chunks is not None
+
+
 class File:
     """A file type handler."""
 
@@ -128,6 +177,68 @@ class File:
         """
         return []
 
+    @classmethod
+    def time_ranges_from_indexes(
+        cls, indexes: IndexDict
+    ) -> dict[str, list[tuple[float, float]]]:
+        """Derive the time ranges covered by a file from its index values.
+
+        The ranges should be conservative: a time range filter on a
+        component can only match if one of the ranges for that component
+        overlaps it.
+
+        Args:
+          indexes: Dictionary mapping index keys to values
+        Returns: Dictionary mapping component names to lists of
+          (start, end) UTC timestamps. Components for which the
+          necessary index values are not present are omitted.
+        :raise NotImplementedError: If time ranges are not supported for
+          this file type
+        """
+        raise NotImplementedError(cls.time_ranges_from_indexes)
+
+    @classmethod
+    def components_from_indexes(cls, indexes: IndexDict) -> dict[IndexKey, bool]:
+        """Derive which components a file contains from its index values.
+
+        Args:
+          indexes: Dictionary mapping index keys to values
+        Returns: Dictionary mapping component index keys to whether the
+          file contains such a component
+        :raise NotImplementedError: If components are not supported for
+          this file type
+        """
+        raise NotImplementedError(cls.components_from_indexes)
+
+    @classmethod
+    def text_index_keys(cls, properties: Iterable[str]) -> list[IndexKey]:
+        """Return the index keys to use for a text index on properties.
+
+        Args:
+          properties: Names of properties
+        Returns: list of index keys
+        """
+        return []
+
+    @classmethod
+    def index_value_texts(cls, key: IndexKey, value: bytes) -> list[str]:
+        """Return the text that text-match filters compare to an index value.
+
+        :raise NotImplementedError: If text indexing is not supported for
+          this file type
+        :raise ValueError: If the value can not be parsed
+        """
+        raise NotImplementedError(cls.index_value_texts)
+
+    @classmethod
+    def normalize_text(cls, text: str) -> str:
+        """Normalize text for text indexing.
+
+        If a text-match filter considers a value to contain a string, then
+        the normalized value must contain the normalized string.
+        """
+        return text.casefold()
+
     def _get_index(self, key: IndexKey) -> IndexValueIterator:
         """Obtain an index for this file.
 
@@ -186,6 +297,40 @@ class Filter:
         """
         raise NotImplementedError(self.check_from_indexes)
 
+    def index_time_range(self) -> tuple[str, datetime, datetime] | None:
+        """Return a time range that all matching resources overlap.
+
+        Returns: tuple with component name, start and end, or None if
+          this filter does not restrict resources to a time range
+        """
+        return None
+
+    def index_components(self) -> list[tuple[IndexKey, bool]] | None:
+        """Return the components whose presence determines whether resources match.
+
+        Returns: list of (component index key, present) tuples, or None if
+          this filter checks anything other than the presence of components
+        """
+        return None
+
+    def index_text_matches(self) -> list[tuple[IndexKey, str]]:
+        """Return strings that the values of matching resources contain.
+
+        Returns: list of (index key, text) tuples; matching resources
+          have a value for each index key that contains the text (as
+          normalized by File.normalize_text)
+        """
+        return []
+
+    def cache_key(self) -> Hashable:
+        """Return a canonical representation of this filter.
+
+        Filters with equal cache keys match the same items.
+
+        :raise NotImplementedError: If the filter can not be cached
+        """
+        raise NotImplementedError(self.cache_key)
+
 
 def open_by_content_type(
     content: Iterable[bytes], content_type: str, extra_file_handlers
@@ -290,6 +435,108 @@ class LockedError(Exception):
         self.path = path
 
 
+class _ItemListing:
+    """The items in a store at a particular ctag, by etag.
+
+    This allows looking up the items for the etags an index returns without
+    listing the whole store. The listing also remembers which derived
+    indexes were found to cover all of its items; after a change, only the
+    items that were added have to be checked again.
+    """
+
+    def __init__(
+        self,
+        ctag: str,
+        by_etag: dict[str, dict[str, str]],
+        count: int,
+        covered: dict[Hashable, Callable[[str], bool]] | None = None,
+    ) -> None:
+        self.ctag = ctag
+        # Maps etags to dictionaries mapping names to content types
+        self.by_etag = by_etag
+        # Number of items
+        self.count = count
+        self._covered = covered or {}
+        self._lock = threading.Lock()
+
+    @classmethod
+    def from_items(
+        cls, ctag: str, items: Iterable[tuple[str, str, str]]
+    ) -> "_ItemListing":
+        by_etag: dict[str, dict[str, str]] = {}
+        count = 0
+        for name, content_type, etag in items:
+            by_etag.setdefault(etag, {})[name] = content_type
+            count += 1
+        return cls(ctag, by_etag, count)
+
+    def updated(
+        self, ctag: str, changes: Iterable[tuple[str, str, str | None, str | None]]
+    ) -> "_ItemListing":
+        """Return a listing for a later ctag.
+
+        Args:
+          ctag: New ctag
+          changes: Iterable over (name, content_type, old_etag, new_etag)
+            tuples, as returned by Store.iter_changes
+        """
+        by_etag = dict(self.by_etag)
+        count = self.count
+        added = set()
+        for name, content_type, old_etag, new_etag in changes:
+            if old_etag is not None:
+                names = dict(by_etag.get(old_etag, {}))
+                if names.pop(name, None) is not None:
+                    count -= 1
+                if names:
+                    by_etag[old_etag] = names
+                else:
+                    by_etag.pop(old_etag, None)
+            if new_etag is not None:
+                names = dict(by_etag.get(new_etag, {}))
+                names[name] = content_type
+                by_etag[new_etag] = names
+                count += 1
+                added.add(new_etag)
+        with self._lock:
+            covered = dict(self._covered)
+        return type(self)(
+            ctag,
+            by_etag,
+            count,
+            {
+                key: covers
+                for (key, covers) in covered.items()
+                if all(covers(etag) for etag in added)
+            },
+        )
+
+    def covered_by(self, key: Hashable, covers: Callable[[str], bool]) -> bool:
+        """Check whether an index covers all items.
+
+        Args:
+          key: Key identifying the index (and its state)
+          covers: Function that checks whether the index covers an etag
+        """
+        with self._lock:
+            if key in self._covered:
+                return True
+        if not all(covers(etag) for etag in self.by_etag):
+            return False
+        with self._lock:
+            self._covered[key] = covers
+        return True
+
+    def iter_items(self, etags: Iterable[str]) -> Iterator[tuple[str, str, str]]:
+        """Iterate over the items with specific etags.
+
+        Returns: iterator over (name, content_type, etag) tuples
+        """
+        for etag in etags:
+            for name, content_type in self.by_etag.get(etag, {}).items():
+                yield (name, content_type, etag)
+
+
 class Store:
     """A object store."""
 
@@ -301,19 +548,46 @@ class Store:
         *,
         double_check_indexes: bool = False,
         index_threshold: int | None = None,
+        max_index_size: int | None = None,
     ) -> None:
         self.extra_file_handlers = {}
         self.index = index
-        self.index_manager = AutoIndexManager(self.index, threshold=index_threshold)
+        self.index_manager = AutoIndexManager(
+            self.index, threshold=index_threshold, memory_budget=max_index_size
+        )
+        self.time_range_index = TimeRangeIndex()
+        self.text_index = TrigramIndex()
+        self.component_index = ComponentIndex()
+        self.text_index_keys: set[IndexKey] = set()
         self.double_check_indexes = double_check_indexes
+        self._filter_cache: collections.OrderedDict[
+            Hashable, tuple[str, dict[str, str]]
+        ] = collections.OrderedDict()
+        self._filter_cache_lock = threading.Lock()
+        self._listing: _ItemListing | None = None
+        self._listing_lock = threading.Lock()
 
     def load_extra_file_handler(self, file_handler: type[File]) -> None:
         self.extra_file_handlers[file_handler.content_type] = file_handler
         new_keys = set(file_handler.default_index_keys())
-        if new_keys:
-            existing_keys = set(self.index.available_keys())
-            if not new_keys.issubset(existing_keys):
-                self.index.reset(existing_keys | new_keys)
+        self.index_manager.pinned.update(new_keys)
+        self.index.add_keys(new_keys)
+
+    def enable_text_index(self, properties: Iterable[str]) -> None:
+        """Maintain a trigram index on the values of the specified properties.
+
+        This speeds up text-match filters on those properties.
+
+        Args:
+          properties: Names of properties, e.g. SUMMARY or FN
+        """
+        properties = list(properties)
+        keys: set[IndexKey] = set()
+        for handler in self.extra_file_handlers.values():
+            keys.update(handler.text_index_keys(properties))
+        self.text_index_keys = keys
+        self.index_manager.pinned.update(keys)
+        self.index.add_keys(keys)
 
     def _index_file(self, name: str, etag: str, fi: File) -> None:
         """Populate index values for an imported file.
@@ -330,7 +604,131 @@ class Store:
             values = fi.get_indexes(keys)
         except (InvalidFileContents, NotImplementedError):
             return
+        self._add_index_values(name, etag, fi.content_type, values)
+
+    def _add_index_values(
+        self, name: str, etag: str, content_type: str, values: IndexDict
+    ) -> None:
+        """Store index values for an item, and anything derived from them.
+
+        Args:
+          name: Name of the item
+          etag: Etag of the item
+          content_type: Content type of the item
+          values: Dictionary mapping index keys to values
+        """
+        self.index_manager.record_values(name, etag, values)
         self.index.add_values(name, etag, values)
+        self._add_derived_index_values(etag, content_type, values)
+
+    def _remove_index_values(self, etags: Iterable[str]) -> None:
+        """Drop index values, and anything derived from them, for items.
+
+        Args:
+          etags: Etags of the items
+        """
+        etags = list(etags)
+        self.index.remove_values(etags)
+        self.index_manager.forget_values(etags)
+        self.time_range_index.remove(etags)
+        self.text_index.remove(etags)
+        self.component_index.remove(etags)
+
+    def _add_derived_index_values(
+        self, etag: str, content_type: str, values: IndexDict
+    ) -> None:
+        """Update the time range, component and text indexes from index values."""
+        try:
+            handler = self.extra_file_handlers[content_type.split(";")[0]]
+        except KeyError:
+            return
+        try:
+            components = handler.components_from_indexes(values)
+        except NotImplementedError:
+            pass
+        else:
+            if components:
+                self.component_index.add(etag, components)
+        try:
+            ranges = handler.time_ranges_from_indexes(values)
+        except NotImplementedError:
+            pass
+        else:
+            if ranges:
+                self.time_range_index.add(etag, ranges)
+        for key in self.text_index_keys.intersection(values):
+            if self.text_index.covers(etag, key):
+                continue
+            try:
+                texts = [
+                    handler.normalize_text(text)
+                    for value in values[key]
+                    if isinstance(value, bytes)
+                    for text in handler.index_value_texts(key, value)
+                ]
+            except (NotImplementedError, ValueError):
+                continue
+            self.text_index.add(etag, key, texts)
+
+    def _index_prefilters(
+        self, filter: Filter
+    ) -> list[tuple[Hashable, Callable[[str], bool], set[str]]]:
+        """Find sets of candidate items for a filter.
+
+        Returns: list of (key, covers, candidates) tuples; items for which
+          covers(etag) is true can only match if they are in candidates.
+          key identifies the index the candidates come from.
+        """
+        prefilters: list[tuple[Hashable, Callable[[str], bool], set[str]]] = []
+        time_range = filter.index_time_range()
+        if time_range is not None:
+            (component, start, end) = time_range
+            prefilters.append(
+                (
+                    ("time-range", component, self.time_range_index.resets),
+                    lambda etag: self.time_range_index.covers(etag, component),
+                    self.time_range_index.query(
+                        component, start.timestamp(), end.timestamp()
+                    ),
+                )
+            )
+        handler = self.extra_file_handlers.get(filter.content_type)
+        if handler is not None:
+            for key, text in filter.index_text_matches():
+                if key not in self.text_index_keys:
+                    continue
+                candidates = self.text_index.query(key, handler.normalize_text(text))
+                if candidates is not None:
+                    prefilters.append(
+                        (
+                            ("text", key, self.text_index.resets),
+                            functools.partial(self.text_index.covers, key=key),
+                            candidates,
+                        )
+                    )
+        return prefilters
+
+    def _get_item_listing(self, ctag: str) -> _ItemListing:
+        """Return the items in the store at a ctag, by etag.
+
+        The listing is kept, and updated from the changes since, if the
+        store can provide them.
+        """
+        with self._listing_lock:
+            listing = self._listing
+            if listing is not None and listing.ctag == ctag:
+                return listing
+            if listing is not None:
+                try:
+                    listing = listing.updated(
+                        ctag, self.iter_changes(listing.ctag, ctag)
+                    )
+                except (NotImplementedError, InvalidCTag):
+                    listing = None
+            if listing is None:
+                listing = _ItemListing.from_items(ctag, self.iter_with_etag(ctag))
+            self._listing = listing
+            return listing
 
     def iter_with_etag(self, ctag: str | None = None) -> Iterator[tuple[str, str, str]]:
         """Iterate over all items in the store with etag.
@@ -348,6 +746,16 @@ class Store:
           filter: Filter to apply
         Returns: iterator over (name, file, etag) tuples
         """
+        try:
+            cache_key = (type(filter), filter.cache_key())
+            ctag = self.get_ctag()
+        except NotImplementedError:
+            return self._iter_with_filter_uncached(filter)
+        return self._iter_with_filter_cached(filter, cache_key, ctag)
+
+    def _iter_with_filter_uncached(
+        self, filter: Filter, ctag: str | None = None
+    ) -> Iterator[tuple[str, File, str]]:
         if self.index_manager is not None:
             try:
                 necessary_keys = filter.index_keys()
@@ -356,13 +764,96 @@ class Store:
             else:
                 present_keys = self.index_manager.find_present_keys(necessary_keys)
                 if present_keys is not None:
-                    return self._iter_with_filter_indexes(filter, present_keys)
-        return self._iter_with_filter_naive(filter)
+                    return self._iter_with_filter_indexes(filter, present_keys, ctag)
+        return self._iter_with_filter_naive(filter, ctag)
+
+    def _iter_with_filter_cached(
+        self, filter: Filter, cache_key: Hashable, ctag: str
+    ) -> Iterator[tuple[str, File, str]]:
+        with self._filter_cache_lock:
+            try:
+                (cached_ctag, matches) = self._filter_cache[cache_key]
+            except KeyError:
+                cached = None
+            else:
+                cached = (cached_ctag, matches)
+                self._filter_cache.move_to_end(cache_key)
+        if cached is not None:
+            (cached_ctag, matches) = cached
+            try:
+                if cached_ctag != ctag:
+                    matches = self._update_filter_matches(
+                        filter, matches, cached_ctag, ctag
+                    )
+            except (NotImplementedError, InvalidCTag):
+                pass
+            else:
+                if self.double_check_indexes:
+                    expected = {
+                        name: etag
+                        for (name, file, etag) in self._iter_with_filter_uncached(
+                            filter, ctag
+                        )
+                    }
+                    if expected != matches:
+                        raise AssertionError(
+                            f"cached results {matches!r} for filter {filter} "
+                            f"do not match actual results {expected!r}"
+                        )
+                self._cache_filter_matches(cache_key, ctag, matches)
+                for name, etag in matches.items():
+                    yield (name, self.get_file(name, filter.content_type, etag), etag)
+                return
+        matches = {}
+        for name, file, etag in self._iter_with_filter_uncached(filter, ctag):
+            matches[name] = etag
+            yield (name, file, etag)
+        self._cache_filter_matches(cache_key, ctag, matches)
+
+    def _update_filter_matches(
+        self, filter: Filter, matches: dict[str, str], old_ctag: str, new_ctag: str
+    ) -> dict[str, str]:
+        """Update the items matching a filter for changes to the store.
+
+        Only the items that changed between the two ctags are checked.
+
+        Args:
+          filter: Filter to apply
+          matches: Dictionary mapping names to etags of matching items
+            in old_ctag
+          old_ctag: Ctag at which matches were determined
+          new_ctag: Ctag to update to
+        Returns: dictionary mapping names to etags of matching items
+          in new_ctag
+        """
+        matches = dict(matches)
+        for name, content_type, old_etag, new_etag in self.iter_changes(
+            old_ctag, new_ctag
+        ):
+            matches.pop(name, None)
+            if new_etag is None or content_type != filter.content_type:
+                continue
+            file = self.get_file(name, content_type, new_etag)
+            try:
+                if filter.check(name, file):
+                    matches[name] = new_etag
+            except InvalidFileContents:
+                logger.warning("Unable to parse file %s, skipping.", name)
+        return matches
+
+    def _cache_filter_matches(
+        self, cache_key: Hashable, ctag: str, matches: dict[str, str]
+    ) -> None:
+        with self._filter_cache_lock:
+            self._filter_cache[cache_key] = (ctag, matches)
+            self._filter_cache.move_to_end(cache_key)
+            while len(self._filter_cache) > FILTER_CACHE_SIZE:
+                self._filter_cache.popitem(last=False)
 
     def _iter_with_filter_naive(
-        self, filter: Filter
+        self, filter: Filter, ctag: str | None = None
     ) -> Iterator[tuple[str, File, str]]:
-        for name, content_type, etag in self.iter_with_etag():
+        for name, content_type, etag in self.iter_with_etag(ctag):
             if not filter.content_type == content_type:
                 continue
             file = self.get_file(name, content_type, etag)
@@ -373,34 +864,125 @@ class Store:
                 logger.warning("Unable to parse file %s, skipping.", name)
 
     def _iter_with_filter_indexes(
-        self, filter: Filter, keys
+        self, filter: Filter, keys, ctag: str | None = None
     ) -> Iterator[tuple[str, File, str]]:
-        for name, content_type, etag in self.iter_with_etag():
+        prefilters = self._index_prefilters(filter)
+        candidate_sets = list(prefilters)
+        components = filter.index_components()
+        if components is not None:
+            component_keys = [key for (key, present) in components]
+            component_matches = self.component_index.query(components)
+            # If the component index covers all items, the matches can be
+            # taken from it directly.
+            candidate_sets.append(
+                (
+                    (
+                        "components",
+                        frozenset(component_keys),
+                        self.component_index.resets,
+                    ),
+                    functools.partial(self.component_index.covers, keys=component_keys),
+                    component_matches,
+                )
+            )
+        listing = None
+        if ctag is not None:
+            listing = self._get_item_listing(ctag)
+            narrowed = [
+                candidates
+                for (key, covers, candidates) in candidate_sets
+                if listing.covered_by(key, covers)
+            ]
+            if not narrowed:
+                listing = None
+        checked = matched = 0
+        seen: Set[str]
+        if listing is not None:
+            # Every item is covered by at least one of the indexes, so only
+            # the candidates it returns have to be looked at.
+            candidates = set.intersection(*narrowed)
+            if self.double_check_indexes:
+                for name, content_type, etag in self.iter_with_etag(ctag):
+                    if etag in candidates or content_type != filter.content_type:
+                        continue
+                    if filter.check(name, self.get_file(name, content_type, etag)):
+                        raise AssertionError(
+                            f"index excluded {name} ({etag}), "
+                            f"which matches filter {filter}"
+                        )
+            items = listing.iter_items(sorted(candidates))
+            seen = listing.by_etag.keys()
+            checked = listing.count
+        else:
+            items = self.iter_with_etag(ctag)
+            seen = walked = set()
+        for name, content_type, etag in items:
+            if listing is None:
+                walked.add(etag)
             if not filter.content_type == content_type:
                 continue
+            if listing is None:
+                checked += 1
+            if components is not None and self.component_index.covers(
+                etag, component_keys
+            ):
+                # Answered from the component index alone.
+                if self.double_check_indexes:
+                    file = self.get_file(name, content_type, etag)
+                    if filter.check(name, file) != (etag in component_matches):
+                        raise AssertionError(
+                            f"component index result for {name} ({etag}) "
+                            f"not matching real file filter {filter}"
+                        )
+                if etag in component_matches:
+                    matched += 1
+                    yield (name, self.get_file(name, content_type, etag), etag)
+                continue
+            if any(
+                etag not in candidates and covers(etag)
+                for (key, covers, candidates) in prefilters
+            ):
+                if self.double_check_indexes:
+                    file = self.get_file(name, content_type, etag)
+                    if filter.check(name, file):
+                        raise AssertionError(
+                            f"index prefilter excluded {name} ({etag}), "
+                            f"which matches filter {filter}"
+                        )
+                continue
             try:
                 file_values = self.index.get_values(name, etag, keys)
             except KeyError:
                 # Index values not yet present for this file.
                 file = self.get_file(name, content_type, etag)
+                # Keys may have been evicted from the index since the pass
+                # started, so make sure the values for them are available.
+                all_keys = list(self.index.available_keys())
+                all_keys.extend(key for key in keys if key not in all_keys)
                 try:
-                    file_values = file.get_indexes(self.index.available_keys())
+                    file_values = file.get_indexes(all_keys)
                 except InvalidFileContents:
                     logger.warning(
                         "Unable to parse file %s for indexing, skipping.", name
                     )
-                    file_values = {}
-                self.index.add_values(name, etag, file_values)
+                    file_values = {key: [] for key in all_keys}
+                self._add_index_values(name, etag, content_type, file_values)
                 try:
                     if filter.check_from_indexes(name, file_values):
+                        matched += 1
                         yield (name, file, etag)
                 except InsufficientIndexDataError:
                     # Fallback to full file check when index data is insufficient
                     if filter.check(name, file):
+                        matched += 1
                         yield (name, file, etag)
             else:
                 if file_values is None:
                     continue
+                if components is not None or not all(
+                    covers(etag) for (key, covers, candidates) in prefilters
+                ):
+                    self._add_derived_index_values(etag, content_type, file_values)
                 if self.double_check_indexes:
                     file = self.get_file(name, content_type, etag)
                     if file_values != file.get_indexes(keys):
@@ -421,12 +1003,22 @@ class Store:
                         pass
                 try:
                     if filter.check_from_indexes(name, file_values):
+                        matched += 1
                         yield (name, self.get_file(name, content_type, etag), etag)
                 except InsufficientIndexDataError:
                     # Fallback to full file check when index data is insufficient
                     file = self.get_file(name, content_type, etag)
                     if filter.check(name, file):
+                        matched += 1
                         yield (name, file, etag)
+        self.index_manager.record_pass(keys, checked, matched)
+        # Drop derived values for items that no longer exist.
+        if len(self.time_range_index) > 2 * len(seen):
+            self.time_range_index.retain(seen)
+        if len(self.text_index) > 2 * len(seen):
+            self.text_index.retain(seen)
+        if len(self.component_index) > 2 * len(seen):
+            self.component_index.retain(seen)
 
     def get_file(
         self,
@@ -487,6 +1079,39 @@ class Store:
             mime_type = DEFAULT_MIME_TYPE
         return (mime_type, etag)
 
+    def lookup_uid(self, uid: str) -> tuple[str, str]:
+        """Find the item with a particular UID.
+
+        Args:
+          uid: UID to look for
+        Returns: (name, etag) tuple
+        Raises:
+          KeyError: if there is no item with the UID
+        """
+        raise NotImplementedError(self.lookup_uid)
+
+    def get_creation_date(self, name: str) -> datetime:
+        """Return the time at which an item was created.
+
+        Args:
+          name: Name of the item
+        Raises:
+          KeyError: if the item does not exist
+        Returns: timezone-aware datetime
+        """
+        raise NotImplementedError(self.get_creation_date)
+
+    def get_last_modified(self, name: str) -> datetime:
+        """Return the time at which an item was last modified.
+
+        Args:
+          name: Name of the item
+        Raises:
+          KeyError: if the item does not exist
+        Returns: timezone-aware datetime
+        """
+        raise NotImplementedError(self.get_last_modified)
+
     def get_ctag(self) -> str:
         """Return the ctag for this store."""
         raise NotImplementedError(self.get_ctag)
@@ -518,6 +1143,44 @@ class Store:
         """
         raise NotImplementedError(self.import_one)
 
+    def import_many(
+        self,
+        items: Iterable[tuple[str | None, str, Iterable[bytes]]],
+        message: str | None = None,
+        remote_user: str | None = None,
+        requester: str | None = None,
+        workers: int = 0,
+    ) -> list[tuple[str, str]]:
+        """Import several objects at once.
+
+        The default implementation imports the items one at a time;
+        stores that can do better override this.
+
+        Args:
+          items: Iterable over (name, content type, data) tuples; the name
+            can be None to have one generated
+          message: Commit message
+          remote_user: Optional user name of the actor
+          requester: Optional User-Agent or client information
+          workers: Number of worker processes to validate the items in;
+            0 to validate them in the current thread
+        Raise:
+          InvalidFileContents: when one of the items is invalid
+          DuplicateUidError: when the uid already exists
+        Returns: list of (name, etag) tuples
+        """
+        return [
+            self.import_one(
+                name,
+                content_type,
+                data,
+                message=message,
+                remote_user=remote_user,
+                requester=requester,
+            )
+            for (name, content_type, data) in items
+        ]
+
     def delete_one(
         self,
         name: str,
@@ -590,13 +1253,15 @@ class Store:
         raise NotImplementedError(self.set_color)
 
     def iter_changes(
-        self, old_ctag: str, new_ctag: str
+        self, old_ctag: str, new_ctag: str, after: str | None = None
     ) -> Iterator[tuple[str, str, str, str]]:
         """Get changes between two versions of this store.
 
         Args:
           old_ctag: Old ctag (None for empty Store)
           new_ctag: New ctag
+          after: Only report changes to items with names that sort after
+            this one
         Returns: Iterator over (name, content_type, old_etag, new_etag)
         """
         raise NotImplementedError(self.iter_changes)
@@ -649,30 +1314,261 @@ def open_store(location: str) -> Store:
     return GitStore.open_from_path(location)
 
 
-def _populate_indexes(store: Store) -> None:
-    """Scan all items in a store and populate index values."""
-    keys = list(store.index.available_keys())
-    count = 0
-    for name, content_type, etag in store.iter_with_etag():
-        if etag in store.index.iter_etags():
-            continue
+def _index_batch(
+    batch: list[tuple[type[File], list[bytes], str]], keys: list[IndexKey]
+) -> list[IndexDict | None]:
+    """Extract index values from a batch of items.
+
+    This runs in eager indexing worker processes.
+
+    Args:
+      batch: List of (file handler, content, content type) tuples
+      keys: Index keys to extract
+    Returns: list with index values for each item, or None if the item
+      could not be parsed
+    """
+    ret: list[IndexDict | None] = []
+    for handler, content, content_type in batch:
         try:
-            file = store.get_file(name, content_type, etag)
-            values = file.get_indexes(keys)
+            ret.append(handler(content, content_type).get_indexes(keys))
         except (InvalidFileContents, KeyError):
-            logger.warning("Unable to index file %s, skipping.", name)
+            ret.append(None)
+    return ret
+
+
+def _prepare_import_batch(
+    batch: list[tuple[type[File], list[bytes], str]], keys: list[IndexKey]
+) -> list[tuple[list[bytes], str | None, IndexDict | None, str | None]]:
+    """Validate and normalize a batch of items to import.
+
+    This runs in eager indexing worker processes.
+
+    Args:
+      batch: List of (file handler, content, content type) tuples
+      keys: Index keys to extract
+    Returns: list with a (normalized content, uid, index values, error)
+      tuple for each item; error is None unless the item is invalid
+    """
+    ret: list[tuple[list[bytes], str | None, IndexDict | None, str | None]] = []
+    for handler, content, content_type in batch:
+        fi = handler(content, content_type)
+        try:
+            fi.validate()
+            normalized = list(fi.normalized())
+        except InvalidFileContents as exc:
+            ret.append(([], None, None, str(exc.error)))
             continue
-        store.index.add_values(name, etag, values)
-        count += 1
-    logger.info("Eager indexing complete for %r: indexed %d items.", store, count)
+        try:
+            uid = fi.get_uid()
+        except (KeyError, NotImplementedError):
+            uid = None
+        values: IndexDict | None = None
+        if keys:
+            try:
+                values = fi.get_indexes(keys)
+            except (InvalidFileContents, NotImplementedError):
+                pass
+        ret.append((normalized, uid, values, None))
+    return ret
+
+
+def _prepare_imports(
+    batch: list[tuple[type[File], list[bytes], str]],
+    keys: list[IndexKey],
+    workers: int = 0,
+    batch_size: int = DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+) -> list[tuple[list[bytes], str | None, IndexDict | None, str | None]]:
+    """Validate and normalize items to import, optionally in worker processes.
+
+    Args:
+      batch: List of (file handler, content, content type) tuples
+      keys: Index keys to extract
+      workers: Number of worker processes to use; 0 to process the items
+        in the current thread
+      batch_size: Number of items to send to a worker at once
+    Returns: see _prepare_import_batch
+    """
+    if workers < 1:
+        return _prepare_import_batch(batch, keys)
+    executor = _get_eager_indexing_pool(workers)
+    futures = [
+        executor.submit(_prepare_import_batch, batch[i : i + batch_size], keys)
+        for i in range(0, len(batch), batch_size)
+    ]
+    return [result for future in futures for result in future.result()]
+
+
+@functools.cache
+def _get_eager_indexing_pool(workers: int) -> ProcessPoolExecutor:
+    # Forking a process with running threads is unsafe, so start the
+    # workers afresh.
+    return ProcessPoolExecutor(
+        max_workers=workers, mp_context=multiprocessing.get_context("spawn")
+    )
+
+
+def _iter_index_values(
+    store: Store,
+    items: list[tuple[str, str, str]],
+    keys: list[IndexKey],
+    workers: int = 0,
+    batch_size: int = DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+) -> Iterator[tuple[tuple[str, str, str], IndexDict | None]]:
+    """Extract index values for items, optionally in worker processes.
+
+    Args:
+      store: Store to read the items from
+      items: List of (name, content type, etag) tuples
+      keys: Index keys to extract
+      workers: Number of worker processes to use; 0 to extract the values
+        in the current thread
+      batch_size: Number of items to send to a worker at once
+    Returns: iterator over (item, index values) tuples; the values are
+      None for items that could not be read or parsed
+    """
+    if workers < 1:
+        for item in items:
+            (name, content_type, etag) = item
+            try:
+                file = store.get_file(name, content_type, etag)
+                values: IndexDict | None = file.get_indexes(keys)
+            except (InvalidFileContents, KeyError):
+                values = None
+            yield (item, values)
+        return
+    executor = _get_eager_indexing_pool(workers)
+    pending: collections.deque[
+        tuple[list[tuple[str, str, str]], Future[list[IndexDict | None]]]
+    ] = collections.deque()
+    for i in range(0, len(items), batch_size):
+        batch = []
+        contents = []
+        for item in items[i : i + batch_size]:
+            (name, content_type, etag) = item
+            try:
+                file = store.get_file(name, content_type, etag)
+            except KeyError:
+                yield (item, None)
+                continue
+            batch.append(item)
+            contents.append((type(file), list(file.content), file.content_type))
+        pending.append((batch, executor.submit(_index_batch, contents, keys)))
+        # Keep enough batches in flight to keep all workers busy, without
+        # reading everything into memory at once.
+        while len(pending) > 2 * workers:
+            (batch, future) = pending.popleft()
+            yield from zip(batch, future.result())
+    while pending:
+        (batch, future) = pending.popleft()
+        yield from zip(batch, future.result())
+
+
+def _populate_indexes(
+    store: Store,
+    workers: int = 0,
+    batch_size: int = DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+) -> None:
+    """Bring the index values for the items in a store up to date.
+
+    The index records the ctag it was last brought up to date for. If
+    the store can report the changes since then, only the changed items
+    are processed; otherwise all items are scanned.
+
+    Args:
+      store: Store to index
+      workers: Number of worker processes to parse items in; 0 to parse
+        them in the current thread
+      batch_size: Number of items to send to a worker at once
+    """
+    keys = list(store.index.available_keys())
+    try:
+        ctag: str | None = store.get_ctag()
+    except NotImplementedError:
+        ctag = None
+    indexed_ctag = store.index.get_indexed_ctag()
+    if ctag is not None and ctag == indexed_ctag:
+        logger.info("Indexes for %r are up to date.", store)
+        return
+    changes = None
+    if ctag is not None and indexed_ctag is not None:
+        try:
+            changes = list(store.iter_changes(indexed_ctag, ctag))
+        except (NotImplementedError, InvalidCTag):
+            pass
+    if changes is None:
+        indexed = set(store.index.iter_etags())
+        items = list(store.iter_with_etag(ctag))
+        present = {etag for (name, content_type, etag) in items}
+        to_index = []
+        for name, content_type, etag in items:
+            if etag in indexed:
+                continue
+            try:
+                # Values may be shared with items in other stores.
+                store.index.get_values(name, etag, keys)
+            except KeyError:
+                to_index.append((name, content_type, etag))
+        removed = indexed - present
+    else:
+        present = {new_etag for (_, _, _, new_etag) in changes if new_etag is not None}
+        to_index = []
+        for name, content_type, old_etag, new_etag in changes:
+            if new_etag is None:
+                continue
+            try:
+                # Items added through the store have been indexed already.
+                store.index.get_values(name, new_etag, keys)
+            except KeyError:
+                to_index.append((name, content_type, new_etag))
+        removed = {
+            old_etag for (_, _, old_etag, _) in changes if old_etag is not None
+        } - present
+        if removed:
+            assert ctag is not None
+            # Other items may still have the same contents.
+            removed.difference_update(store._get_item_listing(ctag).by_etag)
+    count = 0
+    for i, ((name, content_type, etag), values) in enumerate(
+        _iter_index_values(store, to_index, keys, workers, batch_size), 1
+    ):
+        if values is None:
+            logger.warning("Unable to index file %s, skipping.", name)
+        else:
+            store._add_index_values(name, etag, content_type, values)
+            count += 1
+        if i % EAGER_INDEXING_PROGRESS_INTERVAL == 0:
+            logger.info(
+                "Eager indexing %r: processed %d of %d items.", store, i, len(to_index)
+            )
+    store._remove_index_values(removed)
+    if ctag is not None:
+        store.index.set_indexed_ctag(ctag)
+    logger.info(
+        "Eager indexing complete for %r: indexed %d items, dropped %d.",
+        store,
+        count,
+        len(removed),
+    )
 
 
-def start_eager_indexing(store: Store) -> threading.Thread | None:
+def start_eager_indexing(
+    store: Store,
+    workers: int = 0,
+    batch_size: int = DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+) -> threading.Thread | None:
     """Initialize default indexes and start a background scan to populate them.
 
-    Collects default_index_keys() from all loaded file handlers, resets the
-    index with those keys, then scans all items in a background thread.
+    Collects default_index_keys() from all loaded file handlers, adds any
+    that are missing to the index, then indexes the items that changed
+    since the index was last populated in a background thread. Items that
+    are already present in the index (e.g. because it is persistent) are
+    skipped.
 
+    Args:
+      store: Store to index
+      workers: Number of worker processes to parse items in, shared
+        between all stores; 0 to parse them in the background thread
+      batch_size: Number of items to send to a worker at once
     Returns: The background thread performing the scan, or None if there
         are no default index keys.
     """
@@ -681,10 +1577,10 @@ def start_eager_indexing(store: Store) -> threading.Thread | None:
         all_keys.update(handler.default_index_keys())
     if not all_keys:
         return None
-    store.index.reset(all_keys)
+    store.index.add_keys(all_keys)
     thread = threading.Thread(
         target=_populate_indexes,
-        args=(store,),
+        args=(store, workers, batch_size),
         name="eager-index-scan",
         daemon=True,
     )
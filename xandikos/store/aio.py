@@ -0,0 +1,145 @@
+# Xandikos
+# Copyright (C) 2016-2017 Jelmer Vernooĳ <jelmer@jelmer.uk>, et al.
+#
+# This program is free software; you can redistribute it and/or
+# modify it under the terms of the GNU General Public License
+# as published by the Free Software Foundation; version 3
+# of the License or (at your option) any later version of
+# the License.
+#
+# This program is distributed in the hope that it will be useful,
+# but WITHOUT ANY WARRANTY; without even the implied warranty of
+# MERCHANTABILITY or FITNESS FOR A PARTICULAR PURPOSE.  See the
+# GNU General Public License for more details.
+#
+# You should have received a copy of the GNU General Public License
+# along with this program; if not, write to the Free Software
+# Foundation, Inc., 51 Franklin Street, Fifth Floor, Boston,
+# MA  02110-1301, USA.
+
+"""Asynchronous access to stores.
+
+Stores are synchronous and may spend a long time on disk or in git. The
+AsyncStore facade runs store operations on a thread pool, so that an
+event loop serving other clients is not blocked in the meantime.
+"""
+
+import asyncio
+import contextvars
+import functools
+from collections.abc import AsyncIterator, Callable, Iterable
+from concurrent.futures import Executor, ThreadPoolExecutor
+from datetime import datetime
+from typing import TypeVar
+
+from . import File, Filter, Store
+
+# Default number of threads used to run store operations in.
+DEFAULT_STORE_THREADS = 8
+
+T = TypeVar("T")
+
+
+def create_store_executor(
+    max_workers: int = DEFAULT_STORE_THREADS,
+) -> ThreadPoolExecutor:
+    """Create a thread pool for running store operations in.
+
+    Args:
+      max_workers: Maximum number of threads
+    Returns: A ThreadPoolExecutor
+    """
+    if max_workers < 1:
+        raise ValueError(f"invalid number of store threads: {max_workers!r}")
+    return ThreadPoolExecutor(
+        max_workers=max_workers, thread_name_prefix="xandikos-store"
+    )
+
+
+class AsyncStore:
+    """Awaitable facade for a Store.
+
+    Every operation runs on the executor; listings are collected in a
+    single call and then handed out by an asynchronous iterator, so that
+    store iterators never hold locks across threads.
+    """
+
+    def __init__(self, store: Store, executor: Executor | None = None) -> None:
+        """Create an AsyncStore.
+
+        Args:
+          store: Store to wrap
+          executor: Executor to run store operations in; None for the
+            default executor of the running event loop
+        """
+        self.store = store
+        self.executor = executor
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.store!r})"
+
+    async def run(self, func: Callable[..., T], /, *args, **kwargs) -> T:
+        """Run a function on the executor and wait for its result.
+
+        Like asyncio.to_thread, the current context is propagated.
+        """
+        loop = asyncio.get_running_loop()
+        ctx = contextvars.copy_context()
+        call = functools.partial(ctx.run, func, *args, **kwargs)
+        return await loop.run_in_executor(self.executor, call)
+
+    async def _iterate(
+        self, func: Callable[..., Iterable[T]], /, *args
+    ) -> AsyncIterator[T]:
+        for item in await self.run(lambda: list(func(*args))):
+            yield item
+
+    async def get_ctag(self) -> str:
+        return await self.run(self.store.get_ctag)
+
+    async def get_etag(self, name: str) -> str:
+        return await self.run(self.store.get_etag, name)
+
+    async def get_file(
+        self,
+        name: str,
+        content_type: str | None = None,
+        etag: str | None = None,
+    ) -> File:
+        return await self.run(self.store.get_file, name, content_type, etag)
+
+    async def get_file_meta(self, name: str) -> tuple[str, str]:
+        return await self.run(self.store.get_file_meta, name)
+
+    async def lookup_uid(self, uid: str) -> tuple[str, str]:
+        return await self.run(self.store.lookup_uid, uid)
+
+    async def get_creation_date(self, name: str) -> datetime:
+        return await self.run(self.store.get_creation_date, name)
+
+    async def get_last_modified(self, name: str) -> datetime:
+        return await self.run(self.store.get_last_modified, name)
+
+    async def import_one(
+        self, name: str | None, content_type: str, data: Iterable[bytes], **kwargs
+    ) -> tuple[str, str]:
+        return await self.run(self.store.import_one, name, content_type, data, **kwargs)
+
+    async def delete_one(self, name: str, **kwargs) -> None:
+        await self.run(self.store.delete_one, name, **kwargs)
+
+    async def subdirectories(self) -> list[str]:
+        return await self.run(lambda: list(self.store.subdirectories()))
+
+    def iter_with_etag(
+        self, ctag: str | None = None
+    ) -> AsyncIterator[tuple[str, str, str]]:
+        return self._iterate(self.store.iter_with_etag, ctag)
+
+    def iter_with_filter(self, filter: Filter) -> AsyncIterator[tuple[str, File, str]]:
+        return self._iterate(self.store.iter_with_filter, filter)
+
+    def iter_changes(
+        self, old_ctag: str, new_ctag: str, after: str | None = None
+    ) -> AsyncIterator[tuple[str, str, str, str]]:
+        return self._iterate(self.store.iter_changes, old_ctag, new_ctag, after)
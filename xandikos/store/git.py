@@ -19,24 +19,39 @@
 
 """Git store."""
 
+import collections
 import configparser
+import contextlib
 import errno
 import functools
+import hashlib
+import json
 import threading
 from logging import getLogger
 import os
 import shutil
 import stat
 import uuid
-from io import BytesIO, StringIO
+from datetime import datetime, timezone
+from io import StringIO
 from typing import cast
-from collections.abc import Iterable
+from collections.abc import Iterable, Iterator
 
 import dulwich.repo
-from dulwich.file import FileLocked
-from dulwich.index import IndexEntry, index_entry_from_stat, locked_index
+from dulwich.errors import MissingCommitError
+from dulwich.file import FileLocked, GitFile
+from dulwich.index import (
+    IndexEntry,
+    blob_from_path_and_stat,
+    index_entry_from_stat,
+    locked_index,
+)
+from dulwich.object_store import DiskObjectStore
 from dulwich.objects import Blob, Commit, Tree
+from dulwich.pack import PackFileDisappeared, full_unpacked_object
 from dulwich.porcelain import get_user_identity
+from dulwich.refs import DiskRefsContainer
+from dulwich.walk import ORDER_TOPO
 
 from . import (
     DEFAULT_MIME_TYPE,
@@ -46,25 +61,570 @@ from . import (
     InvalidCTag,
     InvalidETag,
     InvalidFileContents,
+    LazyContent,
     LockedError,
     NoSuchItem,
     NotStoreError,
     OutOfSpaceError,
     Store,
+    _prepare_imports,
     open_by_content_type,
     open_by_extension,
 )
 from .config import CONFIG_FILENAME
 from .config import CollectionMetadata, FileBasedCollectionMetadata, is_metadata_file
-from .index import MemoryIndex
+from .index import MEMORY_INDEX_BACKEND, open_index
 
 DEFAULT_ENCODING = "utf-8"
 DEFAULT_FILE_CACHE_SIZE = 1024
 
+# Maximum number of writes to combine into a single group commit.
+DEFAULT_COMMIT_BATCH_SIZE = 100
+
+# Number of loose objects above which scheduled maintenance packs them.
+DEFAULT_MAINTENANCE_LOOSE_OBJECTS = 1000
+
+MaintenanceStats = collections.namedtuple(
+    "MaintenanceStats", ["objects_packed", "bytes_reclaimed"]
+)
+
+# Policies for syncing written items and git objects to disk:
+# none leaves it to the operating system, batch syncs everything a commit
+# records just before it is made, and always syncs every file as it is
+# written.
+FSYNC_NONE = "none"
+FSYNC_BATCH = "batch"
+FSYNC_ALWAYS = "always"
+FSYNC_POLICIES = (FSYNC_NONE, FSYNC_BATCH, FSYNC_ALWAYS)
+DEFAULT_FSYNC_POLICY = FSYNC_NONE
+
+# Policies for generating commit messages for writes that don't come with
+# one: full describes what changed compared to the previous version of an
+# item, which means parsing that too; summary only describes the new
+# version; minimal only mentions the name of the item.
+COMMIT_MESSAGES_FULL = "full"
+COMMIT_MESSAGES_SUMMARY = "summary"
+COMMIT_MESSAGES_MINIMAL = "minimal"
+COMMIT_MESSAGE_POLICIES = (
+    COMMIT_MESSAGES_FULL,
+    COMMIT_MESSAGES_SUMMARY,
+    COMMIT_MESSAGES_MINIMAL,
+)
+DEFAULT_COMMIT_MESSAGE_POLICY = COMMIT_MESSAGES_FULL
+
+# Tree layouts of bare git stores: flat keeps all items in the root tree,
+# sharded keeps them in subtrees named after a prefix of the hash of their
+# name, so that a write only needs to rewrite a small subtree.
+LAYOUT_FLAT = "flat"
+LAYOUT_SHARDED = "sharded"
+LAYOUTS = (LAYOUT_FLAT, LAYOUT_SHARDED)
+
+# Git config section that store settings, like the layout, are kept in.
+STORE_CONFIG_SECTION = (b"xandikos", b"store")
+
+# Name of the file in the control directory that item times are kept in.
+ITEM_TIMES_FILENAME = "xandikos-times.json"
+
+# Changes are appended to the item times file until it is larger than twice
+# its snapshot plus this many bytes; it is then rewritten.
+ITEM_TIMES_MIN_LOG_SIZE = 64 * 1024
+
+# Number of recent commits that the changelog of a store covers.
+DEFAULT_CHANGELOG_SIZE = 1000
+
 
 logger = getLogger("xandikos")
 
 
+def _disk_usage(path: str) -> int:
+    """Return the disk space used by the files under a directory."""
+    total = 0
+    for dirpath, dirnames, filenames in os.walk(path):
+        for filename in filenames:
+            try:
+                st = os.lstat(os.path.join(dirpath, filename))
+            except FileNotFoundError:
+                continue
+            # Small files take up a whole block; count that where possible.
+            blocks = getattr(st, "st_blocks", None)
+            total += st.st_size if blocks is None else blocks * 512
+    return total
+
+
+def _fsync_path(path: str) -> None:
+    """Flush a file or directory that has already been written to disk."""
+    fd = os.open(path, os.O_RDONLY)
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def _stat_token(path: str) -> tuple[int, int, int] | None:
+    """Return a value that changes whenever a file is replaced or modified."""
+    try:
+        st = os.stat(path)
+    except FileNotFoundError:
+        return None
+    return (st.st_ino, st.st_mtime_ns, st.st_size)
+
+
+def open_object_pool(path: str) -> DiskObjectStore:
+    """Open a pool of git objects shared by several stores.
+
+    The pool is created if it doesn't exist yet.
+
+    Args:
+      path: Path to the pool
+    Returns: A `DiskObjectStore`
+    """
+    for subdir in ("info", "pack"):
+        os.makedirs(os.path.join(path, subdir), exist_ok=True)
+    return DiskObjectStore(path)
+
+
+class _PoolAwareObjectStore(DiskObjectStore):
+    """DiskObjectStore that notices alternates added after it was opened.
+
+    Maintenance may set up an object pool for a store that is already open
+    elsewhere, and then remove the objects it moved into the pool from the
+    store itself. Dulwich only reads the alternates file once, so the list
+    of alternates is read again whenever the file has changed. Alternates
+    are only consulted for objects the store doesn't have itself, so this
+    costs a single stat on such lookups.
+    """
+
+    def __init__(self, *args, **kwargs) -> None:
+        super().__init__(*args, **kwargs)
+        self._pool_alternates: list[DiskObjectStore] | None = None
+        self._pool_alternates_token: tuple[int, int, int] | None = None
+
+    @property
+    def alternates(self):
+        path = os.path.join(self.path, "info", "alternates")
+        token = _stat_token(path)
+        if self._pool_alternates is None or token != self._pool_alternates_token:
+            self._close_alternates()
+            alternates = []
+            try:
+                with open(path, "rb") as f:
+                    for line in f:
+                        line = line.rstrip(b"\n")
+                        if not line or line.startswith(b"#"):
+                            continue
+                        alternates.append(
+                            DiskObjectStore(os.path.join(self.path, os.fsdecode(line)))
+                        )
+            except FileNotFoundError:
+                pass
+            self._pool_alternates = alternates
+            self._pool_alternates_token = token
+        return self._pool_alternates
+
+    def add_alternate_path(self, path) -> None:
+        super().add_alternate_path(path)
+        # Read the updated file, rather than trusting the appended entry.
+        self._close_alternates()
+
+    def _close_alternates(self) -> None:
+        if self._pool_alternates is not None:
+            for alternate in self._pool_alternates:
+                alternate.close()
+            self._pool_alternates = None
+
+    def close(self) -> None:
+        self._close_alternates()
+        super().close()
+
+
+def _write_repo_config(config) -> None:
+    """Write out a repository config that was changed.
+
+    Memory repositories keep their config in memory only.
+    """
+    if getattr(config, "path", None) is not None:
+        config.write_to_path()
+
+
+def _open_repo(path: str) -> dulwich.repo.Repo:
+    """Open a repository for a store.
+
+    The repository uses an object store that notices object pools that
+    are set up while it is open.
+    """
+    repo = dulwich.repo.Repo(path)
+    try:
+        object_store = _PoolAwareObjectStore.from_config(
+            repo.object_store.path, repo.get_config()
+        )
+    finally:
+        repo.close()
+    repo = dulwich.repo.Repo(path, object_store=object_store)
+    repo._autogc_disabled = True
+    return repo
+
+
+def _remove_pack(pack) -> None:
+    """Remove the files of a pack.
+
+    Object stores that have the pack open notice that it is gone the next
+    time they look for packs.
+    """
+    basename = os.path.splitext(os.fspath(pack.data.path))[0]
+    # Without its index, the pack is no longer picked up.
+    for ext in (".idx", ".pack", ".rev", ".bitmap", ".keep"):
+        try:
+            os.remove(basename + ext)
+        except FileNotFoundError:
+            pass
+
+
+def _shard(name: bytes) -> bytes:
+    """Return the name of the subtree an item lives in, in a sharded tree."""
+    return hashlib.sha1(name).hexdigest()[:2].encode("ascii")
+
+
+def _item_name(path: bytes) -> str:
+    """Return the name of the item at a path in a tree."""
+    return path.rsplit(b"/", 1)[-1].decode(DEFAULT_ENCODING)
+
+
+def _changes_by_name(
+    object_store, old_tree: bytes | None, new_tree: bytes
+) -> dict[str, list[bytes | None]]:
+    """Find the items that differ between two trees.
+
+    Items in subtrees, as in the sharded layout, are named after the last
+    component of their path, so an item that moves between subtrees
+    shows up as a single change.
+
+    Returns: dict mapping names to [old sha, new sha] lists
+    """
+    changes: dict[str, list[bytes | None]] = {}
+    for (old_path, new_path), _, (old_sha, new_sha) in object_store.tree_changes(
+        old_tree, new_tree
+    ):
+        if old_path is not None:
+            changes.setdefault(_item_name(old_path), [None, None])[0] = old_sha
+        if new_path is not None:
+            changes.setdefault(_item_name(new_path), [None, None])[1] = new_sha
+    return changes
+
+
+def _add_actor_trailers(
+    message: str, remote_user: str | None, requester: str | None
+) -> str:
+    """Add trailers describing the actor to a commit message."""
+    if remote_user is not None or requester is not None:
+        message += "\n"
+        if remote_user is not None:
+            message += f"\nRemote-User: {remote_user}"
+        if requester is not None:
+            message += f"\nRequester: {requester}"
+    return message
+
+
+class ItemTimes:
+    """Creation and last modification times of the items in a git store.
+
+    These are the commit times of the commits that added and last changed
+    each item. The history is walked once; after that, only the commits
+    made since the last lookup are examined. If a path is given, the
+    times are kept there so that they survive restarts.
+
+    The file starts with a JSON snapshot of all times, followed by a JSON
+    line with the changes for every later commit, so that moving to a new
+    commit only appends the items that changed. Once the changes outgrow
+    the snapshot, the file is rewritten.
+    """
+
+    def __init__(self, path: str | None = None) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._loaded = path is None
+        # Token of the file as last read or written
+        self._token: tuple[int, int, int] | None = None
+        # Number of bytes of the file that have been read
+        self._offset = 0
+        # Size of the snapshot at the start of the file
+        self._snapshot_size = 0
+        # Commit up to which the times have been determined
+        self._commit: bytes | None = None
+        # Maps names to (creation time, last modification time)
+        self._times: dict[str, tuple[int, int]] = {}
+
+    def _load(self) -> None:
+        assert self.path is not None
+        try:
+            f = open(self.path, "rb")
+        except FileNotFoundError:
+            self._token = None
+            return
+        with f:
+            st = os.fstat(f.fileno())
+            self._token = (st.st_ino, st.st_mtime_ns, st.st_size)
+            snapshot = f.readline()
+            try:
+                data = json.loads(snapshot)
+                commit = data["commit"].encode("ascii")
+                times = {
+                    name: (created, modified)
+                    for (name, (created, modified)) in data["items"].items()
+                }
+            except (ValueError, KeyError, TypeError, AttributeError):
+                logger.warning("Ignoring invalid item times file %s", self.path)
+                # Make sure the file is rewritten rather than appended to.
+                self._token = None
+                return
+            self._commit = commit
+            self._times = times
+            self._snapshot_size = self._offset = len(snapshot)
+            self._read_changes(f)
+
+    def _read_changes(self, f) -> None:
+        """Apply the changes recorded in the file from the current offset."""
+        for line in f:
+            if not line.endswith(b"\n"):
+                # Still being written.
+                break
+            self._offset += len(line)
+            try:
+                data = json.loads(line)
+                parent = data["parent"].encode("ascii")
+                commit = data["commit"].encode("ascii")
+                changes = {
+                    name: None if value is None else (value[0], value[1])
+                    for (name, value) in data["items"].items()
+                }
+            except (ValueError, KeyError, TypeError, AttributeError, IndexError):
+                logger.warning("Ignoring invalid line in item times file %s", self.path)
+                continue
+            if parent != self._commit:
+                # Recorded by a process that was behind, or ahead of us.
+                continue
+            for name, value in changes.items():
+                if value is None:
+                    self._times.pop(name, None)
+                else:
+                    self._times[name] = value
+            self._commit = commit
+
+    def _refresh(self) -> None:
+        """Pick up changes to the file made by other processes."""
+        assert self.path is not None
+        token = _stat_token(self.path)
+        if token == self._token:
+            return
+        if (
+            token is not None
+            and self._token is not None
+            and token[0] == self._token[0]
+            and token[2] >= self._offset
+            and self._commit is not None
+        ):
+            # Changes were appended to the file.
+            with open(self.path, "rb") as f:
+                f.seek(self._offset)
+                self._read_changes(f)
+            self._token = token
+        else:
+            self._load()
+
+    def _save(
+        self, parent: bytes | None, changes: dict[str, tuple[int, int] | None] | None
+    ) -> None:
+        assert self.path is not None and self._commit is not None
+        token = _stat_token(self.path)
+        if (
+            parent is None
+            or changes is None
+            or token is None
+            or self._token is None
+            or token[0] != self._token[0]
+            or token[2] > 2 * self._snapshot_size + ITEM_TIMES_MIN_LOG_SIZE
+        ):
+            self._save_snapshot()
+            return
+        line = (
+            json.dumps(
+                {
+                    "parent": parent.decode("ascii"),
+                    "commit": self._commit.decode("ascii"),
+                    "items": changes,
+                }
+            ).encode("utf-8")
+            + b"\n"
+        )
+        # Lines are appended with a single write, so that concurrent
+        # writers don't interleave.
+        with open(self.path, "ab") as f:
+            f.write(line)
+        if token == self._token and token[2] == self._offset:
+            self._offset += len(line)
+            self._token = _stat_token(self.path)
+
+    def _save_snapshot(self) -> None:
+        assert self.path is not None and self._commit is not None
+        data = {"commit": self._commit.decode("ascii"), "items": self._times}
+        snapshot = json.dumps(data).encode("utf-8") + b"\n"
+        try:
+            with GitFile(self.path, "wb") as f:
+                f.write(snapshot)
+        except FileLocked:
+            # Another process is updating the file.
+            pass
+        else:
+            self._token = _stat_token(self.path)
+            self._snapshot_size = self._offset = len(snapshot)
+
+    def _update(self, repo, head: bytes) -> dict[str, tuple[int, int] | None] | None:
+        """Bring the times up to date with a commit.
+
+        Returns: dictionary with the new times of the items that changed,
+          or None if the history had to be walked from the start
+        """
+        times = self._times
+        walker = None
+        if self._commit is not None:
+            try:
+                walker = repo.get_walker(
+                    include=[head], exclude=[self._commit], order=ORDER_TOPO
+                )
+                entries = list(walker)
+            except (KeyError, MissingCommitError):
+                walker = None
+            else:
+                # Start over if history was rewritten.
+                if not entries or self._commit not in entries[-1].commit.parents:
+                    walker = None
+        updated: dict[str, tuple[int, int] | None] | None
+        if walker is None:
+            times = {}
+            updated = None
+            entries = list(repo.get_walker(include=[head], order=ORDER_TOPO))
+        else:
+            times = dict(times)
+            updated = {}
+        for entry in reversed(entries):
+            commit = entry.commit
+            if commit.parents:
+                old_tree = repo.object_store[commit.parents[0]].tree
+            else:
+                old_tree = None
+            changes = _changes_by_name(repo.object_store, old_tree, commit.tree)
+            for name, (old_sha, new_sha) in changes.items():
+                if new_sha is None:
+                    times.pop(name, None)
+                elif new_sha != old_sha:
+                    created = times.get(name, (commit.commit_time,))[0]
+                    times[name] = (created, commit.commit_time)
+                else:
+                    continue
+                if updated is not None:
+                    updated[name] = times.get(name)
+        self._times = times
+        self._commit = head
+        return updated
+
+    def get(self, repo, head: bytes, name: str) -> tuple[int, int]:
+        """Look up the times for an item.
+
+        Args:
+          repo: Repository
+          head: Id of the current commit
+          name: Name of the item
+        Raises:
+          KeyError: if the item does not exist in the current commit
+        Returns: tuple with creation and last modification time, in
+          seconds since the epoch
+        """
+        with self._lock:
+            if not self._loaded:
+                self._load()
+                self._loaded = True
+            elif head != self._commit and self.path is not None:
+                # Another process may already have brought the times up
+                # to date.
+                self._refresh()
+            if head != self._commit:
+                parent = self._commit
+                changes = self._update(repo, head)
+                if self.path is not None:
+                    self._save(parent, changes)
+            return self._times[name]
+
+
+class Changelog:
+    """Recent ctags of a git store, with the changes between them.
+
+    The changes are recorded as the store makes commits, which allows
+    determining the changes between two recent ctags without comparing
+    the full trees. Commits made by other processes are not known; the
+    changelog starts over after them.
+    """
+
+    def __init__(self, max_size: int = DEFAULT_CHANGELOG_SIZE) -> None:
+        self.max_size = max_size
+        self._lock = threading.Lock()
+        # ctags, oldest first; _steps[i] has the changes from _ctags[i] to
+        # _ctags[i + 1] as (name, old sha, new sha) tuples.
+        self._ctags: list[str] = []
+        self._steps: list[list[tuple[str, bytes | None, bytes | None]]] = []
+
+    def record(
+        self,
+        old_ctag: str,
+        new_ctag: str,
+        changes: Iterable[tuple[str, bytes | None, bytes | None]],
+    ) -> None:
+        """Record the changes made by a commit.
+
+        Args:
+          old_ctag: ctag before the commit
+          new_ctag: ctag after the commit
+          changes: Iterable over (name, old sha, new sha) tuples
+        """
+        with self._lock:
+            if not self._ctags or self._ctags[-1] != old_ctag:
+                # Somebody else committed in the meantime.
+                self._ctags = [old_ctag]
+                self._steps = []
+            self._steps.append(list(changes))
+            self._ctags.append(new_ctag)
+            del self._steps[: -self.max_size]
+            del self._ctags[: -self.max_size - 1]
+
+    def changes(
+        self, old_ctag: str, new_ctag: str
+    ) -> list[tuple[str, bytes | None, bytes | None]] | None:
+        """Find the changes between two ctags.
+
+        Args:
+          old_ctag: Old ctag
+          new_ctag: New ctag
+        Returns: list of (name, old sha, new sha) tuples, or None if the
+          ctags are not both in the changelog
+        """
+        with self._lock:
+            try:
+                new_index = len(self._ctags) - 1 - self._ctags[::-1].index(new_ctag)
+                old_index = new_index - self._ctags[new_index::-1].index(old_ctag)
+            except ValueError:
+                return None
+            combined: dict[str, list[bytes | None]] = {}
+            for step in self._steps[old_index:new_index]:
+                for name, old_sha, new_sha in step:
+                    try:
+                        combined[name][1] = new_sha
+                    except KeyError:
+                        combined[name] = [old_sha, new_sha]
+        return [
+            (name, old_sha, new_sha)
+            for (name, (old_sha, new_sha)) in combined.items()
+            if old_sha != new_sha
+        ]
+
+
 class RepoCollectionMetadata(CollectionMetadata):
     def __init__(self, repo) -> None:
         self._repo = repo
@@ -135,9 +695,7 @@ class RepoCollectionMetadata(CollectionMetadata):
         self._write_config(config)
 
     def _write_config(self, config):
-        f = BytesIO()
-        config.write_to_file(f)
-        self._repo._put_named_file("config", f.getvalue())
+        _write_repo_config(config)
         # Update cache after write
         self._cached_config = config
         config_path = getattr(config, "path", None)
@@ -266,22 +824,65 @@ class GitStore(Store):
         ref: bytes = b"HEAD",
         check_for_duplicate_uids=True,
         parsed_file_cache_size: int | None = None,
+        index_backend: str = MEMORY_INDEX_BACKEND,
+        commit_delay: float | None = None,
+        commit_batch_size: int = DEFAULT_COMMIT_BATCH_SIZE,
+        fsync_policy: str = DEFAULT_FSYNC_POLICY,
+        commit_message_policy: str = DEFAULT_COMMIT_MESSAGE_POLICY,
         **kwargs,
     ) -> None:
-        super().__init__(MemoryIndex(), **kwargs)
+        if fsync_policy not in FSYNC_POLICIES:
+            raise ValueError(f"Unknown fsync policy {fsync_policy!r}")
+        if commit_message_policy not in COMMIT_MESSAGE_POLICIES:
+            raise ValueError(f"Unknown commit message policy {commit_message_policy!r}")
+        try:
+            controldir = repo.controldir()
+        except AttributeError:
+            # In-memory repositories don't have a control directory.
+            controldir = None
+        super().__init__(open_index(index_backend, controldir), **kwargs)
+        self._item_times = ItemTimes(
+            os.path.join(controldir, ITEM_TIMES_FILENAME)
+            if controldir is not None
+            else None
+        )
+        self._changelog = Changelog()
         self.ref = repo.refs.follow(ref)[0][-1]
         self.repo = repo
         # Disable automatic garbage collection
         self.repo._autogc_disabled = True
-        # Maps uids to (sha, fname)
-        self._uid_to_fname: dict[str, tuple[bytes, str]] = {}
+        # Maps uids to (fname, etag)
+        self._uid_to_fname: dict[str, tuple[str, str]] = {}
         self._check_for_duplicate_uids = check_for_duplicate_uids
-        # Set of blob ids that have already been scanned
-        self._fname_to_uid: dict[str, tuple[str, str]] = {}
+        # Maps fnames to (etag, uid)
+        self._fname_to_uid: dict[str, tuple[str, str | None]] = {}
+        # ctag up to which the uid maps have been scanned
+        self._uids_ctag: str | None = None
         # Guards mutations of the uid maps above so that concurrent
-        # _scan_uids callers don't race in the terminal cleanup loop.
+        # _scan_uids callers don't race.
         self._uid_lock = threading.Lock()
 
+        # Group commit: if commit_delay is set, writes are staged and
+        # committed together once commit_delay seconds have passed since
+        # the first of them, or commit_batch_size writes have been staged.
+        self.commit_delay = commit_delay
+        self.commit_batch_size = commit_batch_size
+        # Maps names of staged items to blob ids, or None for deletions
+        self._staged: dict[str, bytes | None] = {}
+        self._staged_messages: list[str] = []
+        self._commit_lock = threading.RLock()
+        self._commit_timer: threading.Timer | None = None
+
+        self.fsync_policy = fsync_policy
+        # Files written since the last commit that still need to be synced
+        self._unsynced: list[str] = []
+        if fsync_policy == FSYNC_ALWAYS and isinstance(
+            repo.object_store, DiskObjectStore
+        ):
+            repo.object_store.fsync_object_files = True
+
+        self.commit_message_policy = commit_message_policy
+
         # Cache for guessed store type (when not set in git config)
         self._guessed_type: str | None = None
         self._guessed_type_ctag: str | None = None
@@ -294,17 +895,22 @@ class GitStore(Store):
         )
 
     def _parse_file_by_sha(self, sha: str, content_type: str | None, name: str):
-        """Parse a file by its SHA, used for caching."""
-        blob = self.repo.object_store[sha.encode("ascii")]
+        """Parse a file by its SHA, used for caching.
+
+        The blob is only read once the contents of the file are accessed.
+        """
+        if sha.encode("ascii") not in self.repo.object_store:
+            raise KeyError(sha)
+        content = LazyContent(functools.partial(self._get_raw, name, sha))
         if content_type is None:
             return open_by_extension(
-                blob.chunked,
+                content,
                 name,
                 extra_file_handlers=self.extra_file_handlers,
             )
         else:
             return open_by_content_type(
-                blob.chunked,
+                content,
                 content_type,
                 extra_file_handlers=self.extra_file_handlers,
             )
@@ -320,7 +926,111 @@ class GitStore(Store):
         return self._parsed_file_cache(etag, content_type, name)
 
     def get_etag(self, name: str) -> str:
-        raise NotImplementedError(self.get_etag)
+        with self._commit_lock:
+            try:
+                sha = self._staged[name]
+            except KeyError:
+                pass
+            else:
+                if sha is None:
+                    raise KeyError(name)
+                return sha.decode("ascii")
+        return self._get_committed_etag(name)
+
+    def _get_committed_etag(self, name: str) -> str:
+        raise NotImplementedError(self._get_committed_etag)
+
+    def _get_item_times(self, name: str) -> tuple[int, int]:
+        with self._commit_lock:
+            if name in self._staged:
+                # The times of an item come from the commits that change it.
+                self.flush()
+        try:
+            head = self.repo.refs[self.ref]
+        except KeyError as exc:
+            # No commits yet
+            raise KeyError(name) from exc
+        return self._item_times.get(self.repo, head, name)
+
+    def get_creation_date(self, name: str) -> datetime:
+        (created, modified) = self._get_item_times(name)
+        return datetime.fromtimestamp(created, timezone.utc)
+
+    def get_last_modified(self, name: str) -> datetime:
+        (created, modified) = self._get_item_times(name)
+        return datetime.fromtimestamp(modified, timezone.utc)
+
+    def get_ctag(self) -> str:
+        """Return the ctag for this store.
+
+        Any staged writes are committed first.
+        """
+        self.flush()
+        return self._get_committed_ctag()
+
+    def _get_committed_ctag(self) -> str:
+        raise NotImplementedError(self._get_committed_ctag)
+
+    def _commit_changes(self, changes: list[tuple[str, bytes | None]], message: str):
+        """Commit a set of changes at once.
+
+        Args:
+          changes: List of (name, blob id) tuples; the blob id is None
+            for items that should be removed
+          message: Commit message
+        """
+        raise NotImplementedError(self._commit_changes)
+
+    def _stage(self, name: str, sha: bytes | None, message: str) -> None:
+        """Stage a write for the next group commit.
+
+        Args:
+          name: Name of the item
+          sha: Id of the new blob (already in the object store), or None
+            if the item is removed
+          message: Commit message describing the write
+        """
+        with self._commit_lock:
+            # Keep the staged writes in the order in which they were made.
+            self._staged.pop(name, None)
+            self._staged[name] = sha
+            self._staged_messages.append(message)
+            if len(self._staged_messages) >= self.commit_batch_size:
+                self.flush()
+            elif self._commit_timer is None:
+                assert self.commit_delay is not None
+                self._commit_timer = threading.Timer(
+                    self.commit_delay, self._flush_in_background
+                )
+                # Not a daemon thread, so that staged writes are committed
+                # before the process exits.
+                self._commit_timer.start()
+
+    def _flush_in_background(self) -> None:
+        try:
+            self.flush()
+        except Exception:
+            # The writes stay staged; the next flush will retry them.
+            logger.exception("Unable to commit staged writes for %r", self)
+
+    def flush(self) -> None:
+        """Commit any staged writes."""
+        with self._commit_lock:
+            if self._commit_timer is not None:
+                self._commit_timer.cancel()
+                self._commit_timer = None
+            if not self._staged:
+                return
+            if len(self._staged_messages) == 1:
+                message = self._staged_messages[0]
+            else:
+                message = "\n\n".join(
+                    [f"Update {len(self._staged_messages)} items"]
+                    + self._staged_messages
+                )
+            self._commit_changes(list(self._staged.items()), message)
+            self._staged = {}
+            self._staged_messages = []
 
     def _import_one(
         self,
@@ -418,26 +1128,158 @@ class GitStore(Store):
             uid = fi.get_uid()
         except (KeyError, NotImplementedError):
             uid = None
-        self._check_duplicate(uid, name, replace_etag)
+        current_etag = self._check_duplicate(uid, name, replace_etag)
         if message is None:
-            try:
-                old_fi = self.get_file(name, content_type, replace_etag)
-            except KeyError:
-                old_fi = None
-            message = "\n".join(fi.describe_delta(name, old_fi))
-
-        if remote_user is not None or requester is not None:
-            message += "\n"
-            if remote_user is not None:
-                message += f"\nRemote-User: {remote_user}"
-            if requester is not None:
-                message += f"\nRequester: {requester}"
+            message = self._describe_import(name, content_type, fi, current_etag)
+        message = _add_actor_trailers(message, remote_user, requester)
 
-        etag = self._import_one(name, fi.normalized(), message)
+        if self.commit_delay is None:
+            etag = self._import_one(name, fi.normalized(), message)
+        else:
+            blob = Blob()
+            blob.chunked = list(fi.normalized())
+            self.repo.object_store.add_object(blob)
+            self._objects_written([blob.id])
+            self._stage(name, blob.id, message)
+            etag = blob.id
         etag_str = etag.decode("ascii")
+        with self._uid_lock:
+            self._record_uid(name, etag_str, uid)
         self._index_file(name, etag_str, fi)
         return (name, etag_str)
 
+    def _describe_import(
+        self, name: str, content_type: str, fi, current_etag: str | None
+    ) -> str:
+        """Generate a commit message for a write, as the policy asks.
+
+        Args:
+          name: Name of the item
+          content_type: Content type of the item
+          fi: Parsed new version of the item
+          current_etag: Etag of the current version of the item, if any
+        Returns: Commit message
+        """
+        if self.commit_message_policy == COMMIT_MESSAGES_FULL:
+            if current_etag is None:
+                old_fi = None
+            else:
+                try:
+                    old_fi = self.get_file(name, content_type, current_etag)
+                except KeyError:
+                    old_fi = None
+            return "\n".join(fi.describe_delta(name, old_fi))
+        if self.commit_message_policy == COMMIT_MESSAGES_SUMMARY:
+            description = fi.describe(name)
+        else:
+            description = name
+        if current_etag is None:
+            return "Added " + description
+        return "Modified " + description
+
+    def _describe_delete(self, name: str, content: Iterable[bytes]) -> str:
+        """Generate a commit message for a deletion, as the policy asks.
+
+        Args:
+          name: Name of the item
+          content: Contents of the item; only read if needed
+        Returns: Commit message
+        """
+        if self.commit_message_policy == COMMIT_MESSAGES_MINIMAL:
+            return "Delete " + name
+        fi = open_by_extension(content, name, self.extra_file_handlers)
+        return "Delete " + fi.describe(name)
+
+    def import_many(
+        self,
+        items: Iterable[tuple[str | None, str, Iterable[bytes]]],
+        message: str | None = None,
+        remote_user: str | None = None,
+        requester: str | None = None,
+        workers: int = 0,
+    ) -> list[tuple[str, str]]:
+        """Import several objects in a single commit.
+
+        All items are validated (in worker processes, if workers is
+        non-zero) and checked for duplicate UIDs before anything is
+        written, so either all or none of the items are imported.
+
+        Args:
+          items: Iterable over (name, content type, data) tuples; the name
+            can be None to have one generated
+          message: Commit message
+          remote_user: Optional user name of the actor
+          requester: Optional User-Agent or client information
+          workers: Number of worker processes to validate the items in;
+            0 to validate them in the current thread
+        Raises:
+          InvalidFileContents: when one of the items is invalid
+          DuplicateUidError: when the uid already exists
+        Returns: list of (name, etag) tuples
+        """
+        names = []
+        batch = []
+        for name, content_type, data in items:
+            if content_type is None:
+                fi = open_by_extension(data, name, self.extra_file_handlers)
+            else:
+                fi = open_by_content_type(data, content_type, self.extra_file_handlers)
+            if name is None:
+                name = str(uuid.uuid4())
+                extension = MIMETYPES.guess_extension(fi.content_type)
+                if extension is not None:
+                    name += extension
+            names.append(name)
+            batch.append((type(fi), list(fi.content), fi.content_type))
+        if not batch:
+            return []
+        keys = list(self.index.available_keys())
+        prepared = _prepare_imports(batch, keys, workers)
+        for (handler, content, content_type), (_, _, _, error) in zip(batch, prepared):
+            if error is not None:
+                raise InvalidFileContents(content_type, content, error)
+
+        if self._check_for_duplicate_uids:
+            self._scan_uids()
+            with self._uid_lock:
+                seen = {uid: name for (uid, (name, _)) in self._uid_to_fname.items()}
+            for name, (_, uid, _, _) in zip(names, prepared):
+                if uid is None:
+                    continue
+                existing_name = seen.setdefault(uid, name)
+                if existing_name != name:
+                    raise DuplicateUidError(uid, existing_name, name)
+
+        blobs = []
+        for normalized, _, _, _ in prepared:
+            blob = Blob()
+            blob.chunked = normalized
+            blobs.append(blob)
+        if message is None:
+            message = f"Import {len(blobs)} items"
+        message = _add_actor_trailers(message, remote_user, requester)
+        with self._syncing_objects():
+            self.repo.object_store.add_objects([(blob, None) for blob in blobs])
+        with self._commit_lock:
+            # Commit anything that was staged earlier first, so that the
+            # import doesn't get mixed into the group commit.
+            self.flush()
+            self._commit_changes(
+                [(name, blob.id) for (name, blob) in zip(names, blobs)], message
+            )
+
+        ret = []
+        for name, blob, (_, _, content_type), (_, uid, values, _) in zip(
+            names, blobs, batch, prepared
+        ):
+            etag = blob.id.decode("ascii")
+            with self._uid_lock:
+                self._record_uid(name, etag, uid)
+            if values is not None:
+                self._add_index_values(name, etag, content_type, values)
+            ret.append((name, etag))
+        return ret
+
     def _get_raw(self, name, etag=None):
         """Get the raw contents of an object.
 
@@ -451,43 +1293,135 @@ class GitStore(Store):
         blob = self.repo.object_store[etag.encode("ascii")]
         return blob.chunked
 
+    def _read_uid(self, name: str, etag: str) -> str | None:
+        blob = self.repo.object_store[etag.encode("ascii")]
+        fi = open_by_extension(blob.chunked, name, self.extra_file_handlers)
+        try:
+            return fi.get_uid()
+        except KeyError:
+            logger.warning("No UID found in file %s", name)
+        except InvalidFileContents as e:
+            logger.warning("Unable to parse file %s: %s", name, e)
+        except NotImplementedError:
+            # This file type doesn't support UIDs
+            pass
+        return None
+
+    def _record_uid(self, name: str, etag: str | None, uid: str | None) -> None:
+        """Record the uid of an item, or its removal if etag is None.
+
+        The caller should hold _uid_lock.
+        """
+        old = self._fname_to_uid.pop(name, None)
+        if old is not None and old[1] is not None:
+            if self._uid_to_fname.get(old[1], (None, None))[0] == name:
+                del self._uid_to_fname[old[1]]
+        if etag is not None:
+            self._fname_to_uid[name] = (etag, uid)
+            if uid is not None:
+                self._uid_to_fname[uid] = (name, etag)
+
     def _scan_uids(self):
-        # Build the new mapping locally and swap it in under the
-        # lock, so two concurrent scanners can't corrupt each
-        # other's intermediate state. The blob parsing work (which
-        # can be expensive) happens outside the lock.
-        with self._uid_lock:
-            existing = dict(self._fname_to_uid)
-        new_fname_to_uid: dict[str, tuple[str, str]] = {}
-        new_uid_to_fname: dict[str, tuple[bytes, str]] = {}
-        for name, mode, sha in self._iterblobs():
-            etag = sha.decode("ascii")
-            cached = existing.get(name)
-            if cached is not None and cached[0] == etag:
-                new_fname_to_uid[name] = cached
-                uid = cached[1]
-                if uid is not None:
-                    new_uid_to_fname[uid] = (name, etag)
-                continue
-            blob = self.repo.object_store[sha]
-            fi = open_by_extension(blob.chunked, name, self.extra_file_handlers)
+        # Only items that changed since the last scan are parsed. The
+        # parsing (which can be expensive) happens outside the lock;
+        # the results are only applied if no other scanner has updated
+        # the maps in the meantime.
+        while True:
+            ctag = self._get_committed_ctag()
+            with self._uid_lock:
+                old_ctag = self._uids_ctag
+            if old_ctag == ctag:
+                return
             try:
-                uid = fi.get_uid()
-            except KeyError:
-                logger.warning("No UID found in file %s", name)
-                uid = None
-            except InvalidFileContents as e:
-                logger.warning("Unable to parse file %s: %s", name, e)
-                uid = None
-            except NotImplementedError:
-                # This file type doesn't support UIDs
-                uid = None
-            new_fname_to_uid[name] = (etag, uid)
-            if uid is not None:
-                new_uid_to_fname[uid] = (name, etag)
+                changes = [
+                    (name, new_etag)
+                    for (name, content_type, old_etag, new_etag) in self.iter_changes(
+                        old_ctag, ctag
+                    )
+                ]
+                complete = False
+            except InvalidCTag:
+                changes = [
+                    (name, sha.decode("ascii"))
+                    for (name, mode, sha) in self._iterblobs(ctag)
+                ]
+                complete = True
+            updates = []
+            for name, etag in changes:
+                if etag is not None:
+                    cached = self._fname_to_uid.get(name)
+                    if cached is not None and cached[0] == etag:
+                        uid = cached[1]
+                    else:
+                        uid = self._read_uid(name, etag)
+                else:
+                    uid = None
+                updates.append((name, etag, uid))
+            with self._uid_lock:
+                if self._uids_ctag != old_ctag:
+                    continue
+                if complete:
+                    present = {name for (name, etag) in changes}
+                    for name in list(self._fname_to_uid):
+                        if name not in present:
+                            self._record_uid(name, None, None)
+                for name, etag, uid in updates:
+                    self._record_uid(name, etag, uid)
+                self._uids_ctag = ctag
+                return
+
+    def delete_one(
+        self,
+        name: str,
+        message: str | None = None,
+        etag: str | None = None,
+        remote_user: str | None = None,
+        requester: str | None = None,
+    ) -> None:
+        """Delete an item.
+
+        Args:
+          name: Filename to delete
+          message: Commit message
+          etag: Optional mandatory etag of object to remove
+          remote_user: Optional user name of the actor
+          requester: Optional User-Agent or client information
+        Raises:
+          NoSuchItem: when the item doesn't exist
+          InvalidETag: If the specified ETag doesn't match the current
+        """
+        if self.commit_delay is None:
+            return self._delete_one(name, message, etag, remote_user, requester)
+        try:
+            current_etag = self.get_etag(name)
+        except KeyError as exc:
+            raise NoSuchItem(name) from exc
+        if etag is not None and etag != current_etag:
+            raise InvalidETag(name, etag, current_etag)
+        if message is None:
+            message = self._describe_delete(
+                name,
+                LazyContent(functools.partial(self._get_raw, name, current_etag)),
+            )
+        message = _add_actor_trailers(message, remote_user, requester)
+        self._stage(name, None, message)
+        with self._uid_lock:
+            self._record_uid(name, None, None)
+
+    def _delete_one(
+        self,
+        name: str,
+        message: str | None,
+        etag: str | None,
+        remote_user: str | None,
+        requester: str | None,
+    ) -> None:
+        raise NotImplementedError(self._delete_one)
+
+    def lookup_uid(self, uid):
+        self._scan_uids()
         with self._uid_lock:
-            self._fname_to_uid = new_fname_to_uid
-            self._uid_to_fname = new_uid_to_fname
+            return self._uid_to_fname[uid]
 
     def _iterblobs(self, ctag=None):
         raise NotImplementedError(self._iterblobs)
@@ -499,6 +1433,8 @@ class GitStore(Store):
           ctag: Ctag to iterate for
         Returns: iterator over (name, content_type, etag) tuples
         """
+        if ctag is None:
+            self.flush()
         for name, mode, sha in self._iterblobs(ctag):
             (mime_type, _) = MIMETYPES.guess_type(name)
             if mime_type is None:
@@ -506,9 +1442,13 @@ class GitStore(Store):
             yield (name, mime_type, sha.decode("ascii"))
 
     @classmethod
-    def create(cls, path):
+    def create(cls, path, object_pool: str | None = None):
         """Create a new store backed by a Git repository on disk.
 
+        Args:
+          path: Path to create the repository at
+          object_pool: Optional path to a pool of objects shared with
+            other stores
         Returns: A `GitStore`
         """
         raise NotImplementedError(cls.create)
@@ -522,8 +1462,7 @@ class GitStore(Store):
         Returns: A `GitStore`
         """
         try:
-            repo = dulwich.repo.Repo(path)
-            repo._autogc_disabled = True
+            repo = _open_repo(path)
             return cls.open(repo, **kwargs)
         except dulwich.repo.NotGitRepository:
             raise NotStoreError(path)
@@ -645,48 +1584,406 @@ class GitStore(Store):
             self._guessed_type_ctag = ctag
             return store_type
 
-    def iter_changes(self, old_ctag, new_ctag):
+    def iter_changes(self, old_ctag, new_ctag, after=None):
         """Get changes between two versions of this store.
 
         Args:
           old_ctag: Old ctag (None for empty Store)
           new_ctag: New ctag
+          after: Only report changes to items with names that sort after
+            this one
         Returns: Iterator over (name, content_type, old_etag, new_etag)
         """
-        if old_ctag is None:
-            t = Tree()
-            self.repo.object_store.add_object(t)
-            old_ctag = t.id.decode("ascii")
-        previous = {
-            name: (content_type, etag)
-            for (name, content_type, etag) in self.iter_with_etag(old_ctag)
-        }
-        for name, new_content_type, new_etag in self.iter_with_etag(new_ctag):
-            try:
-                (old_content_type, old_etag) = previous[name]
-            except KeyError:
-                old_etag = None
-            else:
-                assert old_content_type == new_content_type
-            if old_etag != new_etag:
-                yield (name, new_content_type, old_etag, new_etag)
-            if old_etag is not None:
-                del previous[name]
-        for name, (old_content_type, old_etag) in previous.items():
-            yield (name, old_content_type, old_etag, None)
+        changes = None
+        if old_ctag is not None:
+            changes = self._changelog.changes(old_ctag, new_ctag)
+        if changes is None:
+            # Not made by this store recently; compare the trees instead.
+            trees: list[bytes | None] = []
+            for ctag in (old_ctag, new_ctag):
+                tree_id = ctag.encode("ascii") if ctag is not None else None
+                if tree_id is None or tree_id == Tree().id:
+                    # The empty tree is not necessarily in the object store.
+                    trees.append(None)
+                elif tree_id in self.repo.object_store:
+                    trees.append(tree_id)
+                else:
+                    raise InvalidCTag(ctag)
+            changes = [
+                (name, old_sha, new_sha)
+                for (name, (old_sha, new_sha)) in _changes_by_name(
+                    self.repo.object_store, *trees
+                ).items()
+                if old_sha != new_sha
+            ]
+        for name, old_sha, new_sha in changes:
+            if (after is not None and name <= after) or is_metadata_file(name):
+                continue
+            (content_type, _) = MIMETYPES.guess_type(name)
+            if content_type is None:
+                content_type = DEFAULT_MIME_TYPE
+            yield (
+                name,
+                content_type,
+                old_sha.decode("ascii") if old_sha is not None else None,
+                new_sha.decode("ascii") if new_sha is not None else None,
+            )
 
     def destroy(self):
         """Destroy this store."""
         shutil.rmtree(self.path)
 
+    def _maintenance_lock(self):
+        """Return a context manager that keeps other writers out."""
+        return contextlib.nullcontext()
+
+    def _files_written(self, paths: Iterable[str]) -> None:
+        """Sync files that were just written, as the fsync policy asks.
+
+        The directories containing them are synced as well, so that new and
+        renamed files are kept.
+        """
+        if self.fsync_policy == FSYNC_NONE:
+            return
+        paths = list(paths)
+        paths.extend(dict.fromkeys(os.path.dirname(path) for path in paths))
+        if self.fsync_policy == FSYNC_ALWAYS:
+            for path in paths:
+                _fsync_path(path)
+        else:
+            self._unsynced.extend(paths)
+
+    def _objects_written(self, shas: Iterable[bytes]) -> None:
+        """Sync loose objects that were just written, as the policy asks."""
+        object_store = self.repo.object_store
+        if self.fsync_policy != FSYNC_BATCH or not isinstance(
+            object_store, DiskObjectStore
+        ):
+            # Objects are synced by the object store itself, if at all.
+            return
+        paths = []
+        for sha in shas:
+            path = object_store._get_shafile_path(sha)
+            if os.path.exists(path):
+                paths.append(path)
+        self._files_written(paths)
+
+    @contextlib.contextmanager
+    def _syncing_objects(self):
+        """Sync objects written in this context, unless the policy is none.
+
+        This is for objects written in one go, like a pack or a commit.
+        """
+        object_store = self.repo.object_store
+        if self.fsync_policy != FSYNC_BATCH or not isinstance(
+            object_store, DiskObjectStore
+        ):
+            yield
+            return
+        with self._commit_lock:
+            # The repository may be configured to always sync objects.
+            previous = object_store.fsync_object_files
+            object_store.fsync_object_files = True
+            try:
+                yield
+            finally:
+                object_store.fsync_object_files = previous
+
+    @contextlib.contextmanager
+    def _recording_commit(self):
+        """Sync everything written so far, before a commit records it."""
+        with self._commit_lock:
+            (unsynced, self._unsynced) = (self._unsynced, [])
+            for path in dict.fromkeys(unsynced):
+                try:
+                    _fsync_path(path)
+                except FileNotFoundError:
+                    # Removed again, or packed in the meantime.
+                    pass
+            with self._syncing_objects():
+                yield
+
+    def maintain(self, min_loose_objects: int = 0) -> MaintenanceStats:
+        """Pack loose objects into a pack file.
+
+        Automatic garbage collection is disabled for stores, so without
+        this every write leaves a few more loose objects behind.
+
+        Args:
+          min_loose_objects: Only pack objects if there are at least this
+            many loose objects
+        Raises:
+          LockedError: if the store is being written to
+        Returns: MaintenanceStats with the number of objects packed and
+          the number of bytes of disk space reclaimed
+        """
+        object_store = self.repo.object_store
+        if not isinstance(object_store, DiskObjectStore):
+            return MaintenanceStats(0, 0)
+        if object_store.count_loose_objects() < max(min_loose_objects, 1):
+            return MaintenanceStats(0, 0)
+        with self._commit_lock, self._maintenance_lock():
+            before = _disk_usage(object_store.path)
+            packed = object_store.pack_loose_objects()
+            # Remove any temporary files left behind by interrupted packing
+            object_store.prune()
+            after = _disk_usage(object_store.path)
+        return MaintenanceStats(packed, before - after)
+
+    def use_object_pool(self, path: str) -> None:
+        """Look up objects in a pool shared with other stores, too.
+
+        Args:
+          path: Path to the pool, which is created if necessary
+        Raises:
+          NotImplementedError: if the store is not kept on disk
+        """
+        object_store = self.repo.object_store
+        if not isinstance(object_store, DiskObjectStore):
+            raise NotImplementedError(self.use_object_pool)
+        path = os.path.abspath(path)
+        if any(
+            os.path.abspath(alternate.path) == path
+            for alternate in object_store.alternates
+        ):
+            return
+        open_object_pool(path)
+        object_store.add_alternate_path(path)
+
+    def iter_own_objects(self) -> Iterator[bytes]:
+        """Iterate over the ids of the objects kept in the store itself.
+
+        Objects that are only available from an object pool are skipped,
+        and objects may be reported more than once.
+        """
+        object_store = self.repo.object_store
+        if not isinstance(object_store, DiskObjectStore):
+            yield from object_store
+            return
+        for pack in object_store.packs:
+            try:
+                yield from pack
+            except PackFileDisappeared:
+                # Removed by maintenance since the packs were last listed.
+                continue
+        yield from object_store._iter_loose_objects()
+
+    def share_objects(self, pool_path: str, shas: Iterable[bytes]) -> MaintenanceStats:
+        """Move objects into a pool shared with other stores.
+
+        The store is set up to use the pool first, if it doesn't yet.
+        Objects that are already in the pool are just removed from the
+        store.
+
+        Args:
+          pool_path: Path to the pool
+          shas: Ids of the objects to move
+        Raises:
+          LockedError: if the store is being written to
+        Returns: MaintenanceStats with the number of objects moved and the
+          number of bytes of disk space reclaimed
+        """
+        object_store = self.repo.object_store
+        shas = set(shas)
+        if not isinstance(object_store, DiskObjectStore) or not shas:
+            return MaintenanceStats(0, 0)
+        self.use_object_pool(pool_path)
+        pool = open_object_pool(pool_path)
+        with self._commit_lock, self._maintenance_lock():
+            before = _disk_usage(object_store.path)
+            missing = [sha for sha in shas if sha not in pool]
+            if missing:
+                pool.add_pack_data(
+                    len(missing),
+                    (full_unpacked_object(object_store[sha]) for sha in missing),
+                )
+            # Only drop objects once they can be found in the pool.
+            shared = {sha for sha in shas if sha in pool}
+            for pack in object_store.packs:
+                dropped = sum(1 for sha in shared if sha in pack)
+                if not dropped:
+                    continue
+                # Only packs with shared objects are rewritten, one object
+                # at a time.
+                if dropped < len(pack):
+                    object_store.add_pack_data(
+                        len(pack) - dropped,
+                        (
+                            full_unpacked_object(obj)
+                            for obj in pack.iterobjects()
+                            if obj.id not in shared
+                        ),
+                    )
+                _remove_pack(pack)
+            for sha in shared:
+                if object_store.contains_loose(sha):
+                    object_store.delete_loose_object(sha)
+            object_store.prune()
+            after = _disk_usage(object_store.path)
+        return MaintenanceStats(len(shas), before - after)
+
 
 class BareGitStore(GitStore):
-    """A Store backed by a bare git repository."""
+    """A Store backed by a bare git repository.
+
+    Items are either all kept in the root tree, or, with the sharded
+    layout, in subtrees; see `set_layout`. Metadata files are always kept
+    in the root tree.
+    """
 
     def __init__(self, repo, **kwargs) -> None:
         super().__init__(repo, **kwargs)
         self._cached_tree = None
         self._cached_ref_target = None
+        try:
+            layout = repo.get_config().get(STORE_CONFIG_SECTION, b"layout")
+        except KeyError:
+            self.layout = LAYOUT_FLAT
+        else:
+            self.layout = layout.decode("ascii")
+        if self.layout not in LAYOUTS:
+            logger.warning("Unknown layout %r for %r", self.layout, self)
+            self.layout = LAYOUT_FLAT
+
+    def _is_sharded(self, tree) -> bool:
+        """Check whether a tree uses the sharded layout."""
+        for name, mode, _sha in tree.iteritems():
+            if stat.S_ISDIR(mode):
+                return True
+            if not is_metadata_file(name.decode(DEFAULT_ENCODING)):
+                return False
+        # No items to tell by
+        return self.layout == LAYOUT_SHARDED
+
+    def _lookup(self, tree, name: bytes) -> tuple[int, bytes]:
+        """Look up the mode and sha of an item in a tree.
+
+        Raises:
+          KeyError: if the item does not exist
+        """
+        # Avoid _is_sharded here; it is relatively expensive for large
+        # flat trees, and this is on the hot path.
+        try:
+            (mode, subtree_id) = tree[_shard(name)]
+        except KeyError:
+            pass
+        else:
+            if stat.S_ISDIR(mode) and not is_metadata_file(
+                name.decode(DEFAULT_ENCODING)
+            ):
+                return self.repo.object_store[subtree_id][name]
+        return tree[name]
+
+    def _log_changes(
+        self, tree, changes: Iterable[tuple[bytes, bytes | None]]
+    ) -> list[tuple[str, bytes | None, bytes | None]]:
+        """Pair the changes about to be made to a tree with the old shas.
+
+        Returns: list of (name, old sha, new sha) tuples for the changelog
+        """
+        ret = []
+        for name, sha in changes:
+            try:
+                old_sha = self._lookup(tree, name)[1]
+            except KeyError:
+                old_sha = None
+            ret.append((name.decode(DEFAULT_ENCODING), old_sha, sha))
+        return ret
+
+    def _apply_changes(self, tree, changes) -> list:
+        """Add, replace or remove items in a tree, in place.
+
+        Args:
+          tree: Tree to modify
+          changes: Iterable over (name, sha) tuples, with None as sha for
+            items to remove
+        Returns: list of trees that need to be added to the object store
+        """
+        sharded = self._is_sharded(tree)
+        subtrees: dict[bytes, Tree] = {}
+        for name, sha in changes:
+            if sharded and not is_metadata_file(name.decode(DEFAULT_ENCODING)):
+                shard = _shard(name)
+                try:
+                    target = subtrees[shard]
+                except KeyError:
+                    try:
+                        (_mode, subtree_id) = tree[shard]
+                    except KeyError:
+                        target = Tree()
+                    else:
+                        target = self.repo.object_store[subtree_id]
+                    subtrees[shard] = target
+            else:
+                target = tree
+            if sha is None:
+                if name in target:
+                    del target[name]
+            else:
+                target[name] = (0o644 | stat.S_IFREG, sha)
+        objects = []
+        for shard, subtree in subtrees.items():
+            if len(subtree) == 0:
+                if shard in tree:
+                    del tree[shard]
+            else:
+                tree[shard] = (stat.S_IFDIR, subtree.id)
+                objects.append(subtree)
+        objects.append(tree)
+        return objects
+
+    def set_layout(self, layout: str, message: str | None = None) -> None:
+        """Change the tree layout of this store.
+
+        All items are moved in a single commit. Their etags don't change.
+
+        Args:
+          layout: New layout (one of LAYOUTS)
+          message: Commit message
+        """
+        if layout not in LAYOUTS:
+            raise ValueError(f"Unknown layout {layout!r}")
+        with self._commit_lock:
+            self.flush()
+            config = self.repo.get_config()
+            config.set(STORE_CONFIG_SECTION, b"layout", layout.encode("ascii"))
+            _write_repo_config(config)
+            self.layout = layout
+            tree = self._get_current_tree()
+            items = [
+                (name.encode(DEFAULT_ENCODING), sha)
+                for (name, _mode, sha) in self._iterblobs()
+            ]
+            new_tree = Tree()
+            for name, mode, sha in tree.iteritems():
+                if not stat.S_ISDIR(mode) and is_metadata_file(
+                    name.decode(DEFAULT_ENCODING)
+                ):
+                    new_tree.add(name, mode, sha)
+            objects = self._apply_changes(new_tree, items)
+            if new_tree.id == tree.id:
+                return
+            with self._syncing_objects():
+                self.repo.object_store.add_objects([(obj, None) for obj in objects])
+            if message is None:
+                message = f"Change layout to {layout}"
+            # Items keep their names and etags.
+            self._commit_tree(new_tree.id, message.encode(DEFAULT_ENCODING), [])
+
+    @contextlib.contextmanager
+    def _maintenance_lock(self):
+        # Writers hold the lock on the ref while they update it.
+        if not isinstance(self.repo.refs, DiskRefsContainer):
+            yield
+            return
+        try:
+            f = GitFile(os.fsdecode(self.repo.refs.refpath(self.ref)), "wb")
+        except FileLocked as exc:
+            raise LockedError(self.repo.path) from exc
+        try:
+            yield
+        finally:
+            f.abort()
 
     def _get_current_tree(self):
         try:
@@ -706,13 +2003,12 @@ class BareGitStore(GitStore):
         self._cached_ref_target = current_ref
         return tree
 
-    def get_etag(self, name):
+    def _get_committed_etag(self, name):
         tree = self._get_current_tree()
         name = name.encode(DEFAULT_ENCODING)
-        return tree[name][1].decode("ascii")
+        return self._lookup(tree, name)[1].decode("ascii")
 
-    def get_ctag(self):
-        """Return the ctag for this store."""
+    def _get_committed_ctag(self):
         return self._get_current_tree().id.decode("ascii")
 
     def _iterblobs(self, ctag=None):
@@ -724,6 +2020,11 @@ class BareGitStore(GitStore):
             except KeyError as exc:
                 raise InvalidCTag(ctag) from exc
         for name, mode, sha in tree.iteritems():
+            if stat.S_ISDIR(mode):
+                # Shard of a sharded layout
+                for subname, submode, subsha in self.repo.object_store[sha].iteritems():
+                    yield (subname.decode(DEFAULT_ENCODING), submode, subsha)
+                continue
             name = name.decode(DEFAULT_ENCODING)
             if is_metadata_file(name):
                 continue
@@ -738,12 +2039,14 @@ class BareGitStore(GitStore):
         repo = dulwich.repo.MemoryRepo()
         return cls(repo, **kwargs)
 
-    def _commit_tree(self, tree_id, message):
+    def _commit_tree(self, tree_id, message, changes):
         """Create a commit for the given tree.
 
         Args:
             tree_id: Tree object ID
             message: Commit message (bytes)
+            changes: List of (name, old sha, new sha) tuples for the
+              changelog
 
         Returns:
             Commit SHA
@@ -770,13 +2073,23 @@ class BareGitStore(GitStore):
             c.parents = [self.repo.refs[self.ref]]
         except KeyError:
             c.parents = []
+            old_tree_id = Tree().id
+        else:
+            old_tree_id = self.repo[c.parents[0]].tree
 
-        # Add commit to object store
-        self.repo.object_store.add_object(c)
+        with self._recording_commit():
+            # Add commit to object store
+            self.repo.object_store.add_object(c)
 
-        # Update ref
-        self.repo.refs[self.ref] = c.id
+            # Update ref
+            try:
+                self.repo.refs[self.ref] = c.id
+            except FileLocked as exc:
+                raise LockedError(self.repo.path) from exc
 
+        self._changelog.record(
+            old_tree_id.decode("ascii"), tree_id.decode("ascii"), changes
+        )
         return c.id
 
     def _import_one(
@@ -798,62 +2111,70 @@ class BareGitStore(GitStore):
         tree = self._get_current_tree()
         old_tree_id = tree.id
         name_enc = name.encode(DEFAULT_ENCODING)
-        tree[name_enc] = (0o644 | stat.S_IFREG, b.id)
-        self.repo.object_store.add_objects([(tree, ""), (b, name_enc)])
+        changes = self._log_changes(tree, [(name_enc, b.id)])
+        objects = [b] + self._apply_changes(tree, [(name_enc, b.id)])
+        for obj in objects:
+            self.repo.object_store.add_object(obj)
+        self._objects_written([obj.id for obj in objects])
         if tree.id != old_tree_id:
-            self._commit_tree(tree.id, message.encode(DEFAULT_ENCODING))
+            self._commit_tree(tree.id, message.encode(DEFAULT_ENCODING), changes)
         return b.id
 
-    def delete_one(
-        self, name, message=None, etag=None, remote_user=None, requester=None
-    ):
-        """Delete an item.
+    def _commit_changes(self, changes, message):
+        tree = self._get_current_tree()
+        old_tree_id = tree.id
+        changes = [(name.encode(DEFAULT_ENCODING), sha) for (name, sha) in changes]
+        logged = self._log_changes(tree, changes)
+        objects = self._apply_changes(tree, changes)
+        for obj in objects:
+            self.repo.object_store.add_object(obj)
+        self._objects_written([obj.id for obj in objects])
+        if tree.id != old_tree_id:
+            self._commit_tree(tree.id, message.encode(DEFAULT_ENCODING), logged)
 
-        Args:
-          name: Filename to delete
-          message: Commit message
-          etag: Optional mandatory etag of object to remove
-          remote_user: Optional user name of the actor
-          requester: Optional User-Agent or client information
-        Raises:
-          NoSuchItem: when the item doesn't exist
-          InvalidETag: If the specified ETag doesn't match the current
-        """
+    def _delete_one(self, name, message, etag, remote_user, requester):
         tree = self._get_current_tree()
         name_enc = name.encode(DEFAULT_ENCODING)
         try:
-            current_sha = tree[name_enc][1]
+            current_sha = self._lookup(tree, name_enc)[1]
         except KeyError as exc:
             raise NoSuchItem(name) from exc
         if etag is not None and current_sha != etag.encode("ascii"):
             raise InvalidETag(name, etag, current_sha.decode("ascii"))
-        del tree[name_enc]
-        self.repo.object_store.add_objects([(tree, "")])
+        objects = self._apply_changes(tree, [(name_enc, None)])
+        for obj in objects:
+            self.repo.object_store.add_object(obj)
+        self._objects_written([obj.id for obj in objects])
         if message is None:
-            fi = open_by_extension(
-                self.repo.object_store[current_sha].chunked,
+            message = self._describe_delete(
                 name,
-                self.extra_file_handlers,
+                LazyContent(
+                    functools.partial(self._get_raw, name, current_sha.decode("ascii"))
+                ),
             )
-            message = "Delete " + fi.describe(name)
-        if remote_user is not None or requester is not None:
-            message += "\n"
-            if remote_user is not None:
-                message += f"\nRemote-User: {remote_user}"
-            if requester is not None:
-                message += f"\nRequester: {requester}"
-        self._commit_tree(tree.id, message.encode(DEFAULT_ENCODING))
+        message = _add_actor_trailers(message, remote_user, requester)
+        self._commit_tree(
+            tree.id, message.encode(DEFAULT_ENCODING), [(name, current_sha, None)]
+        )
+        with self._uid_lock:
+            self._record_uid(name, None, None)
 
     @classmethod
-    def create(cls, path):
+    def create(cls, path, object_pool: str | None = None):
         """Create a new store backed by a Git repository on disk.
 
+        Args:
+          path: Path to create the repository at
+          object_pool: Optional path to a pool of objects shared with
+            other stores
         Returns: A `GitStore`
         """
         os.mkdir(path)
-        repo = dulwich.repo.Repo.init_bare(path)
-        repo._autogc_disabled = True
-        return cls(repo)
+        dulwich.repo.Repo.init_bare(path).close()
+        store = cls(_open_repo(path))
+        if object_pool is not None:
+            store.use_object_pool(object_pool)
+        return store
 
     def subdirectories(self):
         """Returns subdirectories to probe for other stores.
@@ -871,7 +2192,7 @@ class TreeGitStore(GitStore):
     def __init__(self, repo, **kwargs) -> None:
         super().__init__(repo, **kwargs)
         self._cached_index = None
-        self._cached_index_stat: tuple[int, int] | None = None
+        self._cached_index_stat: tuple[int, int, int] | None = None
         self._cached_ctag: str | None = None
 
     def _open_index(self) -> tuple["dulwich.index.Index", str | None]:
@@ -887,7 +2208,9 @@ class TreeGitStore(GitStore):
             self._cached_index_stat = None
             self._cached_ctag = None
             return self.repo.open_index(), None
-        current_stat = (st.st_mtime_ns, st.st_size)
+        # Writers replace the index, so the inode changes even if the
+        # size and modification time happen to stay the same.
+        current_stat = (st.st_ino, st.st_mtime_ns, st.st_size)
         if self._cached_index is not None and self._cached_index_stat == current_stat:
             return self._cached_index, self._cached_ctag
         index = self.repo.open_index()
@@ -896,33 +2219,59 @@ class TreeGitStore(GitStore):
         self._cached_ctag = None
         return index, None
 
+    @contextlib.contextmanager
+    def _maintenance_lock(self):
+        # Writers hold the index lock while they add objects and commit.
+        try:
+            f = GitFile(self.repo.index_path(), "wb")
+        except FileLocked as exc:
+            raise LockedError(self.repo.path) from exc
+        try:
+            yield
+        finally:
+            f.abort()
+
     def _invalidate_index_cache(self):
         self._cached_index = None
         self._cached_index_stat = None
         self._cached_ctag = None
 
     @classmethod
-    def create(cls, path, bare=True):
+    def create(cls, path, bare=True, object_pool: str | None = None):
         """Create a new store backed by a Git repository on disk.
 
+        Args:
+          path: Path to create the repository at
+          object_pool: Optional path to a pool of objects shared with
+            other stores
         Returns: A `GitStore`
         """
         os.mkdir(path)
-        repo = dulwich.repo.Repo.init(path)
-        repo._autogc_disabled = True
-        return cls(repo)
+        dulwich.repo.Repo.init(path).close()
+        store = cls(_open_repo(path))
+        if object_pool is not None:
+            store.use_object_pool(object_pool)
+        return store
 
-    def get_etag(self, name):
+    def _get_committed_etag(self, name):
         index, _ctag = self._open_index()
         name = name.encode(DEFAULT_ENCODING)
         return index[name].sha.decode("ascii")
 
-    def _commit_tree(self, index, message):
+    def _commit_tree(self, index, message, changes):
         tree = index.commit(self.repo.object_store)
-        return self.repo.get_worktree().commit(
-            message=message,
-            tree=tree,
-        )
+        self._objects_written([tree])
+        try:
+            old_tree = self.repo[self.repo.refs[self.ref]].tree
+        except KeyError:
+            old_tree = Tree().id
+        with self._recording_commit():
+            commit_id = self.repo.get_worktree().commit(
+                message=message,
+                tree=tree,
+            )
+        self._changelog.record(old_tree.decode("ascii"), tree.decode("ascii"), changes)
+        return commit_id
 
     def _import_one(
         self,
@@ -943,12 +2292,20 @@ class TreeGitStore(GitStore):
                 p = os.path.join(self.repo.path, name)
                 # Create directory if it doesn't exist
                 os.makedirs(os.path.dirname(p), exist_ok=True)
-                with open(p, "wb") as f:
-                    f.writelines(data)
+                # Stream the contents to a temporary file, so that readers
+                # never see a partially written item.
+                tmppath = p + ".tmp"
+                try:
+                    with open(tmppath, "wb") as f:
+                        f.writelines(data)
+                    os.replace(tmppath, p)
+                except BaseException:
+                    with contextlib.suppress(FileNotFoundError):
+                        os.unlink(tmppath)
+                    raise
                 st = os.lstat(p)
-                # Read the file back to create the blob since data iterator is consumed
-                with open(p, "rb") as f:
-                    blob = Blob.from_string(f.read())
+                blob = blob_from_path_and_stat(os.fsencode(p), st)
+                self._files_written([p])
                 encoded_name = name.encode(DEFAULT_ENCODING)
                 try:
                     entry = index[encoded_name]
@@ -958,8 +2315,13 @@ class TreeGitStore(GitStore):
                     isinstance(entry, IndexEntry) and blob.id != entry.sha
                 ):
                     self.repo.object_store.add_object(blob)
+                    self._objects_written([blob.id])
                     index[encoded_name] = index_entry_from_stat(st, blob.id)
-                    self._commit_tree(index, message.encode(DEFAULT_ENCODING))
+                    self._commit_tree(
+                        index,
+                        message.encode(DEFAULT_ENCODING),
+                        [(name, entry.sha if entry is not None else None, blob.id)],
+                    )
         except FileLocked as exc:
             raise LockedError(name) from exc
         except OSError as exc:
@@ -970,26 +2332,41 @@ class TreeGitStore(GitStore):
             self._invalidate_index_cache()
         return blob.id
 
-    def delete_one(
-        self,
-        name: str,
-        message: str | None = None,
-        etag: str | None = None,
-        remote_user: str | None = None,
-        requester: str | None = None,
-    ) -> None:
-        """Delete an item.
+    def _commit_changes(self, changes, message):
+        try:
+            with locked_index(self.repo.index_path()) as index:
+                logged = []
+                for name, sha in changes:
+                    p = os.path.join(self.repo.path, name)
+                    encoded_name = name.encode(DEFAULT_ENCODING)
+                    try:
+                        logged.append((name, index[encoded_name].sha, sha))
+                    except KeyError:
+                        logged.append((name, None, sha))
+                    if sha is None:
+                        try:
+                            os.unlink(p)
+                        except FileNotFoundError:
+                            pass
+                        if encoded_name in index:
+                            del index[encoded_name]
+                        continue
+                    os.makedirs(os.path.dirname(p), exist_ok=True)
+                    with open(p, "wb") as f:
+                        f.writelines(self.repo.object_store[sha].chunked)
+                    self._files_written([p])
+                    index[encoded_name] = index_entry_from_stat(os.lstat(p), sha)
+                self._commit_tree(index, message.encode(DEFAULT_ENCODING), logged)
+        except FileLocked as exc:
+            raise LockedError(self.repo.path) from exc
+        except OSError as exc:
+            if exc.errno == errno.ENOSPC:
+                raise OutOfSpaceError() from exc
+            raise
+        finally:
+            self._invalidate_index_cache()
 
-        Args:
-          name: Filename to delete
-          message: Commit message
-          etag: Optional mandatory etag of object to remove
-          remote_user: Optional user name of the actor
-          requester: Optional User-Agent or client information
-        Raise:
-          NoSuchItem: when the item doesn't exist
-          InvalidETag: If the specified ETag doesn't match the current
-        """
+    def _delete_one(self, name, message, etag, remote_user, requester):
         p = os.path.join(self.repo.path, name)
         try:
             with open(p, "rb") as f:
@@ -1000,14 +2377,8 @@ class TreeGitStore(GitStore):
         except IsADirectoryError as exc:
             raise NoSuchItem(name) from exc
         if message is None:
-            fi = open_by_extension(current_blob.chunked, name, self.extra_file_handlers)
-            message = "Delete " + fi.describe(name)
-        if remote_user is not None or requester is not None:
-            message += "\n"
-            if remote_user is not None:
-                message += f"\nRemote-User: {remote_user}"
-            if requester is not None:
-                message += f"\nRequester: {requester}"
+            message = self._describe_delete(name, current_blob.chunked)
+        message = _add_actor_trailers(message, remote_user, requester)
         if etag is not None:
             with open(p, "rb") as f:
                 current_etag = current_blob.id
@@ -1017,14 +2388,19 @@ class TreeGitStore(GitStore):
             with locked_index(self.repo.index_path()) as index:
                 os.unlink(p)
                 del index[name.encode(DEFAULT_ENCODING)]
-                self._commit_tree(index, message.encode(DEFAULT_ENCODING))
+                self._commit_tree(
+                    index,
+                    message.encode(DEFAULT_ENCODING),
+                    [(name, current_blob.id, None)],
+                )
         except FileLocked:
             raise LockedError(name)
         finally:
             self._invalidate_index_cache()
+        with self._uid_lock:
+            self._record_uid(name, None, None)
 
-    def get_ctag(self) -> str:
-        """Return the ctag for this store."""
+    def _get_committed_ctag(self) -> str:
         index, ctag = self._open_index()
         if ctag is not None:
             return ctag
@@ -19,9 +19,16 @@
 
 """Indexing."""
 
+import array
 import collections
+import math
+import os
+import sqlite3
+import struct
+import sys
+import threading
 from logging import getLogger
-from collections.abc import Iterable, Iterator
+from collections.abc import Iterable, Iterator, Set
 
 logger = getLogger("xandikos")
 
@@ -33,6 +40,33 @@ IndexDict = dict[IndexKey, IndexValue]
 
 DEFAULT_INDEXING_THRESHOLD = 5
 
+# Number of filter passes after which index key statistics are halved.
+INDEX_STATS_DECAY_INTERVAL = 1000
+
+# Number of index planner decisions to remember.
+INDEX_DECISION_HISTORY = 100
+
+MEMORY_INDEX_BACKEND = "memory"
+COMPACT_INDEX_BACKEND = "compact"
+SQLITE_INDEX_BACKEND = "sqlite"
+SHARED_INDEX_BACKEND = "shared"
+INDEX_BACKENDS = (
+    MEMORY_INDEX_BACKEND,
+    COMPACT_INDEX_BACKEND,
+    SQLITE_INDEX_BACKEND,
+    SHARED_INDEX_BACKEND,
+)
+DEFAULT_INDEX_BACKEND = MEMORY_INDEX_BACKEND
+
+# Default memory budget for the process-wide shared index, in bytes.
+DEFAULT_SHARED_INDEX_BUDGET = 64 * 1024 * 1024
+
+# Name of the on-disk index file, relative to the store's control directory.
+SQLITE_INDEX_FILENAME = "xandikos-index.sqlite"
+
+# Version of the layout of the on-disk index.
+SQLITE_INDEX_SCHEMA_VERSION = 1
+
 
 class Index:
     """Index management."""
@@ -42,29 +76,74 @@ class Index:
         raise NotImplementedError(self.available_keys)
 
     def get_values(self, name: str, etag: str, keys: list[IndexKey]):
-        """Get the values for specified keys for a name."""
+        """Get the values for specified keys for a name.
+
+        :raise KeyError: If the item has not been indexed for all of the keys
+        """
         raise NotImplementedError(self.get_values)
 
     def iter_etags(self) -> Iterator[str]:
         """Return all the etags covered by this index."""
         raise NotImplementedError(self.iter_etags)
 
+    def add_values(self, name: str, etag: str, values: IndexDict) -> None:
+        """Store the index values for a particular etag.
+
+        Values for keys that are not being indexed are ignored.
+        """
+        raise NotImplementedError(self.add_values)
+
+    def remove_values(self, etags: Iterable[str]) -> None:
+        """Drop the index values for the specified etags."""
+        raise NotImplementedError(self.remove_values)
+
+    def get_indexed_ctag(self) -> str | None:
+        """Return the ctag for which all items have been indexed.
+
+        Returns: ctag, or None if the index has not been fully populated
+        """
+        raise NotImplementedError(self.get_indexed_ctag)
+
+    def set_indexed_ctag(self, ctag: str | None) -> None:
+        """Record that all items in a ctag have been indexed."""
+        raise NotImplementedError(self.set_indexed_ctag)
+
+    def reset(self, keys: Iterable[IndexKey]) -> None:
+        """Drop all values and start indexing the specified keys."""
+        raise NotImplementedError(self.reset)
+
+    def add_keys(self, keys: Iterable[IndexKey]) -> None:
+        """Start indexing additional keys, keeping values for existing keys.
+
+        Items that have already been indexed are not considered indexed
+        for the new keys until their values are added again.
+        """
+        raise NotImplementedError(self.add_keys)
+
+    def remove_keys(self, keys: Iterable[IndexKey]) -> None:
+        """Stop indexing the specified keys and drop their values."""
+        raise NotImplementedError(self.remove_keys)
+
 
 class MemoryIndex(Index):
     def __init__(self) -> None:
         self._indexes: dict[IndexKey, dict[str, IndexValue]] = {}
-        self._in_index: set[str] = set()
+        # Items are covered for the keys that were added in or before the
+        # generation in which they were indexed.
+        self._generation = 0
+        self._key_generations: dict[IndexKey, int] = {}
+        self._in_index: dict[str, int] = {}
+        self._indexed_ctag: str | None = None
 
     def available_keys(self):
         return self._indexes.keys()
 
     def get_values(self, name, etag, keys):
-        if etag not in self._in_index:
-            raise KeyError(etag)
+        generation = self._in_index[etag]
         indexes = {}
         for k in keys:
-            if k not in self._indexes:
-                raise AssertionError
+            if self._key_generations.get(k, math.inf) > generation:
+                raise KeyError(etag)
             try:
                 indexes[k] = self._indexes[k][etag]
             except KeyError:
@@ -72,57 +151,1382 @@ class MemoryIndex(Index):
         return indexes
 
     def iter_etags(self):
-        return iter(self._in_index)
+        generation = max(self._key_generations.values(), default=0)
+        return (etag for (etag, g) in self._in_index.items() if g >= generation)
 
     def add_values(self, name, etag, values):
         for k, v in values.items():
-            if k not in self._indexes:
-                raise AssertionError
-            self._indexes[k][etag] = v
-        self._in_index.add(etag)
+            if k in self._indexes:
+                self._indexes[k][etag] = v
+        self._in_index[etag] = self._generation
+
+    def remove_values(self, etags):
+        for etag in etags:
+            self._in_index.pop(etag, None)
+            for values in self._indexes.values():
+                values.pop(etag, None)
+
+    def get_indexed_ctag(self):
+        return self._indexed_ctag
+
+    def set_indexed_ctag(self, ctag):
+        self._indexed_ctag = ctag
 
     def reset(self, keys):
-        self._in_index = set()
+        self._in_index = {}
         self._indexes = {}
+        self._key_generations = {}
+        self._indexed_ctag = None
         for key in keys:
             self._indexes[key] = {}
+            self._key_generations[key] = self._generation
+
+    def add_keys(self, keys):
+        new_keys = set(keys) - set(self._indexes)
+        if not new_keys:
+            return
+        self._generation += 1
+        for key in new_keys:
+            self._indexes[key] = {}
+            self._key_generations[key] = self._generation
+        self._indexed_ctag = None
+
+    def remove_keys(self, keys):
+        for key in keys:
+            self._indexes.pop(key, None)
+            self._key_generations.pop(key, None)
+
+
+# Size of a binary etag in a CompactMemoryIndex; git object ids.
+COMPACT_ETAG_SIZE = 20
+
+# Slots in the hash table of a CompactMemoryIndex that are empty, or whose
+# row was removed. Other slots hold the row number plus one.
+_EMPTY_SLOT = 0
+_REMOVED_SLOT = -1
+
+# Initial number of slots in the hash table of a CompactMemoryIndex.
+_INITIAL_SLOTS = 8
+
+
+def _pack_etag(etag: str) -> bytes | None:
+    """Pack a hex etag into its binary form, if it round-trips exactly."""
+    if len(etag) != COMPACT_ETAG_SIZE * 2:
+        return None
+    try:
+        packed = bytes.fromhex(etag)
+    except ValueError:
+        return None
+    if packed.hex() != etag:
+        return None
+    return packed
+
+
+def _get_bit(bits: bytearray, i: int) -> bool:
+    return i >> 3 < len(bits) and bool(bits[i >> 3] & (1 << (i & 7)))
+
+
+def _set_bit(bits: bytearray, i: int, value: bool) -> None:
+    if i >> 3 >= len(bits):
+        if not value:
+            return
+        bits.extend(bytes((i >> 3) + 1 - len(bits)))
+    if value:
+        bits[i >> 3] |= 1 << (i & 7)
+    else:
+        bits[i >> 3] &= ~(1 << (i & 7))
+
+
+class _IndexColumn:
+    """Values for a single index key in a CompactMemoryIndex, by row.
+
+    Values that consist of a single boolean are kept in bitsets. Other
+    values are kept in a list that is only allocated once needed: a
+    single bytes value is stored as is, anything else as a tuple. Rows
+    without an entry have an empty value.
+    """
+
+    __slots__ = ("_true", "_false", "_values")
+
+    def __init__(self) -> None:
+        self._true = bytearray()
+        self._false = bytearray()
+        self._values: list[bytes | tuple[bytes | bool, ...] | None] | None = None
+
+    def get(self, row: int) -> IndexValue:
+        if _get_bit(self._true, row):
+            return [True]
+        if _get_bit(self._false, row):
+            return [False]
+        if self._values is None or row >= len(self._values):
+            return []
+        value = self._values[row]
+        if value is None:
+            return []
+        if isinstance(value, bytes):
+            return [value]
+        return list(value)
+
+    def set(self, row: int, value: IndexValue, replace: bool = True) -> None:
+        if replace:
+            self.clear(row)
+        if not value:
+            return
+        if len(value) == 1 and isinstance(value[0], bool):
+            _set_bit(self._true if value[0] else self._false, row, True)
+            return
+        if self._values is None:
+            self._values = []
+        if row >= len(self._values):
+            self._values.extend([None] * (row + 1 - len(self._values)))
+        if len(value) == 1:
+            self._values[row] = value[0]  # type: ignore[assignment]
+        else:
+            self._values[row] = tuple(value)
+
+    def clear(self, row: int) -> None:
+        _set_bit(self._true, row, False)
+        _set_bit(self._false, row, False)
+        if self._values is not None and row < len(self._values):
+            self._values[row] = None
+
+
+class CompactMemoryIndex(Index):
+    """Memory index with a columnar layout.
+
+    Each etag is assigned a row: hex etags are kept once, in binary form,
+    in a single byte array and the values for each key are kept in a
+    column per key (see `_IndexColumn`). Rows are found through an open
+    addressing hash table of row numbers, which hashes the etags in the
+    byte array rather than keeping copies of them. This uses considerably
+    less memory than `MemoryIndex` for large collections.
+    """
+
+    def __init__(self) -> None:
+        self._etags = bytearray()
+        # Hash table of rows with packed etags, using linear probing
+        self._slots = array.array("q", bytes(8 * _INITIAL_SLOTS))
+        # Number of slots that are not empty, including removed ones
+        self._used_slots = 0
+        # Etags that can not be packed, and their rows
+        self._unpacked_rows: dict[str, int] = {}
+        self._unpacked_etags: dict[int, str] = {}
+        # Generation in which each row was indexed; -1 for free rows
+        self._row_generations = array.array("q")
+        self._free_rows: list[int] = []
+        self._columns: dict[IndexKey, _IndexColumn] = {}
+        self._generation = 0
+        self._key_generations: dict[IndexKey, int] = {}
+        self._indexed_ctag: str | None = None
+
+    def _lookup(self, etag: str) -> int:
+        packed = _pack_etag(etag)
+        if packed is None:
+            return self._unpacked_rows[etag]
+        slot = self._find_slot(packed)
+        if slot is None:
+            raise KeyError(etag)
+        return self._slots[slot] - 1
+
+    def _find_slot(self, packed: bytes) -> int | None:
+        """Find the slot for the row of a packed etag, if there is one."""
+        slots = self._slots
+        mask = len(slots) - 1
+        # Etags are hashes already.
+        i = int.from_bytes(packed[:8], "little") & mask
+        while True:
+            value = slots[i]
+            if value == _EMPTY_SLOT:
+                return None
+            if value != _REMOVED_SLOT:
+                offset = (value - 1) * COMPACT_ETAG_SIZE
+                if self._etags[offset : offset + COMPACT_ETAG_SIZE] == packed:
+                    return i
+            i = (i + 1) & mask
+
+    def _insert_slot(self, packed: bytes, row: int) -> None:
+        """Add a row for a packed etag that is not in the table yet."""
+        if (self._used_slots + 1) * 2 > len(self._slots):
+            self._resize_slots()
+        slots = self._slots
+        mask = len(slots) - 1
+        i = int.from_bytes(packed[:8], "little") & mask
+        while slots[i] > 0:
+            i = (i + 1) & mask
+        if slots[i] == _EMPTY_SLOT:
+            self._used_slots += 1
+        slots[i] = row + 1
+
+    def _resize_slots(self) -> None:
+        """Rebuild the hash table, dropping removed slots."""
+        rows = [value - 1 for value in self._slots if value > 0]
+        size = _INITIAL_SLOTS
+        while len(rows) * 4 > size:
+            size *= 2
+        self._slots = array.array("q", bytes(8 * size))
+        self._used_slots = 0
+        for row in rows:
+            offset = row * COMPACT_ETAG_SIZE
+            self._insert_slot(self._etags[offset : offset + COMPACT_ETAG_SIZE], row)
+
+    def _etag(self, row: int) -> str:
+        try:
+            return self._unpacked_etags[row]
+        except KeyError:
+            offset = row * COMPACT_ETAG_SIZE
+            return self._etags[offset : offset + COMPACT_ETAG_SIZE].hex()
+
+    def available_keys(self):
+        return self._columns.keys()
+
+    def get_values(self, name, etag, keys):
+        row = self._lookup(etag)
+        generation = self._row_generations[row]
+        indexes = {}
+        for k in keys:
+            if self._key_generations.get(k, math.inf) > generation:
+                raise KeyError(etag)
+            indexes[k] = self._columns[k].get(row)
+        return indexes
+
+    def iter_etags(self):
+        generation = max(self._key_generations.values(), default=0)
+        return (
+            self._etag(row)
+            for (row, row_generation) in enumerate(self._row_generations)
+            if row_generation >= generation
+        )
+
+    def add_values(self, name, etag, values):
+        packed = _pack_etag(etag)
+        try:
+            row = self._lookup(etag)
+        except KeyError:
+            row = self._allocate_row(etag, packed)
+            # New and freed rows have no values left to clear.
+            replace = False
+        else:
+            replace = True
+        for k, v in values.items():
+            try:
+                column = self._columns[k]
+            except KeyError:
+                continue
+            column.set(row, v, replace)
+        self._row_generations[row] = self._generation
+
+    def _allocate_row(self, etag: str, packed: bytes | None) -> int:
+        if self._free_rows:
+            row = self._free_rows.pop()
+        else:
+            row = len(self._row_generations)
+            self._row_generations.append(-1)
+            self._etags.extend(bytes(COMPACT_ETAG_SIZE))
+        if packed is None:
+            self._unpacked_etags[row] = etag
+            self._unpacked_rows[etag] = row
+        else:
+            offset = row * COMPACT_ETAG_SIZE
+            self._etags[offset : offset + COMPACT_ETAG_SIZE] = packed
+            self._insert_slot(packed, row)
+        return row
+
+    def remove_values(self, etags):
+        for etag in etags:
+            packed = _pack_etag(etag)
+            if packed is None:
+                row = self._unpacked_rows.pop(etag, None)
+                if row is None:
+                    continue
+                del self._unpacked_etags[row]
+            else:
+                slot = self._find_slot(packed)
+                if slot is None:
+                    continue
+                row = self._slots[slot] - 1
+                self._slots[slot] = _REMOVED_SLOT
+            self._row_generations[row] = -1
+            for column in self._columns.values():
+                column.clear(row)
+            self._free_rows.append(row)
+
+    def get_indexed_ctag(self):
+        return self._indexed_ctag
+
+    def set_indexed_ctag(self, ctag):
+        self._indexed_ctag = ctag
+
+    def reset(self, keys):
+        self._etags = bytearray()
+        self._slots = array.array("q", bytes(8 * _INITIAL_SLOTS))
+        self._used_slots = 0
+        self._unpacked_rows = {}
+        self._unpacked_etags = {}
+        self._row_generations = array.array("q")
+        self._free_rows = []
+        self._columns = {}
+        self._key_generations = {}
+        self._indexed_ctag = None
+        for key in keys:
+            self._columns[key] = _IndexColumn()
+            self._key_generations[key] = self._generation
+
+    def add_keys(self, keys):
+        new_keys = set(keys) - set(self._columns)
+        if not new_keys:
+            return
+        self._generation += 1
+        for key in new_keys:
+            self._columns[key] = _IndexColumn()
+            self._key_generations[key] = self._generation
+        self._indexed_ctag = None
+
+    def remove_keys(self, keys):
+        for key in keys:
+            self._columns.pop(key, None)
+            self._key_generations.pop(key, None)
+
+
+def _estimate_index_value_size(value: IndexValue) -> int:
+    """Estimate the memory used by an index value, in bytes."""
+    size = sys.getsizeof(value)
+    for v in value:
+        if isinstance(v, bytes):
+            size += sys.getsizeof(v)
+    return size
+
+
+def _estimate_index_values_size(values: IndexDict) -> int:
+    """Estimate the memory used by a set of index values, in bytes."""
+    return sys.getsizeof(values) + sum(
+        _estimate_index_value_size(value) for value in values.values()
+    )
+
+
+class SharedIndexCache:
+    """Process-wide cache of index values, keyed by etag.
+
+    The etags of git-backed stores are blob SHAs, so items with identical
+    contents in different collections (e.g. copies of an invitation or a
+    subscribed holiday calendar) share a single set of index values.
+
+    When the estimated size of the cached values exceeds the memory
+    budget, the least recently used entries are evicted.
+    """
+
+    def __init__(self, budget: int = DEFAULT_SHARED_INDEX_BUDGET) -> None:
+        self.budget = budget
+        self.size = 0
+        # Number of entries evicted so far
+        self.evictions = 0
+        self._entries: collections.OrderedDict[str, tuple[IndexDict, int]] = (
+            collections.OrderedDict()
+        )
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}(budget={self.budget!r})"
+
+    def set_budget(self, budget: int) -> None:
+        """Change the memory budget, evicting entries if necessary."""
+        with self._lock:
+            self.budget = budget
+            self._evict()
+
+    def get(self, etag: str) -> IndexDict:
+        """Return the cached index values for an etag.
+
+        :raise KeyError: If there are no values for the etag
+        """
+        with self._lock:
+            (values, size) = self._entries[etag]
+            self._entries.move_to_end(etag)
+            return values
+
+    def add(self, etag: str, values: IndexDict) -> None:
+        """Add index values for an etag, merging with any existing ones."""
+        with self._lock:
+            try:
+                (existing, size) = self._entries.pop(etag)
+            except KeyError:
+                merged = dict(values)
+            else:
+                self.size -= size
+                merged = dict(existing)
+                merged.update(values)
+            size = _estimate_index_values_size(merged)
+            self._entries[etag] = (merged, size)
+            self.size += size
+            self._evict()
+
+    def iter_etags(
+        self, keys: Iterable[IndexKey], etags: Iterable[str]
+    ) -> Iterator[str]:
+        """Iterate over the etags that have values for all specified keys.
+
+        Args:
+          keys: Index keys that values should be present for
+          etags: Etags to consider
+        """
+        keys = set(keys)
+        with self._lock:
+            found = [
+                etag
+                for etag in etags
+                if etag in self._entries and keys.issubset(self._entries[etag][0])
+            ]
+        return iter(found)
+
+    def clear(self) -> None:
+        """Remove all cached values."""
+        with self._lock:
+            self._entries.clear()
+            self.size = 0
+
+    def _evict(self) -> None:
+        while self.size > self.budget and self._entries:
+            (etag, (values, size)) = self._entries.popitem(last=False)
+            self.size -= size
+            self.evictions += 1
+
+    def __contains__(self, etag: str) -> bool:
+        return etag in self._entries
+
+
+# Cache shared by all stores using the shared index backend.
+SHARED_INDEX_CACHE = SharedIndexCache()
+
+
+class SharedIndex(Index):
+    """Index for a single store, backed by a shared cache.
+
+    Each store keeps its own set of available keys and tracks the etags
+    of its own items, but values are stored in (and may be evicted from)
+    the shared cache. Since values are keyed only by etag, this must only
+    be used for stores whose etags are derived from the item contents.
+    """
+
+    def __init__(self, cache: SharedIndexCache | None = None) -> None:
+        if cache is None:
+            cache = SHARED_INDEX_CACHE
+        self._cache = cache
+        self._keys: frozenset[IndexKey] = frozenset()
+        # Etags with values for this store, in the order they were added
+        self._etags: dict[str, None] = {}
+        self._indexed_ctag: str | None = None
+        # Evictions from the cache when the indexed ctag was last checked
+        self._evictions = cache.evictions
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self._cache!r})"
+
+    def available_keys(self):
+        return set(self._keys)
+
+    def get_values(self, name, etag, keys):
+        values = self._cache.get(etag)
+        indexes = {}
+        for k in keys:
+            if k not in self._keys:
+                raise KeyError(etag)
+            # Values for this key may not have been computed yet, if
+            # the item was indexed by a store with different keys.
+            indexes[k] = values[k]
+        # The item may have been indexed by another store with the same
+        # contents; from now on it counts as indexed for this store too.
+        self._etags[etag] = None
+        return indexes
+
+    def iter_etags(self):
+        return self._cache.iter_etags(self._keys, list(self._etags))
+
+    def add_values(self, name, etag, values):
+        # Only store the values that were computed; keys may have been
+        # added since, and a missing value would read as "not present".
+        self._cache.add(etag, {k: v for k, v in values.items() if k in self._keys})
+        self._etags[etag] = None
+
+    def remove_values(self, etags):
+        # Other stores may have items with the same contents; values that
+        # are no longer used are evicted from the cache eventually.
+        for etag in etags:
+            self._etags.pop(etag, None)
+
+    def get_indexed_ctag(self):
+        evictions = self._cache.evictions
+        if self._indexed_ctag is not None and evictions != self._evictions:
+            # The items are no longer all indexed if any of their values
+            # were evicted.
+            if any(etag not in self._cache for etag in list(self._etags)):
+                self._indexed_ctag = None
+        self._evictions = evictions
+        return self._indexed_ctag
+
+    def set_indexed_ctag(self, ctag):
+        self._indexed_ctag = ctag
+        self._evictions = self._cache.evictions
+
+    def reset(self, keys):
+        # Values are keyed by content, so values that are already cached
+        # remain valid; only the set of keys changes.
+        self._keys = frozenset(keys)
+        self._indexed_ctag = None
+
+    def add_keys(self, keys):
+        new_keys = set(keys) - self._keys
+        if new_keys:
+            self._keys = self._keys | new_keys
+            self._indexed_ctag = None
+
+    def remove_keys(self, keys):
+        self._keys = self._keys - set(keys)
+
+
+def _encode_index_value(value: IndexValue) -> bytes:
+    ret = []
+    for v in value:
+        if v is True:
+            ret.append(b"T")
+        elif v is False:
+            ret.append(b"F")
+        else:
+            ret.append(b"B" + struct.pack(">I", len(v)) + v)
+    return b"".join(ret)
+
+
+def _decode_index_value(data: bytes) -> IndexValue:
+    ret: IndexValue = []
+    i = 0
+    while i < len(data):
+        kind = data[i : i + 1]
+        i += 1
+        if kind == b"T":
+            ret.append(True)
+        elif kind == b"F":
+            ret.append(False)
+        elif kind == b"B":
+            (length,) = struct.unpack(">I", data[i : i + 4])
+            i += 4
+            ret.append(data[i : i + length])
+            i += length
+        else:
+            raise ValueError(f"invalid index value type {kind!r}")
+    return ret
+
+
+class SqliteIndex(Index):
+    """Index that is persisted in a SQLite database.
+
+    Values are keyed by etag, so they remain valid across restarts for as
+    long as the content they were derived from is unchanged. The database
+    can be shared by several processes serving the same store: values
+    indexed by one are used by all, and changes to the set of indexed keys
+    made by one are picked up by the others.
+    """
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock, self._conn:
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            (version,) = self._conn.execute("PRAGMA user_version").fetchone()
+            if version != SQLITE_INDEX_SCHEMA_VERSION:
+                # The index only holds derived data, so rather than
+                # migrating it just start afresh.
+                for table in (
+                    "index_keys",
+                    "indexed_etags",
+                    "index_values",
+                    "index_state",
+                ):
+                    self._conn.execute(f"DROP TABLE IF EXISTS {table}")
+                self._conn.execute(
+                    f"PRAGMA user_version = {SQLITE_INDEX_SCHEMA_VERSION}"
+                )
+            # Items are covered for the keys that were added in or before
+            # the generation in which they were indexed.
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_keys ("
+                "key TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS indexed_etags ("
+                "etag TEXT PRIMARY KEY, generation INTEGER NOT NULL)"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_values ("
+                "etag TEXT NOT NULL, key TEXT NOT NULL, value BLOB NOT NULL, "
+                "PRIMARY KEY (etag, key)) WITHOUT ROWID"
+            )
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS index_state "
+                "(name TEXT PRIMARY KEY, value TEXT NOT NULL)"
+            )
+            self._keys: dict[IndexKey, int] = {}
+            self._generation = 0
+            # Changes whenever another connection modifies the database
+            self._data_version: int | None = None
+            self._refresh()
+
+    def __repr__(self) -> str:
+        return f"{type(self).__name__}({self.path!r})"
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+    def _refresh(self) -> None:
+        """Reload the indexed keys if another process may have changed them.
+
+        Must be called with the lock held.
+        """
+        (data_version,) = self._conn.execute("PRAGMA data_version").fetchone()
+        if data_version == self._data_version:
+            return
+        self._keys = dict(self._conn.execute("SELECT key, generation FROM index_keys"))
+        row = self._conn.execute(
+            "SELECT value FROM index_state WHERE name = 'generation'"
+        ).fetchone()
+        self._generation = int(row[0]) if row is not None else 0
+        self._data_version = data_version
+
+    def available_keys(self):
+        with self._lock:
+            self._refresh()
+            return set(self._keys)
+
+    def get_values(self, name, etag, keys):
+        with self._lock:
+            self._refresh()
+            rows = self._conn.execute(
+                "SELECT e.generation, v.key, v.value FROM indexed_etags e "
+                "LEFT JOIN index_values v ON v.etag = e.etag WHERE e.etag = ?",
+                (etag,),
+            ).fetchall()
+        if not rows:
+            raise KeyError(etag)
+        generation = rows[0][0]
+        stored = {key: value for (_, key, value) in rows if key is not None}
+        indexes = {}
+        for k in keys:
+            if self._keys.get(k, math.inf) > generation:
+                raise KeyError(etag)
+            try:
+                indexes[k] = _decode_index_value(stored[k])
+            except KeyError:
+                indexes[k] = []
+        return indexes
+
+    def iter_etags(self):
+        with self._lock:
+            self._refresh()
+            generation = max(self._keys.values(), default=0)
+            rows = self._conn.execute(
+                "SELECT etag FROM indexed_etags WHERE generation >= ?",
+                (generation,),
+            ).fetchall()
+        return (row[0] for row in rows)
+
+    def add_values(self, name, etag, values):
+        with self._lock, self._conn:
+            self._refresh()
+            values = {k: v for (k, v) in values.items() if k in self._keys}
+            self._conn.execute(
+                "INSERT OR REPLACE INTO indexed_etags (etag, generation) VALUES (?, ?)",
+                (etag, self._generation),
+            )
+            self._conn.executemany(
+                "INSERT OR REPLACE INTO index_values (etag, key, value) "
+                "VALUES (?, ?, ?)",
+                [(etag, k, _encode_index_value(v)) for (k, v) in values.items()],
+            )
+
+    def remove_values(self, etags):
+        params = [(etag,) for etag in etags]
+        with self._lock, self._conn:
+            self._conn.executemany("DELETE FROM index_values WHERE etag = ?", params)
+            self._conn.executemany("DELETE FROM indexed_etags WHERE etag = ?", params)
+
+    def get_indexed_ctag(self):
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value FROM index_state WHERE name = 'indexed_ctag'"
+            ).fetchone()
+        return row[0] if row is not None else None
+
+    def set_indexed_ctag(self, ctag):
+        with self._lock, self._conn:
+            self._set_indexed_ctag(ctag)
+
+    def _begin(self) -> None:
+        """Start a write transaction, with the indexed keys up to date.
+
+        Must be called with the lock held.
+        """
+        # Take the write lock straight away, so that the keys can't be
+        # changed by another process before this transaction commits.
+        self._conn.execute("BEGIN IMMEDIATE")
+        self._refresh()
+
+    def _set_indexed_ctag(self, ctag):
+        if ctag is None:
+            self._conn.execute("DELETE FROM index_state WHERE name = 'indexed_ctag'")
+        else:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO index_state (name, value) "
+                "VALUES ('indexed_ctag', ?)",
+                (ctag,),
+            )
+
+    def reset(self, keys):
+        keys = set(keys)
+        with self._lock, self._conn:
+            self._begin()
+            self._conn.execute("DELETE FROM index_values")
+            self._conn.execute("DELETE FROM indexed_etags")
+            self._conn.execute("DELETE FROM index_keys")
+            self._set_indexed_ctag(None)
+            self._conn.executemany(
+                "INSERT INTO index_keys (key, generation) VALUES (?, ?)",
+                [(k, self._generation) for k in keys],
+            )
+            self._keys = dict.fromkeys(keys, self._generation)
+
+    def add_keys(self, keys):
+        keys = set(keys)
+        with self._lock, self._conn:
+            self._begin()
+            new_keys = keys - set(self._keys)
+            if not new_keys:
+                return
+            self._generation += 1
+            self._conn.execute(
+                "INSERT OR REPLACE INTO index_state (name, value) "
+                "VALUES ('generation', ?)",
+                (str(self._generation),),
+            )
+            self._conn.executemany(
+                "INSERT INTO index_keys (key, generation) VALUES (?, ?)",
+                [(k, self._generation) for k in new_keys],
+            )
+            self._set_indexed_ctag(None)
+            self._keys.update(dict.fromkeys(new_keys, self._generation))
+
+    def remove_keys(self, keys):
+        with self._lock, self._conn:
+            self._begin()
+            keys = set(keys) & set(self._keys)
+            self._conn.executemany(
+                "DELETE FROM index_values WHERE key = ?", [(k,) for k in keys]
+            )
+            self._conn.executemany(
+                "DELETE FROM index_keys WHERE key = ?", [(k,) for k in keys]
+            )
+            for k in keys:
+                del self._keys[k]
+
+
+class _IntervalTree:
+    """Static augmented interval tree.
+
+    The tree is stored implicitly in arrays sorted by start: the root of the
+    subtree covering [lo, hi) lives at (lo + hi) // 2, and ``_max_end``
+    holds the largest end point found in the subtree rooted at each slot.
+    """
+
+    def __init__(self, intervals: Iterable[tuple[float, float, str]]) -> None:
+        entries = sorted(intervals)
+        self._starts = [entry[0] for entry in entries]
+        self._ends = [entry[1] for entry in entries]
+        self._etags = [entry[2] for entry in entries]
+        self._max_end = list(self._ends)
+        self._build(0, len(entries))
+
+    def _build(self, lo: int, hi: int) -> float:
+        if lo >= hi:
+            return -math.inf
+        mid = (lo + hi) // 2
+        max_end = max(self._ends[mid], self._build(lo, mid), self._build(mid + 1, hi))
+        self._max_end[mid] = max_end
+        return max_end
+
+    def __len__(self) -> int:
+        return len(self._starts)
+
+    def query(self, start: float, end: float, found: set[str]) -> None:
+        """Add the etags of all intervals overlapping [start, end] to found."""
+        todo = [(0, len(self._starts))]
+        while todo:
+            (lo, hi) = todo.pop()
+            if lo >= hi:
+                continue
+            mid = (lo + hi) // 2
+            if self._max_end[mid] < start:
+                continue
+            todo.append((lo, mid))
+            if self._starts[mid] <= end:
+                if self._ends[mid] >= start:
+                    found.add(self._etags[mid])
+                todo.append((mid + 1, hi))
+
+
+class TimeRangeIndex:
+    """Index of the time ranges covered by the components in each item.
+
+    Ranges are (start, end) pairs of UTC timestamps, recorded per etag and
+    component name. Open-ended ranges (e.g. for recurring components) use
+    infinite bounds. Ranges only need to be conservative: a query may
+    return items that do not actually match, but never omits any that do.
+
+    Lookups use an interval tree per component. Additions are kept in a
+    small unsorted list until there are enough of them to make rebuilding
+    the tree worthwhile; removed etags are filtered out of query results.
+    """
+
+    # Minimum number of pending additions before the tree is rebuilt.
+    REBUILD_THRESHOLD = 64
+
+    def __init__(self) -> None:
+        self._ranges: dict[str, dict[str, list[tuple[float, float]]]] = {}
+        self._trees: dict[str, _IntervalTree] = {}
+        self._pending: dict[str, list[tuple[float, float, str]]] = {}
+        self._removed = 0
+        # Number of times the index was reset
+        self.resets = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._ranges)
+
+    def covers(self, etag: str, component: str) -> bool:
+        """Check whether ranges for a component in an item are known."""
+        try:
+            return component in self._ranges[etag]
+        except KeyError:
+            return False
+
+    def add(self, etag: str, ranges: dict[str, list[tuple[float, float]]]) -> None:
+        """Record the time ranges for an item.
+
+        Args:
+          etag: Etag of the item
+          ranges: Dictionary mapping component names to lists of
+            (start, end) tuples; an empty list means the item has
+            no such components.
+        """
+        with self._lock:
+            existing = self._ranges.setdefault(etag, {})
+            for component, intervals in ranges.items():
+                if component in existing:
+                    continue
+                existing[component] = list(intervals)
+                self._pending.setdefault(component, []).extend(
+                    (start, end, etag) for (start, end) in intervals
+                )
+
+    def remove(self, etags: Iterable[str]) -> None:
+        """Forget the time ranges for a set of items."""
+        with self._lock:
+            for etag in etags:
+                if self._ranges.pop(etag, None) is not None:
+                    self._removed += 1
+
+    def retain(self, etags: Set[str]) -> None:
+        """Forget the time ranges for all items except those specified."""
+        self.remove([etag for etag in self._ranges if etag not in etags])
+
+    def reset(self) -> None:
+        """Forget all time ranges."""
+        with self._lock:
+            self.resets += 1
+            self._ranges = {}
+            self._trees = {}
+            self._pending = {}
+            self._removed = 0
+
+    def _rebuild(self) -> None:
+        self._trees = {}
+        self._pending = {}
+        self._removed = 0
+        intervals: dict[str, list[tuple[float, float, str]]] = {}
+        for etag, ranges in self._ranges.items():
+            for component, component_ranges in ranges.items():
+                intervals.setdefault(component, []).extend(
+                    (start, end, etag) for (start, end) in component_ranges
+                )
+        for component, component_intervals in intervals.items():
+            self._trees[component] = _IntervalTree(component_intervals)
+
+    def query(self, component: str, start: float, end: float) -> set[str]:
+        """Find the items with a component that may overlap a time range.
+
+        Args:
+          component: Component name (e.g. "VEVENT")
+          start: Start of the range, as UTC timestamp
+          end: End of the range, as UTC timestamp
+        Returns: set of etags
+        """
+        with self._lock:
+            pending = sum(len(p) for p in self._pending.values())
+            if pending + self._removed > max(
+                self.REBUILD_THRESHOLD, len(self._ranges) // 4
+            ):
+                self._rebuild()
+            found: set[str] = set()
+            try:
+                tree = self._trees[component]
+            except KeyError:
+                pass
+            else:
+                tree.query(start, end, found)
+            for entry_start, entry_end, etag in self._pending.get(component, []):
+                if entry_start <= end and entry_end >= start:
+                    found.add(etag)
+            if self._removed:
+                found.intersection_update(self._ranges)
+            return found
+
+
+def trigrams(text: str) -> set[str]:
+    """Return the set of trigrams in a string."""
+    return {text[i : i + 3] for i in range(len(text) - 2)}
+
+
+class TrigramIndex:
+    """Inverted index from trigrams to items, for substring searches.
+
+    For each index key, maps the trigrams found in the (normalized) text of
+    an item's values to the etags of the items. Any item with a value that
+    contains a string of three or more characters has all of that
+    string's trigrams.
+    """
+
+    def __init__(self) -> None:
+        self._postings: dict[IndexKey, dict[str, set[str]]] = {}
+        self._trigrams: dict[str, dict[IndexKey, set[str]]] = {}
+        # Number of times the index was reset
+        self.resets = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._trigrams)
+
+    def covers(self, etag: str, key: IndexKey) -> bool:
+        """Check whether the trigrams for a key of an item are known."""
+        try:
+            return key in self._trigrams[etag]
+        except KeyError:
+            return False
+
+    def add(self, etag: str, key: IndexKey, texts: Iterable[str]) -> None:
+        """Record the text of the values of an item for a key.
+
+        Args:
+          etag: Etag of the item
+          key: Index key
+          texts: Normalized text of each of the values
+        """
+        found: set[str] = set()
+        for text in texts:
+            found.update(trigrams(text))
+        with self._lock:
+            existing = self._trigrams.setdefault(etag, {})
+            if key in existing:
+                return
+            existing[key] = found
+            postings = self._postings.setdefault(key, {})
+            for trigram in found:
+                postings.setdefault(trigram, set()).add(etag)
+
+    def remove(self, etags: Iterable[str]) -> None:
+        """Forget the text of a set of items."""
+        with self._lock:
+            for etag in etags:
+                for key, found in self._trigrams.pop(etag, {}).items():
+                    postings = self._postings[key]
+                    for trigram in found:
+                        postings[trigram].discard(etag)
+                        if not postings[trigram]:
+                            del postings[trigram]
+
+    def retain(self, etags: Set[str]) -> None:
+        """Forget the text of all items except those specified."""
+        self.remove([etag for etag in self._trigrams if etag not in etags])
+
+    def reset(self) -> None:
+        """Forget the text of all items."""
+        with self._lock:
+            self.resets += 1
+            self._postings = {}
+            self._trigrams = {}
+
+    def query(self, key: IndexKey, text: str) -> set[str] | None:
+        """Find the items with a value for a key that may contain a string.
+
+        Args:
+          key: Index key
+          text: Normalized string to search for
+        Returns: set of etags, or None if the string is too short to
+          narrow down the items
+        """
+        needle = trigrams(text)
+        if not needle:
+            return None
+        with self._lock:
+            postings = self._postings.get(key, {})
+            candidates = sorted(
+                (postings.get(trigram, set()) for trigram in needle), key=len
+            )
+            return set(candidates[0]).intersection(*candidates[1:])
+
+
+class ComponentIndex:
+    """Index of the component types that are present in each item.
+
+    For each component key (e.g. "C=VCALENDAR/C=VTODO"), keeps the etags
+    of the items that contain such a component and of those that do not.
+    A filter that only checks for the presence or absence of components
+    can then be answered with a single set intersection.
+    """
+
+    def __init__(self) -> None:
+        self._present: dict[IndexKey, set[str]] = {}
+        self._absent: dict[IndexKey, set[str]] = {}
+        self._components: dict[str, dict[IndexKey, bool]] = {}
+        # Number of times the index was reset
+        self.resets = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._components)
+
+    def covers(self, etag: str, keys: Iterable[IndexKey]) -> bool:
+        """Check whether the presence of components in an item is known."""
+        try:
+            components = self._components[etag]
+        except KeyError:
+            return False
+        return all(key in components for key in keys)
+
+    def add(self, etag: str, components: dict[IndexKey, bool]) -> None:
+        """Record which components are present in an item.
+
+        Args:
+          etag: Etag of the item
+          components: Dictionary mapping component keys to whether the
+            item contains such a component
+        """
+        with self._lock:
+            existing = self._components.setdefault(etag, {})
+            for key, present in components.items():
+                if key in existing:
+                    continue
+                existing[key] = present
+                (self._present if present else self._absent).setdefault(key, set()).add(
+                    etag
+                )
+
+    def remove(self, etags: Iterable[str]) -> None:
+        """Forget the components of a set of items."""
+        with self._lock:
+            for etag in etags:
+                for key, present in self._components.pop(etag, {}).items():
+                    (self._present if present else self._absent)[key].discard(etag)
+
+    def retain(self, etags: Set[str]) -> None:
+        """Forget the components of all items except those specified."""
+        self.remove([etag for etag in self._components if etag not in etags])
+
+    def reset(self) -> None:
+        """Forget the components of all items."""
+        with self._lock:
+            self.resets += 1
+            self._present = {}
+            self._absent = {}
+            self._components = {}
+
+    def query(self, components: Iterable[tuple[IndexKey, bool]]) -> set[str]:
+        """Find the items that match a set of component conditions.
+
+        Args:
+          components: Iterable of (component key, present) tuples
+        Returns: set of etags of the items known to contain (or, if present
+          is False, known not to contain) each of the components
+        """
+        with self._lock:
+            candidates = sorted(
+                (
+                    (self._present if present else self._absent).get(key, set())
+                    for (key, present) in components
+                ),
+                key=len,
+            )
+            if not candidates:
+                return set(self._components)
+            return set(candidates[0]).intersection(*candidates[1:])
+
+
+def open_index(backend: str, directory: str | None = None) -> Index:
+    """Create an index using the specified backend.
+
+    Args:
+      backend: Name of the index backend (one of INDEX_BACKENDS)
+      directory: Directory in which persistent backends keep their data.
+        Persistent backends fall back to a memory index if this is None.
+    Returns: An `Index`
+    """
+    if backend == MEMORY_INDEX_BACKEND:
+        return MemoryIndex()
+    elif backend == COMPACT_INDEX_BACKEND:
+        return CompactMemoryIndex()
+    elif backend == SHARED_INDEX_BACKEND:
+        return SharedIndex()
+    elif backend == SQLITE_INDEX_BACKEND:
+        if directory is None:
+            logger.debug("No directory for persistent index, using memory index.")
+            return MemoryIndex()
+        return SqliteIndex(os.path.join(directory, SQLITE_INDEX_FILENAME))
+    else:
+        raise ValueError(f"unknown index backend {backend!r}")
+
+
+class IndexKeyStats:
+    """Statistics on the use of an index key by filters."""
+
+    def __init__(self) -> None:
+        # Number of filter passes that were answered using the key, and
+        # that needed the key while it was not indexed. These decay over
+        # time, so that they reflect recent use.
+        self.hits = 0.0
+        self.misses = 0.0
+        # Number of items checked and matched by filter passes using the key.
+        self.checked = 0
+        self.matched = 0
+        # Estimated memory used by the values for the key, in bytes, and
+        # the number of items with values for the key.
+        self.size = 0
+        self.count = 0
+
+    def __repr__(self) -> str:
+        return (
+            f"{type(self).__name__}(hits={self.hits!r}, misses={self.misses!r}, "
+            f"selectivity={self.selectivity!r}, size={self.size!r})"
+        )
+
+    @property
+    def hit_rate(self) -> float | None:
+        """Fraction of filter passes needing the key that could use it."""
+        total = self.hits + self.misses
+        if not total:
+            return None
+        return self.hits / total
+
+    @property
+    def selectivity(self) -> float | None:
+        """Fraction of items checked that matched filters using the key."""
+        if not self.checked:
+            return None
+        return self.matched / self.checked
+
+    def score(self) -> float:
+        """Estimate the benefit of indexing the key, per byte of memory.
+
+        Items that don't match are never parsed when filtering with an index,
+        so keys used by more selective filters are worth more.
+        """
+        selectivity = self.selectivity
+        if selectivity is None:
+            selectivity = 1.0
+        return self.hits * (2.0 - selectivity) / max(self.size, 1)
 
 
 class AutoIndexManager:
-    def __init__(self, index, threshold: int | None = None) -> None:
+    """Decide which keys to index, based on the filters that are used.
+
+    Keys that filters need but that are not indexed yet are added once they
+    have been needed more than ``indexing_threshold`` times, keeping the
+    values for the keys that are already indexed.
+
+    Keys in ``pinned`` are always indexed. If a memory budget is set and
+    the estimated size of the values for the other keys exceeds it, the
+    keys with the lowest benefit per byte are evicted. Only the total size
+    per key is kept, and only while there is a budget. Recent decisions are
+    kept in ``decisions``.
+    """
+
+    def __init__(
+        self, index, threshold: int | None = None, memory_budget: int | None = None
+    ) -> None:
         self.index = index
         self.desired: dict[IndexKey, int] = collections.defaultdict(lambda: 0)
         if threshold is None:
             threshold = DEFAULT_INDEXING_THRESHOLD
         self.indexing_threshold = threshold
+        self.memory_budget = memory_budget
+        self.pinned: set[IndexKey] = set()
+        self.stats: dict[IndexKey, IndexKeyStats] = collections.defaultdict(
+            IndexKeyStats
+        )
+        # (action, key, reason) tuples
+        self.decisions: collections.deque[tuple[str, IndexKey, str]] = (
+            collections.deque(maxlen=INDEX_DECISION_HISTORY)
+        )
+        self._passes = 0
+        self._lock = threading.Lock()
 
     def find_present_keys(
         self, necessary_keys: Iterable[Iterable[IndexKey]]
     ) -> Iterable[IndexKey] | None:
-        available_keys = self.index.available_keys()
         needed_keys = []
         missing_keys: list[IndexKey] = []
         new_index_keys = set()
-        for keys in necessary_keys:
-            found = False
-            for key in keys:
-                if key in available_keys:
-                    needed_keys.append(key)
-                    found = True
-            if not found:
+        with self._lock:
+            self._tick()
+            self._evict()
+            available_keys = self.index.available_keys()
+            for keys in necessary_keys:
+                found = False
                 for key in keys:
-                    self.desired[key] += 1
-                    if self.desired[key] > self.indexing_threshold:
-                        new_index_keys.add(key)
-                missing_keys.extend(keys)
-        if not missing_keys:
-            return needed_keys
+                    if key in available_keys:
+                        needed_keys.append(key)
+                        found = True
+                if not found:
+                    for key in keys:
+                        self.desired[key] += 1
+                        self.stats[key].misses += 1
+                        if self.desired[key] > self.indexing_threshold:
+                            new_index_keys.add(key)
+                    missing_keys.extend(keys)
+            if not missing_keys:
+                for key in needed_keys:
+                    self.stats[key].hits += 1
+                return needed_keys
 
-        if new_index_keys:
-            logger.debug("Adding new index keys: %r", new_index_keys)
-            self.index.reset(set(self.index.available_keys()) | new_index_keys)
+            if new_index_keys:
+                logger.debug("Adding new index keys: %r", new_index_keys)
+                for key in new_index_keys:
+                    self._decide(
+                        "add", key, f"needed {self.desired[key]} times while missing"
+                    )
+                self.index.add_keys(new_index_keys)
 
         # TODO(jelmer): Maybe best to check if missing_keys are satisfiable
         # now?
 
         return None
+
+    def record_values(self, name: str, etag: str, values: IndexDict) -> None:
+        """Record index values that are about to be added to the index.
+
+        Values that are in the index for the same etag are replaced.
+        """
+        if self.memory_budget is None:
+            return
+        with self._lock:
+            old_values = self._get_indexed_values(name, etag, list(values))
+            for key, value in values.items():
+                stats = self.stats[key]
+                try:
+                    old_value = old_values[key]
+                except KeyError:
+                    stats.count += 1
+                else:
+                    stats.size -= _estimate_index_value_size(old_value)
+                stats.size += _estimate_index_value_size(value)
+
+    def forget_values(self, etags: Iterable[str]) -> None:
+        """Record that the index values for some etags were removed.
+
+        The sizes of the values are no longer known, so the average size
+        for each key is subtracted.
+        """
+        if self.memory_budget is None:
+            return
+        removed = len(list(etags))
+        with self._lock:
+            for stats in self.stats.values():
+                count = min(removed, stats.count)
+                if not count:
+                    continue
+                stats.size -= stats.size * count // stats.count
+                stats.count -= count
+
+    def _get_indexed_values(
+        self, name: str, etag: str, keys: list[IndexKey]
+    ) -> IndexDict:
+        try:
+            return self.index.get_values(name, etag, keys)
+        except KeyError:
+            pass
+        try:
+            self.index.get_values(name, etag, [])
+        except KeyError:
+            return {}
+        # Indexed before some of the keys were added.
+        values = {}
+        for key in keys:
+            try:
+                values.update(self.index.get_values(name, etag, [key]))
+            except KeyError:
+                pass
+        return values
+
+    def record_pass(self, keys: Iterable[IndexKey], checked: int, matched: int) -> None:
+        """Record the outcome of a filter pass that used the index.
+
+        Args:
+          keys: Index keys used by the filter
+          checked: Number of items checked
+          matched: Number of items that matched
+        """
+        with self._lock:
+            for key in keys:
+                self.stats[key].checked += checked
+                self.stats[key].matched += matched
+
+    def estimated_size(self) -> int:
+        """Return the estimated size of the values of unpinned keys, in bytes."""
+        return sum(
+            self.stats[key].size
+            for key in self.index.available_keys()
+            if key not in self.pinned
+        )
+
+    def _tick(self) -> None:
+        self._passes += 1
+        if self._passes % INDEX_STATS_DECAY_INTERVAL == 0:
+            for stats in self.stats.values():
+                stats.hits /= 2
+                stats.misses /= 2
+
+    def _decide(self, action: str, key: IndexKey, reason: str) -> None:
+        logger.info("Index planner: %s %s (%s)", action, key, reason)
+        self.decisions.append((action, key, reason))
+
+    def _evict(self) -> None:
+        if self.memory_budget is None:
+            return
+        size = self.estimated_size()
+        while size > self.memory_budget:
+            candidates = set(self.index.available_keys()) - self.pinned
+            if not candidates:
+                break
+            victim = min(candidates, key=lambda k: self.stats[k].score())
+            stats = self.stats[victim]
+            self._decide(
+                "evict",
+                victim,
+                f"{size} bytes over budget of {self.memory_budget}; "
+                f"score {stats.score():.3g}",
+            )
+            self.index.remove_keys([victim])
+            size -= stats.size
+            stats.size = 0
+            stats.count = 0
+            # The key has to be needed often enough again to come back.
+            self.desired[victim] = 0
@@ -72,6 +72,10 @@ class MemoryStore(Store):
         for name, (content_type, data, etag) in self._items.items():
             yield (name, content_type, etag)
 
+    def lookup_uid(self, uid: str) -> tuple[str, str]:
+        """Find the item with a particular UID."""
+        return self._uid_to_name[uid]
+
     def _check_duplicate(self, uid, name, replace_etag):
         if uid is not None and self._check_for_duplicate_uids:
             try:
@@ -160,6 +164,8 @@ class MemoryStore(Store):
             del self._name_to_uid[name]
 
         del self._items[name]
+        # Make sure the ctag changes, even if another item is added later.
+        self._etag_counter += 1
 
     def get_ctag(self) -> str:
         """Return a ctag representing current state."""
@@ -195,7 +201,7 @@ class MemoryStore(Store):
         """Set color (no-op for memory store)."""
         self._color = color
 
-    def iter_changes(self, old_ctag: str, new_ctag: str):
+    def iter_changes(self, old_ctag: str, new_ctag: str, after: str | None = None):
         """Get changes between versions (not implemented for memory store)."""
         raise NotImplementedError(self.iter_changes)
 
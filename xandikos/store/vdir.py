@@ -42,7 +42,7 @@ from . import (
 )
 from .config import CONFIG_FILENAME
 from .config import FileBasedCollectionMetadata
-from .index import MemoryIndex
+from .index import MEMORY_INDEX_BACKEND, open_index
 
 DEFAULT_ENCODING = "utf-8"
 DEFAULT_FILE_CACHE_SIZE = 1024
@@ -59,14 +59,18 @@ class VdirStore(Store):
         path,
         check_for_duplicate_uids=True,
         parsed_file_cache_size: int | None = None,
+        index_backend: str = MEMORY_INDEX_BACKEND,
     ) -> None:
-        super().__init__(MemoryIndex())
+        # Persistent index backends would have to keep their data in the
+        # vdir itself, where sync tools like vdirsyncer would pick it up, so
+        # they fall back to a memory index.
+        super().__init__(open_index(index_backend))
         self.path = path
         self._check_for_duplicate_uids = check_for_duplicate_uids
-        # Set of blob ids that have already been scanned
-        self._fname_to_uid: dict[str, str] = {}
-        # Maps uids to (sha, fname)
-        self._uid_to_fname: dict[str, str] = {}
+        # Maps fnames to (etag, uid)
+        self._fname_to_uid: dict[str, tuple[str, str | None]] = {}
+        # Maps uids to (fname, etag)
+        self._uid_to_fname: dict[str, tuple[str, str]] = {}
 
         # Cache etags by (name, mtime_ns, size) to avoid re-hashing unchanged files
         self._etag_cache: dict[str, tuple[int, int, str]] = {}
@@ -131,16 +135,25 @@ class VdirStore(Store):
             raise KeyError(name) from exc
 
     def _parse_file(self, etag: str, content_type: str | None, name: str):
-        """Parse a file, used as the backing function for the LRU cache."""
+        """Parse a file, used as the backing function for the LRU cache.
+
+        Unlike in a git store, the contents for an etag are gone once the
+        file is changed, so the file is read right away and checked
+        against the etag.
+        """
+        content = self._get_raw(name)
+        if hashlib.md5(b"".join(content)).hexdigest() != etag:
+            # The file was changed or replaced since the etag was determined.
+            raise KeyError(name)
         if content_type is None:
             return open_by_extension(
-                self._get_raw(name),
+                content,
                 name,
                 extra_file_handlers=self.extra_file_handlers,
             )
         else:
             return open_by_content_type(
-                self._get_raw(name),
+                content,
                 content_type,
                 extra_file_handlers=self.extra_file_handlers,
             )
@@ -151,7 +164,20 @@ class VdirStore(Store):
             etag = self.get_etag(name)
         return self._parsed_file_cache(etag, content_type, name)
 
+    def _record_uid(self, name: str, etag: str | None, uid: str | None) -> None:
+        """Record the uid of an item, or its removal if etag is None."""
+        old = self._fname_to_uid.pop(name, None)
+        if old is not None and old[1] is not None:
+            if self._uid_to_fname.get(old[1], (None, None))[0] == name:
+                del self._uid_to_fname[old[1]]
+        if etag is not None:
+            self._fname_to_uid[name] = (etag, uid)
+            if uid is not None:
+                self._uid_to_fname[uid] = (name, etag)
+
     def _scan_uids(self):
+        # Etags are cached by mtime and size, so only items that changed
+        # since the last scan are read and parsed.
         removed = set(self._fname_to_uid.keys())
         for name, content_type, etag in self.iter_with_etag():
             if name in removed:
@@ -172,14 +198,13 @@ class VdirStore(Store):
             except NotImplementedError:
                 # This file type doesn't support UIDs
                 uid = None
-            self._fname_to_uid[name] = (etag, uid)
-            if uid is not None:
-                self._uid_to_fname[uid] = (name, etag)
+            self._record_uid(name, etag, uid)
         for name in removed:
-            (unused_etag, uid) = self._fname_to_uid[name]
-            if uid is not None:
-                del self._uid_to_fname[uid]
-            del self._fname_to_uid[name]
+            self._record_uid(name, None, None)
+
+    def lookup_uid(self, uid):
+        self._scan_uids()
+        return self._uid_to_fname[uid]
 
     def _check_duplicate(self, uid, name, replace_etag):
         if uid is not None and self._check_for_duplicate_uids:
@@ -260,6 +285,7 @@ class VdirStore(Store):
                 f.write(chunk)
         os.replace(tmppath, path)
         etag = self.get_etag(name)
+        self._record_uid(name, etag, uid)
         self._index_file(name, etag, fi)
         return (name, etag)
 
@@ -293,14 +319,14 @@ class VdirStore(Store):
         return cls(path)
 
     @classmethod
-    def open_from_path(cls, path: str) -> "VdirStore":
+    def open_from_path(cls, path: str, **kwargs) -> "VdirStore":
         """Open a VdirStore from a path.
 
         Args:
           path: Path
         Returns: A `VdirStore`
         """
-        return cls(path)
+        return cls(path, **kwargs)
 
     def get_description(self):
         """Get extended description.
@@ -387,12 +413,14 @@ class VdirStore(Store):
         """
         self._write_metadata("displayname", displayname)
 
-    def iter_changes(self, old_ctag, new_ctag):
+    def iter_changes(self, old_ctag, new_ctag, after=None):
         """Get changes between two versions of this store.
 
         Args:
           old_ctag: Old ctag (None for empty Store)
           new_ctag: New ctag
+          after: Only report changes to items with names that sort after
+            this one
         Returns: Iterator over (name, content_type, old_etag, new_etag)
         """
         raise NotImplementedError(self.iter_changes)
@@ -417,19 +445,19 @@ class VdirStore(Store):
           InvalidETag: If the specified ETag doesn't match the current
         """
         path = os.path.join(self.path, name)
-        if etag is not None:
-            try:
-                current_etag = self.get_etag(name)
-            except KeyError:
-                raise NoSuchItem(name)
-            if etag != current_etag:
-                raise InvalidETag(name, etag, current_etag)
+        try:
+            current_etag = self.get_etag(name)
+        except KeyError:
+            raise NoSuchItem(name)
+        if etag is not None and etag != current_etag:
+            raise InvalidETag(name, etag, current_etag)
         try:
             os.unlink(path)
         except FileNotFoundError as exc:
             raise NoSuchItem(path) from exc
         except IsADirectoryError as exc:
             raise NoSuchItem(path) from exc
+        self._record_uid(name, None, None)
 
     def get_ctag(self):
         """Return the ctag for this store."""
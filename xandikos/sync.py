@@ -22,8 +22,9 @@
 See https://tools.ietf.org/html/rfc6578
 """
 
-import itertools
+import bisect
 import urllib.parse
+from collections.abc import AsyncIterable
 
 from xandikos import webdav
 
@@ -45,6 +46,70 @@ class SyncToken:
         return ret
 
 
+def format_partial_token(token: str, base: str | None, after: str) -> str:
+    """Create a sync token for a truncated result.
+
+    Args:
+      token: Token that the result was truncated from
+      base: Token that the result started from (None for an initial sync)
+      after: Name of the last member that was reported
+    Returns: a sync token; members up to and including `after` are in the
+      state of `token`, later members in the state of `base`.
+    """
+    return token + "?" + urllib.parse.urlencode({"base": base or "", "after": after})
+
+
+def parse_sync_token(token: str) -> tuple[str, str | None, str | None]:
+    """Parse a sync token.
+
+    Args:
+      token: Sync token, as created by `format_partial_token` or plain
+    Returns: tuple with token, base and name of the last reported member;
+      base and name are None for plain tokens
+    """
+    (token, sep, query) = token.partition("?")
+    if not sep:
+        return (token, None, None)
+    params = urllib.parse.parse_qs(query, keep_blank_values=True)
+    try:
+        [base] = params["base"]
+        [after] = params["after"]
+    except (KeyError, ValueError) as exc:
+        raise InvalidToken(token + sep + query) from exc
+    return (token, base or None, after)
+
+
+async def _first_by_name(changes: AsyncIterable[tuple], n: int) -> list[tuple]:
+    """Collect the n changes for the members with the lowest names.
+
+    Returns: list of changes, sorted by name
+    """
+    first: list[tuple] = []
+    async for change in changes:
+        if len(first) < n or change[0] < first[-1][0]:
+            bisect.insort(first, change, key=lambda change: change[0])
+            del first[n:]
+    return first
+
+
+def _merge_change(earlier: dict[str, tuple], change: tuple) -> tuple | None:
+    """Combine a change with an earlier change to the same member.
+
+    The earlier change, if any, is removed from `earlier`.
+
+    Returns: the combined change, or None if the member did not exist
+      before the earlier change and no longer exists
+    """
+    (name, old_resource, new_resource) = change
+    try:
+        (name, old_resource, unused_resource) = earlier.pop(name)
+    except KeyError:
+        pass
+    if old_resource is None and new_resource is None:
+        return None
+    return (name, old_resource, new_resource)
+
+
 class InvalidToken(Exception):
     """Requested token is invalid."""
 
@@ -91,34 +156,114 @@ class SyncCollectionReporter(webdav.Reporter):
         if sync_level not in ("1",):
             raise webdav.BadRequestError(f"sync level {sync_level!r} unsupported")
 
-        new_token = resource.get_sync_token()
-        try:
+        nresults = None
+        if limit is not None:
             try:
-                diff_iter = resource.iter_differences_since(old_token, new_token)
-            except NotImplementedError:
-                yield webdav.Status(
-                    href,
-                    "403 Forbidden",
-                    error=ET.Element("{DAV:}sync-traversal-supported"),
+                [nresults_el] = list(limit)
+            except ValueError:
+                webdav.nonfatal_bad_request(
+                    "Invalid number of subelements in limit", strict
                 )
-                return
-
-            if limit is not None:
+            else:
                 try:
-                    [nresults_el] = list(limit)
+                    nresults = int(nresults_el.text)
                 except ValueError:
-                    webdav.nonfatal_bad_request(
-                        "Invalid number of subelements in limit", strict
-                    )
+                    webdav.nonfatal_bad_request("nresults not a number", strict)
                 else:
-                    try:
-                        nresults = int(nresults_el.text)
-                    except ValueError:
-                        webdav.nonfatal_bad_request("nresults not a number", strict)
+                    if nresults < 1:
+                        webdav.nonfatal_bad_request("nresults not positive", strict)
+                        nresults = None
+
+        new_token = await resource.get_sync_token()
+        try:
+            if old_token:
+                (token, base, after) = parse_sync_token(old_token)
+            else:
+                (token, base, after) = (old_token, None, None)
+
+            sync_token = new_token
+            truncated = False
+            unsupported = False
+
+            async def iter_first(diff, limit_base, limit_token):
+                """Report the first members of a difference by name.
+
+                Only the first members are reported, so that the next page
+                can resume from the last one.
+                """
+                nonlocal sync_token, truncated
+                first = await _first_by_name(diff, nresults + 1)
+                if len(first) > nresults:
+                    truncated = True
+                    first = first[:nresults]
+                    sync_token = format_partial_token(
+                        limit_token, limit_base, first[-1][0]
+                    )
+                for change in first:
+                    yield change
+
+            async def iter_changes():
+                nonlocal sync_token, truncated, unsupported
+                try:
+                    if after is None:
+                        diff = resource.iter_differences_since(token, new_token, None)
+                        if nresults is None:
+                            async for change in diff:
+                                yield change
+                        else:
+                            async for change in iter_first(diff, token, new_token):
+                                yield change
+                        return
+                    # Finish the truncated result first.
+                    diff = resource.iter_differences_since(base, token, after)
+                    if nresults is None:
+                        earlier = {change[0]: change async for change in diff}
                     else:
-                        diff_iter = itertools.islice(diff_iter, nresults)
+                        earlier = {}
+                        async for change in iter_first(diff, base, token):
+                            earlier[change[0]] = change
+                        if truncated or token == new_token:
+                            for change in earlier.values():
+                                yield change
+                            return
+                    # Members that changed in both are reported once, with
+                    # the old state from the first and the new state from
+                    # the second difference.
+                    diff = resource.iter_differences_since(token, new_token, None)
+                    if nresults is None:
+                        async for change in diff:
+                            change = _merge_change(earlier, change)
+                            if change is not None:
+                                yield change
+                        for change in earlier.values():
+                            yield change
+                        return
+                    later = []
+                    count = len(earlier)
+                    for change in await _first_by_name(diff, nresults + 1):
+                        if change[0] not in earlier:
+                            if count == nresults:
+                                truncated = True
+                                break
+                            count += 1
+                        later.append(change)
+                    if truncated:
+                        if later:
+                            sync_token = format_partial_token(
+                                new_token, token, later[-1][0]
+                            )
+                        else:
+                            sync_token = token
+                    merged = [_merge_change(earlier, change) for change in later]
+                    merged.extend(earlier.values())
+                    for change in sorted(
+                        filter(None, merged), key=lambda change: change[0]
+                    ):
+                        yield change
+                except NotImplementedError:
+                    unsupported = True
 
-            for name, old_resource, new_resource in diff_iter:
+            async for name, old_resource, new_resource in iter_changes():
                 subhref = urllib.parse.urljoin(webdav.ensure_trailing_slash(href), name)
                 if new_resource is None:
                     yield webdav.Status(subhref, status="404 Not Found")
@@ -137,11 +282,25 @@ class SyncCollectionReporter(webdav.Reporter):
                         if old_propstat != new_propstat:
                             propstat.append(new_propstat)
                     yield webdav.Status(subhref, propstat=propstat)
+            if unsupported:
+                yield webdav.Status(
+                    href,
+                    "403 Forbidden",
+                    error=ET.Element("{DAV:}sync-traversal-supported"),
+                )
+                return
         except InvalidToken as exc:
             raise webdav.PreconditionFailure(
                 "{DAV:}valid-sync-token", f"Requested sync token {exc.token} is invalid"
             ) from exc
-        yield SyncToken(new_token)
+        if truncated:
+            # See https://tools.ietf.org/html/rfc6578, section 3.6
+            yield webdav.Status(
+                href,
+                "507 Insufficient Storage",
+                error=ET.Element("{DAV:}number-of-matches-within-limits"),
+            )
+        yield SyncToken(sync_token)
 
 
 class SyncTokenProperty(webdav.Property):
@@ -156,4 +315,4 @@ class SyncTokenProperty(webdav.Property):
     live = True
 
     async def get_value(self, href, resource, el, environ):
-        el.text = resource.get_sync_token()
+        el.text = await resource.get_sync_token()
@@ -19,6 +19,8 @@
 
 """VCard file handling."""
 
+from collections.abc import Iterable
+
 import vobject
 
 from . import collation as _mod_collation
@@ -26,6 +28,36 @@ from .store import File, Filter, InvalidFileContents
 from .store.index import IndexDict, IndexKey, IndexValueIterator
 
 
+def split_vcards(data: bytes) -> list[bytes]:
+    """Split a file with multiple vCards into separate vCards.
+
+    Args:
+      data: Contents of the file
+    Returns: list with the contents of each vCard
+    Raises:
+      InvalidFileContents: if a vCard is not terminated
+    """
+    cards = []
+    current: list[bytes] = []
+    depth = 0
+    for line in data.splitlines(keepends=True):
+        stripped = line.strip().upper()
+        if depth == 0 and stripped != b"BEGIN:VCARD":
+            # Skip anything in between vCards, e.g. empty lines
+            continue
+        current.append(line)
+        if stripped == b"BEGIN:VCARD":
+            depth += 1
+        elif stripped == b"END:VCARD":
+            depth -= 1
+            if depth == 0:
+                cards.append(b"".join(current))
+                current = []
+    if depth != 0:
+        raise InvalidFileContents("text/vcard", [data], "Missing END:VCARD line")
+    return cards
+
+
 class VCardFile(File):
     content_type = "text/vcard"
 
@@ -37,6 +69,19 @@ class VCardFile(File):
             "P=TEL",
         ]
 
+    @classmethod
+    def text_index_keys(cls, properties: Iterable[str]) -> list[IndexKey]:
+        return [f"P={prop.upper()}" for prop in properties]
+
+    @classmethod
+    def index_value_texts(cls, key: IndexKey, value: bytes) -> list[str]:
+        return [value.decode("utf-8", "replace")]
+
+    @classmethod
+    def normalize_text(cls, text: str) -> str:
+        # TextMatch compares uppercased strings
+        return text.upper()
+
     def __init__(self, content, content_type) -> None:
         super().__init__(content, content_type)
         self._addressbook = None
@@ -127,10 +172,14 @@ class TextMatch:
         match_type: str = "contains",
     ):
         self.text = text
+        self.collation_name = collation
         self.collation = _mod_collation.get_collation(collation)
         self.negate_condition = negate_condition
         self.match_type = match_type
 
+    def cache_key(self) -> tuple:
+        return (self.text, self.collation_name, self.negate_condition, self.match_type)
+
     def match(self, value: str) -> bool:
         """Check if a value matches this text match."""
         # Convert both to uppercase for case-insensitive comparison
@@ -171,6 +220,13 @@ class ParamFilter:
         self.text_match = TextMatch(text, collation, negate_condition, match_type)
         return self.text_match
 
+    def cache_key(self) -> tuple:
+        return (
+            self.name,
+            self.is_not_defined,
+            self.text_match.cache_key() if self.text_match is not None else None,
+        )
+
     def match(self, prop) -> bool:
         """Check if a property matches this parameter filter."""
         params = getattr(prop, "params", {})
@@ -223,6 +279,14 @@ class PropertyFilter:
         self.param_filters.append(pf)
         return pf
 
+    def cache_key(self) -> tuple:
+        return (
+            self.name,
+            self.is_not_defined,
+            tuple(tm.cache_key() for tm in self.text_matches),
+            tuple(pf.cache_key() for pf in self.param_filters),
+        )
+
     def match(self, vcard) -> bool:
         """Check if a vCard matches this property filter."""
         properties = get_vcard_properties(vcard, self.name)
@@ -334,6 +398,25 @@ class CardDAVFilter(Filter):
 
         return self.test(results) if results else True
 
+    def cache_key(self) -> tuple:
+        return (
+            self.test.__name__,
+            tuple(pf.cache_key() for pf in self.property_filters),
+        )
+
+    def index_text_matches(self) -> list[tuple[IndexKey, str]]:
+        # With "anyof", no single property filter has to match.
+        if self.test is not all and len(self.property_filters) > 1:
+            return []
+        ret = []
+        for prop_filter in self.property_filters:
+            if prop_filter.is_not_defined:
+                continue
+            for text_match in prop_filter.text_matches:
+                if not text_match.negate_condition:
+                    ret.append((f"P={prop_filter.name}", text_match.text))
+        return ret
+
     def index_keys(self) -> list[list[str]]:
         """Return the index keys needed for this filter."""
         result = []
@@ -34,7 +34,7 @@ import posixpath
 import shutil
 import socket
 import urllib.parse
-from collections.abc import Iterable, Iterator
+from collections.abc import AsyncIterator, Iterable, Iterator
 from email.utils import parseaddr
 from dulwich.web import make_wsgi_chain
 from dulwich.server import DictBackend
@@ -57,8 +57,14 @@ from xandikos import (
     webdav,
     xmpp,
 )
-from xandikos.fs import FilesystemBackend, open_store_from_path
+from xandikos.fs import (
+    OBJECT_POOL_DIRNAME,
+    FilesystemBackend,
+    open_store_from_path,
+    start_maintenance,
+)
 from xandikos.store import (
+    DEFAULT_EAGER_INDEXING_BATCH_SIZE,
     STORE_TYPE_ADDRESSBOOK,
     STORE_TYPE_CALENDAR,
     STORE_TYPE_OTHER,
@@ -70,6 +76,7 @@ from xandikos.store import (
     File,
     InvalidCTag,
     InvalidFileContents,
+    LazyContent,
     LockedError,
     NoSuchItem,
     NotStoreError,
@@ -80,7 +87,23 @@ from xandikos.store import (
 from icalendar.cal import Calendar
 
 from .icalendar import CalendarFilter, ICalendarFile
-from .store.git import GitStore, TreeGitStore
+from .store.aio import DEFAULT_STORE_THREADS, AsyncStore, create_store_executor
+from .store.git import (
+    COMMIT_MESSAGE_POLICIES,
+    DEFAULT_COMMIT_BATCH_SIZE,
+    DEFAULT_COMMIT_MESSAGE_POLICY,
+    DEFAULT_FSYNC_POLICY,
+    DEFAULT_MAINTENANCE_LOOSE_OBJECTS,
+    FSYNC_POLICIES,
+    GitStore,
+    TreeGitStore,
+)
+from .store.index import (
+    DEFAULT_INDEX_BACKEND,
+    DEFAULT_SHARED_INDEX_BUDGET,
+    INDEX_BACKENDS,
+    SHARED_INDEX_CACHE,
+)
 
 logger = getLogger("xandikos")
 
@@ -208,8 +231,12 @@ class ObjectResource(webdav.Resource):
         content_type: str,
         etag: str,
         file: File | None = None,
+        async_store: AsyncStore | None = None,
     ) -> None:
         self.store = store
+        if async_store is None:
+            async_store = AsyncStore(store)
+        self.async_store = async_store
         self.name = name
         self.etag = etag
         self.content_type = content_type
@@ -220,10 +247,14 @@ class ObjectResource(webdav.Resource):
 
     async def get_file(self) -> File:
         if self._file is None:
-            self._file = await asyncio.to_thread(
-                self.store.get_file, self.name, self.content_type, self.etag
+            self._file = await self.async_store.get_file(
+                self.name, self.content_type, self.etag
             )
             assert self._file is not None
+        content = self._file.content
+        if isinstance(content, LazyContent) and not content.loaded:
+            # Read the contents on the executor rather than on the event loop.
+            await self.async_store.run(list, content)
         return self._file
 
     async def get_body(self) -> Iterable[bytes]:
@@ -232,8 +263,7 @@ class ObjectResource(webdav.Resource):
 
     async def set_body(self, data, replace_etag=None, remote_user=None, requester=None):
         try:
-            (name, etag) = await asyncio.to_thread(
-                self.store.import_one,
+            (name, etag) = await self.async_store.import_one(
                 self.name,
                 self.content_type,
                 data,
@@ -279,13 +309,17 @@ class ObjectResource(webdav.Resource):
     def set_comment(self, comment):
         raise NotImplementedError(self.set_comment)
 
-    def get_creationdate(self):
-        # TODO(jelmer): Find creation date using store function
-        raise KeyError
+    async def get_creationdate(self):
+        try:
+            return await self.async_store.get_creation_date(self.name)
+        except NotImplementedError as exc:
+            raise KeyError(self.name) from exc
 
-    def get_last_modified(self):
-        # TODO(jelmer): Find last modified time using store function
-        raise KeyError
+    async def get_last_modified(self):
+        try:
+            return await self.async_store.get_last_modified(self.name)
+        except NotImplementedError as exc:
+            raise KeyError(self.name) from exc
 
     def get_is_executable(self):
         # TODO(jelmer): Retrieve POSIX mode and check for executability.
@@ -315,6 +349,7 @@ class StoreBasedCollection:
         self.backend = backend
         self.relpath = relpath
         self.store = store
+        self.async_store = AsyncStore(store, backend.store_executor)
 
     def __repr__(self) -> str:
         return f"{type(self).__name__}({self.store!r})"
@@ -362,7 +397,14 @@ class StoreBasedCollection:
         etag: str,
         file: File | None = None,
     ) -> webdav.Resource:
-        return ObjectResource(self.store, name, content_type, etag, file=file)
+        return ObjectResource(
+            self.store,
+            name,
+            content_type,
+            etag,
+            file=file,
+            async_store=self.async_store,
+        )
 
     def _get_subcollection(self, name: str) -> webdav.Collection:
         return self.backend.get_resource(posixpath.join(self.relpath, name))
@@ -376,14 +418,14 @@ class StoreBasedCollection:
     def set_displayname(self, displayname: str) -> None:
         self.store.set_displayname(displayname)
 
-    def get_sync_token(self) -> str:
-        return self.store.get_ctag()
+    async def get_sync_token(self) -> str:
+        return await self.async_store.get_ctag()
 
-    def get_ctag(self) -> str:
-        return self.store.get_ctag()
+    async def get_ctag(self) -> str:
+        return await self.async_store.get_ctag()
 
     async def get_etag(self) -> str:
-        return create_strong_etag(self.store.get_ctag())
+        return create_strong_etag(await self.async_store.get_ctag())
 
     def members(self) -> Iterator[tuple[str, webdav.Resource]]:
         for name, content_type, etag in self.store.iter_with_etag():
@@ -392,6 +434,12 @@ class StoreBasedCollection:
         for name, resource in self.subcollections():
             yield (name, resource)
 
+    async def iter_members(self) -> AsyncIterator[tuple[str, webdav.Resource]]:
+        async for name, content_type, etag in self.async_store.iter_with_etag():
+            yield (name, self._get_resource(name, content_type, etag))
+        for name in await self.async_store.subdirectories():
+            yield (name, self._get_subcollection(name))
+
     def subcollections(self):
         for name in self.store.subdirectories():
             yield (name, self._get_subcollection(name))
@@ -406,10 +454,10 @@ class StoreBasedCollection:
             raise KeyError(name)
         return self._get_resource(name, content_type, etag)
 
-    def delete_member(self, name, etag=None, remote_user=None, requester=None):
+    async def delete_member(self, name, etag=None, remote_user=None, requester=None):
         assert name != ""
         try:
-            self.store.delete_one(
+            await self.async_store.delete_one(
                 name,
                 etag=extract_strong_etag(etag),
                 remote_user=remote_user,
@@ -424,7 +472,9 @@ class StoreBasedCollection:
             else:
                 # TODO: Properly allow removing subcollections
                 # _subcoll.destroy()
-                shutil.rmtree(os.path.join(self.store.path, name))
+                await self.async_store.run(
+                    shutil.rmtree, os.path.join(self.store.path, name)
+                )
 
     async def create_member(
         self,
@@ -437,7 +487,7 @@ class StoreBasedCollection:
         # Check if member already exists and raise FileExistsError if it does
         if name is not None:
             try:
-                existing_member = self.get_member(name)
+                existing_member = await self.async_store.run(self.get_member, name)
                 if existing_member is not None:
                     raise FileExistsError(f"Member '{name}' already exists")
             except KeyError:
@@ -445,7 +495,7 @@ class StoreBasedCollection:
                 pass
 
         try:
-            (name, etag) = self.store.import_one(
+            (name, etag) = await self.async_store.import_one(
                 name,
                 content_type,
                 contents,
@@ -482,18 +532,18 @@ class StoreBasedCollection:
         """
         return None
 
-    def iter_differences_since(
-        self, old_token: str, new_token: str
-    ) -> Iterator[tuple[str, webdav.Resource | None, webdav.Resource | None]]:
+    async def iter_differences_since(
+        self, old_token: str, new_token: str, after: str | None = None
+    ) -> AsyncIterator[tuple[str, webdav.Resource | None, webdav.Resource | None]]:
         old_resource: webdav.Resource | None
         new_resource: webdav.Resource | None
         try:
-            for (
+            async for (
                 name,
                 content_type,
                 old_etag,
                 new_etag,
-            ) in self.store.iter_changes(old_token, new_token):
+            ) in self.async_store.iter_changes(old_token, new_token, after):
                 if old_etag is not None:
                     old_resource = self._get_resource(name, content_type, old_etag)
                 else:
@@ -524,11 +574,11 @@ class StoreBasedCollection:
     def set_comment(self, comment):
         self.store.set_comment(comment)
 
-    def get_creationdate(self):
+    async def get_creationdate(self):
         # TODO(jelmer): Find creation date using store function
         raise KeyError
 
-    def get_last_modified(self):
+    async def get_last_modified(self):
         # TODO(jelmer): Find last modified time using store function
         raise KeyError
 
@@ -759,7 +809,16 @@ async def _find_calendar_member_by_uid(
     ObjectResource is returned alongside the parsed calendar so
     callers can update it in place without re-resolving.
     """
-    for name, member in calendar.members():
+    candidates: list[tuple[str, webdav.Resource]]
+    try:
+        (name, etag) = await calendar.async_store.lookup_uid(uid)
+    except KeyError:
+        return None
+    except NotImplementedError:
+        candidates = [member async for member in calendar.iter_members()]
+    else:
+        candidates = [(name, await calendar.async_store.run(calendar.get_member, name))]
+    for name, member in candidates:
         if not isinstance(member, ObjectResource):
             continue
         if member.get_content_type() != "text/calendar":
@@ -820,7 +879,7 @@ class ScheduleOutbox(StoreBasedCollection, scheduling.ScheduleOutbox):
             home_resource = self.backend.get_resource(home_path)
             if home_resource is None:
                 continue
-            for cal_name, cal_resource in home_resource.members():
+            async for cal_name, cal_resource in home_resource.iter_members():
                 if caldav.CALENDAR_RESOURCE_TYPE not in cal_resource.resource_types:
                     continue
                 # Calendars marked TRANSPARENT contribute no busy time —
@@ -1016,9 +1075,9 @@ class CalendarCollection(StoreBasedCollection, caldav.Calendar):
         # TODO(jelmer)
         raise KeyError
 
-    def calendar_query(self, create_filter_fn):
+    async def calendar_query(self, create_filter_fn):
         filter = create_filter_fn(CalendarFilter)
-        for name, file, etag in self.store.iter_with_filter(filter=filter):
+        async for name, file, etag in self.async_store.iter_with_filter(filter):
             resource = self._get_resource(name, file.content_type, etag, file=file)
             yield (name, resource)
 
@@ -1044,7 +1103,7 @@ class CalendarCollection(StoreBasedCollection, caldav.Calendar):
         are skipped for now.
         """
         try:
-            member = self.get_member(member_name)
+            member = await self.async_store.run(self.get_member, member_name)
         except KeyError:
             return
         cal = await _calendar_from_member(member)
@@ -1112,7 +1171,7 @@ class CalendarCollection(StoreBasedCollection, caldav.Calendar):
 
         old_cal: Calendar | None = None
         try:
-            existing = self.get_member(member_name)
+            existing = await self.async_store.run(self.get_member, member_name)
         except KeyError:
             existing = None
         if existing is not None:
@@ -1365,11 +1424,11 @@ class AddressbookCollection(StoreBasedCollection, carddav.Addressbook):
     def set_addressbook_color(self, color):
         self.store.set_color(color)
 
-    def addressbook_query(self, create_filter_fn):
+    async def addressbook_query(self, create_filter_fn):
         from .vcard import CardDAVFilter
 
         filter = create_filter_fn(CardDAVFilter)
-        for name, file, etag in self.store.iter_with_filter(filter=filter):
+        async for name, file, etag in self.async_store.iter_with_filter(filter):
             resource = self._get_resource(name, file.content_type, etag, file=file)
             yield (name, resource)
 
@@ -1400,13 +1459,13 @@ class CollectionSetResource(webdav.Collection):
     def get_displayname(self):
         return posixpath.basename(self.relpath)
 
-    def get_sync_token(self):
+    async def get_sync_token(self):
         raise KeyError
 
     async def get_etag(self):
         raise KeyError
 
-    def get_ctag(self):
+    async def get_ctag(self):
         raise KeyError
 
     def get_supported_locks(self):
@@ -1452,11 +1511,11 @@ class CollectionSetResource(webdav.Collection):
     async def get_content_length(self):
         raise KeyError
 
-    def get_last_modified(self):
+    async def get_last_modified(self):
         # TODO(jelmer): Find last modified time using store function
         raise KeyError
 
-    def delete_member(self, name, etag=None, remote_user=None, requester=None):
+    async def delete_member(self, name, etag=None, remote_user=None, requester=None):
         # This doesn't have any non-collection members.
         self.get_member(name).destroy()
 
@@ -1486,7 +1545,7 @@ class CollectionSetResource(webdav.Collection):
         # TODO(jelmer): Ask the store?
         raise KeyError
 
-    def get_creationdate(self):
+    async def get_creationdate(self):
         # TODO(jelmer): Find creation date using store function
         raise KeyError
 
@@ -1590,7 +1649,7 @@ class RootPage(webdav.Resource):
             h.update(c)
         return h.hexdigest()
 
-    def get_last_modified(self):
+    async def get_last_modified(self):
         raise KeyError
 
     def get_content_language(self):
@@ -1599,7 +1658,7 @@ class RootPage(webdav.Resource):
     def get_member(self, name):
         return self.backend.get_resource("/" + name)
 
-    def delete_member(self, name, etag=None, remote_user=None, requester=None):
+    async def delete_member(self, name, etag=None, remote_user=None, requester=None):
         # This doesn't have any non-collection members.
         self.get_member("/" + name).destroy()
 
@@ -1722,7 +1781,7 @@ class Principal(webdav.Principal):
         # TODO(jelmer): make this configurable
         return "inbox"
 
-    def get_creationdate(self):
+    async def get_creationdate(self):
         raise KeyError
 
 
@@ -1788,7 +1847,18 @@ class SingleUserFilesystemBackend(FilesystemBackend):
         *,
         paranoid: bool = False,
         index_threshold: int | None = None,
+        max_index_size: int | None = None,
         eager_indexing: bool = False,
+        eager_workers: int = 0,
+        eager_batch_size: int = DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+        index_backend: str = DEFAULT_INDEX_BACKEND,
+        text_index_properties: Iterable[str] = (),
+        commit_delay: float | None = None,
+        commit_batch_size: int = DEFAULT_COMMIT_BATCH_SIZE,
+        fsync_policy: str = DEFAULT_FSYNC_POLICY,
+        commit_message_policy: str = DEFAULT_COMMIT_MESSAGE_POLICY,
+        object_pool: bool = False,
+        store_threads: int = DEFAULT_STORE_THREADS,
         autocreate: bool = False,
         show_principals_on_root: bool = True,
     ) -> None:
@@ -1796,7 +1866,18 @@ class SingleUserFilesystemBackend(FilesystemBackend):
         self._user_principals: set[str] = set()
         self.paranoid = paranoid
         self.index_threshold = index_threshold
+        self.max_index_size = max_index_size
         self.eager_indexing = eager_indexing
+        self.eager_workers = eager_workers
+        self.eager_batch_size = eager_batch_size
+        self.index_backend = index_backend
+        self.text_index_properties = tuple(text_index_properties)
+        self.commit_delay = commit_delay
+        self.commit_batch_size = commit_batch_size
+        self.fsync_policy = fsync_policy
+        self.commit_message_policy = commit_message_policy
+        self.object_pool = object_pool
+        self.store_executor = create_store_executor(store_threads)
         self.autocreate = autocreate
         self.show_principals_on_root = show_principals_on_root
         self._open_store = functools.lru_cache(maxsize=16)(self._open_store_uncached)
@@ -1807,15 +1888,31 @@ class SingleUserFilesystemBackend(FilesystemBackend):
             path,
             double_check_indexes=self.paranoid,
             index_threshold=self.index_threshold,
+            max_index_size=self.max_index_size,
             eager_indexing=self.eager_indexing,
+            eager_workers=self.eager_workers,
+            eager_batch_size=self.eager_batch_size,
+            index_backend=self.index_backend,
+            text_index_properties=self.text_index_properties,
+            commit_delay=self.commit_delay,
+            commit_batch_size=self.commit_batch_size,
+            fsync_policy=self.fsync_policy,
+            commit_message_policy=self.commit_message_policy,
         )
 
     def _mark_as_principal(self, path):
         self._user_principals.add(posixpath.normpath(path))
 
+    @property
+    def object_pool_path(self) -> str | None:
+        """Path to the pool of objects shared by new collections, if any."""
+        if not self.object_pool:
+            return None
+        return os.path.join(self.path, OBJECT_POOL_DIRNAME)
+
     def create_collection(self, relpath):
         p = self._map_to_file_path(relpath)
-        store = TreeGitStore.create(p)
+        store = TreeGitStore.create(p, object_pool=self.object_pool_path)
         self._open_store.cache_clear()
         return Collection(self, relpath, store)
 
@@ -2172,6 +2269,18 @@ def run_simple_server(
     web.run_app(app, port=port, host=listen_address, path=socket_path)
 
 
+def parse_mib(size: int | None) -> int | None:
+    """Convert an optional size in MiB to bytes."""
+    if size is None:
+        return None
+    return size * 1024 * 1024
+
+
+def parse_property_list(text: str) -> list[str]:
+    """Parse a comma-separated list of property names."""
+    return [prop.strip().upper() for prop in text.split(",") if prop.strip()]
+
+
 def add_parser(parser):
     import argparse
 
@@ -2284,6 +2393,143 @@ def add_parser(parser):
         action="store_true",
         help="Pre-populate indexes at startup for faster initial queries.",
     )
+    parser.add_argument(
+        "--eager-workers",
+        type=int,
+        default=0,
+        metavar="N",
+        help=(
+            "Number of worker processes to parse items in when pre-populating "
+            "indexes; 0 to parse them in a background thread. [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--eager-batch-size",
+        type=int,
+        default=DEFAULT_EAGER_INDEXING_BATCH_SIZE,
+        metavar="N",
+        help="Number of items to send to an indexing worker at once. [%(default)s]",
+    )
+    parser.add_argument(
+        "--index-backend",
+        choices=INDEX_BACKENDS,
+        default=DEFAULT_INDEX_BACKEND,
+        help=(
+            "Where to keep index values. 'memory' keeps them in memory per "
+            "collection; 'shared' keeps them in memory, shared between "
+            "collections with identical items; 'compact' "
+            "keeps them in a compact layout per collection; 'sqlite' "
+            "persists them in each collection so they survive restarts. "
+            "[%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--index-memory-budget",
+        type=int,
+        default=DEFAULT_SHARED_INDEX_BUDGET // (1024 * 1024),
+        metavar="MIB",
+        help="Memory budget for the shared index, in MiB. [%(default)s]",
+    )
+    parser.add_argument(
+        "--max-index-size",
+        type=int,
+        metavar="MIB",
+        help=(
+            "Estimated size of the values for automatically added index keys "
+            "per collection, in MiB, above which the least useful ones are "
+            "dropped."
+        ),
+    )
+    parser.add_argument(
+        "--text-index",
+        type=parse_property_list,
+        default=[],
+        metavar="PROPERTIES",
+        help=(
+            "Comma-separated list of properties (e.g. SUMMARY,FN) to keep "
+            "a trigram index on, to speed up text searches."
+        ),
+    )
+    parser.add_argument(
+        "--commit-delay",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Combine writes to a collection that arrive within this many "
+            "seconds into a single git commit."
+        ),
+    )
+    parser.add_argument(
+        "--commit-batch-size",
+        type=int,
+        default=DEFAULT_COMMIT_BATCH_SIZE,
+        metavar="N",
+        help=(
+            "Maximum number of writes to combine into a single git commit "
+            "with --commit-delay. [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--fsync",
+        choices=FSYNC_POLICIES,
+        default=DEFAULT_FSYNC_POLICY,
+        dest="fsync_policy",
+        help=(
+            "When to sync written items to disk: as they are written "
+            "(always), once per commit (batch) or leave it to the operating "
+            "system (none). [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--commit-messages",
+        choices=COMMIT_MESSAGE_POLICIES,
+        default=DEFAULT_COMMIT_MESSAGE_POLICY,
+        dest="commit_message_policy",
+        help=(
+            "How to describe writes in git commit messages: what changed "
+            "compared to the previous version (full), the new version only "
+            "(summary) or just the name of the item (minimal). [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--store-threads",
+        type=int,
+        default=DEFAULT_STORE_THREADS,
+        metavar="N",
+        help=(
+            "Number of threads to run collection reads and writes in, so "
+            "that slow git operations do not hold up other requests. "
+            "[%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--maintenance-interval",
+        type=float,
+        metavar="SECONDS",
+        help=(
+            "Pack loose git objects in the background, checking every this "
+            "many seconds."
+        ),
+    )
+    parser.add_argument(
+        "--maintenance-loose-objects",
+        type=int,
+        default=DEFAULT_MAINTENANCE_LOOSE_OBJECTS,
+        metavar="N",
+        help=(
+            "Number of loose objects a collection must have before "
+            "background maintenance packs them. [%(default)s]"
+        ),
+    )
+    parser.add_argument(
+        "--object-pool",
+        action="store_true",
+        help=(
+            "Keep git objects that are stored in several collections in a "
+            "single pool in the root directory. Background maintenance "
+            "moves them there."
+        ),
+    )
 
 
 async def main(options, parser):
@@ -2302,14 +2548,35 @@ async def main(options, parser):
 
     logging.basicConfig(level=loglevel, format="%(message)s")
 
+    SHARED_INDEX_CACHE.set_budget(options.index_memory_budget * 1024 * 1024)
+
     backend = SingleUserFilesystemBackend(
         os.path.abspath(options.directory),
         paranoid=options.paranoid,
         index_threshold=options.index_threshold,
+        max_index_size=parse_mib(options.max_index_size),
         eager_indexing=options.eager,
+        eager_workers=options.eager_workers,
+        eager_batch_size=options.eager_batch_size,
+        index_backend=options.index_backend,
+        text_index_properties=options.text_index,
+        commit_delay=options.commit_delay,
+        commit_batch_size=options.commit_batch_size,
+        fsync_policy=options.fsync_policy,
+        commit_message_policy=options.commit_message_policy,
+        object_pool=options.object_pool,
+        store_threads=options.store_threads,
     )
     backend._mark_as_principal(options.current_user_principal)
 
+    if options.maintenance_interval:
+        start_maintenance(
+            backend.path,
+            options.maintenance_interval,
+            options.maintenance_loose_objects,
+            share_objects=options.object_pool,
+        )
+
     if options.autocreate or options.defaults:
         if not os.path.isdir(options.directory):
             os.makedirs(options.directory)
@@ -27,14 +27,21 @@ functionality should live in xandikos.caldav/xandikos.carddav respectively.
 
 import asyncio
 import collections
+import email.utils
 import fnmatch
 import functools
 from logging import getLogger
 import os
 import posixpath
 import urllib.parse
-from collections.abc import AsyncIterable, Iterable, Iterator, Sequence
-from datetime import datetime
+from collections.abc import (
+    AsyncIterable,
+    AsyncIterator,
+    Iterable,
+    Iterator,
+    Sequence,
+)
+from datetime import datetime, timezone
 from collections.abc import Callable
 from wsgiref.util import request_uri
 
@@ -458,7 +465,7 @@ class Resource:
         """Set the resource display name."""
         raise NotImplementedError(self.set_displayname)
 
-    def get_creationdate(self) -> datetime:
+    async def get_creationdate(self) -> datetime:
         """Get the resource creation date.
 
         Returns: A datetime object
@@ -601,7 +608,7 @@ class Resource:
         """
         raise NotImplementedError(self.get_comment)
 
-    def get_last_modified(self) -> datetime:
+    async def get_last_modified(self) -> datetime:
         """Get last modified time.
 
         Returns: Last modified time
@@ -796,12 +803,38 @@ class GetLastModifiedProperty(Property):
     in_allprops = True
 
     async def get_value(self, href, resource, el, environ):
-        # Use rfc1123 date (section 3.3.1 of RFC2616)
-        el.text = resource.get_last_modified().strftime("%a, %d %b %Y %H:%M:%S GMT")
+        el.text = format_http_date(await resource.get_last_modified())
+
+
+def format_http_date(dt: datetime) -> str:
+    """Format a datetime as an rfc1123 date (section 3.3.1 of RFC2616).
+
+    Naive datetimes are assumed to be in UTC.
+    """
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return email.utils.formatdate(dt.timestamp(), usegmt=True)
+
 
+def parse_http_date(value: str) -> datetime | None:
+    """Parse a HTTP date.
 
-def format_datetime(dt: datetime) -> bytes:
-    s = "%04d%02d%02dT%02d%02d%02dZ" % (
+    Returns: timezone-aware datetime, or None if the date is invalid
+    """
+    try:
+        dt = email.utils.parsedate_to_datetime(value)
+    except (TypeError, ValueError):
+        return None
+    if dt.tzinfo is None:
+        dt = dt.replace(tzinfo=timezone.utc)
+    return dt
+
+
+def format_datetime(dt: datetime) -> str:
+    """Format a datetime as an RFC 3339 date-time (as used by RFC 4918)."""
+    if dt.tzinfo is not None:
+        dt = dt.astimezone(timezone.utc)
+    return "%04d-%02d-%02dT%02d:%02d:%02dZ" % (
         dt.year,
         dt.month,
         dt.day,
@@ -809,7 +842,6 @@ def format_datetime(dt: datetime) -> bytes:
         dt.minute,
         dt.second,
     )
-    return s.encode("utf-8")
 
 
 class CreationDateProperty(Property):
@@ -823,7 +855,7 @@ class CreationDateProperty(Property):
     live = True
 
     async def get_value(self, href, resource, el, environ):
-        el.text = format_datetime(resource.get_creationdate())
+        el.text = format_datetime(await resource.get_creationdate())
 
 
 class GetContentLanguageProperty(Property):
@@ -939,7 +971,7 @@ class GetCTagProperty(Property):
     live = True
 
     async def get_value(self, href, resource, el, environ):
-        el.text = resource.get_ctag()
+        el.text = await resource.get_ctag()
 
 
 class DAVGetCTagProperty(GetCTagProperty):
@@ -1005,6 +1037,17 @@ class Collection(Resource):
         """
         raise NotImplementedError(self.members)
 
+    async def iter_members(self) -> AsyncIterator[tuple[str, Resource]]:
+        """Iterate over all members, without blocking the event loop.
+
+        The default implementation uses members(); collections that have
+        to do I/O to list their members should override this.
+
+        Returns: AsyncIterator over (name, Resource) tuples
+        """
+        for member in self.members():
+            yield member
+
     def get_member(self, name: str) -> Resource:
         """Retrieve a member by name.
 
@@ -1015,7 +1058,7 @@ class Collection(Resource):
         """
         raise NotImplementedError(self.get_member)
 
-    def delete_member(
+    async def delete_member(
         self,
         name: str,
         etag: str | None = None,
@@ -1191,13 +1234,15 @@ class Collection(Resource):
                 requester=requester,
             )
             # Delete source from this collection only after successful creation
-            self.delete_member(name, etag, remote_user=remote_user, requester=requester)
+            await self.delete_member(
+                name, etag, remote_user=remote_user, requester=requester
+            )
             return False  # Created new
         except FileExistsError:
             if not overwrite:
                 raise
             # Delete existing and retry
-            destination.delete_member(
+            await destination.delete_member(
                 destination_name, remote_user=remote_user, requester=requester
             )
             await destination.create_member(
@@ -1208,7 +1253,9 @@ class Collection(Resource):
                 requester=requester,
             )
             # Delete source from this collection only after successful creation
-            self.delete_member(name, etag, remote_user=remote_user, requester=requester)
+            await self.delete_member(
+                name, etag, remote_user=remote_user, requester=requester
+            )
             return True  # Overwrote existing
 
     async def copy_member(
@@ -1260,7 +1307,7 @@ class Collection(Resource):
             if not overwrite:
                 raise
             # Delete existing and retry
-            destination.delete_member(
+            await destination.delete_member(
                 destination_name, remote_user=remote_user, requester=requester
             )
             await destination.create_member(
@@ -1272,28 +1319,29 @@ class Collection(Resource):
             )
             return True  # Overwrote existing
 
-    def get_sync_token(self) -> str:
+    async def get_sync_token(self) -> str:
         """Get sync-token for the current state of this collection."""
         raise NotImplementedError(self.get_sync_token)
 
     def iter_differences_since(
-        self, old_token: str, new_token: str
-    ) -> Iterator[tuple[str, Resource | None, Resource | None]]:
+        self, old_token: str, new_token: str, after: str | None = None
+    ) -> AsyncIterator[tuple[str, Resource | None, Resource | None]]:
         """Iterate over differences in this collection.
 
-        Should return an iterator over (name, old resource, new resource)
+        Should return an async iterator over (name, old resource, new resource)
         tuples. If one of the two didn't exist previously or now, they should
         be None.
 
         If old_token is None, this should return full contents of the
-        collection.
+        collection. If after is set, only members with names that sort
+        after it should be included.
 
         May raise NotImplementedError if iterating differences is not
         supported.
         """
         raise NotImplementedError(self.iter_differences_since)
 
-    def get_ctag(self) -> str:
+    async def get_ctag(self) -> str:
         raise NotImplementedError(self.get_ctag)
 
     def get_headervalue(self) -> str:
@@ -1536,7 +1584,7 @@ async def traverse_resource(
     base_resource: Resource,
     base_href: str,
     depth: str,
-    members: Callable[[Collection], Iterable[tuple[str, Resource]]] | None = None,
+    members: Callable[[Collection], AsyncIterable[tuple[str, Resource]]] | None = None,
     check_access: Callable[[str], bool] | None = None,
 ) -> AsyncIterable[tuple[str, Resource]]:
     """Traverse a resource.
@@ -1546,7 +1594,7 @@ async def traverse_resource(
       base_href: href for base resource
       depth: Depth ("0", "1", "infinity")
       members: Function to use to get members of each
-        collection.
+        collection; should return an async iterator.
       check_access: Optional callback to check if a path is accessible.
         Should return True if accessible, False otherwise.
         If None, all resources are accessible.
@@ -1555,7 +1603,7 @@ async def traverse_resource(
     if members is None:
 
         def members_fn(c):
-            return c.members()
+            return c.iter_members()
 
     else:
         members_fn = members
@@ -1584,7 +1632,7 @@ async def traverse_resource(
         else:
             raise AssertionError(f"invalid depth {depth!r}")
         if COLLECTION_RESOURCE_TYPE in resource.resource_types:
-            for child_name, child_resource in members_fn(resource):
+            async for child_name, child_resource in members_fn(resource):
                 child_href = urllib.parse.urljoin(href, child_name)
                 todo.append((child_href, child_resource, nextdepth))
 
@@ -2130,7 +2178,7 @@ class DeleteMethod(Method):
             if not etag_matches(if_schedule_tag_match, current_schedule_tag):
                 return Response(status=412, reason="Precondition Failed")
         await pr.pre_delete_hook(item_name)
-        pr.delete_member(
+        await pr.delete_member(
             item_name,
             current_etag,
             remote_user=environ.get("REMOTE_USER"),
@@ -2554,7 +2602,7 @@ class CopyMethod(Method):
                             )
                         # Delete existing collection before creating
                         # TODO: This should be atomic
-                        dest_container.delete_member(
+                        await dest_container.delete_member(
                             dest_name,
                             remote_user=environ.get("REMOTE_USER"),
                             requester=request.headers.get("User-Agent"),
@@ -2902,6 +2950,29 @@ async def _do_get(request, environ, app, send_body):
         request.headers.get("Accept-Languages", "*")
     )
 
+    try:
+        last_modified = await r.get_last_modified()
+    except KeyError:
+        # Resource does not have a last modified time
+        last_modified = None
+    # If-Modified-Since is ignored if If-None-Match is present, see
+    # RFC 7232, section 3.3.
+    if_modified_since = request.headers.get("If-Modified-Since", None)
+    if (
+        last_modified is not None
+        and if_modified_since
+        and "If-None-Match" not in request.headers
+    ):
+        since = parse_http_date(if_modified_since)
+        if since is not None and last_modified.replace(microsecond=0) <= since:
+            # See RFC 7232, section 4.1
+            headers = []
+            try:
+                headers.append(("ETag", await r.get_etag()))
+            except (KeyError, NotImplementedError):
+                pass
+            return Response(status="304 Not Modified", headers=headers)
+
     (
         body,
         content_length,
@@ -2916,7 +2987,7 @@ async def _do_get(request, environ, app, send_body):
         and current_etag is not None
         and etag_matches(if_none_match, current_etag)
     ):
-        return Response(status="304 Not Modified")
+        return Response(status="304 Not Modified", headers=[("ETag", current_etag)])
     headers = [
         ("Content-Length", str(content_length)),
     ]
@@ -2924,13 +2995,8 @@ async def _do_get(request, environ, app, send_body):
         headers.append(("ETag", current_etag))
     if content_type is not None:
         headers.append(("Content-Type", content_type))
-    try:
-        last_modified = r.get_last_modified()
-    except KeyError:
-        # Resource does not have a last modified time
-        pass
-    else:
-        headers.append(("Last-Modified", last_modified))
+    if last_modified is not None:
+        headers.append(("Last-Modified", format_http_date(last_modified)))
     if content_languages is not None:
         headers.append(("Content-Language", ", ".join(content_languages)))
     schedule_tag_header = await _maybe_schedule_tag_header(r)
@@ -22,7 +22,16 @@
 from logging import getLogger
 import os
 
-from .web import XandikosApp, SingleUserFilesystemBackend
+from .fs import start_maintenance
+from .store.aio import DEFAULT_STORE_THREADS
+from .store.git import DEFAULT_COMMIT_MESSAGE_POLICY, DEFAULT_FSYNC_POLICY
+from .store.index import DEFAULT_INDEX_BACKEND, SHARED_INDEX_CACHE
+from .web import (
+    XandikosApp,
+    SingleUserFilesystemBackend,
+    parse_mib,
+    parse_property_list,
+)
 
 logger = getLogger("xandikos")
 
@@ -42,10 +51,33 @@ else:
     autocreate = False
 
 eager_indexing = os.getenv("EAGER", "").lower() in ("true", "1", "yes")
+index_memory_budget = os.getenv("INDEX_MEMORY_BUDGET")
+if index_memory_budget:
+    SHARED_INDEX_CACHE.set_budget(int(index_memory_budget) * 1024 * 1024)
 backend = SingleUserFilesystemBackend(
     path=os.environ["XANDIKOSPATH"],
     eager_indexing=eager_indexing,
+    eager_workers=int(os.getenv("EAGER_WORKERS", "0")),
+    max_index_size=parse_mib(
+        int(os.environ["MAX_INDEX_SIZE"]) if os.getenv("MAX_INDEX_SIZE") else None
+    ),
+    index_backend=os.getenv("INDEX_BACKEND", DEFAULT_INDEX_BACKEND),
+    text_index_properties=parse_property_list(os.getenv("TEXT_INDEX", "")),
+    commit_delay=(
+        float(os.environ["COMMIT_DELAY"]) if os.getenv("COMMIT_DELAY") else None
+    ),
+    fsync_policy=os.getenv("FSYNC", DEFAULT_FSYNC_POLICY),
+    commit_message_policy=os.getenv("COMMIT_MESSAGES", DEFAULT_COMMIT_MESSAGE_POLICY),
+    object_pool=os.getenv("OBJECT_POOL", "").lower() in ("true", "1", "yes"),
+    store_threads=int(os.getenv("STORE_THREADS", str(DEFAULT_STORE_THREADS))),
 )
+maintenance_interval = os.getenv("MAINTENANCE_INTERVAL")
+if maintenance_interval:
+    start_maintenance(
+        backend.path,
+        float(maintenance_interval),
+        share_objects=backend.object_pool,
+    )
 if not os.path.isdir(backend.path):
     if autocreate:
         os.makedirs(os.environ["XANDIKOSPATH"])